@@ -0,0 +1,108 @@
+"""
+This module knows the archive formats a package can be published in, and how to read and write each of them.
+
+A package is a tar file, optionally compressed: <package_name>.tar, <package_name>.tar.gz, <package_name>.tar.xz or
+<package_name>.tar.zst. Gzip and xz are handled by the standard library. Zstandard needs the optional `zstandard`
+module (pip install bob[zstd]). Without it, tar.zst is not supported and is skipped when probing.
+
+Archives are read in order, so a compressed archive can be extracted straight from its download stream too. The
+codecs release the GIL while decompressing, so the packages of a frontier decompress in parallel on the download
+worker threads. Zstandard archives are also compressed on all cores when they are written.
+
+tarfile is only imported when an archive is read or written, so that commands that do not touch archives do not load
+it.
+"""
+from contextlib import contextmanager
+
+
+class ArchiveFormatException (Exception):
+    pass
+
+
+class ArchiveFormat:
+    TAR = "tar"
+    GZIP = "tar.gz"
+    XZ = "tar.xz"
+    ZSTD = "tar.zst"
+    # Best compression first. This is the order formats are probed in.
+    FORMATS = [ZSTD, XZ, GZIP, TAR]
+    ZSTD_LEVEL = 19
+
+    @staticmethod
+    def zstandard():
+        try:
+            import zstandard
+            return zstandard
+        except ImportError:
+            return None
+
+    @staticmethod
+    def is_supported(archive_format):
+        if archive_format == ArchiveFormat.ZSTD:
+            return ArchiveFormat.zstandard() is not None
+        return archive_format in ArchiveFormat.FORMATS
+
+    @staticmethod
+    def check(archive_format):
+        if archive_format not in ArchiveFormat.FORMATS:
+            raise ArchiveFormatException(
+                "Invalid archive format " + str(archive_format) + ". Allowed values are: " + ", ".join(ArchiveFormat.FORMATS) + ".")
+        if not ArchiveFormat.is_supported(archive_format):
+            raise ArchiveFormatException("The " + archive_format + " format needs the zstandard python module.")
+        return archive_format
+
+    @staticmethod
+    def errors():
+        """
+        The exceptions raised on a corrupt archive.
+        """
+        import tarfile
+        zstandard = ArchiveFormat.zstandard()
+        return (tarfile.TarError,) if zstandard is None else (tarfile.TarError, zstandard.ZstdError)
+
+    @staticmethod
+    def file_name(package_name, archive_format):
+        return package_name + "." + archive_format
+
+    @staticmethod
+    def open_stream(fileobj, archive_format):
+        """
+        Opens a tar reader on fileobj, that only reads it in order.
+        """
+        import tarfile
+        if archive_format == ArchiveFormat.ZSTD:
+            fileobj = ArchiveFormat.zstandard().ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+        return tarfile.open(fileobj=fileobj, mode="r|*")
+
+    @staticmethod
+    @contextmanager
+    def reader(path, archive_format):
+        import tarfile
+        if archive_format != ArchiveFormat.ZSTD:
+            tfp = tarfile.open(path)
+            try:
+                yield tfp
+            finally:
+                tfp.close()
+            return
+        with open(path, "rb") as raw:
+            with ArchiveFormat.open_stream(raw, archive_format) as tfp:
+                yield tfp
+
+    @staticmethod
+    @contextmanager
+    def writer(path, archive_format):
+        import tarfile
+        ArchiveFormat.check(archive_format)
+        if archive_format == ArchiveFormat.TAR:
+            with tarfile.open(path, "w") as tfp:
+                yield tfp
+        elif archive_format == ArchiveFormat.ZSTD:
+            compressor = ArchiveFormat.zstandard().ZstdCompressor(level=ArchiveFormat.ZSTD_LEVEL, threads=-1)
+            with open(path, "wb") as raw:
+                with compressor.stream_writer(raw, closefd=False) as compressed:
+                    with tarfile.open(fileobj=compressed, mode="w|") as tfp:
+                        yield tfp
+        else:
+            with tarfile.open(path, "w:" + archive_format.rpartition(".")[2]) as tfp:
+                yield tfp
@@ -0,0 +1,60 @@
+"""
+This module wraps the body of a package download, so that it can be extracted while it is still arriving.
+
+The wrapper is a read only file like object that a streaming tar reader (tarfile mode "r|*") reads from. Every byte
+that goes through it is hashed, so the sha256 of the archive is known when the extraction ends without reading the
+archive back. If a keep_path is given, the bytes are also written to <keep_path>.streaming, which is renamed to
+keep_path once the whole body was read. Otherwise the archive never touches the disk.
+
+Initialization parameters:
+1. raw (The response body. Anything with a read(size) method)
+2. keep_path (OPTIONAL. Where to keep a copy of the archive)
+"""
+import os
+import hashlib
+
+
+class ArchiveStreamException (Exception):
+    pass
+
+
+class ArchiveStream:
+    SUFFIX = ".streaming"
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, raw, keep_path=None):
+        self.raw = raw
+        self.keep_path = keep_path
+        self.sha = hashlib.sha256()
+        self.size = 0
+        self.keep_fp = None if keep_path is None else open(keep_path + ArchiveStream.SUFFIX, "wb")
+
+    def read(self, size=-1):
+        data = self.raw.read(size) if size is not None and size >= 0 else self.raw.read()
+        self.sha.update(data)
+        self.size = self.size + len(data)
+        if self.keep_fp is not None:
+            self.keep_fp.write(data)
+        return data
+
+    def finish(self):
+        """
+        Reads what the tar reader left of the body (the end of archive padding), and keeps the archive if asked to.
+        Returns the sha256 and the size of the archive.
+        """
+        while len(self.read(ArchiveStream.CHUNK_SIZE)) > 0:
+            pass
+        if self.keep_fp is not None:
+            self.keep_fp.close()
+            self.keep_fp = None
+            os.replace(self.keep_path + ArchiveStream.SUFFIX, self.keep_path)
+        return self.sha.hexdigest(), self.size
+
+    def abort(self):
+        if self.keep_fp is not None:
+            self.keep_fp.close()
+            self.keep_fp = None
+            try:
+                os.remove(self.keep_path + ArchiveStream.SUFFIX)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,93 @@
+"""
+This module is a content addressed store for the files of extracted packages.
+
+Every unique file content is kept once, under <GlobalPackageCache>/.blobs/<first 2 hex digits>/<sha256>. The files
+of an extracted <package_name>/<package_version> tree are hard links into the store, so consecutive versions of a
+package that share most of their files share most of their disk space too. Executable files are kept apart from
+non executable ones with the same content (their blob name ends with ".x"), because hard links share permissions.
+
+Blobs are made read only, so that a build writing to a file of an extracted tree can not silently change the same file
+in every other version. When a hard link is not possible (for example the link count limit of the file system is
+reached), the file is left as an independent copy.
+
+Initialization parameters:
+1. cache_root (The global package cache)
+"""
+import os
+import stat
+import hashlib
+import tempfile
+
+
+class BlobStoreException (Exception):
+    pass
+
+
+class BlobStore:
+    FOLDER = ".blobs"
+    CHUNK_SIZE = 1024 * 1024
+    READ_ONLY = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    def __init__(self, cache_root):
+        self.root = os.path.join(cache_root, BlobStore.FOLDER)
+
+    @staticmethod
+    def hash_file(path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(BlobStore.CHUNK_SIZE), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def blob_path(self, digest, executable=False):
+        return os.path.join(self.root, digest[:2], digest + (".x" if executable else ""))
+
+    @staticmethod
+    def replace_with_link(blob, path):
+        temp_path = path + ".bloblink"
+        os.link(blob, temp_path)
+        os.replace(temp_path, path)
+
+    def ingest(self, path):
+        """
+        Moves the content of the file at path into the store and replaces the file with a link to its blob.
+        Returns the path of the blob.
+        """
+        mode = os.lstat(path).st_mode
+        executable = bool(mode & stat.S_IXUSR)
+        blob = self.blob_path(BlobStore.hash_file(path), executable)
+        try:
+            if os.path.isfile(blob):
+                BlobStore.replace_with_link(blob, path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.chmod(path, stat.S_IMODE(mode) & BlobStore.READ_ONLY)
+                # Link into a temporary name first, so that a concurrent ingest of the same content can not see a
+                # half written blob
+                fd, temp_blob = tempfile.mkstemp(dir=os.path.dirname(blob))
+                os.close(fd)
+                os.remove(temp_blob)
+                os.link(path, temp_blob)
+                os.replace(temp_blob, blob)
+        except OSError:
+            # No hard links on this file system or too many links to the blob. Keep an independent copy.
+            if os.path.isfile(path + ".bloblink"):
+                os.remove(path + ".bloblink")
+            os.chmod(path, stat.S_IMODE(mode))
+        return blob
+
+    def ingest_tree(self, root):
+        """
+        Ingests every regular file under root. Returns the number of files ingested.
+        """
+        count = 0
+        try:
+            for folder, _, files in os.walk(root):
+                for f in files:
+                    path = os.path.join(folder, f)
+                    if os.path.isfile(path) and not os.path.islink(path):
+                        self.ingest(path)
+                        count = count + 1
+        except OSError as e:
+            raise BlobStoreException("Could not add " + root + " to the blob store: " + str(e))
+        return count
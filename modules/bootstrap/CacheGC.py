@@ -0,0 +1,290 @@
+"""
+This module keeps the global package cache under a size limit, by evicting the least recently used packages.
+
+Every time a package is used by a bootstrap, the downloader touches <global_package_cache>/<name>/<version>/.access.
+Its modification time is the last access time of the package. When the cache grows over MaxGlobalCacheSizeMB, the
+collector removes whole <name>/<version> entries, least recently used first, until the cache fits again, together with
+the build folders (see PackageInstaller) and the cached installs (see InstallCache) of the package, kept in
+<global_package_cache>/.builds/<name>/<version> and <global_package_cache>/.installs/<name>/<version>. Blobs of the
+content addressed store (see BlobStore) that are not linked from any package anymore are removed afterwards.
+
+Entries are never evicted if:
+1. A project that bootstrapped from this cache references them from its md.json or its bob.lock. Projects register
+   themselves in <global_package_cache>/.projects.json when they bootstrap.
+2. They were used within the last GRACE_PERIOD seconds, so a bootstrap running right now does not lose its packages.
+
+Collection runs in a separate background process after a bootstrap, at most once every INTERVAL seconds, so it never
+blocks the bootstrap. It can also be run in the foreground with `bob --gc`. Only one collector runs at a time.
+
+Config parameters needed:
+1. GlobalPackageCache
+2. Logger
+3. MaxGlobalCacheSizeMB (OPTIONAL. Collection is disabled if it is missing or 0)
+"""
+import os
+import sys
+import json
+import time
+import stat
+import fcntl
+import shutil
+import subprocess
+
+from contextlib import contextmanager
+
+
+class CacheGCException (Exception):
+    pass
+
+
+class CacheGC:
+    ACCESS_FILE = ".access"
+    PROJECTS_FILE = ".projects.json"
+    LOCK_FILE = ".gc.lock"
+    BLOBS_FOLDER = ".blobs"
+    # The folders of PackageInstaller.BUILDS_FOLDER and InstallCache.FOLDER, derived from the packages
+    DERIVED_FOLDERS = [".builds", ".installs"]
+    GRACE_PERIOD = 3600
+    INTERVAL = 3600
+    MB = 1024 * 1024
+    DEPENDENCY_SECTIONS = ["Dependencies", "BuildDeps", "TestDeps", "RuntimeDeps"]
+
+    def __init__(self, config_obj):
+        try:
+            self.cache = config_obj["GlobalPackageCache"]
+            self.logger = config_obj["Logger"]
+            self.max_size = int(config_obj.get("MaxGlobalCacheSizeMB", 0)) * CacheGC.MB
+        except KeyError as e:
+            raise CacheGCException("Invalid config object " + str(e))
+        except TypeError as e1:
+            raise CacheGCException(str(e1))
+        except ValueError as e2:
+            raise CacheGCException("Invalid MaxGlobalCacheSizeMB: " + str(e2))
+
+    @staticmethod
+    def touch(folder):
+        """
+        Marks the package in folder as used now. Failures are ignored, access tracking must never fail a bootstrap.
+        """
+        path = os.path.join(folder, CacheGC.ACCESS_FILE)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+            except OSError:
+                pass
+        except OSError:
+            pass
+
+    @staticmethod
+    @contextmanager
+    def locked(path, blocking=True):
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def read_json(path, default):
+        try:
+            with open(path, "r") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return default
+
+    @staticmethod
+    def register_project(cache, project_root):
+        projects_file = os.path.join(cache, CacheGC.PROJECTS_FILE)
+        with CacheGC.locked(projects_file + ".lock"):
+            projects = CacheGC.read_json(projects_file, [])
+            if project_root in projects:
+                return
+            projects.append(project_root)
+            temp_path = projects_file + ".tmp"
+            with open(temp_path, "w") as fp:
+                json.dump(projects, fp, indent=4)
+            os.replace(temp_path, projects_file)
+
+    @staticmethod
+    def schedule(config_obj):
+        """
+        Called after a bootstrap. Registers the project with the cache and starts a background collection if the
+        collector is enabled and did not run recently.
+        """
+        try:
+            max_size = int(config_obj.get("MaxGlobalCacheSizeMB", 0))
+        except (ValueError, TypeError) as e:
+            config_obj["Logger"].warn("Could not start package cache garbage collection: invalid MaxGlobalCacheSizeMB: " + str(e))
+            return
+        if max_size <= 0 or "GlobalPackageCache" not in config_obj:
+            return
+        cache = config_obj["GlobalPackageCache"]
+        try:
+            if "ProjectRoot" in config_obj:
+                CacheGC.register_project(cache, config_obj["ProjectRoot"])
+            lock_path = os.path.join(cache, CacheGC.LOCK_FILE)
+            if os.path.isfile(lock_path) and time.time() - os.path.getmtime(lock_path) < CacheGC.INTERVAL:
+                return
+            CacheGC.touch_file(lock_path)
+            env = dict(os.environ)
+            package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+            env["PYTHONPATH"] = package_root + os.pathsep + env.get("PYTHONPATH", "")
+            subprocess.Popen(
+                [sys.executable, "-c", "from modules.bootstrap.CacheGC import main; main()"],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True)
+            config_obj["Logger"].info("Started package cache garbage collection in the background.")
+        except OSError as e:
+            config_obj["Logger"].warn("Could not start package cache garbage collection: " + str(e))
+
+    @staticmethod
+    def touch_file(path):
+        with open(path, "a"):
+            pass
+        os.utime(path, None)
+
+    def projects(self):
+        return CacheGC.read_json(os.path.join(self.cache, CacheGC.PROJECTS_FILE), [])
+
+    def protected_entries(self):
+        protected = set()
+        for project_root in self.projects():
+            md = CacheGC.read_json(os.path.join(project_root, "md.json"), {})
+            lock = CacheGC.read_json(os.path.join(project_root, "bob.lock"), {})
+            packages = [d for section in CacheGC.DEPENDENCY_SECTIONS for d in md.get(section, [])]
+            packages.extend(lock.get("Packages", []))
+            for package in packages:
+                try:
+                    protected.add((package["Name"], str(package["Version"])))
+                except (KeyError, TypeError):
+                    continue
+        return protected
+
+    def entries(self):
+        """
+        Returns the (last access time, name, version, folder) of every package in the cache.
+        """
+        entries = []
+        for name in os.listdir(self.cache):
+            name_folder = os.path.join(self.cache, name)
+            if name.startswith(".") or not os.path.isdir(name_folder):
+                continue
+            for version in os.listdir(name_folder):
+                folder = os.path.join(name_folder, version)
+                if not os.path.isdir(folder):
+                    continue
+                access_file = os.path.join(folder, CacheGC.ACCESS_FILE)
+                atime = os.path.getmtime(access_file if os.path.isfile(access_file) else folder)
+                entries.append((atime, name, version, folder))
+        return entries
+
+    @staticmethod
+    def disk_usage(root, exclusive_only=False):
+        """
+        Bytes used by the files under root, counting hard linked files once. With exclusive_only, only the files that
+        are not linked from anywhere else than root and the blob store are counted, that is what removing root frees.
+        """
+        seen = set()
+        total = 0
+        for folder, _, files in os.walk(root):
+            for f in files:
+                try:
+                    st = os.lstat(os.path.join(folder, f))
+                except OSError:
+                    continue
+                if st.st_ino in seen or (exclusive_only and st.st_nlink > 2):
+                    continue
+                seen.add(st.st_ino)
+                total = total + st.st_blocks * 512
+        return total
+
+    @staticmethod
+    def remove_tree(folder):
+        def make_writable(function, path, excinfo):
+            os.chmod(os.path.dirname(path), stat.S_IRWXU)
+            function(path)
+        shutil.rmtree(folder, onerror=make_writable)
+
+    @staticmethod
+    def remove_entry(folder):
+        """
+        Removes folder, and its parent if that leaves it empty.
+        """
+        CacheGC.remove_tree(folder)
+        if len(os.listdir(os.path.dirname(folder))) == 0:
+            os.rmdir(os.path.dirname(folder))
+
+    def derived_entries(self, name, version):
+        """
+        Returns the folders built from the package that exist.
+        """
+        folders = [os.path.join(self.cache, derived, name, version) for derived in CacheGC.DERIVED_FOLDERS]
+        return [folder for folder in folders if os.path.isdir(folder)]
+
+    def purge_orphan_blobs(self):
+        removed = 0
+        for folder, _, files in os.walk(os.path.join(self.cache, CacheGC.BLOBS_FOLDER)):
+            for f in files:
+                blob = os.path.join(folder, f)
+                if os.lstat(blob).st_nlink == 1:
+                    os.remove(blob)
+                    removed = removed + 1
+        return removed
+
+    def collect(self):
+        """
+        Evicts least recently used packages until the cache fits in MaxGlobalCacheSizeMB. Returns the list of
+        evicted (name, version).
+        """
+        evicted = []
+        if self.max_size <= 0 or not os.path.isdir(self.cache):
+            return evicted
+        try:
+            with CacheGC.locked(os.path.join(self.cache, CacheGC.LOCK_FILE), blocking=False) as acquired:
+                if not acquired:
+                    self.logger.info("Another garbage collection of the package cache is running. Skipping.")
+                    return evicted
+                usage = CacheGC.disk_usage(self.cache)
+                self.logger.info("Package cache uses " + str(usage // CacheGC.MB) + " MB of " + str(self.max_size // CacheGC.MB) + " MB.")
+                if usage <= self.max_size:
+                    return evicted
+                protected = self.protected_entries()
+                now = time.time()
+                for atime, name, version, folder in sorted(self.entries()):
+                    if usage <= self.max_size:
+                        break
+                    if (name, version) in protected or now - atime < CacheGC.GRACE_PERIOD:
+                        continue
+                    for entry in [folder] + self.derived_entries(name, version):
+                        usage = usage - CacheGC.disk_usage(entry, exclusive_only=True)
+                        CacheGC.remove_entry(entry)
+                    evicted.append((name, version))
+                    self.logger.info("Evicted package " + name + "/" + version + " from the package cache.")
+                removed_blobs = self.purge_orphan_blobs()
+                self.logger.info("Evicted " + str(len(evicted)) + " packages and " + str(removed_blobs) + " unused blobs.")
+        except OSError as e:
+            raise CacheGCException("Garbage collection of the package cache failed: " + str(e))
+        return evicted
+
+
+def main():
+    from modules.config.Config import ConfigException, Config
+    from modules.config.Log import LogException, Log
+    try:
+        config = Config.read_global_config()
+        config["Logger"] = Log(config)
+        CacheGC(config).collect()
+    except (ConfigException, LogException, CacheGCException) as e:
+        print("\n\n[ERROR] Error occured " + str(e))
+        return False
+    return True
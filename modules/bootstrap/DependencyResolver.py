@@ -1,10 +1,51 @@
 """
 This module computes and downloads and installs the entire dependency graph of a project (using BFS).
 It makes use of package downloader and installer to bootstrap the project.
+
+The whole closure is downloaded before anything is installed. It is then installed by InstallScheduler, dependencies
+first, up to InstallConcurrency packages at the same time.
+
+With UsePackageIndex, the dependencies of every package are first looked up in the index of its repository (see
+PackageIndex). If the whole closure is in the indexes, it is computed in memory and all its packages are downloaded in
+one parallel batch. Otherwise, or for dependencies the downloaded md.json files declare but the index missed, the
+packages are downloaded level by level, as each level reveals the next.
+
+With ProbeMetadata, a closure the indexes do not cover is computed by reading just the md.json of every package (see
+PackageDownloader.fetch_dependencies), a level at a time. The packages themselves are then downloaded in one batch.
+
+With UseLockFile, the resolved closure is saved in bob.lock next to md.json (see LockFile), with the install order and
+the sha256 of every package. As long as the dependencies in md.json do not change, bootstrapping only verifies that the
+locked packages are still extracted from the same archives, and fetches and installs again the ones that are not. When
+md.json changes, the packages still reachable through the lock are kept, and only the packages the lock does not know
+are resolved and installed.
+
+A closure that holds two versions of the same package is rejected before anything is installed.
+
+With ResolveVersions, dependencies can be version ranges (see VersionSolver). A single version of every package of the
+closure is picked before anything is downloaded, the newest that satisfies every package depending on it, and the
+packages are then resolved, installed and locked with the versions picked. The versions a package can take are the
+ones the index lists, and the ones extracted in the global package cache. The dependencies of a version are read from
+the index, or from its md.json. When md.json changes, the locked versions are preferred, and the locked packages that
+do not match the versions picked are resolved again.
+
+Config parameters needed (the defaults are the ones of Config.DEFAULT_CONFIG):
+1. Logger
+2. UsePackageIndex (OPTIONAL, defaults to True)
+3. ProbeMetadata (OPTIONAL, defaults to True)
+4. UseLockFile (OPTIONAL, defaults to True)
+5. ProjectRoot (OPTIONAL, needed for UseLockFile)
+6. LocalPackageCache (OPTIONAL, needed for UseLockFile)
+7. InstallConcurrency (OPTIONAL, defaults to 4)
+8. ResolveVersions (OPTIONAL, defaults to False)
 """
+import os
 
 from modules.bootstrap.PackageInstaller import PackageInstallerException, PackageInstaller
+from modules.bootstrap.InstallScheduler import InstallSchedulerException, InstallScheduler
 from modules.bootstrap.PackageDownloader import PackageDownloaderException, PackageDownloader
+from modules.bootstrap.PackageIndex import PackageIndexException, PackageIndex
+from modules.bootstrap.LockFile import LockFileException, LockFile
+from modules.bootstrap.VersionSolver import VersionSolverException, VersionSolver
 
 
 class DependencyResolverException (Exception):
@@ -18,10 +59,25 @@ class DependencyResolver:
             self.downloader = PackageDownloader(self.config_obj)
             self.installer = PackageInstaller(self.config_obj)
             self.logger = self.config_obj["Logger"]
+            self.scheduler = InstallScheduler(self.installer, self.logger, self.config_obj.get("InstallConcurrency", 1))
+            self.probe_metadata = bool(self.config_obj.get("ProbeMetadata", False))
+            self.index = None
+            self.lock_file = None
+            if self.config_obj.get("UseLockFile", False) and "ProjectRoot" in self.config_obj:
+                self.lock_file = LockFile(self.config_obj["ProjectRoot"])
+            if self.config_obj.get("UsePackageIndex", False):
+                self.index = PackageIndex(self.config_obj, self.downloader.http, self.downloader.s3_downloader)
+            self.solver = None
+            if self.config_obj.get("ResolveVersions", False):
+                self.solver = VersionSolver(self.known_versions, self.solver_dependencies, self.logger)
+        except PackageIndexException as e:
+            raise DependencyResolverException(str(e))
         except PackageDownloaderException as e:
             raise DependencyResolverException(str(e))
         except PackageInstallerException as e:
             raise DependencyResolverException(str(e))
+        except InstallSchedulerException as e:
+            raise DependencyResolverException(str(e))
         except KeyError as e:
             raise DependencyResolverException(str(e))
         except TypeError as e:
@@ -47,24 +103,232 @@ class DependencyResolver:
 
         return list(dependencies.values())
 
+    def closure_levels(self, initial_deps, visited, dependencies_of):
+        """
+        Computes the BFS levels of the dependency closure without installing anything. dependencies_of returns the
+        dependency lists of the packages of a level, or None if it does not know them all, in which case this returns
+        None too. Packages of the closure are added to visited.
+        """
+        levels = []
+        closure = dict(visited)
+        frontier = initial_deps
+        while len(frontier) > 0:
+            levels.append(frontier)
+            dependency_lists = dependencies_of(frontier)
+            if dependency_lists is None:
+                return None
+            neighbours = {}
+            for dependencies in dependency_lists:
+                for dep in dependencies:
+                    dep = self.installer.pinned(dep)
+                    neighbours[LockFile.key(dep)] = dep
+            frontier = []
+            for key, n in neighbours.items():
+                if key not in closure:
+                    closure[key] = n
+                    frontier.append(n)
+        visited.update(closure)
+        return levels
+
+    def index_dependencies(self, package_list):
+        dependency_lists = []
+        for package in package_list:
+            entry = self.index.lookup(package)
+            if entry is None:
+                self.logger.info("Package " + str(package["Name"]) + "/" + str(package["Version"]) + " is not in the package index.")
+                return None
+            dependency_lists.append(entry.get("Dependencies", []))
+        return dependency_lists
+
+    def download_hints(self, package):
+        """
+        Adds what the index knows about the archives of package, for the downloader to skip probing, schedule the
+        largest downloads first, check the archives and pick a delta.
+        """
+        entry = None if self.index is None else self.index.lookup(package)
+        archives = {} if entry is None else entry.get("Archives", {})
+        if len(archives) == 0:
+            return package
+        hinted = dict(package)
+        hinted["Archives"] = archives
+        hinted["Size"] = min(int(archive.get("Size", 0)) for archive in archives.values())
+        if isinstance(entry.get("Deltas"), dict):
+            hinted["Deltas"] = entry["Deltas"]
+        return hinted
+
+    def known_versions(self, package):
+        """
+        Returns the versions of the package listed in the index, or extracted in the global package cache.
+        """
+        versions = [] if self.index is None else self.index.versions(package)
+        folder = os.path.join(self.downloader.global_package_cache, str(package["Name"]))
+        try:
+            for version in os.listdir(folder):
+                if not version.startswith(".") and os.path.isfile(os.path.join(folder, version, "md.json")):
+                    versions.append(version)
+        except OSError:
+            pass
+        return versions
+
+    def solver_dependencies(self, package):
+        entry = None if self.index is None else self.index.lookup(package)
+        if entry is not None:
+            return entry.get("Dependencies", [])
+        return self.downloader.package_dependencies(package)
+
+    def solve_versions(self, initial_deps, lock):
+        """
+        Picks the versions of the closure of initial_deps, preferring the locked ones, and pins them. Returns the lock
+        without the packages that do not match the versions picked.
+        """
+        locked_versions = {} if lock is None else {str(e["Name"]): str(e["Version"]) for e in lock["Packages"]}
+        try:
+            pins = self.solver.solve(initial_deps, locked_versions)
+        except VersionSolverException as e:
+            raise DependencyResolverException(str(e))
+        self.installer.pin_versions(pins)
+        if lock is None:
+            return None
+
+        def matches(package):
+            return pins.get(str(package["Name"]), str(package["Version"])) == str(package["Version"])
+        packages = [e for e in lock["Packages"] if matches(e) and all(matches(dep) for dep in e["Dependencies"])]
+        return dict(lock, Packages=packages)
+
+    def package_dependencies(self, package):
+        return self.installer.get_package_dependency(str(package["Name"]), str(package["Version"]))
+
+    def install(self, packages, dependencies_of=None):
+        """
+        Installs packages, dependencies first (see InstallScheduler).
+        """
+        if len(packages) > 0:
+            self.scheduler.install(packages, self.package_dependencies if dependencies_of is None else dependencies_of)
+
+    def expand(self, next_frontier, visited):
+        """
+        Downloads level by level, each level revealing the next through the md.json of its packages. Returns the
+        levels downloaded.
+        """
+        levels = []
+        while len(next_frontier) > 0:
+            frontier = next_frontier
+            next_frontier = []
+            self.downloader.download_and_extract(frontier)
+            levels.append(frontier)
+            for package in frontier:
+                for n in self.package_dependencies(package):
+                    if LockFile.key(n) not in visited:
+                        visited[LockFile.key(n)] = n
+                        next_frontier.append(n)
+        return levels
+
+    def resolve(self, next_frontier, visited):
+        """
+        Resolves and downloads the closure of next_frontier, minus the packages in visited. Returns the levels
+        downloaded, in order.
+        """
+        levels = None
+        if self.index is not None:
+            levels = self.closure_levels(next_frontier, visited, self.index_dependencies)
+            if levels is not None:
+                self.logger.info("Resolved " + str(len(visited)) + " packages from the package index.")
+        if levels is None and self.probe_metadata:
+            levels = self.closure_levels(next_frontier, visited, self.downloader.fetch_dependencies)
+            self.logger.info("Resolved " + str(len(visited)) + " packages from their metadata.")
+        if levels is None:
+            return self.expand(next_frontier, visited)
+        self.downloader.download_and_extract([self.download_hints(p) for level in levels for p in level])
+        next_frontier = []
+        for level in levels:
+            for package in level:
+                for n in self.package_dependencies(package):
+                    if LockFile.key(n) not in visited:
+                        self.logger.warn("Dependency " + LockFile.key(n) + " was missed while resolving ahead.")
+                        visited[LockFile.key(n)] = n
+                        next_frontier.append(n)
+        return levels + self.expand(next_frontier, visited)
+
+    @staticmethod
+    def check_versions(packages):
+        """
+        Raises if packages hold two versions of the same package: they would be installed over each other.
+        """
+        versions = {}
+        for package in packages:
+            name = str(package["Name"])
+            known = versions.setdefault(name, str(package["Version"]))
+            if known != str(package["Version"]):
+                raise DependencyResolverException(
+                    "Conflicting versions " + known + " and " + str(package["Version"]) + " of " + name + " are required. Pin a single version, or enable ResolveVersions.")
+
+    def verify(self, entries):
+        """
+        Fetches and installs again the locked packages that are not extracted from their locked archive anymore.
+        """
+        broken = [e for e in entries if self.downloader.extracted_digest(LockFile.package(e)) != e["Sha256"]]
+        if len(broken) > 0:
+            self.logger.info("Fetching " + str(len(broken)) + " locked packages again.")
+            self.downloader.download_and_extract([LockFile.package(e) for e in broken])
+            for entry in broken:
+                if self.downloader.extracted_digest(LockFile.package(entry)) != entry["Sha256"]:
+                    raise DependencyResolverException(
+                        "Package " + LockFile.key(entry) + " does not match bob.lock anymore. Remove bob.lock to resolve the dependencies again.")
+        local_cache = self.config_obj.get("LocalPackageCache")
+        reinstall = broken if local_cache is None or os.path.isdir(local_cache) else entries
+        locked_dependencies = {LockFile.key(e): e["Dependencies"] for e in entries}
+        self.install([LockFile.package(e) for e in sorted(reinstall, key=lambda e: e["Level"])],
+                     lambda package: locked_dependencies[LockFile.key(package)])
+        self.logger.info("Verified " + str(len(entries)) + " locked packages, installed " + str(len(reinstall)) + " again.")
+
+    def lock(self, md_hash, locked, levels):
+        entries = [dict(entry) for entry in locked]
+        base = 1 + max([entry["Level"] for entry in entries], default=-1)
+        for i, level in enumerate(levels):
+            for package in level:
+                entry = LockFile.package(package)
+                entry["Level"] = base + i
+                entry["Sha256"] = self.downloader.extracted_digest(package)
+                entry["Dependencies"] = self.installer.get_package_dependency(package["Name"], str(package["Version"]))
+                entries.append(entry)
+        self.lock_file.write(md_hash, entries)
+
     def bfs(self):
         try:
-            next_frontier = self.gather_initial_deps()
+            initial_deps = self.gather_initial_deps()
+            lock = None if self.lock_file is None else self.lock_file.read()
+            md_hash = LockFile.md_hash(self.config_obj)
+            if lock is not None and lock["MdHash"] == md_hash:
+                self.logger.info("The dependencies did not change since bob.lock was written. Verifying the locked packages.")
+                if self.solver is not None:
+                    self.installer.pin_versions({str(e["Name"]): str(e["Version"]) for e in lock["Packages"]})
+                self.verify(lock["Packages"])
+                return [LockFile.package(entry) for entry in lock["Packages"]]
+            if self.solver is not None:
+                lock = self.solve_versions(initial_deps, lock)
+                initial_deps = [self.installer.pinned(dep) for dep in initial_deps]
+            locked, next_frontier = ([], initial_deps) if lock is None else LockFile.locked_closure(lock, initial_deps)
+            if lock is not None:
+                self.logger.info("The dependencies changed. Keeping " + str(len(locked)) + " locked packages, resolving from " + str(len(next_frontier)) + " new ones.")
+                self.verify(locked)
             visited = {}
+            for entry in locked:
+                visited[LockFile.key(entry)] = LockFile.package(entry)
             for dep in next_frontier:
-                visited[str(dep)] = dep
-            while len(next_frontier) > 0:
-                frontier = next_frontier
-                next_frontier = []
-                self.downloader.download_and_extract(frontier)
-                neighbours = self.installer.install_packages(frontier).values()
-                for n in list(neighbours):
-                    if str(n) not in visited:
-                        visited[str(n)] = n
-                        next_frontier.append(n)
-            # TODO: Save the dependency closure in a file to be used during packaging
+                visited[LockFile.key(dep)] = dep
+            levels = self.resolve(next_frontier, visited)
+            DependencyResolver.check_versions(visited.values())
+            self.install([package for level in levels for package in level])
+            if self.lock_file is not None:
+                self.lock(md_hash, locked, levels)
             return list(visited.values())
+        except LockFileException as e:
+            raise DependencyResolverException(str(e))
+        except PackageIndexException as e:
+            raise DependencyResolverException(str(e))
         except PackageDownloaderException as e:
             raise DependencyResolverException(str(e))
         except PackageInstallerException as e:
             raise DependencyResolverException(str(e))
+        finally:
+            self.installer.save_metadata()
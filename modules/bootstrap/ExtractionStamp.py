@@ -0,0 +1,108 @@
+"""
+This module remembers that a package archive was already extracted, so that warm bootstraps do not extract it again.
+
+After a package is extracted, <extract_path>/.extracted.json records the size, modification time and sha256 of the
+archive, and the names of its members. The package does not need to be extracted again as long as:
+1. The archive is the same. Its size and modification time are compared first. Only if they differ is the archive
+   hashed, so a re-downloaded identical archive does not trigger an extraction either.
+2. The tree is intact, that is every recorded member still exists under <extract_path>.
+
+A package extracted straight from its download stream (see ArchiveStream) may have no archive on disk. Its stamp
+records the size and sha256 computed on the fly, and no modification time. It matches as long as the tree is intact.
+
+The stamp is removed before an extraction starts, so an interrupted extraction is never taken for a complete one.
+
+Initialization parameters:
+1. archive (Path of the package archive)
+2. extract_path (Folder the archive is extracted in)
+"""
+import os
+import json
+
+from modules.bootstrap.BlobStore import BlobStore
+
+
+class ExtractionStamp:
+    FILE_NAME = ".extracted.json"
+
+    def __init__(self, archive, extract_path):
+        self.archive = archive
+        self.extract_path = extract_path
+        self.path = os.path.join(extract_path, ExtractionStamp.FILE_NAME)
+
+    def read(self):
+        if not os.path.lexists(self.path):
+            return None
+        try:
+            with open(self.path, "r") as fp:
+                stamp = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(stamp, dict) or not all(k in stamp for k in ["Size", "Mtime", "Sha256", "Members"]):
+            return None
+        return stamp
+
+    def is_intact(self, members):
+        return all(os.path.lexists(os.path.join(self.extract_path, member)) for member in members)
+
+    def matches(self):
+        """
+        True if the archive was extracted already and the extracted tree is still there.
+        """
+        try:
+            st = os.stat(self.archive)
+        except FileNotFoundError:
+            st = None
+        except OSError:
+            return False
+        stamp = self.read()
+        if stamp is None or not self.is_intact(stamp["Members"]):
+            return False
+        if st is None:
+            # Only a package extracted while streaming, without keeping the archive, has no archive
+            return stamp["Mtime"] is None
+        if stamp["Size"] == st.st_size and stamp["Mtime"] == st.st_mtime_ns:
+            return True
+        if stamp["Size"] != st.st_size:
+            return False
+        try:
+            if BlobStore.hash_file(self.archive) != stamp["Sha256"]:
+                return False
+        except OSError:
+            return False
+        # Same content under a new modification time. Record it so the next check is cheap again.
+        self.write(stamp["Members"], stamp["Sha256"])
+        return True
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def write(self, members, digest=None, size=None):
+        """
+        Records the archive as extracted. When the archive was streamed and not kept, its digest and size have to be
+        given. Returns False if the stamp could not be written, in which case the package is just extracted again by
+        the next bootstrap.
+        """
+        try:
+            if digest is None or size is None or os.path.isfile(self.archive):
+                st = os.stat(self.archive)
+                size = st.st_size
+                mtime = st.st_mtime_ns
+            else:
+                mtime = None
+            stamp = {
+                "Size": size,
+                "Mtime": mtime,
+                "Sha256": BlobStore.hash_file(self.archive) if digest is None else digest,
+                "Members": sorted(set(os.path.normpath(member) for member in members))
+            }
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as fp:
+                json.dump(stamp, fp)
+            os.replace(temp_path, self.path)
+        except OSError:
+            return False
+        return True
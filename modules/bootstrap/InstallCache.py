@@ -0,0 +1,185 @@
+"""
+This module caches the trees that packages install, so that a package built once is restored instead of being built
+again by every bootstrap.
+
+An installed tree is kept in <global_package_cache>/.installs/<name>/<version>/<install_key>/, outside of the extracted
+tree of the package it was built from. Evicting a package (see CacheGC) evicts its installed trees too. The install key is the sha256 of:
+1. The name and version of the package, and the sha256 of the archive it was extracted from.
+2. The compiler fingerprint: the `--version` output of the C and C++ compilers and of cmake, and the compiler and
+   linker flags of the environment.
+3. The build type.
+4. The install prefix. Installed CMake package files and pkg-config files hold absolute paths to the prefix, so a tree
+   is only reused under the same prefix.
+5. The install keys of the dependencies of the package, so a package is built again when one of them changes.
+
+A tree is restored into the prefix file by file, by reflink where the file system supports it and by copy otherwise.
+With the "hardlink" restore mode, files are hard linked instead. That is the fastest, but the restored files are the
+cached ones: they are made read only, so that writing to them fails instead of changing the cache.
+
+Initialization parameters:
+1. global_cache
+2. restore_mode (OPTIONAL, "copy" or "hardlink", defaults to "copy")
+"""
+import os
+import json
+import stat
+import shutil
+import hashlib
+import subprocess
+
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+
+
+class InstallCacheException (Exception):
+    pass
+
+
+class InstallCache:
+    FOLDER = ".installs"
+    MANIFEST = "install.json"
+    TREE = "tree"
+    RESTORE_MODES = ["copy", "hardlink"]
+    # ioctl(FICLONE) shares the blocks of a file on btrfs, xfs and other copy on write file systems
+    FICLONE = 0x40049409
+    FLAG_VARIABLES = ["CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS"]
+
+    def __init__(self, global_cache, restore_mode="copy"):
+        if restore_mode not in InstallCache.RESTORE_MODES:
+            raise InstallCacheException(
+                "Invalid install cache restore mode " + str(restore_mode) + ". Allowed values are: " + ", ".join(InstallCache.RESTORE_MODES) + ".")
+        self.global_cache = global_cache
+        self.restore_mode = restore_mode
+        self.compiler_fingerprint = None
+
+    @staticmethod
+    def tool_version(command):
+        try:
+            p = subprocess.Popen([command, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            out, _ = p.communicate()
+            return out.decode("utf-8", "replace").strip() if p.returncode == 0 else None
+        except OSError:
+            return None
+
+    def fingerprint(self):
+        """
+        Returns what identifies the tool chain packages are built with. It is computed once per run.
+        """
+        if self.compiler_fingerprint is None:
+            self.compiler_fingerprint = {
+                "CC": InstallCache.tool_version(os.environ.get("CC", "cc")),
+                "CXX": InstallCache.tool_version(os.environ.get("CXX", "c++")),
+                "CMake": InstallCache.tool_version("cmake"),
+                "Flags": {variable: os.environ.get(variable) for variable in InstallCache.FLAG_VARIABLES}
+            }
+        return self.compiler_fingerprint
+
+    def package_digest(self, package_name, package_version):
+        """
+        Returns the sha256 of the archive the package was extracted from, None if it is not known.
+        """
+        stamp = ExtractionStamp(None, os.path.join(self.global_cache, package_name, package_version)).read()
+        return None if stamp is None else stamp["Sha256"]
+
+    def key(self, package_name, package_version, build_type, prefix, dependency_keys):
+        description = {
+            "Name": package_name,
+            "Version": package_version,
+            "Sha256": self.package_digest(package_name, package_version),
+            "Toolchain": self.fingerprint(),
+            "BuildType": build_type,
+            "Prefix": os.path.abspath(prefix),
+            "Dependencies": sorted(dependency_keys)
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def folder(self, package_name, package_version, key):
+        return os.path.join(self.global_cache, InstallCache.FOLDER, package_name, package_version, key)
+
+    def lookup(self, package_name, package_version, key):
+        """
+        Returns the cached tree installed under key, None if there is none.
+        """
+        folder = self.folder(package_name, package_version, key)
+        if not os.path.isfile(os.path.join(folder, InstallCache.MANIFEST)):
+            return None
+        return os.path.join(folder, InstallCache.TREE)
+
+    def store(self, package_name, package_version, key, staged_tree):
+        """
+        Moves the tree a package installed to staged_tree into the cache. Returns the cached tree.
+        """
+        folder = self.folder(package_name, package_version, key)
+        tree = os.path.join(folder, InstallCache.TREE)
+        try:
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+            os.makedirs(folder)
+            if os.path.isdir(staged_tree):
+                os.rename(staged_tree, tree)
+            else:
+                os.makedirs(tree)
+            files = 0
+            for parent, _, names in os.walk(tree):
+                for name in names:
+                    path = os.path.join(parent, name)
+                    files = files + 1
+                    if self.restore_mode == "hardlink" and not os.path.islink(path):
+                        mode = stat.S_IMODE(os.lstat(path).st_mode)
+                        os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            # The manifest is written last, so an interrupted store is never taken for a cached tree
+            temp_path = os.path.join(folder, InstallCache.MANIFEST + ".tmp")
+            with open(temp_path, "w") as fp:
+                json.dump({"Name": package_name, "Version": package_version, "Key": key, "Files": files}, fp)
+            os.replace(temp_path, os.path.join(folder, InstallCache.MANIFEST))
+        except OSError as e:
+            raise InstallCacheException("Could not cache the install of " + package_name + "/" + package_version + ": " + str(e))
+        return tree
+
+    @staticmethod
+    def reflink(src, dest):
+        """
+        Clones src to dest sharing its blocks. Returns False if the file system does not support it.
+        """
+        import fcntl
+        try:
+            with open(src, "rb") as source, open(dest, "wb") as target:
+                fcntl.ioctl(target.fileno(), InstallCache.FICLONE, source.fileno())
+        except OSError:
+            return False
+        shutil.copystat(src, dest)
+        return True
+
+    def restore_file(self, src, dest):
+        if os.path.lexists(dest):
+            os.remove(dest)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dest)
+            return
+        if self.restore_mode == "hardlink":
+            try:
+                os.link(src, dest)
+                return
+            except OSError:
+                pass
+        if not InstallCache.reflink(src, dest):
+            shutil.copy2(src, dest)
+
+    def restore(self, tree, prefix):
+        """
+        Restores the cached tree into prefix. Returns the number of files restored.
+        """
+        restored = 0
+        try:
+            for parent, folders, names in os.walk(tree):
+                relative = os.path.relpath(parent, tree)
+                target = os.path.normpath(os.path.join(prefix, relative))
+                os.makedirs(target, exist_ok=True)
+                for name in folders:
+                    if os.path.islink(os.path.join(parent, name)):
+                        self.restore_file(os.path.join(parent, name), os.path.join(target, name))
+                for name in names:
+                    self.restore_file(os.path.join(parent, name), os.path.join(target, name))
+                    restored = restored + 1
+        except OSError as e:
+            raise InstallCacheException("Could not restore " + tree + " into " + prefix + ": " + str(e))
+        return restored
@@ -0,0 +1,148 @@
+"""
+This module keeps the install receipts of a project: the record of every package installed in its local package cache,
+in <local_package_cache>/.receipts.json.
+
+{
+    "Version": 1,
+    "Packages": {
+        "MyPackageName": {
+            "Version": "1.0",
+            "Key": "...",
+            "Files": ["include/my.h", "lib/libmy.a"]
+        }
+    }
+}
+Key is the install key of the package (see InstallCache), and Files lists what it installed, relative to the local
+package cache. A package whose receipt has the same version and key, and whose files are all there, is installed
+already. When another version of a package is installed, the files of the previous one are removed first, except the
+ones other packages installed too, so the local package cache never mixes two versions of a package.
+
+Initialization parameters:
+1. local_cache
+"""
+import os
+import json
+import threading
+
+
+class InstallReceiptsException (Exception):
+    pass
+
+
+class InstallReceipts:
+    FILE_NAME = ".receipts.json"
+    VERSION = 1
+    # Written by CMake in the build folder, with the absolute path of every installed file
+    INSTALL_MANIFEST = "install_manifest.txt"
+
+    def __init__(self, local_cache):
+        self.local_cache = local_cache
+        self.path = os.path.join(local_cache, InstallReceipts.FILE_NAME)
+        self.lock = threading.Lock()
+        self.packages = None
+
+    def load(self):
+        """
+        Returns the receipts by package name. They are read once, a missing or unreadable file holds none.
+        """
+        if self.packages is None:
+            try:
+                with open(self.path, "r") as fp:
+                    receipts = json.load(fp)
+                if not isinstance(receipts, dict) or receipts.get("Version") != InstallReceipts.VERSION or not isinstance(receipts.get("Packages"), dict):
+                    receipts = {"Packages": {}}
+            except (OSError, ValueError):
+                receipts = {"Packages": {}}
+            self.packages = {
+                name: receipt for name, receipt in receipts["Packages"].items()
+                if isinstance(receipt, dict) and all(k in receipt for k in ["Version", "Key", "Files"])
+            }
+        return self.packages
+
+    def write(self):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as fp:
+                json.dump({"Version": InstallReceipts.VERSION, "Packages": self.packages}, fp, indent=4, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            raise InstallReceiptsException("Could not write the install receipts " + self.path + ": " + str(e))
+
+    def installed(self, package_name, package_version, key):
+        """
+        Returns True if the package is installed with key, and none of its files is missing.
+        """
+        with self.lock:
+            receipt = self.load().get(package_name)
+        if receipt is None or receipt["Version"] != package_version or receipt["Key"] != key:
+            return False
+        return all(os.path.lexists(os.path.join(self.local_cache, path)) for path in receipt["Files"])
+
+    def uninstall(self, package_name):
+        """
+        Removes the files of the installed package, but the ones other packages installed too, and its receipt.
+        Returns the number of files removed.
+        """
+        with self.lock:
+            packages = self.load()
+            receipt = packages.pop(package_name, None)
+            if receipt is None:
+                return 0
+            shared = set()
+            for other in packages.values():
+                shared.update(other["Files"])
+            removed = 0
+            folders = set()
+            for path in receipt["Files"]:
+                if path in shared:
+                    continue
+                full_path = os.path.join(self.local_cache, path)
+                try:
+                    os.remove(full_path)
+                    removed = removed + 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    raise InstallReceiptsException("Could not remove " + full_path + " of " + package_name + ": " + str(e))
+                folders.add(os.path.dirname(path))
+            # Removes the folders left empty, deepest first
+            for folder in sorted(folders, key=len, reverse=True):
+                while folder != "":
+                    try:
+                        os.rmdir(os.path.join(self.local_cache, folder))
+                    except OSError:
+                        break
+                    folder = os.path.dirname(folder)
+            self.write()
+        return removed
+
+    def record(self, package_name, package_version, key, files):
+        with self.lock:
+            self.load()[package_name] = {"Version": package_version, "Key": key, "Files": sorted(files)}
+            self.write()
+
+    @staticmethod
+    def tree_files(tree):
+        """
+        Returns the files of an installed tree, relative to it.
+        """
+        files = []
+        for parent, folders, names in os.walk(tree):
+            relative = os.path.relpath(parent, tree)
+            for name in names + [f for f in folders if os.path.islink(os.path.join(parent, f))]:
+                files.append(os.path.normpath(os.path.join(relative, name)))
+        return files
+
+    @staticmethod
+    def manifest_files(build_folder, prefix):
+        """
+        Returns the files CMake installed from build_folder into prefix, relative to it.
+        """
+        prefix = os.path.abspath(prefix)
+        try:
+            with open(os.path.join(build_folder, InstallReceipts.INSTALL_MANIFEST), "r") as fp:
+                paths = [line.strip() for line in fp if line.strip() != ""]
+        except OSError:
+            # Packages that install nothing have no manifest
+            return []
+        return [os.path.relpath(path, prefix) for path in paths if os.path.abspath(path).startswith(prefix + os.sep)]
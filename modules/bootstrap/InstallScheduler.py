@@ -0,0 +1,148 @@
+"""
+This module installs a set of packages in dependency order: a package is installed only once all the packages it
+depends on are installed. Packages that do not depend on each other are installed concurrently.
+
+The dependency graph is built from the dependencies of every package. Dependencies outside the set are taken as
+installed already. When more packages are ready than there are free workers, the packages heading the longest chains
+of packages waiting on them are started first: that chain (the critical path) bounds the time of the whole install, so
+it is never left waiting behind packages nothing depends on. Packages of a dependency cycle can not be ordered: the one
+of the cycle given first is installed first.
+
+When an install fails, no other install is started. The running ones are waited for, and the first error is raised.
+
+Initialization parameters:
+1. installer (Installs a package with install_a_package(name, version), see PackageInstaller)
+2. logger
+3. concurrency (OPTIONAL, number of packages installed at the same time, defaults to 1)
+"""
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class InstallSchedulerException (Exception):
+    pass
+
+
+class InstallScheduler:
+    def __init__(self, installer, logger, concurrency=1):
+        if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+            raise InstallSchedulerException("Invalid install concurrency " + str(concurrency) + ". It must be a positive integer.")
+        self.installer = installer
+        self.logger = logger
+        self.concurrency = concurrency
+
+    @staticmethod
+    def key(package):
+        return str(package["Name"]) + "/" + str(package["Version"])
+
+    @staticmethod
+    def graph(packages, dependencies_of):
+        """
+        Returns the packages by key, in the order given, and for every package the keys of the packages of the set it
+        depends on.
+        """
+        nodes = {}
+        for package in packages:
+            nodes.setdefault(InstallScheduler.key(package), package)
+        dependencies = {}
+        for key, package in nodes.items():
+            dependencies[key] = set(InstallScheduler.key(dep) for dep in dependencies_of(package)) & set(nodes) - {key}
+        return nodes, dependencies
+
+    @staticmethod
+    def critical_paths(nodes, dependents):
+        """
+        Returns, for every package, the length of the longest chain of packages waiting on it, itself included.
+        """
+        lengths = {}
+        for root in nodes:
+            if root in lengths:
+                continue
+            # Iterative depth first search, so that deep graphs do not hit the recursion limit
+            visiting = {root}
+            stack = [(root, iter(dependents[root]))]
+            while len(stack) > 0:
+                key, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    visiting.discard(key)
+                    lengths[key] = 1 + max([lengths.get(d, 0) for d in dependents[key] if d not in visiting], default=0)
+                elif child not in lengths and child not in visiting:
+                    visiting.add(child)
+                    stack.append((child, iter(dependents[child])))
+        return lengths
+
+    @staticmethod
+    def cycle(waiting):
+        """
+        Returns the packages of a dependency cycle among the packages waiting on each other.
+        """
+        key = min(waiting)
+        path = []
+        seen = {}
+        while key not in seen:
+            seen[key] = len(path)
+            path.append(key)
+            key = min(waiting[key])
+        return path[seen[key]:]
+
+    def install(self, packages, dependencies_of):
+        """
+        Installs packages, dependencies first. dependencies_of returns the dependency list of a package. Returns the
+        packages in the order their installs completed.
+        """
+        nodes, dependencies = InstallScheduler.graph(packages, dependencies_of)
+        dependents = {key: set() for key in nodes}
+        for key, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].add(key)
+        priorities = InstallScheduler.critical_paths(nodes, dependents)
+        order = {key: i for i, key in enumerate(nodes)}
+        waiting = {key: set(deps) for key, deps in dependencies.items()}
+        ready = []
+
+        def release(key):
+            del waiting[key]
+            heapq.heappush(ready, (-priorities[key], order[key], key))
+
+        for key in nodes:
+            if len(waiting[key]) == 0:
+                release(key)
+        installed = []
+        error = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            running = {}
+            while True:
+                while error is None and len(ready) > 0 and len(running) < self.concurrency:
+                    _, _, key = heapq.heappop(ready)
+                    package = nodes[key]
+                    running[pool.submit(self.installer.install_a_package, str(package["Name"]), str(package["Version"]))] = key
+                if len(running) == 0:
+                    if error is not None or len(waiting) == 0:
+                        break
+                    cycle = InstallScheduler.cycle(waiting)
+                    key = min(cycle, key=lambda k: order[k])
+                    self.logger.warn("Packages " + ", ".join(sorted(cycle)) + " depend on each other. Installing " + key + " first.")
+                    release(key)
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                            if len(running) > 0:
+                                self.logger.error("Installing " + key + " failed. Waiting for " + str(len(running)) + " running installs to finish.")
+                        continue
+                    installed.append(nodes[key])
+                    for dependent in dependents[key]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(key)
+                            if len(waiting[dependent]) == 0:
+                                release(dependent)
+        if error is not None:
+            raise error
+        return installed
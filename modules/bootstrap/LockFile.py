@@ -0,0 +1,113 @@
+"""
+This module reads and writes bob.lock, the resolved dependency closure of a project, kept next to its md.json.
+
+{
+    "Version": 1,
+    "MdHash": "...",
+    "Packages": [
+        {
+            "Name": "MyPackageName",
+            "Version": "1.0",
+            "Level": 0,
+            "Sha256": "...",
+            "Dependencies": [{"Name": "OtherPackage", "Version": "2.0"}]
+        }
+    ]
+}
+MdHash is the sha256 of the dependency sections of md.json. Packages lists the whole closure, by its distance (Level)
+from the dependencies of the project. Sha256 pins the archive each package was extracted from, and Dependencies lists
+what its own md.json depends on, so the closure can be walked, and installed dependencies first, without reading any
+package.
+
+Initialization parameters:
+1. project_root
+"""
+import os
+import json
+import hashlib
+
+
+class LockFileException (Exception):
+    pass
+
+
+class LockFile:
+    FILE_NAME = "bob.lock"
+    VERSION = 1
+    DEPENDENCY_SECTIONS = ["Dependencies", "BuildDeps", "TestDeps", "RuntimeDeps"]
+    PACKAGE_FIELDS = ["Name", "Version", "PackageSource"]
+
+    def __init__(self, project_root):
+        self.path = os.path.join(project_root, LockFile.FILE_NAME)
+
+    @staticmethod
+    def md_hash(config_obj):
+        sections = {section: config_obj.get(section, []) for section in LockFile.DEPENDENCY_SECTIONS}
+        return hashlib.sha256(json.dumps(sections, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def key(package):
+        return str(package["Name"]) + "/" + str(package["Version"])
+
+    @staticmethod
+    def package(entry):
+        """
+        Returns the package description of a lock entry, as it appears in a md.json.
+        """
+        return {field: entry[field] for field in LockFile.PACKAGE_FIELDS if field in entry}
+
+    def read(self):
+        """
+        Returns the lock, None if there is none or it can not be used.
+        """
+        try:
+            with open(self.path, "r") as fp:
+                lock = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(lock, dict) or lock.get("Version") != LockFile.VERSION or not isinstance(lock.get("Packages"), list):
+            return None
+        for entry in lock["Packages"]:
+            if not isinstance(entry, dict) or not all(k in entry for k in ["Name", "Version", "Level", "Sha256", "Dependencies"]):
+                return None
+        return lock
+
+    @staticmethod
+    def locked_closure(lock, initial_deps):
+        """
+        Walks the closure of initial_deps through the lock. Returns the lock entries reached, in install order, and
+        the packages that are not in the lock, which still have to be resolved.
+        """
+        entries = {LockFile.key(entry): entry for entry in lock["Packages"]}
+        locked = []
+        new_roots = []
+        seen = set()
+        frontier = initial_deps
+        while len(frontier) > 0:
+            next_frontier = []
+            for package in frontier:
+                key = LockFile.key(package)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if key in entries:
+                    locked.append(entries[key])
+                    next_frontier.extend(entries[key]["Dependencies"])
+                else:
+                    new_roots.append(package)
+            frontier = next_frontier
+        return sorted(locked, key=lambda entry: entry["Level"]), new_roots
+
+    def write(self, md_hash, entries):
+        try:
+            lock = {
+                "Version": LockFile.VERSION,
+                "MdHash": md_hash,
+                "Packages": sorted(entries, key=lambda entry: (entry["Level"], LockFile.key(entry)))
+            }
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as fp:
+                json.dump(lock, fp, indent=4)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            raise LockFileException("Could not write " + self.path + ": " + str(e))
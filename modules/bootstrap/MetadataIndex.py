@@ -0,0 +1,179 @@
+"""
+This module keeps an index of the dependencies of the packages extracted in the global package cache, in
+<global_package_cache>/.metadata.json, so that resolving a warm dependency graph reads a single file instead of the
+md.json of every package.
+
+{
+    "Version": 1,
+    "Packages": {
+        "MyPackageName/1.0": {
+            "Sha256": "...",
+            "Stamp": [1234, 1700000000000000000],
+            "Dependencies": [{"Name": "MyDependency", "Version": "2.0"}]
+        }
+    }
+}
+Sha256 is the sha256 of the archive the package was extracted from (see ExtractionStamp), and Dependencies lists the
+Dependencies, BuildDeps, TestDeps and RuntimeDeps of its md.json, in that order. A package is only indexed once it is
+extracted, and its entry is dropped when the package is extracted again from another archive.
+
+Stamp is the size and modification time, in nanoseconds, of the ExtractionStamp file of the package when it was
+indexed. An entry is only used while the stamp file is unchanged, which takes a single stat and not reading the stamp:
+entries of packages evicted from the cache (see CacheGC), or extracted again by another bootstrap, are dropped when
+they are looked up. Each entry is checked once per process.
+
+The index is read once, the first time it is needed. What is learnt while resolving is kept in memory, and merged into
+the file by save, under a lock, so concurrent bootstraps sharing the cache do not lose each other's entries. The index
+is a cache: when it can not be read or written, the dependencies are read from md.json as before.
+
+All the users of a global package cache in a process share the same index (see MetadataIndex.of), so that what the
+downloader drops is not returned by the installer.
+
+Initialization parameters:
+1. global_cache
+"""
+import os
+import json
+import threading
+
+from modules.bootstrap.CacheGC import CacheGC
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+
+
+class MetadataIndex:
+    FILE_NAME = ".metadata.json"
+    VERSION = 2
+    shared = {}
+    shared_lock = threading.Lock()
+
+    @staticmethod
+    def of(global_cache):
+        """
+        Returns the index of global_cache shared by the whole process.
+        """
+        path = os.path.abspath(global_cache)
+        with MetadataIndex.shared_lock:
+            if path not in MetadataIndex.shared:
+                MetadataIndex.shared[path] = MetadataIndex(global_cache)
+            return MetadataIndex.shared[path]
+
+    @staticmethod
+    def key(package_name, package_version):
+        return package_name + "/" + str(package_version)
+
+    def stamp_validator(self, package_name, package_version):
+        """
+        Returns the size and modification time of the ExtractionStamp file of the package, None if it has none.
+        """
+        try:
+            st = os.stat(os.path.join(self.global_cache, package_name, str(package_version), ExtractionStamp.FILE_NAME))
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def __init__(self, global_cache):
+        self.global_cache = global_cache
+        self.path = os.path.join(global_cache, MetadataIndex.FILE_NAME)
+        self.lock = threading.Lock()
+        self.packages = None
+        # What changed since the index was read: an entry by key, None for the entries dropped
+        self.changes = {}
+        # The keys whose entry matches the extracted package
+        self.verified = set()
+
+    def read(self):
+        try:
+            with open(self.path, "r") as fp:
+                index = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(index, dict) or index.get("Version") != MetadataIndex.VERSION or not isinstance(index.get("Packages"), dict):
+            return {}
+        return {
+            key: entry for key, entry in index["Packages"].items()
+            if isinstance(entry, dict) and isinstance(entry.get("Sha256"), str) and isinstance(entry.get("Stamp"), list)
+            and isinstance(entry.get("Dependencies"), list)
+        }
+
+    def load(self):
+        if self.packages is None:
+            self.packages = self.read()
+        return self.packages
+
+    def dependencies(self, package_name, package_version):
+        """
+        Returns the dependencies of the package, None if it is not indexed, or not extracted from the archive it was
+        indexed from anymore.
+        """
+        key = MetadataIndex.key(package_name, package_version)
+        with self.lock:
+            entry = self.load().get(key)
+            if entry is None or key in self.verified:
+                return None if entry is None else list(entry["Dependencies"])
+        validator = self.stamp_validator(package_name, package_version)
+        with self.lock:
+            if self.packages.get(key) is not entry:
+                return None
+            if validator is None or validator != entry["Stamp"]:
+                del self.packages[key]
+                self.changes[key] = None
+                return None
+            self.verified.add(key)
+        return list(entry["Dependencies"])
+
+    def record(self, package_name, package_version, dependencies):
+        """
+        Indexes the dependencies of the package, read from its md.json. Packages that are not extracted are not indexed.
+        """
+        # The stamp file is looked at before it is read: if it is written again in between, the entry is dropped on lookup
+        validator = self.stamp_validator(package_name, package_version)
+        stamp = ExtractionStamp(None, os.path.join(self.global_cache, package_name, str(package_version))).read()
+        if validator is None or stamp is None:
+            return
+        key = MetadataIndex.key(package_name, package_version)
+        entry = {"Sha256": stamp["Sha256"], "Stamp": validator, "Dependencies": list(dependencies)}
+        with self.lock:
+            self.load()[key] = entry
+            self.changes[key] = entry
+            self.verified.add(key)
+
+    def invalidate(self, package_name, package_version, digest):
+        """
+        Drops the entry of the package unless it was indexed from the archive with sha256 digest.
+        """
+        key = MetadataIndex.key(package_name, package_version)
+        with self.lock:
+            entry = self.load().get(key)
+            if entry is not None and (digest is None or entry["Sha256"] != digest):
+                del self.packages[key]
+                self.changes[key] = None
+                self.verified.discard(key)
+
+    def save(self):
+        """
+        Merges what changed into the index file. Returns False if it could not be written.
+        """
+        with self.lock:
+            if len(self.changes) == 0:
+                return True
+            try:
+                with CacheGC.locked(self.path + ".lock"):
+                    packages = self.read()
+                    for key, entry in self.changes.items():
+                        if entry is not None:
+                            packages[key] = entry
+                        else:
+                            packages.pop(key, None)
+                    temp_path = self.path + ".tmp"
+                    with open(temp_path, "w") as fp:
+                        json.dump({"Version": MetadataIndex.VERSION, "Packages": packages}, fp, separators=(",", ":"))
+                    os.replace(temp_path, self.path)
+            except OSError:
+                return False
+            self.changes = {}
+            for key, entry in packages.items():
+                if self.packages.get(key) != entry:
+                    # Indexed by another bootstrap in the meantime
+                    self.verified.discard(key)
+            self.packages.update(packages)
+        return True
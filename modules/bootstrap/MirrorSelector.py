@@ -0,0 +1,138 @@
+"""
+This module picks which mirror of a package source to download from.
+
+A package source can list mirrors, that serve the same packages, next to its own Url or Bucket:
+{
+    "Type": "URL",
+    "Url": "https://my_ftp_server/sub_folder",
+    "Mirrors": ["https://other_site/sub_folder", "https://third_site/packages"]
+}
+For S3 sources, "Mirrors" lists bucket names (replicated buckets, reachable with the same client).
+
+The first time a source is used in a run, every mirror is probed on the package being fetched: a one byte ranged read
+measures its latency, and a PROBE_SIZE ranged read its throughput. The mirrors are ranked on the time they would take
+to send REFERENCE_SIZE bytes. A mirror that can not be probed is ranked last, and a mirror that fails a download is
+moved to the end of the ranking for the rest of the run, so the next attempt fails over to the next best mirror.
+
+Initialization parameters:
+1. read_range (A function (endpoint, path, start, end) reading the bytes start to end of path from a mirror. It
+   returns None if the mirror does not support ranged reads)
+2. logger
+"""
+import time
+import threading
+
+from modules.bootstrap.HttpDownloader import HttpDownloaderException
+from modules.bootstrap.S3Downloader import S3DownloaderException
+
+
+class MirrorSelectorException (Exception):
+    pass
+
+
+class MirrorSelector:
+    PROBE_SIZE = 256 * 1024
+    REFERENCE_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, read_range, logger):
+        self.read_range = read_range
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.rankings = {}
+
+    @staticmethod
+    def endpoints(source_info):
+        """
+        Returns the source and its mirrors, each as a source of its own, in the order they are configured.
+        """
+        source_type = source_info["Type"].lower()
+        if source_type == "url":
+            field = "Url"
+        elif source_type == "s3":
+            field = "Bucket"
+        else:
+            raise MirrorSelectorException("Unknown package source type " + source_info["Type"])
+        mirrors = source_info.get("Mirrors", [])
+        if isinstance(mirrors, str):
+            mirrors = [mirrors]
+        endpoints = []
+        for location in [source_info[field]] + list(mirrors):
+            endpoint = {k: v for k, v in source_info.items() if k != "Mirrors"}
+            endpoint[field] = location
+            if endpoint not in endpoints:
+                endpoints.append(endpoint)
+        return endpoints
+
+    @staticmethod
+    def describe(endpoint):
+        if endpoint["Type"].lower() == "s3":
+            return "s3://" + endpoint["Bucket"]
+        return endpoint["Url"]
+
+    @staticmethod
+    def source_key(source_info):
+        return MirrorSelector.describe(source_info) + " " + " ".join(source_info.get("Mirrors", []))
+
+    def probe(self, endpoint, path):
+        """
+        Returns the latency (seconds) and the throughput (bytes per second, None if unknown) of endpoint.
+        """
+        start = time.monotonic()
+        first = self.read_range(endpoint, path, 0, 0)
+        latency = time.monotonic() - start
+        if first is None:
+            return latency, None
+        start = time.monotonic()
+        data = self.read_range(endpoint, path, 0, MirrorSelector.PROBE_SIZE - 1)
+        elapsed = time.monotonic() - start
+        if data is None or len(data) <= 1:
+            return latency, None
+        return latency, len(data) / max(elapsed - latency, 1e-6)
+
+    def rank(self, endpoints, path):
+        probes = []
+        for endpoint in endpoints:
+            try:
+                probes.append((endpoint, self.probe(endpoint, path)))
+            except (HttpDownloaderException, S3DownloaderException) as e:
+                self.logger.warn("Could not probe mirror " + MirrorSelector.describe(endpoint) + ": " + str(e))
+                probes.append((endpoint, None))
+        known = [p[1] for _, p in probes if p is not None and p[1] is not None]
+        # A mirror that does not support ranged reads is ranked on its latency alone
+        default_throughput = max(known) if len(known) > 0 else float(MirrorSelector.REFERENCE_SIZE)
+        scored = []
+        for i, (endpoint, p) in enumerate(probes):
+            if p is None:
+                score = float("inf")
+            else:
+                latency, throughput = p
+                score = latency + MirrorSelector.REFERENCE_SIZE / (default_throughput if throughput is None else throughput)
+            scored.append((score, i, endpoint))
+        ranking = [endpoint for _, _, endpoint in sorted(scored, key=lambda s: (s[0], s[1]))]
+        self.logger.info("Mirror ranking: " + ", ".join(MirrorSelector.describe(endpoint) for endpoint in ranking) + ".")
+        return ranking
+
+    def ranked(self, source_info, path):
+        """
+        Returns the mirrors of the source, fastest first. path is a package of the source, to probe the mirrors with
+        if they were not probed yet in this run.
+        """
+        endpoints = MirrorSelector.endpoints(source_info)
+        if len(endpoints) == 1:
+            return endpoints
+        key = MirrorSelector.source_key(source_info)
+        with self.lock:
+            if key not in self.rankings:
+                self.rankings[key] = self.rank(endpoints, path)
+            return list(self.rankings[key])
+
+    def demote(self, source_info, endpoint):
+        """
+        Moves a mirror that failed to the end of the ranking of its source.
+        """
+        key = MirrorSelector.source_key(source_info)
+        with self.lock:
+            ranking = self.rankings.get(key)
+            if ranking is not None and endpoint in ranking:
+                ranking.remove(endpoint)
+                ranking.append(endpoint)
@@ -0,0 +1,262 @@
+"""
+This module builds and applies package deltas: a version of a package described against an older version of the same
+package, so that a host that has the older version extracted only downloads what changed.
+
+A delta is published next to the archives of the new version, as
+<package_name>/<version>/<package_name>.delta-<base_version>.tar.xz. It is a tar holding delta.json:
+{
+    "Base": "1.4.2",
+    "Format": "tar.xz",
+    "Sha256": "...",
+    "Size": 123456,
+    "Files": {
+        "lib/libA.so": {"Sha256": "...", "Mode": 493, "Patch": "lib/libA.so"},
+        "include/a.h": {"Sha256": "...", "Mode": 420, "Base": "include/a.h"},
+        "md.json": {"Sha256": "...", "Mode": 420}
+    },
+    "Links": {"lib/libA.so.1": "libA.so"},
+    "Dirs": ["include", "lib"]
+}
+Format, Sha256 and Size describe the archive of the new version the delta was made from. Every file of the new version
+is listed with its sha256 and mode, and comes:
+1. "Base": from that path of the base version, when the file did not change (or only moved).
+2. "Patch": from patches/<path> in the delta, a zstandard frame compressed with that file of the base version as its
+   dictionary. This is how changed files are sent, when the zstandard module is available on both ends.
+3. Otherwise from files/<path> in the delta, whole.
+
+Applying a delta rebuilds the tree of the new version from the extracted tree of the base version, and checks every
+file against its sha256, so a damaged base tree fails the delta instead of producing a wrong package.
+"""
+import os
+import re
+import json
+import shutil
+import stat
+import tempfile
+
+from modules.bootstrap.ArchiveFormat import ArchiveFormat
+from modules.bootstrap.BlobStore import BlobStore
+
+
+class PackageDeltaException (Exception):
+    pass
+
+
+class PackageDelta:
+    FORMAT = ArchiveFormat.XZ
+    MANIFEST = "delta.json"
+    # Patches keep both versions of a file in memory, and need a zstandard window as large as the file
+    MAX_PATCH_SIZE = 128 * 1024 * 1024
+    ZSTD_LEVEL = 19
+
+    @staticmethod
+    def file_name(package_name, base_version):
+        return package_name + ".delta-" + str(base_version) + "." + PackageDelta.FORMAT
+
+    @staticmethod
+    def base_version(package_name, file_name):
+        """
+        Returns the base version of the delta called file_name, None if it is not a delta of the package.
+        """
+        match = re.match(re.escape(package_name) + r"\.delta-(.+)\." + re.escape(PackageDelta.FORMAT) + "$", file_name)
+        return None if match is None else match.group(1)
+
+    @staticmethod
+    def version_key(version):
+        """
+        Orders versions numerically, component by component: 1.10 comes after 1.9.
+        """
+        return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"[.\-+]", str(version))]
+
+    @staticmethod
+    def zstandard_dict(data):
+        zstandard = ArchiveFormat.zstandard()
+        return zstandard.ZstdCompressionDict(data, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+    @staticmethod
+    def patch(base_data, data):
+        zstandard = ArchiveFormat.zstandard()
+        window_log = min(max(10, (max(len(base_data), len(data)) - 1).bit_length()), 27)
+        params = zstandard.ZstdCompressionParameters.from_level(
+            PackageDelta.ZSTD_LEVEL, window_log=window_log, enable_ldm=True)
+        return zstandard.ZstdCompressor(dict_data=PackageDelta.zstandard_dict(base_data), compression_params=params).compress(data)
+
+    @staticmethod
+    def unpatch(base_data, patch_data):
+        zstandard = ArchiveFormat.zstandard()
+        decompressor = zstandard.ZstdDecompressor(dict_data=PackageDelta.zstandard_dict(base_data), max_window_size=1 << 27)
+        return decompressor.decompress(patch_data)
+
+    @staticmethod
+    def scan(root):
+        """
+        Returns the files (path -> (sha256, mode)), symbolic links (path -> target) and folders under root.
+        """
+        files = {}
+        links = {}
+        dirs = []
+        for folder, subfolders, names in os.walk(root):
+            relative = os.path.relpath(folder, root)
+            for name in subfolders + names:
+                path = os.path.normpath(os.path.join(relative, name))
+                full_path = os.path.join(folder, name)
+                if os.path.islink(full_path):
+                    links[path] = os.readlink(full_path)
+                elif os.path.isdir(full_path):
+                    dirs.append(path)
+                else:
+                    files[path] = (BlobStore.hash_file(full_path), stat.S_IMODE(os.stat(full_path).st_mode))
+        return files, links, sorted(dirs)
+
+    @staticmethod
+    def create(base_archive, base_format, archive, archive_format, base_version, dest):
+        """
+        Writes to dest the delta that rebuilds archive from base_archive. Returns its manifest.
+        """
+        try:
+            with tempfile.TemporaryDirectory() as work:
+                base_root = os.path.join(work, "base")
+                root = os.path.join(work, "new")
+                for path, folder, fmt in [(base_archive, base_root, base_format), (archive, root, archive_format)]:
+                    with ArchiveFormat.reader(path, fmt) as tfp:
+                        tfp.extractall(path=folder)
+                base_files = PackageDelta.scan(base_root)[0]
+                files, links, dirs = PackageDelta.scan(root)
+                by_digest = {}
+                for path, (digest, _) in sorted(base_files.items()):
+                    by_digest.setdefault(digest, path)
+                manifest = {
+                    "Base": str(base_version),
+                    "Format": archive_format,
+                    "Sha256": BlobStore.hash_file(archive),
+                    "Size": os.path.getsize(archive),
+                    "Files": {},
+                    "Links": links,
+                    "Dirs": dirs
+                }
+                payload = os.path.join(work, "payload")
+                for path, (digest, mode) in sorted(files.items()):
+                    entry = {"Sha256": digest, "Mode": mode}
+                    manifest["Files"][path] = entry
+                    if digest in by_digest:
+                        entry["Base"] = by_digest[digest]
+                        continue
+                    full_path = os.path.join(root, path)
+                    size = os.path.getsize(full_path)
+                    if path in base_files and ArchiveFormat.zstandard() is not None and size <= PackageDelta.MAX_PATCH_SIZE \
+                            and os.path.getsize(os.path.join(base_root, path)) <= PackageDelta.MAX_PATCH_SIZE:
+                        with open(os.path.join(base_root, path), "rb") as fp:
+                            base_data = fp.read()
+                        with open(full_path, "rb") as fp:
+                            data = fp.read()
+                        target = os.path.join(payload, "patches", path)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with open(target, "wb") as fp:
+                            fp.write(PackageDelta.patch(base_data, data))
+                        entry["Patch"] = path
+                    else:
+                        target = os.path.join(payload, "files", path)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.copyfile(full_path, target)
+                os.makedirs(payload, exist_ok=True)
+                with open(os.path.join(payload, PackageDelta.MANIFEST), "w") as fp:
+                    json.dump(manifest, fp, indent=4)
+                temp_dest = dest + ".tmp"
+                with ArchiveFormat.writer(temp_dest, PackageDelta.FORMAT) as tfp:
+                    for entry in sorted(os.listdir(payload)):
+                        tfp.add(os.path.join(payload, entry), arcname=entry)
+                os.replace(temp_dest, dest)
+                return manifest
+        except OSError as e:
+            raise PackageDeltaException("Could not create the delta " + dest + ": " + str(e))
+        except ArchiveFormat.errors() as e:
+            raise PackageDeltaException("Could not read a package to create the delta " + dest + ": " + str(e))
+
+    @staticmethod
+    def check_path(path):
+        normalized = os.path.normpath(path)
+        if os.path.isabs(normalized) or normalized == ".." or normalized.startswith(".." + os.sep):
+            raise PackageDeltaException("Path out of the package in delta: " + path)
+        return normalized
+
+    @staticmethod
+    def extract_payload(tfp, payload):
+        """
+        Extracts the payload of a delta into the folder payload. The payload only holds folders and regular files, all
+        inside payload.
+        """
+        import tarfile
+        # The data filter, where tarfile has it, also drops special permission bits
+        options = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+        for member in tfp:
+            PackageDelta.check_path(member.name)
+            if not (member.isdir() or member.isfile()):
+                raise PackageDeltaException("Unexpected member in delta: " + member.name)
+            tfp.extract(member, path=payload, **options)
+
+    @staticmethod
+    def read_manifest(payload):
+        try:
+            with open(os.path.join(payload, PackageDelta.MANIFEST), "r") as fp:
+                manifest = json.load(fp)
+        except OSError as e:
+            raise PackageDeltaException("Delta without " + PackageDelta.MANIFEST + ": " + str(e))
+        except ValueError as e:
+            raise PackageDeltaException("Malformed " + PackageDelta.MANIFEST + ": " + str(e))
+        if not isinstance(manifest, dict) or not all(k in manifest for k in ["Base", "Sha256", "Size", "Files"]):
+            raise PackageDeltaException("Malformed " + PackageDelta.MANIFEST + ".")
+        return manifest
+
+    @staticmethod
+    def apply(delta, base_root, dest):
+        """
+        Rebuilds the new version of the package into the folder dest, which must not exist, from the delta file and
+        the extracted tree of the base version in base_root. Returns the manifest of the delta and the member names of
+        the rebuilt tree.
+        """
+        try:
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(dest)) as payload:
+                with ArchiveFormat.reader(delta, PackageDelta.FORMAT) as tfp:
+                    PackageDelta.extract_payload(tfp, payload)
+                manifest = PackageDelta.read_manifest(payload)
+                os.makedirs(dest)
+                members = []
+                for path in manifest.get("Dirs", []):
+                    os.makedirs(os.path.join(dest, PackageDelta.check_path(path)), exist_ok=True)
+                    members.append(path)
+                for path, entry in sorted(manifest["Files"].items()):
+                    path = PackageDelta.check_path(path)
+                    target = os.path.join(dest, path)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    if "Base" in entry:
+                        shutil.copyfile(os.path.join(base_root, PackageDelta.check_path(entry["Base"])), target)
+                    elif "Patch" in entry:
+                        if ArchiveFormat.zstandard() is None:
+                            raise PackageDeltaException("The delta has patches, that need the zstandard python module.")
+                        with open(os.path.join(base_root, PackageDelta.check_path(entry["Patch"])), "rb") as fp:
+                            base_data = fp.read()
+                        with open(os.path.join(payload, "patches", path), "rb") as fp:
+                            data = PackageDelta.unpatch(base_data, fp.read())
+                        with open(target, "wb") as fp:
+                            fp.write(data)
+                    else:
+                        shutil.copyfile(os.path.join(payload, "files", path), target)
+                    if BlobStore.hash_file(target) != entry["Sha256"]:
+                        raise PackageDeltaException("File " + path + " rebuilt from the delta does not match its sha256.")
+                    os.chmod(target, entry.get("Mode", 0o644))
+                    members.append(path)
+                for path, link_target in sorted(manifest.get("Links", {}).items()):
+                    path = PackageDelta.check_path(path)
+                    if os.path.isabs(link_target):
+                        raise PackageDeltaException("Link out of the package in delta: " + path + " -> " + link_target)
+                    PackageDelta.check_path(os.path.join(os.path.dirname(path), link_target))
+                    os.makedirs(os.path.dirname(os.path.join(dest, path)), exist_ok=True)
+                    os.symlink(link_target, os.path.join(dest, path))
+                    members.append(path)
+                return manifest, members
+        except OSError as e:
+            raise PackageDeltaException("Could not apply the delta " + delta + ": " + str(e))
+        except ArchiveFormat.errors() as e:
+            raise PackageDeltaException("Could not read the delta " + delta + ": " + str(e))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PackageDeltaException("Malformed " + PackageDelta.MANIFEST + ": " + str(e))
@@ -8,10 +8,72 @@ Note that each package can have its individual source override. So you can downl
 
 After downloading, it is extracted inside the same folder.
 
-Config parameters needed:
+The packages of a frontier are downloaded and extracted concurrently on a bounded pool of worker threads. The
+largest packages are scheduled first (using the optional "Size" hint of a package, in bytes) so that the long
+transfers do not end up as the tail of the frontier.
+
+Config parameters needed (the defaults are the ones of Config.DEFAULT_CONFIG):
 1. GlobalPackageCache
 2. PackageSource
 3. Logger
+4. DownloadConcurrency (OPTIONAL, defaults to 8. Number of packages fetched and extracted at the same time)
+5. HttpConnectionsPerHost (OPTIONAL, defaults to 8. Cap on the pooled keep-alive connections to one URL host)
+6. DownloadRetries (OPTIONAL, defaults to 3. Number of attempts for one package before giving up)
+7. S3PartSize (OPTIONAL, defaults to 8 MiB. Size of the parallel ranged GETs large S3 objects are split in)
+8. S3MaxConcurrency (OPTIONAL, defaults to 10. Number of S3 parts in flight, across all the packages of a frontier)
+9. S3MaxPoolConnections (OPTIONAL, defaults to 10. Connections pooled by the S3 client shared by all downloads)
+10. S3EndpointUrl (OPTIONAL. Endpoint of an S3 compatible store to use instead of AWS)
+11. DedupPackageStore (OPTIONAL, defaults to False. Keep extracted files in the content addressed BlobStore)
+12. StreamExtract (OPTIONAL, defaults to False. Extract packages while they download, see below)
+13. KeepArchives (OPTIONAL, defaults to True. With StreamExtract, also keep the archive in the cache)
+14. ArchiveFormats (OPTIONAL, defaults to ["tar"]. Archive formats to look for, in order of preference)
+15. MirrorSegmentSize (OPTIONAL, defaults to 8 MiB. Size of the parts a package is split in to fetch it from several URL
+    mirrors at once. 0 fetches every package from a single mirror)
+16. UseDeltas (OPTIONAL, defaults to False. Rebuild packages from a delta against a version in the cache, see below)
+17. MetadataIndex (OPTIONAL, defaults to True. Look the dependencies of packages up in the index of the cache, see
+    MetadataIndex)
+
+A package can be published in several archive formats (see ArchiveFormat). When more than one format is configured,
+the source is probed with HEAD requests, in order, for the first format it has the package in. The format found is
+tried first for the next packages of the same source. The archive is saved as <package_name>.<format>.
+
+A package resolved from a package index (see PackageIndex) carries an "Archives" hint listing the formats the source
+has it in, with their size and sha256. The first configured format in the hint is downloaded without probing, and the
+sha256 of the downloaded archive is checked against the index.
+
+Downloads are written to <package_name>.tar.partial first and renamed to <package_name>.tar once complete. A failed
+attempt, in this run or an earlier one, is resumed from where it stopped (see PartialFile).
+
+With StreamExtract, the response body is fed to a streaming tar reader and the package is extracted while its bytes
+are still arriving (see ArchiveStream). The archive is hashed on the fly, and only written to disk with KeepArchives.
+A streamed download can not be resumed, a failed attempt starts over.
+
+The dependencies of packages can also be fetched without downloading the packages (fetch_dependencies). md.json is read
+out of an uncompressed tar with ranged reads (see TarProbe). A package whose md.json can not be read that way, because
+the server does not support ranges or the package is compressed, is downloaded and extracted in full instead.
+
+A package source can list mirrors (see MirrorSelector). Packages are fetched from the fastest mirror, and from the next
+one when a mirror fails. With MirrorSegmentSize, packages of URL sources are fetched from all the mirrors at once,
+split in parts of that size (see HttpDownloader.download_segmented). Packages that fit in a part, mirrors that do not
+support Range requests or do not agree on the package, and segmented downloads that fail, fall back to fetching the
+package from a single mirror.
+
+With UseDeltas, a package that has another version extracted in the cache is rebuilt from a delta against that
+version when the source publishes one (see PackageDelta), instead of being downloaded in full. A package resolved from
+the index carries a "Deltas" hint listing the base versions the source has deltas from, and the smallest usable one is
+picked. Otherwise the source is probed for a delta from the newest version in the cache. The rebuilt tree is checked
+file by file, and gets the extraction stamp of the archive it replaces. If the delta can not be used, the package is
+downloaded in full.
+
+A package is only extracted again if its archive changed or its extracted tree is damaged (see ExtractionStamp).
+With MetadataIndex, extracting a package from another archive than the one its dependencies were indexed from drops
+them from the index.
+
+Every package used is marked as accessed (see CacheGC), so the least recently used ones can be evicted when the cache
+grows too large.
+
+With DedupPackageStore, a package is extracted into a staging folder first. Its files are then moved into the blob
+store and the extracted tree is made of links to the blobs, before it replaces the previously extracted tree.
 
 Initialization parameters:
 A list of packages where each member of the list is of the form:
@@ -35,12 +97,24 @@ OR
     }
 }
 """
-import subprocess
 import os
-import boto3
-import tarfile
+import json
+import shutil
+import tempfile
+import threading
 
-from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from modules.bootstrap.HttpDownloader import HttpDownloaderException, HttpDownloader
+from modules.bootstrap.S3Downloader import S3DownloaderException, S3Downloader
+from modules.bootstrap.BlobStore import BlobStoreException, BlobStore
+from modules.bootstrap.CacheGC import CacheGC
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+from modules.bootstrap.MetadataIndex import MetadataIndex
+from modules.bootstrap.ArchiveStream import ArchiveStreamException, ArchiveStream
+from modules.bootstrap.ArchiveFormat import ArchiveFormatException, ArchiveFormat
+from modules.bootstrap.TarProbe import TarProbeException, TarProbe
+from modules.bootstrap.MirrorSelector import MirrorSelectorException, MirrorSelector
+from modules.bootstrap.PackageDelta import PackageDeltaException, PackageDelta
 
 
 class PackageDownloaderException (Exception):
@@ -48,33 +122,162 @@ class PackageDownloaderException (Exception):
 
 
 class PackageDownloader:
-    @staticmethod
-    def wget(url, dest):
-        try:
-            p = subprocess.Popen(["wget", url, "-O", dest], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            err, out = p.communicate()
-            exit_code = True
-            if "ERROR" in str(out) or p.returncode != 0:
-                err = out
-                out = ""
-                exit_code = False
-            return err, out, exit_code
-        except OSError as e:
-            err = str(e)
-            out = ""
-            exit_code = False
-            return err, out, exit_code
-
     def __init__(self, config_object):
         try:
             self.global_package_cache = config_object["GlobalPackageCache"]
             self.global_package_info = config_object["PackageSource"]
             self.logger = config_object["Logger"]
-            self.s3_client = boto3.client("s3")
+            self.concurrency = int(config_object.get("DownloadConcurrency", 1))
+            self.http = HttpDownloader(config_object.get("HttpConnectionsPerHost", 8))
+            self.retries = max(1, int(config_object.get("DownloadRetries", 1)))
+            self.blob_store = BlobStore(self.global_package_cache) if config_object.get("DedupPackageStore", False) else None
+            self.stream_extract = bool(config_object.get("StreamExtract", False))
+            self.keep_archives = bool(config_object.get("KeepArchives", True))
+            self.archive_formats = PackageDownloader.usable_formats(config_object.get("ArchiveFormats", [ArchiveFormat.TAR]))
+            self.source_formats = {}
+            self.local_formats = {}
+            # The S3 client is created the first time an S3 source is used (see s3_downloader)
+            self.s3 = None
+            self.s3_lock = threading.Lock()
+            self.s3_endpoint_url = config_object.get("S3EndpointUrl")
+            self.s3_pool_connections = int(config_object.get("S3MaxPoolConnections", 10))
+            self.s3_part_size = int(config_object.get("S3PartSize", 8 * 1024 * 1024))
+            self.s3_concurrency = int(config_object.get("S3MaxConcurrency", 10))
+            if self.s3_part_size < 1 or self.s3_concurrency < 1:
+                raise S3DownloaderException("Part size and concurrency of S3 transfers need to be positive.")
+            self.mirrors = MirrorSelector(self.read_range, self.logger)
+            self.segment_size = int(config_object.get("MirrorSegmentSize", 0))
+            self.use_deltas = bool(config_object.get("UseDeltas", False))
+            self.metadata = MetadataIndex.of(self.global_package_cache) if config_object.get("MetadataIndex", False) else None
         except KeyError as e1:
             raise PackageDownloaderException(str(e1))
         except TypeError as e2:
             raise PackageDownloaderException(str(e2))
+        except ValueError as e3:
+            raise PackageDownloaderException("Invalid download settings: " + str(e3))
+        except HttpDownloaderException as e4:
+            raise PackageDownloaderException(str(e4))
+        except S3DownloaderException as e5:
+            raise PackageDownloaderException(str(e5))
+        except ArchiveFormatException as e6:
+            raise PackageDownloaderException(str(e6))
+
+    @staticmethod
+    def usable_formats(archive_formats):
+        """
+        Drops the formats this host can not read (tar.zst without the zstandard module).
+        """
+        if isinstance(archive_formats, str):
+            archive_formats = [archive_formats]
+        for archive_format in archive_formats:
+            if archive_format not in ArchiveFormat.FORMATS:
+                ArchiveFormat.check(archive_format)
+        usable = [archive_format for archive_format in archive_formats if ArchiveFormat.is_supported(archive_format)]
+        if len(usable) == 0:
+            raise ArchiveFormatException("None of the archive formats " + ", ".join(archive_formats) + " can be read.")
+        return usable
+
+    @staticmethod
+    def remote_path(package_name, package_version, archive_format):
+        return package_name + "/" + str(package_version) + "/" + ArchiveFormat.file_name(package_name, archive_format)
+
+    def local_archive(self, dest_folder, package_name):
+        """
+        Returns the format of the archive of the package that is in the cache already, None if there is none.
+        """
+        for archive_format in self.archive_formats:
+            if os.path.isfile(os.path.join(dest_folder, ArchiveFormat.file_name(package_name, archive_format))):
+                return archive_format
+        return None
+
+    def s3_downloader(self):
+        """
+        Returns the S3 downloader, creating the boto3 client on first use. Importing boto3 and creating a client takes
+        a large part of a second, which runs that never touch an S3 source do not pay.
+        """
+        with self.s3_lock:
+            if self.s3 is None:
+                import boto3
+                from botocore.config import Config as BotoConfig
+                s3_client = boto3.client(
+                    "s3",
+                    endpoint_url=self.s3_endpoint_url,
+                    config=BotoConfig(max_pool_connections=self.s3_pool_connections))
+                self.s3 = S3Downloader(s3_client, part_size=self.s3_part_size, max_concurrency=self.s3_concurrency)
+            return self.s3
+
+    def variant_exists(self, endpoint, path):
+        if endpoint["Type"].lower() == "url":
+            return self.http.exists(endpoint["Url"] + "/" + path)
+        elif endpoint["Type"].lower() == "s3":
+            return self.s3_downloader().exists(endpoint["Bucket"], path)
+        raise PackageDownloaderException("Unknown package source type " + endpoint["Type"])
+
+    def download_from(self, endpoint, path, dest):
+        if endpoint["Type"].lower() == "url":
+            return self.http.download(endpoint["Url"] + "/" + path, dest)
+        elif endpoint["Type"].lower() == "s3":
+            return self.s3_downloader().download(endpoint["Bucket"], path, dest)
+        raise PackageDownloaderException("Unknown package source type " + endpoint["Type"])
+
+    def read_range(self, endpoint, path, start, end):
+        if endpoint["Type"].lower() == "url":
+            return self.http.read_range(endpoint["Url"] + "/" + path, start, end)
+        elif endpoint["Type"].lower() == "s3":
+            return self.s3_downloader().read_range(endpoint["Bucket"], path, start, end)
+        raise PackageDownloaderException("Unknown package source type " + endpoint["Type"])
+
+    def stream_from(self, endpoint, path, consume):
+        if endpoint["Type"].lower() == "url":
+            return self.http.stream(endpoint["Url"] + "/" + path, consume)
+        elif endpoint["Type"].lower() == "s3":
+            return self.s3_downloader().stream(endpoint["Bucket"], path, consume)
+        raise PackageDownloaderException("Unknown package source type " + endpoint["Type"])
+
+    def probe(self, package_name, package_version, source_info, archives=None):
+        """
+        Returns the first of the configured archive formats the source has the package in. Probing is skipped when the
+        package index names the formats of the package, and a format whose probe fails is taken as not published.
+        """
+        if archives is not None:
+            for archive_format in self.archive_formats:
+                if archive_format in archives:
+                    return archive_format
+        if len(self.archive_formats) == 1:
+            return self.archive_formats[0]
+        source_key = (source_info["Type"].lower(), source_info.get("Url"), source_info.get("Bucket"))
+        # A source usually publishes all its packages in the same format
+        last_found = self.source_formats.get(source_key)
+        order = list(self.archive_formats)
+        if last_found is not None:
+            order.remove(last_found)
+            order.insert(0, last_found)
+        for archive_format in order:
+            path = PackageDownloader.remote_path(package_name, package_version, archive_format)
+            try:
+                found = self.with_failover(path, source_info, MirrorSelector.endpoints(source_info), self.variant_exists, path)
+            except PackageDownloaderException as e:
+                if archive_format == order[-1]:
+                    raise
+                # A source may refuse probes of what it does not publish, try the next format
+                self.logger.warn("Could not probe " + path + ": " + str(e) + " Trying the next format.")
+                found = False
+            if found:
+                self.source_formats[source_key] = archive_format
+                return archive_format
+        raise PackageDownloaderException(
+            "Package " + package_name + "/" + str(package_version) + " not found as any of: " + ", ".join(self.archive_formats) + ".")
+
+    @staticmethod
+    def expected_digest(archives, archive_format):
+        if archives is None or not isinstance(archives.get(archive_format), dict):
+            return None
+        return archives[archive_format].get("Sha256")
+
+    def verify(self, package_name, package_version, digest, expected):
+        if expected is not None and digest != expected:
+            raise PackageDownloaderException(
+                "Package " + package_name + "/" + str(package_version) + " does not match the package index. Expected sha256 " + expected + ", got " + digest + ".")
 
     def prep_cache(self):
         if not os.path.isdir(self.global_package_cache):
@@ -83,62 +286,440 @@ class PackageDownloader:
         self.logger.info("Done setting up global cache.")
         return self
 
-    def download_a_package_if_needed(self, package_name, package_version, source_info):
+    def with_retries(self, description, fetch, *args):
+        for attempt in range(1, self.retries + 1):
+            try:
+                return fetch(*args)
+            except (HttpDownloaderException, S3DownloaderException, ArchiveStreamException) as e:
+                if attempt == self.retries:
+                    raise PackageDownloaderException("Failed to download package " + description + ". " + str(e))
+                self.logger.warn("Attempt " + str(attempt) + " to download " + description + " failed: " + str(e) + ". Resuming.")
+
+    def with_failover(self, description, source_info, endpoints, fetch, *args):
+        """
+        Calls fetch(endpoint, *args) on the mirrors in turn, starting over from the first one, until it succeeds or
+        every mirror was tried and the retries are exhausted.
+        """
+        attempts = max(self.retries, len(endpoints))
+        for attempt in range(1, attempts + 1):
+            endpoint = endpoints[(attempt - 1) % len(endpoints)]
+            try:
+                return fetch(endpoint, *args)
+            except (HttpDownloaderException, S3DownloaderException, ArchiveStreamException) as e:
+                if attempt == attempts:
+                    raise PackageDownloaderException("Failed to download package " + description + ". " + str(e))
+                if len(endpoints) > 1:
+                    self.mirrors.demote(source_info, endpoint)
+                    self.logger.warn("Fetching " + description + " from " + MirrorSelector.describe(endpoint) + " failed: " + str(e) + ". Failing over.")
+                else:
+                    self.logger.warn("Attempt " + str(attempt) + " to download " + description + " failed: " + str(e) + ". Resuming.")
+
+    def download_segmented(self, path, endpoints, dest):
+        """
+        Downloads path from all the URL mirrors at once. Returns the size of the download, None if it has to be
+        downloaded from a single mirror instead.
+        """
+        urls = [endpoint["Url"] + "/" + path for endpoint in endpoints]
+        try:
+            size = self.with_retries(path, self.http.download_segmented, urls, dest, self.segment_size)
+        except PackageDownloaderException as e:
+            self.logger.warn("Could not fetch " + path + " from several mirrors at once: " + str(e) + " Fetching it from one mirror.")
+            return None
+        if size is not None:
+            self.logger.info("Downloaded " + path + " from " + str(len(urls)) + " mirrors (" + str(size) + " bytes).")
+        return size
+
+    def download_a_package_if_needed(self, package_name, package_version, source_info, archives=None, deltas=None):
         try:
             self.prep_cache()
             source_type = source_info["Type"]
             dest_folder = os.path.join(self.global_package_cache, package_name, str(package_version))
-            dest = os.path.join(dest_folder, package_name + ".tar")
-            if os.path.isfile(dest):
+            local_format = self.local_archive(dest_folder, package_name)
+            if local_format is not None:
                 self.logger.info("Package " + package_name + "/" + str(package_version ) + " already downloaded. Skipping.")
+                self.local_formats[(package_name, str(package_version))] = local_format
+                CacheGC.touch(dest_folder)
+                return self
+            if self.rebuilt_from_delta(package_name, package_version, source_info, archives, deltas):
                 return self
-            else:
-                if not os.path.isdir(dest_folder):
-                    os.makedirs(dest_folder)
+            if not os.path.isdir(dest_folder):
+                os.makedirs(dest_folder)
+            archive_format = self.probe(package_name, package_version, source_info, archives)
+            dest = os.path.join(dest_folder, ArchiveFormat.file_name(package_name, archive_format))
             self.logger.info("Downloading package " + package_name + " : " + str(package_version) + " of type " + source_type)
-            if source_type.lower() == "url":
-                url = source_info["Url"] + "/" + package_name + "/" + str(package_version) + "/" + package_name + ".tar"
-                err, out, exit_code = PackageDownloader.wget(url, dest)
-                if not exit_code:
-                    raise PackageDownloaderException("Failed to download package " + url + ".")
-                self.logger.info(out)
-                self.logger.info(err)
-                self.logger.info("Downloaded " + url + ".")
-            elif source_type.lower() == "s3":
-                bucket = source_info["Bucket"]
-                key = package_name + "/" + str(package_version) + "/" + package_name + ".tar"
-                with open(dest, "w") as fp:
-                    try:
-                        self.s3_client.download_fileobj(bucket, key, fp)
-                    except ClientError as e:
-                        raise PackageDownloaderException(e.response["Error"]["Code"])
-                self.logger.info("Downloaded package " + package_name + "/" + str(package_version) + " from S3 bucket " + bucket + ".")
+            path = PackageDownloader.remote_path(package_name, package_version, archive_format)
+            endpoints = self.mirrors.ranked(source_info, path)
+            size = None
+            if source_type.lower() == "url" and len(endpoints) > 1 and self.segment_size > 0:
+                size = self.download_segmented(path, endpoints, dest)
+            if size is None:
+                size = self.with_failover(path, source_info, endpoints, self.download_from, path, dest)
+                self.logger.info("Downloaded package " + package_name + "/" + str(package_version) + " (" + str(size) + " bytes).")
+            expected = PackageDownloader.expected_digest(archives, archive_format)
+            if expected is not None:
+                digest = BlobStore.hash_file(dest)
+                if digest != expected:
+                    os.remove(dest)
+                self.verify(package_name, package_version, digest, expected)
+            self.local_formats[(package_name, str(package_version))] = archive_format
+            CacheGC.touch(dest_folder)
         except KeyError as ex:
             raise PackageDownloaderException("Malformed package info " + str(ex))
         except TypeError as ex1:
             raise PackageDownloaderException("Malformed package info " + str(ex1))
         except OSError as ex2:
             raise PackageDownloaderException(str(ex2))
+        except MirrorSelectorException as ex3:
+            raise PackageDownloaderException(str(ex3))
         return self
 
+    def cached_bases(self, package_name, package_version):
+        """
+        Returns the other versions of the package that are extracted in the cache, newest first.
+        """
+        package_folder = os.path.join(self.global_package_cache, package_name)
+        try:
+            versions = os.listdir(package_folder)
+        except OSError:
+            return []
+        bases = []
+        for version in versions:
+            if version == str(package_version):
+                continue
+            stamp = ExtractionStamp(None, os.path.join(package_folder, version))
+            recorded = stamp.read()
+            if recorded is not None and stamp.is_intact(recorded["Members"]):
+                bases.append(version)
+        return sorted(bases, key=PackageDelta.version_key, reverse=True)
+
+    def pick_base(self, package_name, package_version, archives, deltas):
+        """
+        Returns the cached version to rebuild the package from, None if no delta is worth fetching.
+        """
+        bases = self.cached_bases(package_name, package_version)
+        if deltas is None:
+            return bases[0] if len(bases) > 0 else None
+        bases = [base for base in bases if isinstance(deltas.get(base), dict)]
+        if len(bases) == 0:
+            return None
+        base = min(bases, key=lambda b: int(deltas[b].get("Size", 0)))
+        sizes = [int(archive.get("Size", 0)) for archive in (archives or {}).values() if isinstance(archive, dict)]
+        if len(sizes) > 0 and int(deltas[base].get("Size", 0)) >= min(sizes):
+            return None
+        return base
+
+    def rebuilt_from_delta(self, package_name, package_version, source_info, archives=None, deltas=None):
+        """
+        Rebuilds the package from a delta against a version in the cache, unless it is extracted already. Returns False
+        if the package still has to be downloaded.
+        """
+        dest_folder = os.path.join(self.global_package_cache, package_name, str(package_version))
+        # Without an archive, the stamp of a streamed or rebuilt package matches on its own
+        placeholder = os.path.join(dest_folder, ArchiveFormat.file_name(package_name, self.archive_formats[0]))
+        if ExtractionStamp(placeholder, dest_folder).matches():
+            self.logger.info("Package " + package_name + "/" + str(package_version) + " already extracted. Skipping.")
+            CacheGC.touch(dest_folder)
+            return True
+        if not self.use_deltas:
+            return False
+        base = self.pick_base(package_name, package_version, archives, deltas)
+        if base is None:
+            return False
+        path = package_name + "/" + str(package_version) + "/" + PackageDelta.file_name(package_name, base)
+        endpoints = self.mirrors.ranked(source_info, path)
+        if deltas is None:
+            try:
+                if not self.with_failover(path, source_info, endpoints, self.variant_exists, path):
+                    return False
+            except PackageDownloaderException as e:
+                self.logger.warn("Could not probe the delta of " + package_name + "/" + str(package_version) + " from " + base + ": " + str(e) + ". Downloading it in full.")
+                return False
+        if not os.path.isdir(dest_folder):
+            os.makedirs(dest_folder)
+        delta_file = os.path.join(dest_folder, PackageDelta.file_name(package_name, base))
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=dest_folder)
+        try:
+            self.logger.info("Rebuilding package " + package_name + "/" + str(package_version) + " from " + base + ".")
+            size = self.with_failover(path, source_info, endpoints, self.download_from, path, delta_file)
+            if deltas is not None and deltas[base].get("Sha256") not in [None, BlobStore.hash_file(delta_file)]:
+                raise PackageDeltaException("The delta does not match the package index.")
+            tree = os.path.join(staging, "tree")
+            manifest, members = PackageDelta.apply(delta_file, os.path.join(self.global_package_cache, package_name, base), tree)
+            expected = PackageDownloader.expected_digest(archives, manifest.get("Format"))
+            if expected is not None and expected != manifest["Sha256"]:
+                raise PackageDeltaException("The delta does not rebuild the archive in the package index.")
+            if self.blob_store is not None:
+                self.blob_store.ingest_tree(tree)
+            stamp = ExtractionStamp(os.path.join(dest_folder, ArchiveFormat.file_name(package_name, manifest.get("Format", ArchiveFormat.TAR))), dest_folder)
+            stamp.clear()
+            PackageDownloader.swap_in(tree, dest_folder)
+            if not stamp.write(members, manifest["Sha256"], manifest["Size"]):
+                self.logger.warn("Could not record the extraction of " + package_name + "/" + str(package_version) + ". It will be downloaded again.")
+            self.extracted(package_name, package_version, stamp)
+            self.logger.info("Rebuilt package " + package_name + "/" + str(package_version) + " from a " + str(size) + " bytes delta.")
+            CacheGC.touch(dest_folder)
+            return True
+        except (PackageDeltaException, PackageDownloaderException, BlobStoreException) as e:
+            self.logger.warn("Could not use the delta of " + package_name + "/" + str(package_version) + " from " + base + ": " + str(e) + ". Downloading it in full.")
+            return False
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            if os.path.lexists(delta_file):
+                os.remove(delta_file)
+
     def extract_one_package(self, package_name, package_version):
         try:
-            downloaded_file = os.path.join(self.global_package_cache, package_name, str(package_version), package_name + ".tar")
+            archive_format = self.local_formats.get((package_name, str(package_version)), ArchiveFormat.TAR)
+            downloaded_file = os.path.join(
+                self.global_package_cache, package_name, str(package_version), ArchiveFormat.file_name(package_name, archive_format))
             extract_path = os.path.join(self.global_package_cache, package_name, str(package_version))
-            tfp = tarfile.open(downloaded_file)
-            tfp.extractall(path=extract_path)
-            tfp.close()
+            stamp = ExtractionStamp(downloaded_file, extract_path)
+            if stamp.matches():
+                self.logger.info("Package " + package_name + "/" + str(package_version) + " already extracted. Skipping.")
+                return self
+            stamp.clear()
+            with ArchiveFormat.reader(downloaded_file, archive_format) as tfp:
+                members = self.extract_tar(tfp, extract_path)
             self.logger.info("Extracted file " + downloaded_file + ".")
+            if not stamp.write(members):
+                self.logger.warn("Could not record the extraction of " + downloaded_file + ". It will be extracted again.")
+            self.extracted(package_name, package_version, stamp)
         except OSError as e:
             raise PackageDownloaderException(str(e))
+        except ArchiveFormat.errors() as e:
+            raise PackageDownloaderException("Could not extract " + package_name + "/" + str(package_version) + ": " + str(e))
+        except BlobStoreException as e:
+            raise PackageDownloaderException(str(e))
+        return self
+
+    def extracted(self, package_name, package_version, stamp):
+        """
+        Drops the indexed dependencies of a package just extracted, unless they were indexed from the same archive.
+        """
+        if self.metadata is not None:
+            recorded = stamp.read()
+            self.metadata.invalidate(package_name, package_version, None if recorded is None else recorded["Sha256"])
+
+    def extract_tar(self, tfp, extract_path):
+        """
+        Extracts the open tar file tfp into extract_path and returns the names of its members. The members are read in
+        order, so tfp can be opened on a stream.
+        """
+        if self.blob_store is not None:
+            return self.extract_deduplicated(tfp, extract_path)
+        tfp.extractall(path=extract_path)
+        return tfp.getnames()
+
+    def extract_deduplicated(self, tfp, extract_path):
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=extract_path)
+        try:
+            tfp.extractall(path=staging)
+            members = tfp.getnames()
+            self.blob_store.ingest_tree(staging)
+            PackageDownloader.swap_in(staging, extract_path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return members
+
+    @staticmethod
+    def swap_in(tree, extract_path):
+        """
+        Moves the entries of tree into extract_path. Entries are removed rather than overwritten, because writing to an
+        existing file would write through its link into the blob store.
+        """
+        for entry in os.listdir(tree):
+            target = os.path.join(extract_path, entry)
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            elif os.path.lexists(target):
+                os.remove(target)
+            os.rename(os.path.join(tree, entry), target)
+
+    def extract_stream(self, body, archive_format, keep_path, extract_path):
+        """
+        Extracts the archive in the response body while it is arriving. Returns the member names, the sha256 and the
+        size of the archive.
+        """
+        stream = ArchiveStream(body, keep_path)
+        try:
+            with ArchiveFormat.open_stream(stream, archive_format) as tfp:
+                members = self.extract_tar(tfp, extract_path)
+            digest, size = stream.finish()
+        except ArchiveFormat.errors() as e:
+            raise ArchiveStreamException("Could not extract the download stream: " + str(e))
+        finally:
+            stream.abort()
+        return members, digest, size
+
+    def stream_a_package_if_needed(self, package_name, package_version, source_info, archives=None, deltas=None):
+        try:
+            self.prep_cache()
+            source_type = source_info["Type"]
+            dest_folder = os.path.join(self.global_package_cache, package_name, str(package_version))
+            local_format = self.local_archive(dest_folder, package_name)
+            if local_format is not None:
+                self.local_formats[(package_name, str(package_version))] = local_format
+                CacheGC.touch(dest_folder)
+                return self.extract_one_package(package_name, package_version)
+            if self.rebuilt_from_delta(package_name, package_version, source_info, archives, deltas):
+                return self
+            if not os.path.isdir(dest_folder):
+                os.makedirs(dest_folder)
+            archive_format = self.probe(package_name, package_version, source_info, archives)
+            dest = os.path.join(dest_folder, ArchiveFormat.file_name(package_name, archive_format))
+            stamp = ExtractionStamp(dest, dest_folder)
+            stamp.clear()
+            keep_path = dest if self.keep_archives else None
+
+            def consume(body):
+                return self.extract_stream(body, archive_format, keep_path, dest_folder)
+
+            self.logger.info("Streaming package " + package_name + " : " + str(package_version) + " of type " + source_type)
+            path = PackageDownloader.remote_path(package_name, package_version, archive_format)
+            endpoints = self.mirrors.ranked(source_info, path)
+            members, digest, size = self.with_failover(path, source_info, endpoints, self.stream_from, path, consume)
+            expected = PackageDownloader.expected_digest(archives, archive_format)
+            if expected is not None and digest != expected and keep_path is not None:
+                os.remove(keep_path)
+            # Without a stamp, the tree extracted from a bad archive is extracted again by the next bootstrap
+            self.verify(package_name, package_version, digest, expected)
+            self.local_formats[(package_name, str(package_version))] = archive_format
+            self.logger.info("Extracted package " + package_name + "/" + str(package_version) + " (" + str(size) + " bytes).")
+            if not stamp.write(members, digest, size):
+                self.logger.warn("Could not record the extraction of " + package_name + "/" + str(package_version) + ". It will be extracted again.")
+            self.extracted(package_name, package_version, stamp)
+            CacheGC.touch(dest_folder)
+        except KeyError as ex:
+            raise PackageDownloaderException("Malformed package info " + str(ex))
+        except TypeError as ex1:
+            raise PackageDownloaderException("Malformed package info " + str(ex1))
+        except OSError as ex2:
+            raise PackageDownloaderException(str(ex2))
+        except BlobStoreException as ex3:
+            raise PackageDownloaderException(str(ex3))
+        except MirrorSelectorException as ex4:
+            raise PackageDownloaderException(str(ex4))
         return self
 
+    def extracted_digest(self, package):
+        """
+        Returns the sha256 of the archive the package is extracted from, None if it is not extracted or its extracted
+        tree is damaged.
+        """
+        folder = os.path.join(self.global_package_cache, package["Name"], str(package["Version"]))
+        stamp = ExtractionStamp(None, folder)
+        recorded = stamp.read()
+        if recorded is None or not stamp.is_intact(recorded["Members"]):
+            return None
+        return recorded["Sha256"]
+
+    def download_and_extract_one(self, package):
+        package_name = package["Name"]
+        package_version = package["Version"]
+        if "PackageSource" not in package:
+            package_source_info = self.global_package_info
+        else:
+            package_source_info = package["PackageSource"]
+        archives = package.get("Archives")
+        deltas = package.get("Deltas")
+        if self.stream_extract:
+            self.stream_a_package_if_needed(package_name, package_version, package_source_info, archives, deltas)
+        else:
+            self.download_a_package_if_needed(package_name, package_version, package_source_info, archives, deltas).extract_one_package(package_name, package_version)
+
+    @staticmethod
+    def largest_first(package_list):
+        return sorted(package_list, key=lambda package: int(package.get("Size", 0)), reverse=True)
+
+    def for_each(self, package_list, work):
+        """
+        Runs work on every package of package_list, on the worker threads, and returns the results in order.
+        """
+        if self.concurrency <= 1 or len(package_list) <= 1:
+            return [work(package) for package in package_list]
+
+        # Create the cache once up front, so that the workers do not race on it
+        try:
+            self.prep_cache()
+        except OSError as e:
+            raise PackageDownloaderException(str(e))
+        failures = []
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(package_list))) as pool:
+            futures = [(id(package), package, pool.submit(work, package)) for package in PackageDownloader.largest_first(package_list)]
+            for key, package, future in futures:
+                try:
+                    results[key] = future.result()
+                except PackageDownloaderException as e:
+                    failures.append(str(package.get("Name")) + ": " + str(e))
+                except (KeyError, TypeError, AttributeError) as e:
+                    failures.append("Malformed package info " + str(e))
+        if len(failures) > 0:
+            raise PackageDownloaderException("Failed to fetch " + str(len(failures)) + " package(s): " + "; ".join(failures))
+        return [results[id(package)] for package in package_list]
+
     def download_and_extract(self, package_list):
-        for package in package_list:
-            package_name = package["Name"]
-            package_version = package["Version"]
-            if "PackageSource" not in package:
-                package_source_info = self.global_package_info
-            else:
-                package_source_info = package["PackageSource"]
-            self.download_a_package_if_needed(package_name, package_version, package_source_info).extract_one_package(package_name, package_version)
+        self.for_each(package_list, self.download_and_extract_one)
+        return self
+
+    @staticmethod
+    def dependencies(md):
+        deps = []
+        for section in ["Dependencies", "BuildDeps", "TestDeps", "RuntimeDeps"]:
+            deps.extend(md.get(section, []))
+        return deps
+
+    def read_remote_member(self, endpoint, path, member_name):
+        """
+        Reads member_name out of the remote tar at path with ranged reads. Returns None if that is not possible.
+        """
+        def read_range(start, end):
+            return self.read_range(endpoint, path, start, end)
+        try:
+            return TarProbe(read_range).find(member_name)
+        except TarProbeException as e:
+            self.logger.warn("Could not probe " + path + ": " + str(e))
+            return None
+
+    def package_dependencies(self, package):
+        package_name = package["Name"]
+        package_version = package["Version"]
+        source_info = package.get("PackageSource", self.global_package_info)
+        folder = os.path.join(self.global_package_cache, package_name, str(package_version))
+        md_file = os.path.join(folder, "md.json")
+        if self.metadata is not None:
+            deps = self.metadata.dependencies(package_name, package_version)
+            if deps is not None:
+                return deps
+        try:
+            data = None
+            if not (os.path.lexists(os.path.join(folder, ExtractionStamp.FILE_NAME)) and os.path.isfile(md_file)):
+                archive_format = self.probe(package_name, package_version, source_info, package.get("Archives"))
+                if archive_format == ArchiveFormat.TAR:
+                    path = PackageDownloader.remote_path(package_name, package_version, archive_format)
+                    endpoints = self.mirrors.ranked(source_info, path)
+                    data = self.with_failover(path, source_info, endpoints, self.read_remote_member, path, "md.json")
+                if data is None:
+                    self.logger.info("Downloading " + package_name + "/" + str(package_version) + " to read its dependencies.")
+                    self.download_and_extract_one(package)
+            if data is None:
+                with open(md_file, "rb") as fp:
+                    data = fp.read()
+            md = json.loads(data.decode("utf-8"))
+            deps = PackageDownloader.dependencies(md)
+            if self.metadata is not None:
+                self.metadata.record(package_name, str(package_version), deps)
+            return deps
+        except OSError as e:
+            raise PackageDownloaderException("Could not read the metadata of " + package_name + "/" + str(package_version) + ": " + str(e))
+        except MirrorSelectorException as e:
+            raise PackageDownloaderException(str(e))
+        except (ValueError, AttributeError) as e:
+            raise PackageDownloaderException("Malformed metadata of " + package_name + "/" + str(package_version) + ": " + str(e))
+
+    def fetch_dependencies(self, package_list):
+        """
+        Returns the list of dependencies of every package of package_list, in order, reading as little of each
+        package as possible.
+        """
+        return self.for_each(package_list, self.package_dependencies)
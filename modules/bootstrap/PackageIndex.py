@@ -0,0 +1,250 @@
+"""
+This module reads the metadata index a package repository publishes, so that the dependency closure of a project can
+be computed before any package is downloaded.
+
+A repository publishes index.json at its root (<Url>/index.json for URL sources, the key index.json for S3 buckets):
+{
+    "Packages": {
+        "MyPackageName": {
+            "1.0": {
+                "Dependencies": [{"Name": "OtherPackage", "Version": "2.0"}],
+                "Archives": {
+                    "tar.xz": {"Size": 123456, "Sha256": "..."},
+                    "tar": {"Size": 654321, "Sha256": "..."}
+                }
+            }
+        }
+    }
+}
+"Dependencies" is the union of all the dependency sections of the md.json of the package. `bob --index <folder>` writes
+the index of a repository laid out as <folder>/<package_name>/<package_version>/<package_name>.<format>. A version
+that has deltas from older versions (see PackageDelta) also lists them, as "Deltas": {"<base_version>": {"Size": ...,
+"Sha256": ...}}. `bob --index <folder> --deltas` writes the missing deltas between consecutive versions first.
+
+The index of each source is cached in <GlobalPackageCache>/.index, with its ETag. It is revalidated once per run with
+a conditional GET, so an unchanged index costs one round trip and no transfer. If the index can not be fetched, the
+cached copy is used. A source without an index is resolved the old way, by downloading the packages level by level.
+
+Config parameters needed:
+1. GlobalPackageCache
+2. PackageSource
+3. Logger
+
+Initialization parameters:
+1. config_obj
+2. http (The HttpDownloader used for URL sources)
+3. s3 (A function returning the S3Downloader used for S3 sources. It is only called for S3 sources)
+"""
+import os
+import json
+import hashlib
+
+from modules.bootstrap.HttpDownloader import HttpDownloaderException
+from modules.bootstrap.S3Downloader import S3DownloaderException
+from modules.bootstrap.ArchiveFormat import ArchiveFormat
+from modules.bootstrap.BlobStore import BlobStore
+from modules.bootstrap.PackageDelta import PackageDeltaException, PackageDelta
+
+
+class PackageIndexException (Exception):
+    pass
+
+
+class PackageIndex:
+    FILE_NAME = "index.json"
+    CACHE_FOLDER = ".index"
+    DEPENDENCY_SECTIONS = ["Dependencies", "BuildDeps", "TestDeps", "RuntimeDeps"]
+
+    def __init__(self, config_obj, http, s3):
+        try:
+            self.cache_folder = os.path.join(config_obj["GlobalPackageCache"], PackageIndex.CACHE_FOLDER)
+            self.default_source = config_obj["PackageSource"]
+            self.logger = config_obj["Logger"]
+        except KeyError as e:
+            raise PackageIndexException("Invalid config object " + str(e))
+        except TypeError as e1:
+            raise PackageIndexException(str(e1))
+        self.http = http
+        self.s3 = s3
+        self.indexes = {}
+
+    @staticmethod
+    def source_key(source_info):
+        return json.dumps([source_info["Type"].lower(), source_info.get("Url"), source_info.get("Bucket")])
+
+    def cache_path(self, source_info):
+        digest = hashlib.sha1(PackageIndex.source_key(source_info).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_folder, digest + ".json")
+
+    def read_cached(self, source_info):
+        try:
+            with open(self.cache_path(source_info), "r") as fp:
+                cached = json.load(fp)
+            return cached["ETag"], cached["Index"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def save(self, source_info, etag, index):
+        try:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            temp_path = self.cache_path(source_info) + ".tmp"
+            with open(temp_path, "w") as fp:
+                json.dump({"ETag": etag, "Index": index}, fp)
+            os.replace(temp_path, self.cache_path(source_info))
+        except OSError as e:
+            self.logger.warn("Could not cache the package index: " + str(e))
+
+    def fetch(self, source_info):
+        """
+        Returns the index of the source, revalidating the cached copy. Returns None if the source has no index.
+        """
+        etag, cached = self.read_cached(source_info)
+        source_type = source_info["Type"].lower()
+        try:
+            if source_type == "url":
+                url = source_info["Url"] + "/" + PackageIndex.FILE_NAME
+                status, new_etag, body = self.http.get(url, {} if etag is None or cached is None else {"If-None-Match": etag})
+                if status == 304 and cached is not None:
+                    return cached
+                if status in [404, 410]:
+                    return None
+                if status != 200:
+                    raise HttpDownloaderException("Request to " + url + " failed with status " + str(status))
+            elif source_type == "s3":
+                try:
+                    new_etag, body = self.s3().get(source_info["Bucket"], PackageIndex.FILE_NAME, None if cached is None else etag)
+                except S3DownloaderException as e:
+                    if str(e) in ["304", "NotModified"] and cached is not None:
+                        return cached
+                    if str(e) in ["NoSuchKey", "404"]:
+                        return None
+                    raise
+            else:
+                return None
+            index = json.loads(body.decode("utf-8"))
+            if not isinstance(index, dict) or not isinstance(index.get("Packages"), dict):
+                raise ValueError("expecting a \"Packages\" object")
+        except (HttpDownloaderException, S3DownloaderException) as e:
+            if cached is not None:
+                self.logger.warn("Could not revalidate the package index, using the cached one: " + str(e))
+            return cached
+        except ValueError as e:
+            self.logger.warn("Ignoring malformed package index: " + str(e))
+            return None
+        self.save(source_info, new_etag, index)
+        return index
+
+    def source_index(self, source_info):
+        source_key = PackageIndex.source_key(source_info)
+        if source_key not in self.indexes:
+            self.indexes[source_key] = self.fetch(source_info)
+        return self.indexes[source_key]
+
+    def lookup(self, package):
+        """
+        Returns the index entry of the package, None if it is not in the index of its source.
+        """
+        try:
+            source_info = package.get("PackageSource", self.default_source)
+            index = self.source_index(source_info)
+            if index is None:
+                return None
+            entry = index["Packages"].get(package["Name"], {}).get(str(package["Version"]))
+            return entry if isinstance(entry, dict) else None
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PackageIndexException("Malformed package info " + str(e))
+
+    def versions(self, package):
+        """
+        Returns the versions of the package in the index of its source.
+        """
+        try:
+            index = self.source_index(package.get("PackageSource", self.default_source))
+            if index is None:
+                return []
+            versions = index["Packages"].get(package["Name"], {})
+            return list(versions) if isinstance(versions, dict) else []
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PackageIndexException("Malformed package info " + str(e))
+
+    @staticmethod
+    def read_metadata(archive, archive_format):
+        with ArchiveFormat.reader(archive, archive_format) as tfp:
+            for member in tfp:
+                if os.path.normpath(member.name) == "md.json":
+                    return json.loads(tfp.extractfile(member).read().decode("utf-8"))
+        return {}
+
+    @staticmethod
+    def first_archive(folder, name):
+        """
+        Returns the path and format of the best archive of the package version in folder, None if there is none.
+        """
+        for archive_format in ArchiveFormat.FORMATS:
+            archive = os.path.join(folder, ArchiveFormat.file_name(name, archive_format))
+            if os.path.isfile(archive) and ArchiveFormat.is_supported(archive_format):
+                return archive, archive_format
+        return None
+
+    @staticmethod
+    def make_deltas(repository_root, name):
+        """
+        Writes the deltas from each version of the package to the next one, that are not there yet.
+        """
+        folder = os.path.join(repository_root, name)
+        versions = [v for v in os.listdir(folder) if PackageIndex.first_archive(os.path.join(folder, v), name) is not None]
+        versions = sorted(versions, key=PackageDelta.version_key)
+        for base, version in zip(versions, versions[1:]):
+            dest = os.path.join(folder, version, PackageDelta.file_name(name, base))
+            if not os.path.isfile(dest):
+                base_archive, base_format = PackageIndex.first_archive(os.path.join(folder, base), name)
+                archive, archive_format = PackageIndex.first_archive(os.path.join(folder, version), name)
+                PackageDelta.create(base_archive, base_format, archive, archive_format, base, dest)
+
+    @staticmethod
+    def build(repository_root, make_deltas=False):
+        """
+        Builds the index of the packages under repository_root, and writes it to repository_root/index.json.
+        With make_deltas, the deltas between consecutive versions of every package are written first (see
+        PackageDelta). Returns the index.
+        """
+        packages = {}
+        try:
+            for name in sorted(os.listdir(repository_root)):
+                if not os.path.isdir(os.path.join(repository_root, name)):
+                    continue
+                if make_deltas:
+                    PackageIndex.make_deltas(repository_root, name)
+                for version in sorted(os.listdir(os.path.join(repository_root, name))):
+                    folder = os.path.join(repository_root, name, version)
+                    archives = {}
+                    dependencies = []
+                    for archive_format in ArchiveFormat.FORMATS:
+                        archive = os.path.join(folder, ArchiveFormat.file_name(name, archive_format))
+                        if not os.path.isfile(archive) or not ArchiveFormat.is_supported(archive_format):
+                            continue
+                        archives[archive_format] = {"Size": os.path.getsize(archive), "Sha256": BlobStore.hash_file(archive)}
+                        if len(archives) == 1:
+                            md = PackageIndex.read_metadata(archive, archive_format)
+                            dependencies = [d for section in PackageIndex.DEPENDENCY_SECTIONS for d in md.get(section, [])]
+                    if len(archives) == 0:
+                        continue
+                    entry = {"Dependencies": dependencies, "Archives": archives}
+                    for file_name in sorted(os.listdir(folder)):
+                        base = PackageDelta.base_version(name, file_name)
+                        if base is not None:
+                            delta = os.path.join(folder, file_name)
+                            entry.setdefault("Deltas", {})[base] = {"Size": os.path.getsize(delta), "Sha256": BlobStore.hash_file(delta)}
+                    packages.setdefault(name, {})[version] = entry
+            index = {"Packages": packages}
+            with open(os.path.join(repository_root, PackageIndex.FILE_NAME), "w") as fp:
+                json.dump(index, fp, indent=4)
+            return index
+        except OSError as e:
+            raise PackageIndexException("Could not index " + repository_root + ": " + str(e))
+        except ArchiveFormat.errors() as e:
+            raise PackageIndexException("Could not read the metadata of a package: " + str(e))
+        except ValueError as e:
+            raise PackageIndexException("Malformed md.json in a package: " + str(e))
+        except PackageDeltaException as e:
+            raise PackageIndexException(str(e))
@@ -2,11 +2,57 @@
 This module installed downloaded packages from the global package cache to the project specific cache.
 It assumes that the folders of all the packages passed as arguments exists. If not, it will throw.
 It also returns the collective dependencies of all the packages it installed.
+
+Packages are built out of source, so that their extracted sources in the global package cache stay pristine. A package
+is built in <global_package_cache>/.builds/<name>/<version>/<build_key>/, outside of its extracted tree, where the build
+key covers the install prefix and the cmake arguments. Projects that install a package to different prefixes, or with different configurations,
+build it in different folders, concurrently, and building it again for the same project reuses the configured build. A
+lock in the build folder makes concurrent bootstraps of the same build wait for each other instead of mixing their
+builds.
+
+With InstallCache, what a package installs is kept in the install cache (see InstallCache), and a package that was
+already built with the same inputs is restored from it instead of being built again. A package is then installed to
+a staging folder with `make install DESTDIR=...`, and its tree is cached before it is restored into the project.
+
+With InstallReceipts, every package installed in the local package cache gets a receipt (see InstallReceipts). A
+package whose receipt matches its version and install key is skipped, and installing another version of a package
+first removes the files the previous one installed.
+
+The versions picked for the dependencies given as version ranges (see VersionSolver) are pinned with pin_versions: the
+dependencies read from md.json then carry the pinned versions instead of the ranges.
+
+With MetadataIndex, the dependencies of the packages are looked up in the index of the global package cache (see
+MetadataIndex) before their md.json is read, and the ones read from md.json are added to it. save_metadata writes
+the index once the dependency graph is resolved.
+
+Config parameters needed (the defaults are the ones of Config.DEFAULT_CONFIG):
+1. LocalPackageCache
+2. GlobalPackageCache
+3. Logger
+4. InstallCache (OPTIONAL, defaults to True)
+5. InstallCacheRestore (OPTIONAL, "copy" or "hardlink", defaults to "copy")
+6. BuildType (OPTIONAL, passed to cmake as CMAKE_BUILD_TYPE)
+7. JobServer (OPTIONAL, the jobserver the builds share, see JobServer)
+8. Generator (OPTIONAL, "Ninja" or "Unix Makefiles". When set, builds and installs go through `cmake --build`, see
+   CMakeBuild. Otherwise make is run directly.)
+9. InstallReceipts (OPTIONAL, defaults to True)
+10. MetadataIndex (OPTIONAL, defaults to True)
 """
 
-import subprocess
 import os
 import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+from modules.bootstrap.InstallCache import InstallCache, InstallCacheException
+from modules.bootstrap.InstallReceipts import InstallReceipts, InstallReceiptsException
+from modules.bootstrap.MetadataIndex import MetadataIndex
+from modules.build.JobServer import JobServerException, JobServer
+from modules.build.CMakeBuild import CMakeBuildException, CMakeBuild
+from modules.build.ProcessRunner import ProcessRunnerException, ProcessRunner
 
 
 class PackageInstallerException (Exception):
@@ -14,45 +60,60 @@ class PackageInstallerException (Exception):
 
 
 class PackageInstaller:
+    BUILDS_FOLDER = ".builds"
+    LOCK_FILE = ".lock"
+
     @staticmethod
-    def cmake(src_folder, dest_folder, logger):
-        current = os.getcwd()
-        os.chdir(src_folder)
+    def cmake(src_folder, build_folder, dest_folder, logger, args=[]):
         try:
-            p = subprocess.Popen(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + dest_folder], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = p.communicate()
-            exit_code = True if p.returncode == 0 else False
-        except OSError as e:
+            return_code, tail = ProcessRunner.run(["cmake", "-S", src_folder, "-B", build_folder, "-DCMAKE_INSTALL_PREFIX=" + dest_folder] + args, logger, cwd=build_folder)
+        except (ProcessRunnerException, OSError) as e:
             logger.error("Could not run cmake. Please check if cmake is installed on your system. " + str(e))
-            os.chdir(current)
             return False
-        if not exit_code:
-            logger.error(err)
-            logger.error("CMAKE command failed with error code " + str(p.returncode) + " !")
-        else:
-            logger.info(out)
-        os.chdir(current)
-        return exit_code
+        if return_code != 0:
+            logger.error("\n".join(tail))
+            logger.error("CMAKE command failed with error code " + str(return_code) + " !")
+        return return_code == 0
 
     @staticmethod
-    def make(src_folder, logger, args=[]):
-        current = os.getcwd()
-        os.chdir(src_folder)
+    def make(build_folder, logger, args=[], job_server=None):
         try:
-            p = subprocess.Popen(["make"] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = p.communicate()
-            exit_code = True if p.returncode == 0 else False
-        except OSError as e:
+            if job_server is None:
+                return_code, tail = ProcessRunner.run(["make"] + args, logger, cwd=build_folder)
+            else:
+                with job_server.job():
+                    return_code, tail = ProcessRunner.run(["make"] + args, logger, cwd=build_folder, **job_server.popen_args())
+        except JobServerException as e:
+            logger.error(str(e))
+            return False
+        except (ProcessRunnerException, OSError) as e:
             logger.error("Could not run make. Please make sure make is installed on your system. " + str(e))
-            os.chdir(current)
             return False
-        os.chdir(current)
-        if not exit_code:
-            logger.error(err)
-            logger.error("MAKE command failed with error code " + str(p.returncode) + " !")
-        else:
-            logger.info(out)
-        return exit_code
+        if return_code != 0:
+            logger.error("\n".join(tail))
+            logger.error("MAKE command failed with error code " + str(return_code) + " !")
+        return return_code == 0
+
+    @staticmethod
+    def cmake_build(build_folder, logger, target, generator, job_server=None, destdir=None):
+        try:
+            with CMakeBuild.parallelism(job_server, generator) as (args, popen_args):
+                if destdir is not None:
+                    env = dict(popen_args.get("env", os.environ))
+                    env["DESTDIR"] = destdir
+                    popen_args = dict(popen_args, env=env)
+                command = CMakeBuild.build_command(build_folder, target) + args
+                return_code, tail = ProcessRunner.run(command, logger, cwd=build_folder, **popen_args)
+        except JobServerException as e:
+            logger.error(str(e))
+            return False
+        except (ProcessRunnerException, OSError) as e:
+            logger.error("Could not run cmake. Please check if cmake is installed on your system. " + str(e))
+            return False
+        if return_code != 0:
+            logger.error("\n".join(tail))
+            logger.error("CMAKE build of " + str(target or "all") + " failed with error code " + str(return_code) + " !")
+        return return_code == 0
 
     def __init__(self, config_obj):
         try:
@@ -63,6 +124,156 @@ class PackageInstaller:
             raise PackageInstallerException("Invalid config object " + str(e))
         except TypeError as e1:
             raise PackageInstallerException(str(e1))
+        self.build_type = config_obj.get("BuildType", None)
+        self.job_server = config_obj.get("JobServer", None)
+        self.generator = None
+        if config_obj.get("Generator", None) is not None:
+            try:
+                self.generator = CMakeBuild.generator(config_obj["Generator"], self.logger)
+            except CMakeBuildException as e:
+                raise PackageInstallerException(str(e))
+        self.install_cache = None
+        self.install_keys = {}
+        if config_obj.get("InstallCache", False):
+            try:
+                self.install_cache = InstallCache(self.global_cache, config_obj.get("InstallCacheRestore", "copy"))
+            except InstallCacheException as e:
+                raise PackageInstallerException(str(e))
+        # Install keys are computed for the receipts too, without the install cache
+        self.keys = self.install_cache if self.install_cache is not None else InstallCache(self.global_cache)
+        self.receipts = InstallReceipts(self.local_cache) if config_obj.get("InstallReceipts", False) else None
+        self.pins = {}
+        self.metadata = MetadataIndex.of(self.global_cache) if config_obj.get("MetadataIndex", False) else None
+
+    def pin_versions(self, pins):
+        """
+        Pins the version of the packages named in pins, a version by package name.
+        """
+        self.pins = dict(pins)
+        self.install_keys = {}
+
+    def pinned(self, dep):
+        name = str(dep["Name"])
+        if name not in self.pins or str(dep["Version"]) == self.pins[name]:
+            return dep
+        pinned = dict(dep)
+        pinned["Version"] = self.pins[name]
+        return pinned
+
+    @staticmethod
+    def builds_folder(global_cache, package_name, package_version):
+        return os.path.join(global_cache, PackageInstaller.BUILDS_FOLDER, package_name, package_version)
+
+    @staticmethod
+    def build_folder(global_cache, package_name, package_version, package_dest, cmake_args):
+        key = hashlib.sha256(json.dumps({"Prefix": os.path.abspath(package_dest), "CMakeArgs": cmake_args}).encode("utf-8")).hexdigest()
+        return os.path.join(PackageInstaller.builds_folder(global_cache, package_name, package_version), key[:16])
+
+    @staticmethod
+    @contextmanager
+    def build_lock(build_folder):
+        """
+        Creates the build folder, and holds its lock while a build runs in it.
+        """
+        os.makedirs(build_folder, exist_ok=True)
+        fd = os.open(os.path.join(build_folder, PackageInstaller.LOCK_FILE), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def build(self, package_name, package_version, package_src, package_dest, destdir=None):
+        cmake_args = [] if self.build_type is None else ["-DCMAKE_BUILD_TYPE=" + str(self.build_type)]
+        if self.generator is not None:
+            cmake_args = CMakeBuild.configure_args(self.generator) + cmake_args
+        if self.job_server is not None:
+            cmake_args = cmake_args + JobServer.linker_launcher_args()
+        build_folder = PackageInstaller.build_folder(self.global_cache, package_name, package_version, package_dest, cmake_args)
+        try:
+            with PackageInstaller.build_lock(build_folder):
+                # Cmake
+                return_code = PackageInstaller.cmake(package_src, build_folder, package_dest, self.logger, cmake_args)
+                if not return_code:
+                    raise PackageInstallerException("CMake failed on package " + package_name + "/" + package_version)
+                # Make
+                if self.generator is None:
+                    return_code = PackageInstaller.make(build_folder, self.logger, [], self.job_server)
+                else:
+                    return_code = PackageInstaller.cmake_build(build_folder, self.logger, None, self.generator, self.job_server)
+                if not return_code:
+                    raise PackageInstallerException("Make failed on package " + package_name + "/" + package_version)
+                # Make install
+                if self.generator is None:
+                    install_args = [] if destdir is None else ["DESTDIR=" + destdir]
+                    return_code = PackageInstaller.make(build_folder, self.logger, ["install"] + install_args, self.job_server)
+                else:
+                    return_code = PackageInstaller.cmake_build(build_folder, self.logger, "install", self.generator, self.job_server, destdir)
+                if not return_code:
+                    raise PackageInstallerException("Make install failed on package " + package_name + "/" + package_version)
+        except OSError as e:
+            raise PackageInstallerException("Could not create the build folder " + build_folder + ": " + str(e))
+        return build_folder
+
+    def install_key(self, package_name, package_version, visiting=None):
+        """
+        Returns the install cache key of the package, which covers the install keys of its dependencies.
+        """
+        package_id = package_name + "/" + package_version
+        if package_id in self.install_keys:
+            return self.install_keys[package_id]
+        visiting = set() if visiting is None else visiting
+        visiting.add(package_id)
+        dependency_keys = []
+        for dep in self.get_package_dependency(package_name, package_version):
+            dep_id = str(dep["Name"]) + "/" + str(dep["Version"])
+            if dep_id in visiting:
+                # A dependency cycle: the dependency is identified by its name and version only
+                dependency_keys.append(dep_id)
+            else:
+                dependency_keys.append(self.install_key(str(dep["Name"]), str(dep["Version"]), visiting))
+        visiting.discard(package_id)
+        key = self.keys.key(package_name, package_version, self.build_type, self.local_cache, dependency_keys)
+        self.install_keys[package_id] = key
+        return key
+
+    def install_from_cache(self, package_name, package_version, package_src, package_dest):
+        """
+        Installs the package from the install cache, building and caching it first if it is not cached. Returns the
+        files installed when there are receipts to record them, None otherwise.
+        """
+        package_id = package_name + "/" + package_version
+        key = self.install_key(package_name, package_version)
+        try:
+            tree = self.install_cache.lookup(package_name, package_version, key)
+            if tree is not None:
+                restored = self.install_cache.restore(tree, package_dest)
+                self.logger.info("Restored " + str(restored) + " installed files of " + package_id + " from the install cache.")
+                return None if self.receipts is None else InstallReceipts.tree_files(tree)
+        except InstallCacheException as e:
+            self.logger.warn(str(e) + " Building the package.")
+        prefix = os.path.abspath(package_dest)
+        builds = PackageInstaller.builds_folder(self.global_cache, package_name, package_version)
+        try:
+            os.makedirs(builds, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix="install-", dir=builds)
+        except OSError as e:
+            raise PackageInstallerException("Could not create a staging folder in " + builds + ": " + str(e))
+        try:
+            self.build(package_name, package_version, package_src, prefix, staging)
+            staged_tree = staging + prefix
+            try:
+                tree = self.install_cache.store(package_name, package_version, key, staged_tree)
+            except InstallCacheException as e:
+                self.logger.warn(str(e))
+                tree = staged_tree
+            try:
+                self.install_cache.restore(tree, package_dest)
+            except InstallCacheException as e:
+                raise PackageInstallerException("Could not install package " + package_id + ": " + str(e))
+            return None if self.receipts is None else InstallReceipts.tree_files(tree)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
 
     def install_a_package(self, package_name, package_version):
         package_src = os.path.join(
@@ -75,20 +286,35 @@ class PackageInstaller:
             raise PackageInstallerException("The package " + package_name + "/" + package_version + " is not downloaded. Cannot install.")
         if not os.path.isdir(package_dest):
             os.makedirs(package_dest)
-        # Cmake
-        return_code = PackageInstaller.cmake(package_src, package_dest, self.logger)
-        if not return_code:
-            raise PackageInstallerException("CMake failed on package " + package_name + "/" + package_version)
-        # Make
-        return_code = PackageInstaller.make(package_src, self.logger)
-        if not return_code:
-            raise PackageInstallerException("Make failed on package " + package_name + "/" + package_version)
-        # Make install
-        return_code = PackageInstaller.make(package_src, self.logger, ["install"])
-        if not return_code:
-            raise PackageInstallerException("Make install failed on package " + package_name + "/" + package_version)
+        if self.receipts is None:
+            if self.install_cache is not None:
+                self.install_from_cache(package_name, package_version, package_src, package_dest)
+            else:
+                self.build(package_name, package_version, package_src, package_dest)
+            return
+        package_id = package_name + "/" + package_version
+        key = self.install_key(package_name, package_version)
+        try:
+            if self.receipts.installed(package_name, package_version, key):
+                self.logger.info("The package " + package_id + " is installed already.")
+                return
+            removed = self.receipts.uninstall(package_name)
+            if removed > 0:
+                self.logger.info("Removed " + str(removed) + " files of the previous install of " + package_name + ".")
+            if self.install_cache is not None:
+                files = self.install_from_cache(package_name, package_version, package_src, package_dest)
+            else:
+                build_folder = self.build(package_name, package_version, package_src, package_dest)
+                files = InstallReceipts.manifest_files(build_folder, package_dest)
+            self.receipts.record(package_name, package_version, key, files)
+        except InstallReceiptsException as e:
+            raise PackageInstallerException(str(e))
 
     def get_package_dependency(self, package_name, package_version):
+        if self.metadata is not None:
+            deps = self.metadata.dependencies(package_name, package_version)
+            if deps is not None:
+                return [self.pinned(dep) for dep in deps]
         md_file = os.path.join(
             self.global_cache,
             package_name,
@@ -107,12 +333,18 @@ class PackageInstaller:
                     deps.extend(md["TestDeps"])
                 if "RuntimeDeps" in md:
                     deps.extend(md["RuntimeDeps"])
-                return deps
+                if self.metadata is not None:
+                    self.metadata.record(package_name, package_version, deps)
+                return [self.pinned(dep) for dep in deps]
         except OSError as e:
             raise PackageInstallerException("Could not read metadata file " + md_file + " because " + str(e) + ".")
         except ValueError as e1:
             raise PackageInstallerException("Could not read metadata file " + md_file + " because " + str(e1) + ".")
 
+    def save_metadata(self):
+        if self.metadata is not None and not self.metadata.save():
+            self.logger.warn("Could not write the metadata index " + self.metadata.path + ". The dependencies will be read from md.json.")
+
     def install_packages(self, package_list):
         dependencies = {}
         for package in package_list:
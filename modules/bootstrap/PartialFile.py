@@ -0,0 +1,151 @@
+"""
+This module keeps track of an unfinished download, so that it can be resumed instead of restarted.
+
+The bytes of a download go to <dest>.partial. Next to it, <dest>.partial.json records where the bytes come from, the
+validator of the remote object (ETag or Last-Modified) and the expected total length. The number of bytes already
+received is the size of the partial file. Only a download whose length matches the recorded total is renamed to
+<dest>, so a file at <dest> is always complete.
+
+A download can also be split into parts of a fixed size that are fetched in any order. The partial file is then
+allocated at its full length up front, and the record lists the parts already written, so only the missing parts are
+fetched again on resume.
+
+A partial file is only resumed for the same source it was started from. If the source changed, or the record is
+missing or unreadable, the download starts from byte zero.
+"""
+import os
+import json
+import threading
+
+
+class PartialFileException (Exception):
+    pass
+
+
+class PartialFile:
+    SUFFIX = ".partial"
+    STATE_SUFFIX = ".partial.json"
+
+    def __init__(self, dest, source):
+        self.dest = dest
+        self.source = source
+        self.path = dest + PartialFile.SUFFIX
+        self.state_path = dest + PartialFile.STATE_SUFFIX
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_path, "r") as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(state, dict) or state.get("Source") != self.source or not os.path.isfile(self.path):
+            return {}
+        return state
+
+    def offset(self):
+        if not self.state or self.is_multipart():
+            return 0
+        return os.path.getsize(self.path)
+
+    def is_multipart(self):
+        return self.state.get("PartSize") is not None
+
+    def part_count(self):
+        return -(-self.length() // self.state["PartSize"])
+
+    def done_parts(self):
+        return set(self.state.get("Parts", []))
+
+    def validator(self):
+        return self.state.get("Validator")
+
+    def length(self):
+        return self.state.get("Length")
+
+    def is_complete(self):
+        if self.is_multipart():
+            return len(self.done_parts()) == self.part_count()
+        return self.length() is not None and self.offset() == self.length()
+
+    def save_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as fp:
+            json.dump(self.state, fp)
+        os.replace(temp_path, self.state_path)
+
+    def begin(self, validator, length, resume):
+        """
+        Records the remote object being fetched and returns the partial file, opened for appending when resuming
+        and truncated otherwise.
+        """
+        self.state = {
+            "Source": self.source,
+            "Validator": validator,
+            "Length": length
+        }
+        self.save_state()
+        return open(self.path, "ab" if resume else "wb")
+
+    def begin_parts(self, validator, length, part_size):
+        """
+        Prepares a download split in parts of part_size bytes. Parts recorded by an earlier attempt at the same
+        object are kept. Returns the indices of the parts that still have to be fetched.
+        """
+        resumable = self.is_multipart() and self.validator() == validator and self.length() == length and \
+            self.state["PartSize"] == part_size and os.path.getsize(self.path) == length
+        if not resumable:
+            self.state = {
+                "Source": self.source,
+                "Validator": validator,
+                "Length": length,
+                "PartSize": part_size,
+                "Parts": []
+            }
+            with open(self.path, "wb") as fp:
+                fp.truncate(length)
+            self.save_state()
+        return [i for i in range(self.part_count()) if i not in self.done_parts()]
+
+    def part_range(self, index):
+        start = index * self.state["PartSize"]
+        return start, min(start + self.state["PartSize"], self.length()) - 1
+
+    def write_part(self, index, chunks):
+        """
+        Writes the chunks of bytes of part index at its place in the partial file, and records the part as done.
+        """
+        start, end = self.part_range(index)
+        written = 0
+        with open(self.path, "r+b") as fp:
+            fp.seek(start)
+            for chunk in chunks:
+                fp.write(chunk)
+                written = written + len(chunk)
+        if written != end - start + 1:
+            raise PartialFileException("Short read of part " + str(index) + " of " + self.source + ".")
+        with self.lock:
+            self.state["Parts"] = sorted(self.done_parts() | {index})
+            self.save_state()
+
+    def commit(self):
+        size = os.path.getsize(self.path)
+        if self.is_multipart() and not self.is_complete():
+            raise PartialFileException("Incomplete download of " + self.source + ": missing parts.")
+        if self.length() is not None and size != self.length():
+            raise PartialFileException(
+                "Incomplete download of " + self.source + ": got " + str(size) + " of " + str(self.length()) + " bytes.")
+        os.replace(self.path, self.dest)
+        self.remove_state()
+        return size
+
+    def discard(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.remove_state()
+
+    def remove_state(self):
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+        self.state = {}
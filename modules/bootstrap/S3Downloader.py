@@ -0,0 +1,218 @@
+"""
+This module downloads packages from S3 buckets.
+
+Objects are fetched with ranged GETs of part_size bytes. The first GET asks for the first part only. If the object is
+larger than that, the remaining parts are fetched in parallel on a pool of max_concurrency worker threads. The pool
+and the boto3 client are shared by all the downloads of a downloader, so a frontier of packages downloads through one
+set of pooled connections with a bounded number of transfers in flight.
+
+Every download goes through a partial file (see PartialFile). If an earlier attempt left one behind, only the parts
+(or, for an object fetched in one piece, the bytes) it is missing are fetched again. The GETs are conditioned on the
+ETag recorded for the partial file, so a partial file of an object that was overwritten in the meantime is thrown away
+instead of being completed with the new bytes.
+
+An object can also be streamed to a consumer with one plain GET. Parts are not used then, the consumer reads in order.
+A slice of an object can be read with a single ranged GET.
+
+Initialization parameters:
+1. client (A boto3 S3 client. It should have at least max_concurrency pooled connections)
+2. part_size (OPTIONAL, size of the ranged GETs in bytes, defaults to 8 MiB)
+3. max_concurrency (OPTIONAL, number of parts fetched at the same time, defaults to 10)
+"""
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from modules.bootstrap.PartialFile import PartialFileException, PartialFile
+
+
+class S3DownloaderException (Exception):
+    pass
+
+
+class S3Downloader:
+    CHUNK_SIZE = 1024 * 1024
+    STALE_PARTIAL_CODES = ["InvalidRange", "PreconditionFailed", "412", "416"]
+    # Without s3:ListBucket, S3 answers 403 rather than 404 for missing keys
+    MISSING_CODES = ["NoSuchKey", "404", "403"]
+
+    def __init__(self, client, part_size=8 * 1024 * 1024, max_concurrency=10):
+        if int(part_size) < 1 or int(max_concurrency) < 1:
+            raise S3DownloaderException("Part size and concurrency of S3 transfers need to be positive.")
+        # botocore is imported here rather than with the module, so that importing this module does not load it
+        from botocore import exceptions
+        self.client = client
+        self.boto_errors = exceptions
+        self.part_size = int(part_size)
+        self.max_concurrency = int(max_concurrency)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def part_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+            return self.pool
+
+    @staticmethod
+    def byte_range(start, end=None):
+        return "bytes=" + str(start) + "-" + ("" if end is None else str(end))
+
+    @staticmethod
+    def total_length(response):
+        content_range = response.get("ContentRange")
+        if content_range is not None:
+            return int(content_range.rpartition("/")[2])
+        return response["ContentLength"]
+
+    @staticmethod
+    def chunks(response):
+        return response["Body"].iter_chunks(S3Downloader.CHUNK_SIZE)
+
+    def get_object(self, bucket, key, **kwargs):
+        args = {k: v for k, v in kwargs.items() if v is not None}
+        try:
+            return self.client.get_object(Bucket=bucket, Key=key, **args)
+        except self.boto_errors.ClientError as e:
+            raise S3DownloaderException(e.response["Error"]["Code"])
+
+    def fetch_part(self, partial, bucket, key, index):
+        start, end = partial.part_range(index)
+        response = self.get_object(bucket, key, Range=S3Downloader.byte_range(start, end), IfMatch=partial.validator())
+        try:
+            partial.write_part(index, S3Downloader.chunks(response))
+        except PartialFileException as e:
+            # Only this part is lost, the parts that made it stay recorded for the next attempt
+            raise S3DownloaderException(str(e))
+
+    def fetch_parts(self, partial, bucket, key, parts):
+        futures = [self.part_pool().submit(self.fetch_part, partial, bucket, key, index) for index in parts]
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except (S3DownloaderException, PartialFileException, self.boto_errors.BotoCoreError, OSError) as e:
+                errors.append(e)
+        if len(errors) > 0:
+            raise errors[0]
+
+    def resume(self, partial, bucket, key):
+        if partial.is_multipart():
+            self.fetch_parts(partial, bucket, key, partial.begin_parts(partial.validator(), partial.length(), partial.state["PartSize"]))
+            return
+        offset = partial.offset()
+        response = self.get_object(bucket, key, Range=S3Downloader.byte_range(offset), IfMatch=partial.validator())
+        with partial.begin(partial.validator(), partial.length(), True) as fp:
+            for chunk in S3Downloader.chunks(response):
+                fp.write(chunk)
+
+    def start(self, partial, bucket, key):
+        try:
+            response = self.get_object(bucket, key, Range=S3Downloader.byte_range(0, self.part_size - 1))
+        except S3DownloaderException as e:
+            if str(e) != "InvalidRange":
+                raise
+            # Empty objects cannot be fetched with a range
+            response = self.get_object(bucket, key)
+        length = S3Downloader.total_length(response)
+        if length <= self.part_size:
+            with partial.begin(response.get("ETag"), length, False) as fp:
+                for chunk in S3Downloader.chunks(response):
+                    fp.write(chunk)
+            return
+        remaining = partial.begin_parts(response.get("ETag"), length, self.part_size)
+        try:
+            partial.write_part(0, S3Downloader.chunks(response))
+        except PartialFileException as e:
+            raise S3DownloaderException(str(e))
+        self.fetch_parts(partial, bucket, key, remaining[1:])
+
+    def download(self, bucket, key, dest):
+        """
+        Downloads s3://bucket/key into the file dest, resuming an earlier partial download of the same object if there
+        is one. Returns the size of the complete file.
+        """
+        partial = PartialFile(dest, "s3://" + bucket + "/" + key)
+        try:
+            if not partial.is_complete():
+                if partial.offset() > 0 or partial.is_multipart():
+                    try:
+                        self.resume(partial, bucket, key)
+                    except S3DownloaderException as e:
+                        if str(e) not in S3Downloader.STALE_PARTIAL_CODES:
+                            raise
+                        partial.discard()
+                        self.start(partial, bucket, key)
+                else:
+                    self.start(partial, bucket, key)
+            return partial.commit()
+        except PartialFileException as e:
+            partial.discard()
+            raise S3DownloaderException(str(e))
+        except self.boto_errors.BotoCoreError as e:
+            raise S3DownloaderException("Failed to download s3://" + bucket + "/" + key + ": " + str(e))
+        except OSError as e:
+            raise S3DownloaderException("Failed to download s3://" + bucket + "/" + key + ": " + str(e))
+
+    def get(self, bucket, key, if_none_match=None):
+        """
+        Fetches a small object in memory. Returns its ETag and its content. If if_none_match is the current ETag of the
+        object, S3DownloaderException("304") is raised instead.
+        """
+        try:
+            response = self.get_object(bucket, key, IfNoneMatch=if_none_match)
+            return response.get("ETag"), response["Body"].read()
+        except self.boto_errors.BotoCoreError as e:
+            raise S3DownloaderException("Failed to get s3://" + bucket + "/" + key + ": " + str(e))
+        except OSError as e:
+            raise S3DownloaderException("Failed to get s3://" + bucket + "/" + key + ": " + str(e))
+
+    def read_range(self, bucket, key, start, end):
+        """
+        Reads the bytes start to end (inclusive) of s3://bucket/key. Returns fewer bytes at the end of the object.
+        """
+        try:
+            return self.get_object(bucket, key, Range=S3Downloader.byte_range(start, end))["Body"].read()
+        except S3DownloaderException as e:
+            if str(e) != "InvalidRange":
+                raise
+            return b""
+        except self.boto_errors.BotoCoreError as e:
+            raise S3DownloaderException("Failed to read s3://" + bucket + "/" + key + ": " + str(e))
+        except OSError as e:
+            raise S3DownloaderException("Failed to read s3://" + bucket + "/" + key + ": " + str(e))
+
+    def exists(self, bucket, key):
+        """
+        Probes s3://bucket/key with a HEAD request. Returns False if there is no such object.
+        """
+        try:
+            self.client.head_object(Bucket=bucket, Key=key)
+            return True
+        except self.boto_errors.ClientError as e:
+            if e.response["Error"]["Code"] in S3Downloader.MISSING_CODES:
+                return False
+            raise S3DownloaderException(e.response["Error"]["Code"])
+        except self.boto_errors.BotoCoreError as e:
+            raise S3DownloaderException("Failed to probe s3://" + bucket + "/" + key + ": " + str(e))
+
+    def stream(self, bucket, key, consume):
+        """
+        Fetches s3://bucket/key with a single GET and hands the body, a file like object, to consume while it is
+        arriving. Returns what consume returns.
+        """
+        try:
+            body = self.get_object(bucket, key)["Body"]
+            try:
+                return consume(body)
+            finally:
+                body.close()
+        except self.boto_errors.BotoCoreError as e:
+            raise S3DownloaderException("Failed to stream s3://" + bucket + "/" + key + ": " + str(e))
+        except OSError as e:
+            raise S3DownloaderException("Failed to stream s3://" + bucket + "/" + key + ": " + str(e))
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
@@ -0,0 +1,107 @@
+"""
+This module finds a member of a remote, uncompressed tar file with ranged reads, without downloading the whole tar.
+
+A tar file is a sequence of 512 byte headers, each followed by the content of its member, padded to 512 bytes. The
+header of a member gives its name and size, so the header of the next member is at a known offset. The probe reads
+the tar in blocks of BLOCK_SIZE bytes from the start, and walks the headers until it finds the member it is looking
+for. Packages put md.json right at the start, so finding it usually takes a single ranged read.
+
+GNU long names and pax extended headers are understood. The probe gives up after MAX_MEMBERS members, so a member at
+the end of a large tar is not worth probing for.
+
+Initialization parameters:
+1. read_range (A function (start, end) returning the bytes start to end (inclusive) of the tar, fewer at its end.
+   It returns None if the remote does not support ranged reads)
+"""
+
+
+class TarProbeException (Exception):
+    pass
+
+
+class TarProbe:
+    HEADER_SIZE = 512
+    BLOCK_SIZE = 64 * 1024
+    MAX_MEMBERS = 16
+
+    def __init__(self, read_range):
+        self.read_range = read_range
+        self.buffer = b""
+        self.buffer_start = 0
+        self.reads = 0
+
+    def read(self, start, length):
+        """
+        Returns length bytes at start, fewer at the end of the tar. Returns None if ranged reads are not supported.
+        """
+        end = start + length
+        if start < self.buffer_start or end > self.buffer_start + len(self.buffer):
+            data = self.read_range(start, start + max(length, TarProbe.BLOCK_SIZE) - 1)
+            self.reads = self.reads + 1
+            if data is None:
+                return None
+            self.buffer = data
+            self.buffer_start = start
+        return self.buffer[start - self.buffer_start:end - self.buffer_start]
+
+    @staticmethod
+    def padded(size):
+        return (size + TarProbe.HEADER_SIZE - 1) // TarProbe.HEADER_SIZE * TarProbe.HEADER_SIZE
+
+    @staticmethod
+    def pax_path(data):
+        """
+        Returns the path record of a pax extended header, None if it has none.
+        """
+        path = None
+        while len(data) > 0:
+            length, _, rest = data.partition(b" ")
+            if not length.isdigit() or int(length) <= len(length) or int(length) > len(data):
+                raise TarProbeException("Malformed pax extended header.")
+            keyword, _, value = rest[:int(length) - len(length) - 2].partition(b"=")
+            if keyword == b"path":
+                path = value.decode("utf-8", "surrogateescape")
+            data = data[int(length):]
+        return path
+
+    @staticmethod
+    def normalize(name):
+        parts = [part for part in name.split("/") if part not in ["", "."]]
+        return "/".join(parts)
+
+    def find(self, member_name):
+        """
+        Returns the content of the member called member_name, None if it could not be found by probing.
+        """
+        import tarfile
+        offset = 0
+        long_name = None
+        for _ in range(TarProbe.MAX_MEMBERS):
+            header = self.read(offset, TarProbe.HEADER_SIZE)
+            if header is None or len(header) < TarProbe.HEADER_SIZE:
+                return None
+            try:
+                info = tarfile.TarInfo.frombuf(header, tarfile.ENCODING, "surrogateescape")
+            except tarfile.EOFHeaderError:
+                return None
+            except tarfile.HeaderError as e:
+                raise TarProbeException("Not a tar file: " + str(e))
+            data_offset = offset + TarProbe.HEADER_SIZE
+            offset = data_offset + TarProbe.padded(info.size)
+            if info.type in [tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE]:
+                data = self.read(data_offset, info.size)
+                if data is None:
+                    return None
+                if info.type == tarfile.GNUTYPE_LONGNAME:
+                    long_name = data.rstrip(b"\0").decode(tarfile.ENCODING, "surrogateescape")
+                else:
+                    long_name = TarProbe.pax_path(data)
+                continue
+            name = info.name if long_name is None else long_name
+            long_name = None
+            if info.isreg() and TarProbe.normalize(name) == TarProbe.normalize(member_name):
+                data = self.read(data_offset, info.size)
+                if data is None or len(data) < info.size:
+                    return None
+                return data
+        return None
@@ -0,0 +1,299 @@
+"""
+This module picks a single version of every package of a dependency graph, so that every dependency is satisfied.
+
+The version of a dependency, in md.json, is either an exact version ("1.2") or a range: constraints separated by
+commas, each an operator among ==, !=, >=, <=, >, < followed by a version (">=1.2,<2.0"). "*" accepts any version.
+Versions are compared numerically, component by component (see PackageDelta.version_key). An exact version only
+matches itself.
+
+The packages are solved depth first: each gets the newest of its known versions that satisfies everything required of
+it so far, preferred versions first, and its own dependencies are then solved right after it, the ones with the fewest
+versions left first. A version is only picked if every dependency it requires can still be satisfied. When a package
+has no version left, the solver goes back to the last pick that ruled one of its versions out, skipping the picks that
+had nothing to do with it, and tries the next version there (backjumping). The picks that led to the dead end are
+remembered together, and never tried together again, whatever the order they come back in. The dependencies of every
+package version are only fetched once, and the versions left for every package are narrowed as requirements are added
+instead of being matched again.
+
+Initialization parameters:
+1. versions_of (Returns the known versions of a package, given a dependency on it)
+2. dependencies_of (Returns the dependencies of a package, given the package with its version)
+3. logger
+"""
+import functools
+import re
+
+from modules.bootstrap.PackageDelta import PackageDelta
+
+
+class VersionSolverException (Exception):
+    pass
+
+
+class VersionSolver:
+    ANY = "*"
+    OPERATORS = ["==", "!=", ">=", "<=", ">", "<"]
+    CONSTRAINT = re.compile(r"^\s*(==|!=|>=|<=|>|<)\s*(\S+)\s*$")
+
+    @staticmethod
+    def parse(spec):
+        """
+        Returns the constraints of a version spec, as (operator, version) pairs.
+        """
+        spec = str(spec).strip()
+        if spec == VersionSolver.ANY:
+            return ()
+        if not any(spec.startswith(operator) for operator in VersionSolver.OPERATORS):
+            return (("==", spec),)
+        constraints = []
+        for part in spec.split(","):
+            match = VersionSolver.CONSTRAINT.match(part)
+            if match is None:
+                raise VersionSolverException("Invalid version range " + spec + ".")
+            constraints.append((match.group(1), match.group(2)))
+        return tuple(constraints)
+
+    @staticmethod
+    def is_range(spec):
+        return VersionSolver.parse(spec) != (("==", str(spec).strip()),)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def version_key(version):
+        return PackageDelta.version_key(version)
+
+    @staticmethod
+    def matches(version, constraints):
+        key = None
+        for operator, bound in constraints:
+            if operator == "==":
+                if version != bound:
+                    return False
+                continue
+            if operator == "!=":
+                if version == bound:
+                    return False
+                continue
+            key = VersionSolver.version_key(version) if key is None else key
+            bound_key = VersionSolver.version_key(bound)
+            if operator == ">=" and not key >= bound_key:
+                return False
+            if operator == "<=" and not key <= bound_key:
+                return False
+            if operator == ">" and not key > bound_key:
+                return False
+            if operator == "<" and not key < bound_key:
+                return False
+        return True
+
+    def __init__(self, versions_of, dependencies_of, logger):
+        self.versions_of = versions_of
+        self.dependencies_of = dependencies_of
+        self.logger = logger
+        self.known_versions = {}
+        self.ordered_versions = {}
+        self.dependencies = {}
+        self.preferred = {}
+
+    def versions(self, name, package):
+        """
+        Returns the known versions of a package, in the order they are tried: preferred first, then newest first.
+        """
+        if name not in self.ordered_versions:
+            versions = set(str(version) for version in self.versions_of(package))
+            ordered = sorted(versions, key=VersionSolver.version_key, reverse=True)
+            if self.preferred.get(name) in versions:
+                ordered.remove(self.preferred[name])
+                ordered.insert(0, self.preferred[name])
+            self.known_versions[name] = versions
+            self.ordered_versions[name] = ordered
+        return self.ordered_versions[name]
+
+    def narrow(self, name, package, candidates, previous, constraints):
+        """
+        Returns the candidates of a package that also satisfy constraints. previous are the requirements the candidates
+        satisfy already.
+        """
+        narrowed = [v for v in candidates if VersionSolver.matches(v, constraints)]
+        for operator, bound in constraints:
+            # Exact versions can be fetched even when no source lists them
+            if operator == "==" and bound not in narrowed and bound not in self.known_versions[name]:
+                if VersionSolver.matches(bound, constraints) and all(VersionSolver.matches(bound, r[0]) for r in previous):
+                    narrowed.append(bound)
+        return narrowed
+
+    def package_dependencies(self, name, version, package):
+        key = (name, version)
+        if key not in self.dependencies:
+            pinned = dict(package)
+            pinned["Version"] = version
+            self.dependencies[key] = [(str(dep["Name"]), dep, VersionSolver.parse(dep["Version"])) for dep in self.dependencies_of(pinned)]
+        return self.dependencies[key]
+
+    @staticmethod
+    def describe(name, requirements):
+        required = [spec + " by " + ("the project" if requirer is None else requirer) for _, spec, _, requirer in requirements]
+        return name + " is required as " + ", ".join(required)
+
+    def solve(self, requirements, preferred=None):
+        """
+        Returns the version picked for every package of the graph of requirements, by name. Versions in preferred are
+        tried first.
+        """
+        if preferred != self.preferred:
+            self.preferred = {} if preferred is None else dict(preferred)
+            self.ordered_versions = {}
+        # What is required of every package: (constraints, spec, name of the requirer, requirer)
+        required = {}
+        packages = {}
+        # The versions of every package that satisfy what is required of it, one list per requirement added
+        allowed = {}
+        # The packages required but not picked yet, the next to pick on top
+        pending = []
+        log = []
+        assignment = {}
+        depths = {}
+
+        def candidates_with(name, dep, constraints):
+            if name in allowed:
+                return self.narrow(name, packages[name], allowed[name][-1], required[name], constraints)
+            return self.narrow(name, dep, self.versions(name, dep), [], constraints)
+
+        def require(dep, constraints, requirer, candidates):
+            name = str(dep["Name"])
+            if name not in required:
+                required[name] = []
+                packages[name] = dep
+                allowed[name] = []
+                pending.append(name)
+            label = None if requirer is None else requirer + "/" + assignment[requirer]
+            required[name].append((constraints, str(dep["Version"]), requirer, label))
+            allowed[name].append(candidates)
+            log.append(name)
+
+        def undo(mark):
+            while len(log) > mark:
+                name = log.pop()
+                required[name].pop()
+                allowed[name].pop()
+                if len(required[name]) == 0:
+                    del required[name]
+                    del packages[name]
+                    del allowed[name]
+                    pending.pop()
+
+        def requirer_depths(requirements):
+            return set(depths[requirer] for _, _, requirer, _ in requirements if requirer in depths)
+
+        def culprits(name, dep, constraints):
+            """
+            Returns the depths of the picks whose requirements rule out every version of a package, along with
+            constraints.
+            """
+            if name not in required:
+                return set()
+            versions = self.versions(name, dep)
+            for requirement in required[name]:
+                if len(self.narrow(name, dep, self.narrow(name, dep, versions, [], requirement[0]), [requirement], constraints)) == 0:
+                    return requirer_depths([requirement])
+            return requirer_depths(required[name])
+
+        def unsatisfied(name, version):
+            """
+            Returns the dependency of the package version that can not be satisfied, what is required of it, and the
+            depths of the picks that rule it out. Returns None if there is none, with the candidates of every
+            dependency.
+            """
+            candidates = []
+            for dep_name, dep, constraints in self.package_dependencies(name, version, packages[name]):
+                requirement = (constraints, str(dep["Version"]), name, name + "/" + version)
+                if dep_name in assignment:
+                    if not VersionSolver.matches(assignment[dep_name], constraints):
+                        return (dep_name, required[dep_name] + [requirement], {depths[dep_name]}), None
+                    candidates.append([assignment[dep_name]])
+                    continue
+                dep_candidates = candidates_with(dep_name, dep, constraints)
+                if len(dep_candidates) == 0:
+                    return (dep_name, required.get(dep_name, []) + [requirement], culprits(dep_name, dep, constraints)), None
+                candidates.append(dep_candidates)
+            return None, candidates
+
+        try:
+            for dep in reversed(requirements):
+                name = str(dep["Name"])
+                constraints = VersionSolver.parse(dep["Version"])
+                require(dep, constraints, None, candidates_with(name, dep, constraints))
+            # The sets of picks that leave some package without a version, by pick
+            nogoods = {}
+            conflict = None
+            backtracks = 0
+            # A frame per package being picked: [name, candidates, index of the candidate tried, log mark, picked,
+            # depths of the picks that ruled out the candidates tried]
+            stack = []
+
+            def unpick(frame):
+                frame[4] = False
+                del assignment[frame[0]]
+                del depths[frame[0]]
+                undo(frame[3])
+
+            while len(pending) > 0:
+                name = pending.pop()
+                stack.append([name, allowed[name][-1], -1, len(log), False, set()])
+                while len(stack) > 0:
+                    frame = stack[-1]
+                    name, candidates, index, mark, picked, conflicts = frame
+                    if picked:
+                        unpick(frame)
+                    frame[2] = index = index + 1
+                    if index == len(candidates):
+                        # No version of the package is left: back to the last pick that ruled one out (backjumping)
+                        depth = len(stack) - 1
+                        stack.pop()
+                        pending.append(name)
+                        backtracks = backtracks + 1
+                        if len(candidates) == 0:
+                            conflict = (name, list(required[name]))
+                        conflicts = (conflicts | requirer_depths(required[name])) - {depth}
+                        if len(conflicts) == 0:
+                            stack = []
+                            break
+                        nogood = frozenset((stack[d][0], assignment[stack[d][0]]) for d in conflicts)
+                        for pick in nogood:
+                            nogoods.setdefault(pick, []).append(nogood)
+                        target = max(conflicts)
+                        while len(stack) > target + 1:
+                            unpick(stack[-1])
+                            pending.append(stack.pop()[0])
+                        stack[-1][5].update(conflicts - {target})
+                        continue
+                    version = candidates[index]
+                    unsatisfiable, dep_candidates = unsatisfied(name, version)
+                    if unsatisfiable is not None:
+                        conflict = unsatisfiable[:2]
+                        conflicts.update(unsatisfiable[2])
+                        continue
+                    assignment[name] = version
+                    depths[name] = len(stack) - 1
+                    frame[4] = True
+                    nogood = next((n for n in nogoods.get((name, version), []) if all(assignment.get(p) == v for p, v in n)), None)
+                    if nogood is not None:
+                        conflicts.update(depths[p] for p, _ in nogood if p != name)
+                        continue
+                    # The dependencies with the fewest candidates are picked first, right after the package, so that
+                    # conflicts show up close to the pick that causes them
+                    deps = self.package_dependencies(name, version, packages[name])
+                    for i in sorted(range(len(deps)), key=lambda i: len(dep_candidates[i]), reverse=True):
+                        dep_name, dep, constraints = deps[i]
+                        require(dep, constraints, name, dep_candidates[i])
+                    break
+                if len(stack) == 0 and len(pending) > 0:
+                    message = "Could not find versions of the dependencies that satisfy all their requirements."
+                    if conflict is not None:
+                        message = message + " " + VersionSolver.describe(*conflict) + "."
+                    raise VersionSolverException(message)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise VersionSolverException("Malformed dependency " + str(e))
+        if backtracks > 0:
+            self.logger.info("Solved the versions of " + str(len(assignment)) + " packages, backtracking " + str(backtracks) + " times.")
+        return assignment
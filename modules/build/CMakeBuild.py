@@ -0,0 +1,60 @@
+"""
+This module drives the build tool of a CMake build tree through `cmake --build`, whatever the generator: Ninja, or
+the Makefile generator.
+
+Ninja builds are faster, mostly no-op and incremental ones, so Ninja is used when the configured generator is "Ninja"
+and ninja is installed. Otherwise the Makefile generator is used.
+
+The parallelism of the builds is taken from the jobserver (see JobServer):
+1. make shares the jobserver: it takes a token per job from it.
+2. ninja can not share it. A Ninja build takes the tokens that are free when it starts, at least one, and runs that
+   many jobs (cmake --build --parallel) until it is done.
+"""
+import shutil
+from contextlib import contextmanager
+
+
+class CMakeBuildException (Exception):
+    pass
+
+
+class CMakeBuild:
+    NINJA = "Ninja"
+    MAKEFILES = "Unix Makefiles"
+    GENERATORS = [NINJA, MAKEFILES]
+
+    @staticmethod
+    def generator(name, logger):
+        """
+        Returns the generator to use for the configured one.
+        """
+        if name not in CMakeBuild.GENERATORS:
+            raise CMakeBuildException("Invalid generator " + str(name) + ". Allowed values are: " + ", ".join(CMakeBuild.GENERATORS) + ".")
+        if name == CMakeBuild.NINJA and shutil.which("ninja") is None:
+            logger.warn("Could not find ninja. Building with make instead.")
+            return CMakeBuild.MAKEFILES
+        return name
+
+    @staticmethod
+    def configure_args(generator):
+        return ["-G", generator]
+
+    @staticmethod
+    def build_command(build_folder, target=None):
+        return ["cmake", "--build", build_folder] + ([] if target is None else ["--target", target])
+
+    @staticmethod
+    @contextmanager
+    def parallelism(job_server, generator):
+        """
+        Holds the jobserver tokens of a build while it runs. Yields the extra arguments of `cmake --build`, and the
+        arguments of subprocess.Popen, that make the build use them.
+        """
+        if job_server is None:
+            yield [], {}
+        elif generator == CMakeBuild.MAKEFILES:
+            with job_server.job():
+                yield [], job_server.popen_args()
+        else:
+            with job_server.free_jobs() as jobs:
+                yield ["--parallel", str(jobs)], job_server.popen_args(False)
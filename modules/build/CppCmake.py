@@ -4,11 +4,25 @@ Required config parameters are:
 1. Package cache
 2. Build folder
 3. Logger
+4. JobServer (OPTIONAL, the jobserver the builds share, see JobServer)
+5. Generator (OPTIONAL, "Ninja" or "Unix Makefiles". When set, the project is built and tested through `cmake --build`,
+   see CMakeBuild. Otherwise make is run directly.)
+6. InstallReceipts (OPTIONAL, when set, the package cache is kept by clean: the receipts of the installed packages keep
+   it consistent, see InstallReceipts)
+7. BuildFingerprint (OPTIONAL, defaults to True, see Config.DEFAULT_CONFIG)
+
+With BuildFingerprint, the project is fingerprinted before it is built (see SourceFingerprint). When nothing changed
+since the last successful build, the build does nothing. Otherwise CMake only configures the build folder again when
+its inputs changed: the CMake files, md.json, the files of the project, the package cache or the cmake arguments.
 """
-import subprocess
 import os
 import shutil
 
+from modules.build.JobServer import JobServerException, JobServer
+from modules.build.CMakeBuild import CMakeBuildException, CMakeBuild
+from modules.build.ProcessRunner import ProcessRunnerException, ProcessRunner
+from modules.build.SourceFingerprint import SourceFingerprint
+
 
 class BuildException (Exception):
     pass
@@ -16,33 +30,89 @@ class BuildException (Exception):
 
 class CppCmake:
     @staticmethod
-    def cmake(root, build_folder, package_cache, logger):
+    def cmake(root, build_folder, package_cache, logger, args=[]):
         try:
             os.chdir(build_folder)
-            p = subprocess.Popen(["cmake", root, "-DPACKAGE_CACHE=" + package_cache], stdout=subprocess.PIPE)
-            o, e = p.communicate()
-            logger.info("Running command: cmake " + root + " -DPACKAGE_CACHE=" + package_cache)
-            logger.info(o)
-            logger.info(e)
-            os.chdir(root)
+            try:
+                logger.info("Running command: cmake " + root + " -DPACKAGE_CACHE=" + package_cache)
+                return_code, tail = ProcessRunner.run(["cmake", root, "-DPACKAGE_CACHE=" + package_cache] + args, logger)
+            finally:
+                os.chdir(root)
+        except ProcessRunnerException as e:
+            raise BuildException(str(e))
         except OSError as e:
             raise BuildException(str(e))
+        if return_code != 0:
+            logger.error("\n".join(tail))
+            raise BuildException("CMake failed with error code " + str(return_code) + ".")
 
     @staticmethod
-    def make(root, build_folder, args=[]):
+    def make(root, build_folder, logger, args=[], job_server=None):
         try:
             os.chdir(build_folder)
-            p = subprocess.Popen(["make"] + args)
-            p.communicate()
-            os.chdir(root)
+            try:
+                if job_server is None:
+                    return_code, tail = ProcessRunner.run(["make"] + args, logger)
+                else:
+                    with job_server.job():
+                        return_code, tail = ProcessRunner.run(["make"] + args, logger, **job_server.popen_args())
+            finally:
+                os.chdir(root)
+        except JobServerException as e:
+            raise BuildException(str(e))
+        except ProcessRunnerException as e:
+            raise BuildException(str(e))
+        except OSError as e:
+            raise BuildException(str(e))
+        if return_code != 0:
+            logger.error("\n".join(tail))
+            raise BuildException("make " + " ".join(args) + " failed with error code " + str(return_code) + ".")
+
+    @staticmethod
+    def cmake_build(build_folder, logger, target, generator, job_server=None):
+        try:
+            with CMakeBuild.parallelism(job_server, generator) as (args, popen_args):
+                return_code, tail = ProcessRunner.run(CMakeBuild.build_command(build_folder, target) + args, logger, **popen_args)
+        except JobServerException as e:
+            raise BuildException(str(e))
+        except ProcessRunnerException as e:
+            raise BuildException(str(e))
         except OSError as e:
             raise BuildException(str(e))
+        if return_code != 0:
+            logger.error("\n".join(tail))
+            raise BuildException("Building " + str(target or "all") + " failed with error code " + str(return_code) + ".")
+
+    @staticmethod
+    def cached_generator(build_folder):
+        """
+        Returns the generator the build folder was configured with, None if it is not configured.
+        """
+        try:
+            with open(os.path.join(build_folder, "CMakeCache.txt"), "r") as fp:
+                for line in fp:
+                    if line.startswith("CMAKE_GENERATOR:"):
+                        return line.split("=", 1)[1].strip()
+        except OSError:
+            pass
+        return None
 
     def __init__(self, config_obj):
         self.root = config_obj["ProjectRoot"]
         self.package_cache = config_obj["LocalPackageCache"]
         self.build_dir = config_obj["BuildDir"]
         self.logger = config_obj["Logger"]
+        self.job_server = config_obj.get("JobServer", None)
+        self.receipts = config_obj.get("InstallReceipts", False)
+        self.fingerprint = None
+        if config_obj.get("BuildFingerprint", False):
+            self.fingerprint = SourceFingerprint(self.root, self.build_dir, self.package_cache)
+        self.generator = None
+        if config_obj.get("Generator", None) is not None:
+            try:
+                self.generator = CMakeBuild.generator(config_obj["Generator"], self.logger)
+            except CMakeBuildException as e:
+                raise BuildException(str(e))
 
     def build(self):
         if not os.path.isdir(self.build_dir):
@@ -51,18 +121,52 @@ class CppCmake:
                 os.makedirs(self.build_dir)
             except OSError as e:
                 raise BuildException("Could not create build folder because " + str(e))
-        CppCmake.cmake(self.root, self.build_dir, self.package_cache, self.logger)
-        CppCmake.make(self.root, self.build_dir)
+        cmake_args = [] if self.job_server is None else JobServer.linker_launcher_args()
+        if self.generator is not None:
+            cmake_args = CMakeBuild.configure_args(self.generator) + cmake_args
+        configure = True
+        if self.fingerprint is not None:
+            fingerprint = self.fingerprint.compute(cmake_args)
+            previous = self.fingerprint.read()
+            if previous is not None and previous["Build"] == fingerprint["Build"]:
+                self.logger.info("Nothing changed since the last build. Skipping it.")
+                return
+            self.fingerprint.clear()
+            configure = previous is None or previous["Configure"] != fingerprint["Configure"] or not os.path.isfile(os.path.join(self.build_dir, "CMakeCache.txt"))
+        if self.generator is not None:
+            cached_generator = CppCmake.cached_generator(self.build_dir)
+            if cached_generator is not None and cached_generator != self.generator:
+                # CMake can not change the generator of a configured build folder
+                self.logger.info("The build dir was configured for " + cached_generator + ". Configuring it again for " + self.generator + ".")
+                os.remove(os.path.join(self.build_dir, "CMakeCache.txt"))
+                shutil.rmtree(os.path.join(self.build_dir, "CMakeFiles"), ignore_errors=True)
+                configure = True
+        if configure:
+            CppCmake.cmake(self.root, self.build_dir, self.package_cache, self.logger, cmake_args)
+        else:
+            self.logger.info("The CMake inputs did not change since the last build. Skipping the configure step.")
+        if self.fingerprint is not None:
+            # Configured: building again after a failed build does not need to configure again
+            self.fingerprint.write(dict(fingerprint, Build=""))
+        if self.generator is None:
+            CppCmake.make(self.root, self.build_dir, self.logger, [], self.job_server)
+        else:
+            CppCmake.cmake_build(self.build_dir, self.logger, None, self.generator, self.job_server)
+        if self.fingerprint is not None and not self.fingerprint.write(fingerprint):
+            self.logger.warn("Could not record the fingerprint of the build. The next build will run in full.")
 
     def run_tests(self):
         if not os.path.isdir(self.build_dir):
             self.logger.warn("Could not find build dir. Building first.")
             self.build()
-        CppCmake.make(self.root, self.build_dir, ["test"])
+        if self.generator is None:
+            CppCmake.make(self.root, self.build_dir, self.logger, ["test"], self.job_server)
+        else:
+            CppCmake.cmake_build(self.build_dir, self.logger, "test", self.generator, self.job_server)
 
     def clean(self):
         if os.path.isdir(self.build_dir):
             shutil.rmtree(self.build_dir)
 
-        if os.path.isdir(self.package_cache):
+        if not self.receipts and os.path.isdir(self.package_cache):
             shutil.rmtree(self.package_cache)
@@ -0,0 +1,207 @@
+"""
+This module is a GNU make compatible jobserver, shared by all the builds of a run: the dependencies built concurrently
+while bootstrapping, and the project build.
+
+The jobserver is a pipe holding one byte (token) per job allowed to run. Every make started by Bob gets the pipe through
+MAKEFLAGS (--jobserver-auth, GNU make 4.2 and later), and takes a token from it for every job it runs besides its first.
+Bob takes a token for that first job itself, before starting make, so that all the builds together never run more jobs
+than there are tokens, however many makes run at the same time.
+
+Link jobs need a lot more memory than compile jobs, so they also take a token from a second, smaller pool. That pool
+is a named pipe, given to CMake as the linker launcher: the launcher (this file, run as a script) takes a token from
+the named pipe given in BOB_LINK_POOL, runs the link command, and gives the token back. CMake uses linker launchers
+from version 3.21.
+
+By default, there is a job per core, as long as every job has JOB_MEMORY of the available memory, and a link job per
+LINK_JOB_MEMORY of the available memory, up to a quarter of the jobs. Both can be set in the global config.
+
+Config parameters needed:
+1. BuildJobs (OPTIONAL, number of jobs, 0 to compute it, defaults to 0)
+2. LinkJobs (OPTIONAL, number of link jobs, 0 to compute it, defaults to 0)
+"""
+import os
+import sys
+import atexit
+import select
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class JobServerException (Exception):
+    pass
+
+
+class JobServer:
+    JOB_MEMORY = 1024 * 1024 * 1024
+    LINK_JOB_MEMORY = 4 * 1024 * 1024 * 1024
+    LINK_POOL_VARIABLE = "BOB_LINK_POOL"
+    LINKER_LAUNCHER_LANGUAGES = ["C", "CXX"]
+
+    @staticmethod
+    def cores():
+        try:
+            return len(os.sched_getaffinity(0))
+        except (AttributeError, OSError):
+            return os.cpu_count() or 1
+
+    @staticmethod
+    def available_memory():
+        """
+        Returns the memory available to new processes in bytes, None if it is not known.
+        """
+        try:
+            with open("/proc/meminfo", "r") as fp:
+                for line in fp:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    @staticmethod
+    def limits(jobs=0, link_jobs=0):
+        """
+        Returns the number of jobs and link jobs. The ones that are 0 are computed from the cores and the memory.
+        """
+        for name, value in [("BuildJobs", jobs), ("LinkJobs", link_jobs)]:
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise JobServerException("Invalid " + name + " " + str(value) + ". It must be a positive integer, or 0 to compute it.")
+        memory = None
+        if jobs == 0 or link_jobs == 0:
+            memory = JobServer.available_memory()
+        if jobs == 0:
+            jobs = JobServer.cores()
+            if memory is not None:
+                jobs = min(jobs, memory // JobServer.JOB_MEMORY)
+            jobs = max(1, jobs)
+        if link_jobs == 0:
+            link_jobs = max(1, jobs // 4)
+            if memory is not None:
+                link_jobs = min(link_jobs, memory // JobServer.LINK_JOB_MEMORY)
+            link_jobs = max(1, link_jobs)
+        return jobs, min(link_jobs, jobs)
+
+    @staticmethod
+    def from_config(config_obj):
+        jobs, link_jobs = JobServer.limits(config_obj.get("BuildJobs", 0), config_obj.get("LinkJobs", 0))
+        return JobServer(jobs, link_jobs)
+
+    def __init__(self, jobs, link_jobs):
+        self.jobs = jobs
+        self.link_jobs = link_jobs
+        self.lock = threading.Lock()
+        self.greedy_lock = threading.Lock()
+        # The pipes are only created by the first build, so commands that build nothing do not pay for them
+        self.pipe = None
+        self.link_pool = None
+        self.link_pool_fd = None
+
+    def open(self):
+        with self.lock:
+            if self.pipe is not None:
+                return
+            try:
+                read_fd, write_fd = os.pipe()
+                os.write(write_fd, b"+" * self.jobs)
+                folder = tempfile.mkdtemp(prefix="bob-jobserver-")
+                link_pool = os.path.join(folder, "link")
+                os.mkfifo(link_pool, 0o600)
+                # Opened for reading and writing, the named pipe keeps its tokens while no launcher has it open
+                self.link_pool_fd = os.open(link_pool, os.O_RDWR)
+                os.write(self.link_pool_fd, b"+" * self.link_jobs)
+            except (OSError, AttributeError) as e:
+                raise JobServerException("Could not create the jobserver: " + str(e))
+            self.pipe = (read_fd, write_fd)
+            self.link_pool = link_pool
+        atexit.register(self.close)
+
+    def close(self):
+        with self.lock:
+            if self.pipe is None:
+                return
+            for fd in list(self.pipe) + [self.link_pool_fd]:
+                os.close(fd)
+            os.remove(self.link_pool)
+            os.rmdir(os.path.dirname(self.link_pool))
+            self.pipe = None
+            self.link_pool = None
+            self.link_pool_fd = None
+
+    @contextmanager
+    def job(self):
+        """
+        Holds a token for the first job of a make, while it runs.
+        """
+        self.open()
+        token = os.read(self.pipe[0], 1)
+        try:
+            yield
+        finally:
+            os.write(self.pipe[1], token)
+
+    @contextmanager
+    def free_jobs(self):
+        """
+        Holds the tokens that are free, at least one, for a build tool that can not share the jobserver. Yields their
+        number.
+        """
+        self.open()
+        with self.greedy_lock:
+            tokens = os.read(self.pipe[0], 1)
+            # Other readers share the pipe, so it is polled rather than made non blocking
+            while len(tokens) < self.jobs and len(select.select([self.pipe[0]], [], [], 0)[0]) > 0:
+                tokens = tokens + os.read(self.pipe[0], 1)
+        try:
+            yield len(tokens)
+        finally:
+            os.write(self.pipe[1], tokens)
+
+    def popen_args(self, jobserver=True):
+        """
+        Returns the arguments of subprocess.Popen for a make, or another jobserver client, to share the jobserver.
+        Without jobserver, only the link pool is shared.
+        """
+        self.open()
+        env = dict(os.environ)
+        env[JobServer.LINK_POOL_VARIABLE] = self.link_pool
+        if not jobserver:
+            env.pop("MAKEFLAGS", None)
+            return {"env": env}
+        auth = str(self.pipe[0]) + "," + str(self.pipe[1])
+        env["MAKEFLAGS"] = "-j" + str(self.jobs) + " --jobserver-auth=" + auth
+        return {"env": env, "pass_fds": self.pipe}
+
+    @staticmethod
+    def linker_launcher_args():
+        """
+        Returns the cmake arguments that run the link commands through the link pool.
+        """
+        launcher = sys.executable + ";" + os.path.abspath(__file__)
+        return ["-DCMAKE_" + language + "_LINKER_LAUNCHER=" + launcher for language in JobServer.LINKER_LAUNCHER_LANGUAGES]
+
+    @staticmethod
+    def launch_link(command):
+        """
+        Runs a link command holding a token of the link pool. Returns its exit code.
+        """
+        link_pool = os.environ.get(JobServer.LINK_POOL_VARIABLE)
+        if link_pool is None or not os.path.exists(link_pool):
+            return subprocess.call(command)
+        fd = os.open(link_pool, os.O_RDWR)
+        try:
+            token = os.read(fd, 1)
+            try:
+                return subprocess.call(command)
+            finally:
+                os.write(fd, token)
+        finally:
+            os.close(fd)
+
+
+if __name__ == "__main__":
+    sys.exit(JobServer.launch_link(sys.argv[1:]))
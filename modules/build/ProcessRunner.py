@@ -0,0 +1,38 @@
+"""
+This module runs the build commands, streaming their output to the logger line by line, as they write it, instead of
+logging it all once they exit. stderr is merged into stdout, so the lines are logged in the order they were written.
+
+Only the last lines of the output are kept, to report why a command failed, so the memory taken by a command does not
+grow with its output. Lines longer than LINE_LIMIT bytes are logged in pieces.
+"""
+import subprocess
+from collections import deque
+
+
+class ProcessRunnerException (Exception):
+    pass
+
+
+class ProcessRunner:
+    TAIL_LINES = 100
+    LINE_LIMIT = 64 * 1024
+
+    @staticmethod
+    def run(command, logger, tail_lines=TAIL_LINES, **popen_args):
+        """
+        Runs command, logging its output as it comes. Returns its exit code, and the last tail_lines lines of its
+        output.
+        """
+        try:
+            p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **popen_args)
+        except OSError as e:
+            raise ProcessRunnerException("Could not run " + str(command[0]) + ": " + str(e))
+        tail = deque(maxlen=tail_lines)
+        output = p.stdout
+        with output:
+            for line in iter(lambda: output.readline(ProcessRunner.LINE_LIMIT), b""):
+                line = line.decode("utf-8", "replace").rstrip("\r\n")
+                tail.append(line)
+                logger.info(line)
+        p.wait()
+        return p.returncode, list(tail)
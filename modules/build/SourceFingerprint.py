@@ -0,0 +1,144 @@
+"""
+This module tells whether the project changed since it was last built, so that a build of an unchanged project skips
+both CMake and the build tool.
+
+The fingerprint of a project is made of two sha256 digests:
+1. Configure covers the inputs of the CMake configure step: the paths of all the files of the project (files added or
+   removed change what a glob finds), the CMake files (CMakeLists.txt, *.cmake, *.cmake.in) and md.json, the state of
+   the package cache, and the arguments cmake is run with.
+2. Build covers the size and modification time of every file of the project, on top of Configure.
+Files are only stat'ed, never read: the tree is walked with os.scandir, whose entries carry most of what is needed.
+The version control folders, the build folder and the package cache are left out of the project files. The package
+cache is fingerprinted from its install receipts (see InstallReceipts) when it has some, from the stat of its files
+otherwise.
+
+The fingerprint of the last successful build is kept in <build_folder>/.fingerprint.json. It is removed before a build
+starts, so an interrupted or failed build is never taken for a complete one. Once CMake has configured the build
+folder, the fingerprint is written without its Build digest, so building again after a failed build does not
+configure again.
+
+Initialization parameters:
+1. root (Folder of the project)
+2. build_folder
+3. package_cache
+"""
+import os
+import json
+import hashlib
+
+from modules.bootstrap.InstallReceipts import InstallReceipts
+
+
+class SourceFingerprint:
+    FILE_NAME = ".fingerprint.json"
+    VERSION = 1
+    IGNORED_FOLDERS = [".git", ".hg", ".svn"]
+    CMAKE_FILES = ["CMakeLists.txt", "md.json"]
+    CMAKE_SUFFIXES = (".cmake", ".cmake.in")
+
+    def __init__(self, root, build_folder, package_cache):
+        self.root = root
+        self.build_folder = build_folder
+        self.package_cache = package_cache
+        self.path = os.path.join(build_folder, SourceFingerprint.FILE_NAME)
+
+    @staticmethod
+    def is_cmake_file(name):
+        return name in SourceFingerprint.CMAKE_FILES or name.endswith(SourceFingerprint.CMAKE_SUFFIXES)
+
+    @staticmethod
+    def walk(root, excluded):
+        """
+        Yields the path relative to root and the stat of every file under root, without descending into the folders in
+        excluded, given as absolute paths. The files of a folder come in name order, before the files of its
+        subfolders.
+        """
+        root = os.path.abspath(root)
+        folders = [""]
+        while len(folders) > 0:
+            relative = folders.pop()
+            try:
+                with os.scandir(os.path.join(root, relative)) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            children = []
+            for entry in entries:
+                path = os.path.join(relative, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SourceFingerprint.IGNORED_FOLDERS and entry.path not in excluded:
+                            children.append(path)
+                        continue
+                    yield path, entry.stat()
+                except OSError:
+                    # Dangling links and files removed while walking
+                    yield path, None
+            folders.extend(reversed(children))
+
+    def package_cache_state(self, digest):
+        receipts = os.path.join(self.package_cache, InstallReceipts.FILE_NAME)
+        try:
+            with open(receipts, "rb") as fp:
+                digest.update(fp.read())
+            return
+        except FileNotFoundError:
+            pass
+        except OSError:
+            digest.update(b"unreadable")
+            return
+        for path, st in SourceFingerprint.walk(self.package_cache, set()):
+            digest.update((path + "\0" + ("" if st is None else str(st.st_size) + ":" + str(st.st_mtime_ns)) + "\n").encode("utf-8"))
+
+    def compute(self, cmake_args):
+        """
+        Returns the fingerprint of the project as it is now, built with cmake_args.
+        """
+        excluded = set(os.path.abspath(folder) for folder in [self.build_folder, self.package_cache])
+        configure = hashlib.sha256()
+        build = hashlib.sha256()
+        configure.update(("\0".join([os.path.abspath(self.package_cache)] + list(cmake_args)) + "\n").encode("utf-8"))
+        for path, st in SourceFingerprint.walk(self.root, excluded):
+            stat = "" if st is None else str(st.st_size) + ":" + str(st.st_mtime_ns)
+            line = (path + "\0" + stat + "\n").encode("utf-8")
+            if SourceFingerprint.is_cmake_file(os.path.basename(path)):
+                configure.update(line)
+            else:
+                configure.update((path + "\n").encode("utf-8"))
+            build.update(line)
+        self.package_cache_state(configure)
+        configure = configure.hexdigest()
+        build.update(configure.encode("utf-8"))
+        return {"Configure": configure, "Build": build.hexdigest()}
+
+    def read(self):
+        try:
+            with open(self.path, "r") as fp:
+                fingerprint = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(fingerprint, dict) or fingerprint.get("Version") != SourceFingerprint.VERSION:
+            return None
+        if not all(isinstance(fingerprint.get(k), str) for k in ["Configure", "Build"]):
+            return None
+        return fingerprint
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def write(self, fingerprint):
+        """
+        Records fingerprint as the one of the last successful build. Returns False if it could not be written, in which
+        case the next build just runs in full.
+        """
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as fp:
+                json.dump(dict(fingerprint, Version=SourceFingerprint.VERSION), fp)
+            os.replace(temp_path, self.path)
+        except OSError:
+            return False
+        return True
@@ -17,34 +17,66 @@ class Config:
         "GlobalPackageCache": os.path.join(os.environ["HOME"], ".packagecache"),
         "LogFile": os.path.join(os.environ["HOME"], ".bob", "bob.log"),
         "Level": "INFO",
-        "ProgramName": "Bob"
+        "ProgramName": "Bob",
+        "DownloadConcurrency": 8,
+        "HttpConnectionsPerHost": 8,
+        "DownloadRetries": 3,
+        "S3PartSize": 8388608,
+        "S3MaxConcurrency": 10,
+        "S3MaxPoolConnections": 10,
+        "DedupPackageStore": False,
+        "MaxGlobalCacheSizeMB": 0,
+        "StreamExtract": False,
+        "KeepArchives": True,
+        "ArchiveFormats": ["tar"],
+        "UsePackageIndex": True,
+        "ProbeMetadata": True,
+        "MirrorSegmentSize": 8388608,
+        "UseLockFile": True,
+        "UseDeltas": False,
+        "InstallCache": True,
+        "InstallCacheRestore": "copy",
+        "InstallConcurrency": 4,
+        "BuildJobs": 0,
+        "LinkJobs": 0,
+        "InstallReceipts": True,
+        "ResolveVersions": False,
+        "MetadataIndex": True,
+        "BuildFingerprint": True
     }
 
-    def __init__(self, project_root):
-        # Read config file
-        self.config = dict()
+    @staticmethod
+    def read_global_config():
+        """
+        Reads the host wide config file, creating it with the default values if needed. Values missing from the file
+        take their default values.
+        """
         if not os.path.isfile(Config.CONFIG_FILE):
             try:
                 if not os.path.isdir(Config.ROOT):
                     os.makedirs(Config.ROOT)
                 with open(Config.CONFIG_FILE, "w") as fp:
                     fp.write(json.dumps(Config.DEFAULT_CONFIG, indent=4))
-                self.config = copy.deepcopy(Config.DEFAULT_CONFIG)
+                return copy.deepcopy(Config.DEFAULT_CONFIG)
             except OSError as e:
                 raise ConfigException("Failed to write new config file because " + str(e) + ".")
-        else:
-            self.config = copy.deepcopy(Config.DEFAULT_CONFIG)
-            try:
-                with open(Config.CONFIG_FILE, "r") as fp:
-                    config = json.load(fp)
-                    for key in config:
-                        self.config[key] = config[key]
-            except OSError as e:
-                raise ConfigException("Could not read config file because " + str(e) + ".")
-            except ValueError as e:
-                with open(Config.CONFIG_FILE, "w") as fp:
-                    fp.write(json.dumps(Config.DEFAULT_CONFIG, indent=4))
-                self.config = copy.deepcopy(Config.DEFAULT_CONFIG)
+        global_config = copy.deepcopy(Config.DEFAULT_CONFIG)
+        try:
+            with open(Config.CONFIG_FILE, "r") as fp:
+                config = json.load(fp)
+                for key in config:
+                    global_config[key] = config[key]
+        except OSError as e:
+            raise ConfigException("Could not read config file because " + str(e) + ".")
+        except ValueError:
+            with open(Config.CONFIG_FILE, "w") as fp:
+                fp.write(json.dumps(Config.DEFAULT_CONFIG, indent=4))
+            global_config = copy.deepcopy(Config.DEFAULT_CONFIG)
+        return global_config
+
+    def __init__(self, project_root):
+        # Read config file
+        self.config = Config.read_global_config()
         self.config["ProjectRoot"] = project_root
         self.config["BuildFolder"] = os.path.join(project_root, "build")
 
@@ -13,7 +13,10 @@ This needs a lot of parameters:
 import os
 import tempfile
 import shutil
-import subprocess
+
+from modules.build.ProcessRunner import ProcessRunnerException, ProcessRunner
+from modules.bootstrap.ArchiveFormat import ArchiveFormat
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
 
 
 class SnapCMakeException(Exception):
@@ -36,13 +39,16 @@ class SnapCMake:
 
     def get_package_path(self, package_name: "str", package_version: "str"):
         try:
-            local_path = os.path.join(
-                self.config["GlobalPackageCache"],
-                package_name, package_version,
-                package_name + ".tar")
-            if not os.path.isfile(local_path):
-                raise SnapCMakeException("Package " + package_name + "/" + package_version + " not bootstrapped.")
-            return local_path
+            extract_path = os.path.join(self.config["GlobalPackageCache"], package_name, package_version)
+            # The uncompressed tar first, as before, then the archives of the other formats
+            for archive_format in [ArchiveFormat.TAR] + [f for f in ArchiveFormat.FORMATS if f != ArchiveFormat.TAR]:
+                local_path = os.path.join(extract_path, ArchiveFormat.file_name(package_name, archive_format))
+                if os.path.isfile(local_path):
+                    return local_path
+            # Packages extracted while streaming may not keep their archive. The extracted folder works as a source too.
+            if os.path.isfile(os.path.join(extract_path, ExtractionStamp.FILE_NAME)):
+                return extract_path
+            raise SnapCMakeException("Package " + package_name + "/" + package_version + " not bootstrapped.")
         except KeyError as e:
             raise SnapCMakeException("Missing configuration: " + str(e))
 
@@ -93,13 +99,12 @@ class SnapCMake:
             cwd = os.getcwd()
             os.chdir(temp_folder)
             try:
-                p = subprocess.Popen(["snapcraft"])
-                o, e = p.communicate()
-            except OSError as e:
+                return_code, tail = ProcessRunner.run(["snapcraft"], self.logger)
+            except ProcessRunnerException as e:
                 raise SnapCMakeException("You might not have snapcraft installed. Error message: " + str(e))
-            if not p.returncode == 0:
+            if not return_code == 0:
                 self.logger.error("Building snap failed.")
-                self.logger.error(e)
+                self.logger.error("\n".join(tail))
                 raise SnapCMakeException("Failed to build the snap.")
             else:
                 self.logger.info("Built snap in folder: " + temp_folder)
@@ -14,15 +14,17 @@ This module needs the following config parameters:
 4. LibNames (Needed if PartType == lib)
 5. HeadersSource (Needed if PartType == headers)
 6. HeadersDest (Needed if PartType == headers)
+7. ArchiveFormat (OPTIONAL, defaults to tar. One of tar, tar.gz, tar.xz and tar.zst, see ArchiveFormat)
 
 NOTE:
     No exceptions are thrown in the constructor to enable creation of an onject even if packaging info is absent in md.
 """
 import os
-import tarfile
 import json
 import tempfile
 
+from modules.bootstrap.ArchiveFormat import ArchiveFormatException, ArchiveFormat
+
 
 class SnapPartException (Exception):
     pass
@@ -92,6 +94,12 @@ class SnapPart:
             cmake_str = cmake_str + "install(DIRECTORY " + dest + " DESTINATION headers USE_SOURCE_PERMISSIONS)"
         return cmake_str
 
+    def archive_format(self):
+        return self.config.get("ArchiveFormat", ArchiveFormat.TAR)
+
+    def archive_name(self):
+        return os.path.join(self.config["BuildFolder"], ArchiveFormat.file_name(self.config["Name"], self.archive_format()))
+
     def generate_archive_libs(self):
         cmake_str = self.generate_cmake_lists()
         md_str = self.generate_meta_data()
@@ -103,8 +111,8 @@ class SnapPart:
         if len(all_libs) != len(self.config["LibNames"]):
             raise SnapPartException("Could not find all libraries.")
 
-        archive_name = os.path.join(self.config["BuildFolder"], self.config["Name"] + ".tar")
-        with tarfile.open(archive_name, "w") as tfp:
+        archive_name = self.archive_name()
+        with ArchiveFormat.writer(archive_name, self.archive_format()) as tfp:
             # Add CMakeLists.txt
             with tempfile.NamedTemporaryFile(mode="w") as cmake_file:
                 cmake_file.write(cmake_str)
@@ -150,8 +158,8 @@ class SnapPart:
         cmake_str = self.generate_cmake_lists()
         md_str = self.generate_meta_data()
 
-        archive_name = os.path.join(self.config["BuildFolder"], self.config["Name"] + ".tar")
-        with tarfile.open(archive_name, "w") as tfp:
+        archive_name = self.archive_name()
+        with ArchiveFormat.writer(archive_name, self.archive_format()) as tfp:
             # Add cMakeLists.txt
             with tempfile.NamedTemporaryFile(mode="w") as cmake_file:
                 cmake_file.write(cmake_str)
@@ -179,10 +187,14 @@ class SnapPart:
                 self.generate_archive_libs()
             except OSError as e:
                 raise (SnapPartException(str(e)))
+            except ArchiveFormatException as e:
+                raise (SnapPartException(str(e)))
         elif part_type == "headers":
             try:
                 self.generate_archive_headers()
             except OSError as e:
                 raise (SnapPartException(str(e)))
+            except ArchiveFormatException as e:
+                raise (SnapPartException(str(e)))
         else:
             raise SnapPartException("Invalid part type. Allowed values are:  \"lib\" and \"headers\".")
@@ -8,13 +8,15 @@ You can run the end to end workflow or a single step. The available steps are:
 1. Build
 2. Test
 3. Clean
+
+Use --gc to trim the global package cache to MaxGlobalCacheSizeMB, evicting the least recently used packages.
+Use --index <folder> to write the index.json of a package repository laid out in folder. Add --deltas to also write
+the deltas between consecutive versions of its packages.
 """
 
 import argparse
 import sys
 
-from modules.workflow.Workflow import WorkflowException, Workflow
-
 
 def execute_cmd():
     version_maj = sys.version_info[0]
@@ -26,9 +28,27 @@ def execute_cmd():
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("-c", "--clean", help="Clean the project.", action="store_true")
     parser.add_argument("-s", "--step", help="Run single step.")
+    parser.add_argument("-g", "--gc", help="Garbage collect the global package cache.", action="store_true")
+    parser.add_argument("-i", "--index", help="Write the package index of a package repository folder.")
+    parser.add_argument("-d", "--deltas", help="With --index, write the missing package deltas too.", action="store_true")
 
     args = parser.parse_args(sys.argv[1:])
 
+    # The workflow modules are imported once the arguments are parsed, so that `bob --help` does not load them
+    if args.gc:
+        from modules.bootstrap import CacheGC
+        return CacheGC.main()
+    if args.index:
+        from modules.bootstrap.PackageIndex import PackageIndexException, PackageIndex
+        try:
+            index = PackageIndex.build(args.index, args.deltas)
+            print("Indexed " + str(sum(len(versions) for versions in index["Packages"].values())) + " packages.")
+            return True
+        except PackageIndexException as e:
+            print("\n\n[ERROR] Error occured " + str(e))
+            return False
+
+    from modules.workflow.Workflow import WorkflowException, Workflow
     try:
         workflow = Workflow()
         if args.clean:
@@ -3,8 +3,9 @@ import traceback
 
 from modules.config.Config import ConfigException, Config
 from modules.build.CppCmake import BuildException, CppCmake
+from modules.build.JobServer import JobServerException, JobServer
 from modules.bootstrap.DependencyResolver import DependencyResolverException, DependencyResolver
-from modules.package.Package import PackageException, Package
+from modules.bootstrap.CacheGC import CacheGC
 
 
 class WorkflowException (Exception):
@@ -27,6 +28,12 @@ class Workflow:
         except ConfigException as e:
             raise WorkflowException("Could not configure project because " + str(e))
 
+        # The dependency builds and the project build share a jobserver
+        try:
+            self.config_obj["JobServer"] = JobServer.from_config(self.config_obj)
+        except JobServerException as e:
+            raise WorkflowException("Could not configure the builds because " + str(e))
+
         # Detect build system
         build_system = self.config_obj["BuildSystem"]
         try:
@@ -40,15 +47,17 @@ class Workflow:
         # Initialize other stuff
         try:
             self.resolver = DependencyResolver(self.config_obj)
-            self.package = Package(self.config_obj)
         except DependencyResolverException as e:
             raise WorkflowException("Could not initialize dependency resolver because: " + str(e))
+        # The packaging modules are loaded by the Package step, the only one that needs them
+        self.package = None
 
     def execute_step(self, step_name):
         self.logger.info("Executing step: " + step_name + ".")
         try:
             if step_name == "Bootstrap":
                 self.resolver.bfs()
+                CacheGC.schedule(self.config_obj)
             elif step_name == "Build":
                 self.builder.build()
             elif step_name == "Test":
@@ -56,16 +65,23 @@ class Workflow:
             elif step_name == "Clean":
                 self.builder.clean()
             elif step_name == "Package":
-                self.package.package()
+                self.run_package()
             else:
                 raise WorkflowException("Invalid step name.")
         except DependencyResolverException as e:
             raise WorkflowException("Could not resolve dependencies because: " + str(e))
         except BuildException as e:
             raise WorkflowException("Could not resolve build / test because: " + str(e))
+        self.logger.info("Finished executing step: " + step_name + ".")
+
+    def run_package(self):
+        from modules.package.Package import PackageException, Package
+        try:
+            if self.package is None:
+                self.package = Package(self.config_obj)
+            self.package.package()
         except PackageException as e:
             raise WorkflowException("Could not package because: " + str(e))
-        self.logger.info("Finished executing step: " + step_name + ".")
 
     def run(self):
         for step in Workflow.STEPS:
@@ -35,6 +35,7 @@ setup(
     extras_require={
         'dev': [],
         'test': ["coverage"],
+        'zstd': ["zstandard"],
     },
     entry_points={
         "console_scripts": [
@@ -0,0 +1,74 @@
+"""
+This benchmark tracks how long fingerprinting a project takes (see SourceFingerprint), that is how long a build of an
+unchanged project takes with BuildFingerprint.
+
+A synthetic project of FILES files, spread over folders of FILES_PER_FOLDER files, is written to a temporary folder,
+with a package cache. The project is fingerprinted a few times, and the median wall time is compared to its budget. The
+benchmark exits with status 1 if a project goes over budget.
+
+Usage: python -m tst.benchmarks.BuildFingerprintBenchmark [runs]
+"""
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from modules.build.SourceFingerprint import SourceFingerprint  # noqa: E402
+
+FILES_PER_FOLDER = 50
+
+# Median wall time budgets in milliseconds, by number of files
+BUDGETS = {
+    5000: 250,
+    50000: 1000
+}
+
+
+def project(root, files):
+    """
+    Writes a project of files source files to root, with a package cache of a tenth of its size.
+    """
+    for i in range(files):
+        folder = os.path.join(root, "src", "module" + str(i // FILES_PER_FOLDER))
+        if i % FILES_PER_FOLDER == 0:
+            os.makedirs(folder)
+            with open(os.path.join(folder, "CMakeLists.txt"), "w") as fp:
+                fp.write("add_library(module" + str(i // FILES_PER_FOLDER) + " STATIC)\n")
+        with open(os.path.join(folder, "file" + str(i) + ".cpp"), "w") as fp:
+            fp.write("int f" + str(i) + "() { return " + str(i) + "; }\n")
+    for i in range(files // 10):
+        folder = os.path.join(root, ".packagecache", "include", "package" + str(i // FILES_PER_FOLDER))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "header" + str(i) + ".h"), "w") as fp:
+            fp.write("int f" + str(i) + "();\n")
+    with open(os.path.join(root, "CMakeLists.txt"), "w") as fp:
+        fp.write("cmake_minimum_required(VERSION 3.13)\n")
+    os.makedirs(os.path.join(root, "build"))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    ok = True
+    for files, budget in BUDGETS.items():
+        with tempfile.TemporaryDirectory() as root:
+            project(root, files)
+            fingerprint = SourceFingerprint(root, os.path.join(root, "build"), os.path.join(root, ".packagecache"))
+            timings = []
+            for _ in range(runs):
+                start = time.monotonic()
+                fingerprint.compute([])
+                timings.append((time.monotonic() - start) * 1000)
+        median = statistics.median(timings)
+        print("Project of " + str(files) + " files: median " + str(round(median, 1)) + " ms, min " + str(round(min(timings), 1)) +
+              " ms over " + str(runs) + " runs (budget " + str(budget) + " ms).")
+        if median > budget:
+            print("  over budget.")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
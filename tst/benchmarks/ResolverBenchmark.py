@@ -0,0 +1,92 @@
+"""
+This benchmark tracks how long the version solver (see VersionSolver) takes on synthetic dependency graphs of thousands
+of packages.
+
+The graphs are layered: every package has VERSIONS versions, and every version depends on three packages of the layer
+below, through version ranges. In the "conflicts" graphs, the newer versions of half the packages need, through a
+private package, a newer version of a shared package than the project allows, so the solver has to backtrack out of
+them. Every graph is solved a few times, and the median wall time is compared to its budget. The benchmark exits with
+status 1 if a graph goes over budget.
+
+Usage: python -m tst.benchmarks.ResolverBenchmark [runs]
+"""
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from modules.bootstrap.VersionSolver import VersionSolver  # noqa: E402
+
+VERSIONS = 4
+LAYER_SIZE = 100
+
+# Median wall time budgets in milliseconds, by graph
+BUDGETS = {
+    ("ranges", 1000): 100,
+    ("ranges", 5000): 500,
+    ("conflicts", 1000): 500,
+    ("conflicts", 5000): 3000
+}
+
+
+class NullLog:
+    def info(self, msg):
+        pass
+
+
+def graph(kind, size):
+    """
+    Returns the repository of a synthetic graph, dependencies by version by package, and the requirements of its root.
+    """
+    names = ["P" + str(i) for i in range(size)]
+    repository = {}
+    for i, name in enumerate(names):
+        layer, position = divmod(i, LAYER_SIZE)
+        below = names[(layer + 1) * LAYER_SIZE:(layer + 2) * LAYER_SIZE]
+        repository[name] = {}
+        for version in range(1, VERSIONS + 1):
+            # Every package of a layer is needed by the layer above
+            deps = [{"Name": below[(position + k * 37) % len(below)], "Version": ">=1.0"} for k in range(3) if len(below) > 0]
+            if kind == "conflicts" and layer % 2 == 1:
+                # Newer versions need a newer private package, which needs a newer Shared than the project allows: the
+                # solver only finds out once it picks the private package, and has to come back to this one
+                deps.append({"Name": "Q" + str(i), "Version": ">=" + str(version) + ".0"})
+                repository["Q" + str(i)] = {str(v) + ".0": [{"Name": "Shared", "Version": ">=" + str(v) + ".0"}] for v in range(1, VERSIONS + 1)}
+            repository[name][str(version) + ".0"] = deps
+    repository["Shared"] = {str(version) + ".0": [] for version in range(1, VERSIONS + 1)}
+    requirements = [{"Name": name, "Version": "*"} for name in names[:LAYER_SIZE]]
+    if kind == "conflicts":
+        requirements.append({"Name": "Shared", "Version": "<2.0"})
+    return repository, requirements
+
+
+def solve(repository, requirements):
+    solver = VersionSolver(lambda package: list(repository.get(package["Name"], {})),
+                           lambda package: repository[package["Name"]][package["Version"]], NullLog())
+    return solver.solve(requirements)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    ok = True
+    for (kind, size), budget in BUDGETS.items():
+        repository, requirements = graph(kind, size)
+        timings = []
+        solved = {}
+        for _ in range(runs):
+            start = time.monotonic()
+            solved = solve(repository, requirements)
+            timings.append((time.monotonic() - start) * 1000)
+        median = statistics.median(timings)
+        print(kind + " graph of " + str(size) + " packages: " + str(len(solved)) + " solved, median " + str(round(median, 1)) +
+              " ms, min " + str(round(min(timings), 1)) + " ms over " + str(runs) + " runs (budget " + str(budget) + " ms).")
+        if median > budget:
+            print("  over budget.")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
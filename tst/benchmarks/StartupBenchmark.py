@@ -0,0 +1,80 @@
+"""
+This benchmark tracks how long `bob --help` and `bob -c` take to start, and which modules they import on the way.
+
+Every command runs in a fresh interpreter, on a throwaway CppCmake project and HOME, so the user's config is not
+touched. The bytecode cache is warmed by a first, untimed run. The median wall time of each command is compared to
+its budget, and the benchmark exits with status 1 if a command goes over budget or imports one of HEAVY_MODULES.
+
+Usage: python -m tst.benchmarks.StartupBenchmark [runs]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# Modules that only bootstraps and packaging need
+HEAVY_MODULES = ["boto3", "botocore", "tarfile", "http.client", "ssl", "modules.package.Package"]
+
+# Median wall time budgets in milliseconds, interpreter start included
+BUDGETS = {
+    "--help": 150,
+    "-c": 250
+}
+
+BOB = (
+    "import sys, json\n"
+    "sys.argv[0] = 'bob'\n"
+    "import modules\n"
+    "try:\n"
+    "    modules.main()\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "sys.stderr.write(json.dumps(sorted(m for m in " + json.dumps(HEAVY_MODULES) + " if m in sys.modules)))\n"
+)
+
+
+def run_bob(args, project, home):
+    """
+    Runs bob with args in project. Returns the wall time in milliseconds and the heavy modules it imported.
+    """
+    env = dict(os.environ, HOME=home, PYTHONPATH=ROOT)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, "-c", BOB] + args, cwd=project, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    elapsed = (time.monotonic() - start) * 1000
+    return elapsed, json.loads(result.stderr.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    ok = True
+    with tempfile.TemporaryDirectory() as project, tempfile.TemporaryDirectory() as home:
+        with open(os.path.join(project, "md.json"), "w") as fp:
+            json.dump({"Name": "Startup", "Version": "1.0", "BuildSystem": "CppCmake"}, fp)
+        for command, budget in BUDGETS.items():
+            run_bob([command], project, home)
+            timings = []
+            imported = []
+            for _ in range(runs):
+                elapsed, imported = run_bob([command], project, home)
+                timings.append(elapsed)
+            median = statistics.median(timings)
+            print("bob " + command + ": median " + str(round(median, 1)) + " ms, min " + str(round(min(timings), 1)) +
+                  " ms over " + str(runs) + " runs (budget " + str(budget) + " ms).")
+            if len(imported) > 0:
+                print("  imports " + ", ".join(imported) + ".")
+                ok = False
+            if median > budget:
+                print("  over budget.")
+                ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,62 @@
+import unittest
+import os
+import io
+import tempfile
+
+from modules.bootstrap.ArchiveFormat import ArchiveFormatException, ArchiveFormat
+
+
+class TestArchiveFormat (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "src")
+        os.makedirs(os.path.join(self.source, "include"))
+        with open(os.path.join(self.source, "include", "a.h"), "w") as fp:
+            fp.write("int a();\n" * 1000)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def supported_formats(self):
+        return [f for f in ArchiveFormat.FORMATS if ArchiveFormat.is_supported(f)]
+
+    def write(self, archive_format):
+        path = os.path.join(self.temp_dir.name, ArchiveFormat.file_name("A", archive_format))
+        with ArchiveFormat.writer(path, archive_format) as tfp:
+            tfp.add(os.path.join(self.source, "include"), arcname="include")
+        return path
+
+    def test_round_trip(self):
+        for archive_format in self.supported_formats():
+            path = self.write(archive_format)
+            with ArchiveFormat.reader(path, archive_format) as tfp:
+                self.assertEqual(["include", "include/a.h"], sorted(tfp.getnames()))
+
+    def test_compressed_formats_are_smaller(self):
+        size = os.path.getsize(self.write(ArchiveFormat.TAR))
+        for archive_format in self.supported_formats():
+            if archive_format != ArchiveFormat.TAR:
+                self.assertLess(os.path.getsize(self.write(archive_format)), size)
+
+    def test_stream(self):
+        for archive_format in self.supported_formats():
+            with open(self.write(archive_format), "rb") as fp:
+                stream = io.BufferedReader(io.BytesIO(fp.read()))
+            with ArchiveFormat.open_stream(stream, archive_format) as tfp:
+                members = [member.name for member in tfp]
+            self.assertEqual(["include", "include/a.h"], sorted(members))
+
+    @unittest.skipIf(ArchiveFormat.zstandard() is None, "zstandard is not installed")
+    def test_corrupt_zstd(self):
+        path = os.path.join(self.temp_dir.name, "A.tar.zst")
+        with open(path, "wb") as fp:
+            fp.write(b"not zstd")
+        with self.assertRaises(ArchiveFormat.errors()):
+            with ArchiveFormat.reader(path, ArchiveFormat.ZSTD) as tfp:
+                tfp.getnames()
+
+    def test_invalid_format(self):
+        self.assertRaises(ArchiveFormatException, ArchiveFormat.check, "zip")
+        with self.assertRaises(ArchiveFormatException):
+            with ArchiveFormat.writer(os.path.join(self.temp_dir.name, "A.zip"), "zip"):
+                pass
@@ -0,0 +1,42 @@
+import unittest
+import os
+import io
+import hashlib
+import tempfile
+
+from modules.bootstrap.ArchiveStream import ArchiveStream
+
+
+class TestArchiveStream (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(3 * ArchiveStream.CHUNK_SIZE + 17)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_hashes_what_is_read_and_the_rest(self):
+        stream = ArchiveStream(io.BytesIO(self.data))
+        self.assertEqual(self.data[:10], stream.read(10))
+        digest, size = stream.finish()
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(), digest)
+        self.assertEqual(len(self.data), size)
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+    def test_keeps_archive(self):
+        keep_path = os.path.join(self.temp_dir.name, "A.tar")
+        stream = ArchiveStream(io.BytesIO(self.data), keep_path)
+        stream.read()
+        self.assertFalse(os.path.exists(keep_path))
+        stream.finish()
+        with open(keep_path, "rb") as fp:
+            self.assertEqual(self.data, fp.read())
+        self.assertEqual(["A.tar"], os.listdir(self.temp_dir.name))
+
+    def test_abort_removes_kept_bytes(self):
+        keep_path = os.path.join(self.temp_dir.name, "A.tar")
+        stream = ArchiveStream(io.BytesIO(self.data), keep_path)
+        stream.read(100)
+        stream.abort()
+        stream.abort()
+        self.assertEqual([], os.listdir(self.temp_dir.name))
@@ -0,0 +1,68 @@
+import unittest
+import os
+import stat
+import tempfile
+
+from unittest.mock import patch
+from modules.bootstrap.BlobStore import BlobStoreException, BlobStore
+
+
+class TestBlobStore (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = self.temp_dir.name
+        self.store = BlobStore(self.cache)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, path, text, mode=0o644):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            fp.write(text)
+        os.chmod(path, mode)
+        return path
+
+    def count_blobs(self):
+        return sum(len(files) for _, _, files in os.walk(os.path.join(self.cache, BlobStore.FOLDER)))
+
+    def test_identical_files_share_one_blob(self):
+        v1 = os.path.join(self.cache, "A", "1.0")
+        v2 = os.path.join(self.cache, "A", "2.0")
+        self.write(os.path.join(v1, "include", "a.h"), "same")
+        self.write(os.path.join(v1, "include", "b.h"), "old")
+        self.write(os.path.join(v2, "include", "a.h"), "same")
+        self.write(os.path.join(v2, "include", "b.h"), "new")
+        self.assertEqual(2, self.store.ingest_tree(v1))
+        self.assertEqual(2, self.store.ingest_tree(v2))
+
+        self.assertEqual(3, self.count_blobs())
+        self.assertEqual(os.stat(os.path.join(v1, "include", "a.h")).st_ino, os.stat(os.path.join(v2, "include", "a.h")).st_ino)
+        self.assertNotEqual(os.stat(os.path.join(v1, "include", "b.h")).st_ino, os.stat(os.path.join(v2, "include", "b.h")).st_ino)
+        with open(os.path.join(v2, "include", "b.h")) as fp:
+            self.assertEqual("new", fp.read())
+
+    def test_blobs_are_read_only(self):
+        path = self.write(os.path.join(self.cache, "A", "1.0", "a.h"), "text")
+        blob = self.store.ingest(path)
+        self.assertEqual(os.stat(blob).st_ino, os.stat(path).st_ino)
+        self.assertFalse(os.stat(blob).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_executables_are_kept_apart(self):
+        script = self.write(os.path.join(self.cache, "A", "1.0", "run.sh"), "echo", 0o755)
+        text = self.write(os.path.join(self.cache, "A", "1.0", "run.txt"), "echo", 0o644)
+        self.assertNotEqual(self.store.ingest(script), self.store.ingest(text))
+        self.assertTrue(os.stat(script).st_mode & stat.S_IXUSR)
+        self.assertFalse(os.stat(text).st_mode & stat.S_IXUSR)
+
+    def test_symlinks_are_left_alone(self):
+        v1 = os.path.join(self.cache, "A", "1.0")
+        self.write(os.path.join(v1, "lib", "libx.so.1"), "binary")
+        os.symlink("libx.so.1", os.path.join(v1, "lib", "libx.so"))
+        self.assertEqual(1, self.store.ingest_tree(v1))
+        self.assertTrue(os.path.islink(os.path.join(v1, "lib", "libx.so")))
+
+    @patch("modules.bootstrap.BlobStore.BlobStore.hash_file", side_effect=OSError("Permission denied"))
+    def test_exception_on_unreadable_tree(self, mock_hash_file):
+        self.write(os.path.join(self.cache, "A", "1.0", "a.h"), "text")
+        self.assertRaises(BlobStoreException, self.store.ingest_tree, os.path.join(self.cache, "A", "1.0"))
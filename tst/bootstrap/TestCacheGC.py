@@ -0,0 +1,146 @@
+import unittest
+import os
+import json
+import time
+import tempfile
+
+from unittest.mock import patch
+from modules.bootstrap.BlobStore import BlobStore
+from modules.bootstrap.CacheGC import CacheGCException, CacheGC
+from tst.testutils.Mocks import MockLog
+
+
+class TestCacheGC (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.temp_dir.name, "cache")
+        os.makedirs(self.cache)
+        self.config = {
+            "GlobalPackageCache": self.cache,
+            "Logger": MockLog(),
+            "MaxGlobalCacheSizeMB": 1
+        }
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def add_package(self, name, version, size_kb, age, content=None):
+        folder = os.path.join(self.cache, name, version)
+        os.makedirs(folder)
+        with open(os.path.join(folder, name + ".tar"), "wb") as fp:
+            fp.write(content if content is not None else os.urandom(size_kb * 1024))
+        CacheGC.touch(folder)
+        accessed = time.time() - age
+        os.utime(os.path.join(folder, CacheGC.ACCESS_FILE), (accessed, accessed))
+        return folder
+
+    def test_invalid_config(self):
+        with self.assertRaises(CacheGCException):
+            CacheGC({"Logger": MockLog()})
+        with self.assertRaises(CacheGCException):
+            CacheGC({"GlobalPackageCache": self.cache, "Logger": MockLog(), "MaxGlobalCacheSizeMB": "big"})
+
+    def test_touch_is_best_effort(self):
+        CacheGC.touch(os.path.join(self.cache, "missing", "1.0"))
+        folder = os.path.join(self.cache, "A", "1.0")
+        os.makedirs(folder)
+        CacheGC.touch(folder)
+        self.assertTrue(os.path.isfile(os.path.join(folder, CacheGC.ACCESS_FILE)))
+
+    def test_nothing_evicted_under_limit(self):
+        self.add_package("A", "1.0", 100, 7200)
+        self.assertEqual([], CacheGC(self.config).collect())
+        self.assertTrue(os.path.isdir(os.path.join(self.cache, "A", "1.0")))
+
+    def test_disabled(self):
+        self.add_package("A", "1.0", 2048, 7200)
+        self.config["MaxGlobalCacheSizeMB"] = 0
+        self.assertEqual([], CacheGC(self.config).collect())
+
+    def test_evicts_least_recently_used_first(self):
+        self.add_package("Old", "1.0", 600, 3 * 86400)
+        self.add_package("Older", "1.0", 600, 4 * 86400)
+        self.add_package("New", "1.0", 600, 2 * 86400)
+        evicted = CacheGC(self.config).collect()
+        self.assertEqual([("Older", "1.0"), ("Old", "1.0")], evicted)
+        self.assertFalse(os.path.exists(os.path.join(self.cache, "Older")))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache, "New", "1.0")))
+
+    def test_evicts_builds_and_installs(self):
+        self.add_package("Old", "1.0", 600, 3 * 86400)
+        self.add_package("Old", "2.0", 100, 2 * 86400)
+        for derived in CacheGC.DERIVED_FOLDERS:
+            for version in ["1.0", "2.0"]:
+                folder = os.path.join(self.cache, derived, "Old", version, "0123456789abcdef")
+                os.makedirs(folder)
+                with open(os.path.join(folder, "libold.a"), "wb") as fp:
+                    fp.write(os.urandom(300 * 1024))
+        self.assertEqual([("Old", "1.0")], CacheGC(self.config).collect())
+        for derived in CacheGC.DERIVED_FOLDERS:
+            self.assertEqual(["2.0"], os.listdir(os.path.join(self.cache, derived, "Old")))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache, "Old", "2.0")))
+
+    def test_recently_used_and_pinned_packages_are_kept(self):
+        project = os.path.join(self.temp_dir.name, "project")
+        os.makedirs(project)
+        with open(os.path.join(project, "md.json"), "w") as fp:
+            json.dump({"Name": "P", "Version": "1.0", "Dependencies": [{"Name": "Pinned", "Version": "1.0"}]}, fp)
+        with open(os.path.join(project, "bob.lock"), "w") as fp:
+            json.dump({"Packages": [{"Name": "Locked", "Version": "2.0"}]}, fp)
+        CacheGC.register_project(self.cache, project)
+        CacheGC.register_project(self.cache, project)
+        self.assertEqual([project], CacheGC(self.config).projects())
+
+        self.add_package("Pinned", "1.0", 600, 5 * 86400)
+        self.add_package("Locked", "2.0", 600, 5 * 86400)
+        self.add_package("Fresh", "1.0", 600, 60)
+        self.assertEqual([], CacheGC(self.config).collect())
+        for name, version in [("Pinned", "1.0"), ("Locked", "2.0"), ("Fresh", "1.0")]:
+            self.assertTrue(os.path.isdir(os.path.join(self.cache, name, version)))
+
+    def test_orphan_blobs_are_purged(self):
+        store = BlobStore(self.cache)
+        shared = os.urandom(400 * 1024)
+        old = self.add_package("A", "1.0", 0, 3 * 86400, content=shared + os.urandom(400 * 1024))
+        new = self.add_package("A", "2.0", 0, 60, content=shared + os.urandom(400 * 1024))
+        store.ingest_tree(old)
+        store.ingest_tree(new)
+        os.chmod(old, 0o555)
+        self.assertEqual([("A", "1.0")], CacheGC(self.config).collect())
+        blobs = [f for _, _, files in os.walk(store.root) for f in files]
+        # The blob of the evicted tar is gone, the blobs still linked from 2.0 stay
+        self.assertEqual(2, len(blobs))
+        self.assertTrue(os.path.isfile(os.path.join(new, "A.tar")))
+
+    def test_skips_when_another_collection_runs(self):
+        self.add_package("A", "1.0", 2048, 7200)
+        with CacheGC.locked(os.path.join(self.cache, CacheGC.LOCK_FILE)):
+            with patch("fcntl.flock", side_effect=BlockingIOError()):
+                self.assertEqual([], CacheGC(self.config).collect())
+        self.assertTrue(os.path.isdir(os.path.join(self.cache, "A", "1.0")))
+
+    @patch("subprocess.Popen")
+    def test_schedule_registers_project_and_throttles(self, mock_popen):
+        self.config["ProjectRoot"] = "PROJECT"
+        CacheGC.schedule(self.config)
+        CacheGC.schedule(self.config)
+        self.assertEqual(1, mock_popen.call_count)
+        self.assertTrue(mock_popen.call_args[1]["start_new_session"])
+        self.assertEqual(["PROJECT"], CacheGC(self.config).projects())
+
+    @patch("subprocess.Popen")
+    def test_schedule_disabled(self, mock_popen):
+        CacheGC.schedule({"Logger": MockLog()})
+        self.config["MaxGlobalCacheSizeMB"] = 0
+        CacheGC.schedule(self.config)
+        mock_popen.assert_not_called()
+        self.assertFalse(os.path.exists(os.path.join(self.cache, CacheGC.PROJECTS_FILE)))
+
+    @patch("subprocess.Popen")
+    def test_schedule_invalid_size(self, mock_popen):
+        with patch.object(self.config["Logger"], "warn") as mock_warn:
+            for size in ["10GB", None]:
+                self.config["MaxGlobalCacheSizeMB"] = size
+                CacheGC.schedule(self.config)
+            self.assertEqual(2, mock_warn.call_count)
+        mock_popen.assert_not_called()
@@ -1,7 +1,11 @@
 import unittest
+import os
+import json
+import shutil
+import tempfile
 
 from unittest.mock import patch
-from tst.testutils.Mocks import MockPackageDownloader, MockPackageInstaller, MockLog
+from tst.testutils.Mocks import MockPackageDownloader, MockPackageInstaller, MockPackageIndex, MockLog
 from modules.bootstrap.DependencyResolver import DependencyResolverException, DependencyResolver
 from modules.bootstrap.PackageInstaller import PackageInstallerException
 from modules.bootstrap.PackageDownloader import PackageDownloaderException
@@ -11,13 +15,13 @@ class TestDependencyResolver (unittest.TestCase):
     @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
     @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
     def setUp(self, mock_package_downloader, mock_package_installers):
-        returned_dependencies = [
-            {"A": {"Name": "A", "Version": "1.0"}, "B": {"Name": "B", "Version": "2.0"}},
-            {"A": {"Name": "A", "Version": "1.0"}, "C": {"Name": "C", "Version": "3.0"}},
-            {"A": {"Name": "B", "Version": "2.0"}, "C": {"Name": "C", "Version": "3.0"}}
-        ]
+        package_dependencies = {
+            "D1": [{"Name": "A", "Version": "1.0"}, {"Name": "B", "Version": "2.0"}],
+            "D2": [{"Name": "A", "Version": "1.0"}],
+            "A": [{"Name": "C", "Version": "3.0"}]
+        }
         mock_package_downloader.side_effect = [MockPackageDownloader()]
-        mock_package_installers.side_effect = [MockPackageInstaller(returned_dependencies)]
+        mock_package_installers.side_effect = [MockPackageInstaller(package_dependencies)]
         self.config_obj = {
             "Dependencies": [{"Name": "D1", "Version": "1.0"}],
             "BuildDeps": [{"Name": "D2", "Version": "1.0"}],
@@ -38,17 +42,19 @@ class TestDependencyResolver (unittest.TestCase):
             {"Name": "D3", "Version": "1.0"}
         ]
         self.assertEqual(sorted(expected_dependency_closure, key=lambda x: x["Name"]), sorted(actual_dependency_closure, key=lambda x: x["Name"]))
+        # What was learnt about the dependencies is saved once
+        self.assertEqual(1, self.resolver.installer.saved)
 
     @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
     @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
     def test_exception_on_bad_md(self, mock_package_downloader, mock_package_installers):
-        returned_dependencies = [
-            {"A": {"Name": "A", "Version": "1.0"}, "B": {"Name": "B", "Version": "2.0"}},
-            {"A": {"Name": "A", "Version": "1.0"}, "C": {"Name": "C", "Version": "3.0"}},
-            {"A": {"Name": "B", "Version": "2.0"}, "C": {"Name": "C", "Version": "3.0"}}
-        ]
+        package_dependencies = {
+            "D1": [{"Name": "A", "Version": "1.0"}, {"Name": "B", "Version": "2.0"}],
+            "D2": [{"Name": "A", "Version": "1.0"}],
+            "A": [{"Name": "C", "Version": "3.0"}]
+        }
         mock_package_downloader.side_effect = [MockPackageDownloader()]
-        mock_package_installers.side_effect = [MockPackageInstaller(returned_dependencies)]
+        mock_package_installers.side_effect = [MockPackageInstaller(package_dependencies)]
         self.config_obj = {
             "Dependencies": [{"Name": "D1", "Version": "1.0"}],
             "BuildDeps": [{"Name": "D2", "Version": "1.0"}],
@@ -85,3 +91,209 @@ class TestDependencyResolver (unittest.TestCase):
     def test_init_error_on_conf_init(self, mock_package_downloader, mock_package_installers):
         self.assertRaises(DependencyResolverException, DependencyResolver, {})
         self.assertRaises(DependencyResolverException, DependencyResolver, 10)
+
+    @patch("modules.bootstrap.DependencyResolver.PackageIndex", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def test_resolve_from_index(self, mock_package_downloader, mock_package_installers, mock_package_index):
+        archives = {"tar.xz": {"Size": 10, "Sha256": "X"}, "tar": {"Size": 40, "Sha256": "Y"}}
+        entries = {
+            "D1": {"Dependencies": [{"Name": "A", "Version": "1.0"}, {"Name": "B", "Version": "2.0"}], "Archives": archives},
+            "D2": {"Dependencies": [], "Archives": archives, "Deltas": {"0.9": {"Size": 2, "Sha256": "Z"}}},
+            "D3": {"Dependencies": [{"Name": "B", "Version": "2.0"}]},
+            "A": {"Dependencies": [{"Name": "C", "Version": "3.0"}]},
+            "B": {"Dependencies": []},
+            "C": {"Dependencies": []}
+        }
+        downloader = MockPackageDownloader()
+        installer = MockPackageInstaller({
+            "D1": [{"Name": "A", "Version": "1.0"}, {"Name": "B", "Version": "2.0"}],
+            "D3": [{"Name": "B", "Version": "2.0"}],
+            "A": [{"Name": "C", "Version": "3.0"}]
+        })
+        mock_package_downloader.side_effect = [downloader]
+        mock_package_installers.side_effect = [installer]
+        mock_package_index.side_effect = [MockPackageIndex(entries)]
+        self.config_obj["UsePackageIndex"] = True
+        closure = DependencyResolver(self.config_obj).bfs()
+        self.assertEqual(["A", "B", "C", "D1", "D2", "D3"], sorted(p["Name"] for p in closure))
+        # The whole closure is downloaded in a single batch
+        self.assertEqual(1, len(downloader.invocations))
+        self.assertEqual(["A", "B", "C", "D1", "D2", "D3"], sorted(p["Name"] for p in downloader.invocations[0]))
+        hinted = [p for p in downloader.invocations[0] if p["Name"] == "D1"][0]
+        self.assertEqual(archives, hinted["Archives"])
+        self.assertEqual(10, hinted["Size"])
+        self.assertNotIn("Deltas", hinted)
+        hinted = [p for p in downloader.invocations[0] if p["Name"] == "D2"][0]
+        self.assertEqual({"0.9": {"Size": 2, "Sha256": "Z"}}, hinted["Deltas"])
+        # But installed dependencies first, the longest chain (C, A, D1) first
+        self.assertEqual(["C", "A", "B", "D1", "D3", "D2"], installer.invocations)
+
+    @patch("modules.bootstrap.DependencyResolver.PackageIndex", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def test_resolve_level_by_level_when_not_indexed(self, mock_package_downloader, mock_package_installers, mock_package_index):
+        entries = {
+            "D1": {"Dependencies": [{"Name": "A", "Version": "1.0"}]},
+            "D2": {"Dependencies": []},
+            "D3": {"Dependencies": []}
+        }
+        downloader = MockPackageDownloader()
+        mock_package_downloader.side_effect = [downloader]
+        mock_package_installers.side_effect = [MockPackageInstaller({"D1": [{"Name": "A", "Version": "1.0"}]})]
+        mock_package_index.side_effect = [MockPackageIndex(entries)]
+        self.config_obj["UsePackageIndex"] = True
+        closure = DependencyResolver(self.config_obj).bfs()
+        self.assertEqual(["A", "D1", "D2", "D3"], sorted(p["Name"] for p in closure))
+        self.assertEqual([["D1", "D2", "D3"], ["A"]], [sorted(p["Name"] for p in level) for level in downloader.invocations])
+
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def test_resolve_from_metadata(self, mock_package_downloader, mock_package_installers):
+        downloader = MockPackageDownloader()
+        downloader.metadata = {
+            "D1": [{"Name": "A", "Version": "1.0"}],
+            "D3": [{"Name": "B", "Version": "2.0"}],
+            "B": [{"Name": "C", "Version": "3.0"}]
+        }
+        installer = MockPackageInstaller(downloader.metadata)
+        mock_package_downloader.side_effect = [downloader]
+        mock_package_installers.side_effect = [installer]
+        self.config_obj["ProbeMetadata"] = True
+        closure = DependencyResolver(self.config_obj).bfs()
+        self.assertEqual(["A", "B", "C", "D1", "D2", "D3"], sorted(p["Name"] for p in closure))
+        self.assertEqual([["D1", "D2", "D3"], ["A", "B"], ["C"]], [sorted(p["Name"] for p in level) for level in downloader.probes])
+        # The payloads are all fetched at once, after the graph was expanded
+        self.assertEqual(1, len(downloader.invocations))
+        self.assertEqual(6, len(downloader.invocations[0]))
+        self.assertEqual(["C", "A", "B", "D1", "D3", "D2"], installer.invocations)
+
+    @patch("modules.bootstrap.DependencyResolver.PackageIndex", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def test_resolve_version_ranges(self, mock_package_downloader, mock_package_installers, mock_package_index):
+        entries = {
+            "D1/1.0": {"Dependencies": [{"Name": "A", "Version": ">=1.0"}]},
+            "D2/1.0": {"Dependencies": [{"Name": "C", "Version": "1.5"}]},
+            "D3/1.0": {"Dependencies": []},
+            "A/1.0": {"Dependencies": [{"Name": "C", "Version": ">=1.0,<2.0"}]},
+            "A/2.0": {"Dependencies": [{"Name": "C", "Version": ">=2.0"}]},
+            "C/1.0": {"Dependencies": []},
+            "C/1.5": {"Dependencies": []},
+            "C/2.0": {"Dependencies": []}
+        }
+        downloader = MockPackageDownloader()
+        installer = MockPackageInstaller({
+            "D1": [{"Name": "A", "Version": ">=1.0"}],
+            "D2": [{"Name": "C", "Version": "1.5"}],
+            "A/1.0": [{"Name": "C", "Version": ">=1.0,<2.0"}]
+        })
+        mock_package_downloader.side_effect = [downloader]
+        mock_package_installers.side_effect = [installer]
+        mock_package_index.side_effect = [MockPackageIndex(entries)]
+        self.config_obj["UsePackageIndex"] = True
+        self.config_obj["ResolveVersions"] = True
+        closure = DependencyResolver(self.config_obj).bfs()
+        # A 2.0 needs a C that D2 does not accept: the diamond resolves to A 1.0 and a single C
+        self.assertEqual(["A/1.0", "C/1.5", "D1/1.0", "D2/1.0", "D3/1.0"], sorted(p["Name"] + "/" + p["Version"] for p in closure))
+        self.assertEqual({"A": "1.0", "C": "1.5", "D1": "1.0", "D2": "1.0", "D3": "1.0"}, installer.pins)
+        self.assertEqual(["C", "A", "D1", "D3", "D2"], installer.invocations)
+
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def test_exception_on_version_conflict(self, mock_package_downloader, mock_package_installers):
+        downloader = MockPackageDownloader()
+        downloader.metadata = {
+            "D1": [{"Name": "C", "Version": "1.0"}],
+            "D2": [{"Name": "C", "Version": "2.0"}]
+        }
+        mock_package_downloader.side_effect = [downloader]
+        mock_package_installers.side_effect = [MockPackageInstaller(downloader.metadata)]
+        self.config_obj["ResolveVersions"] = True
+        self.assertRaises(DependencyResolverException, DependencyResolver(self.config_obj).bfs)
+        # Nothing is downloaded for an unsolvable graph
+        self.assertEqual([], downloader.invocations)
+
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def test_exception_on_two_versions(self, mock_package_downloader, mock_package_installers):
+        installer = MockPackageInstaller({
+            "D1": [{"Name": "C", "Version": "1.0"}],
+            "D2": [{"Name": "C", "Version": "2.0"}]
+        })
+        mock_package_downloader.side_effect = [MockPackageDownloader()]
+        mock_package_installers.side_effect = [installer]
+        self.assertRaises(DependencyResolverException, DependencyResolver(self.config_obj).bfs)
+        # Neither C is installed over the other
+        self.assertEqual([], installer.invocations)
+
+    @patch("modules.bootstrap.DependencyResolver.PackageInstaller", autospec=True)
+    @patch("modules.bootstrap.DependencyResolver.PackageDownloader", autospec=True)
+    def run_locked(self, config_obj, digests, mock_package_downloader, mock_package_installers):
+        downloader = MockPackageDownloader()
+        downloader.digests = digests
+        installer = MockPackageInstaller({
+            "D1": [{"Name": "A", "Version": "1.0"}],
+            "D3": [{"Name": "B", "Version": "2.0"}],
+            "A": [{"Name": "C", "Version": "3.0"}]
+        })
+        mock_package_downloader.side_effect = [downloader]
+        mock_package_installers.side_effect = [installer]
+        closure = DependencyResolver(config_obj).bfs()
+        return sorted(p["Name"] for p in closure), [[p["Name"] for p in level] for level in downloader.invocations], installer.invocations
+
+    def test_lock_file(self):
+        with tempfile.TemporaryDirectory() as root:
+            config_obj = dict(self.config_obj)
+            config_obj["ProjectRoot"] = root
+            config_obj["LocalPackageCache"] = os.path.join(root, ".packagecache")
+            config_obj["UseLockFile"] = True
+            os.makedirs(config_obj["LocalPackageCache"])
+
+            closure, downloads, installs = self.run_locked(config_obj, {})
+            self.assertEqual(["A", "B", "C", "D1", "D2", "D3"], closure)
+            with open(os.path.join(root, "bob.lock"), "r") as fp:
+                lock = json.load(fp)
+            self.assertEqual(
+                [("D1", 0), ("D2", 0), ("D3", 0), ("A", 1), ("B", 1), ("C", 2)],
+                [(entry["Name"], entry["Level"]) for entry in lock["Packages"]])
+            self.assertEqual("sha-A", lock["Packages"][3]["Sha256"])
+            self.assertEqual([{"Name": "C", "Version": "3.0"}], lock["Packages"][3]["Dependencies"])
+
+            # Unchanged: nothing is fetched or installed
+            closure, downloads, installs = self.run_locked(config_obj, {})
+            self.assertEqual(["A", "B", "C", "D1", "D2", "D3"], closure)
+            self.assertEqual(([], []), (downloads, installs))
+
+            # A damaged package is fetched and installed again
+            closure, downloads, installs = self.run_locked(config_obj, {"B": None})
+            self.assertEqual(([["B"]], ["B"]), (downloads, installs))
+
+            # Changed: D3 (and B with it) is removed, D4 is added. Only D4 is resolved.
+            config_obj["RuntimeDeps"] = [{"Name": "D4", "Version": "1.0"}]
+            closure, downloads, installs = self.run_locked(config_obj, {})
+            self.assertEqual(["A", "C", "D1", "D2", "D4"], closure)
+            self.assertEqual(([["D4"]], ["D4"]), (downloads, installs))
+            with open(os.path.join(root, "bob.lock"), "r") as fp:
+                lock = json.load(fp)
+            self.assertEqual(
+                [("D1", 0), ("D2", 0), ("A", 1), ("C", 2), ("D4", 3)],
+                [(entry["Name"], entry["Level"]) for entry in lock["Packages"]])
+
+            # A missing local cache is installed again, dependencies first
+            shutil.rmtree(config_obj["LocalPackageCache"])
+            closure, downloads, installs = self.run_locked(config_obj, {})
+            self.assertEqual(([], ["C", "A", "D1", "D2", "D4"]), (downloads, installs))
+
+    def test_lock_file_mismatch(self):
+        with tempfile.TemporaryDirectory() as root:
+            config_obj = dict(self.config_obj)
+            config_obj["ProjectRoot"] = root
+            config_obj["UseLockFile"] = True
+            self.run_locked(config_obj, {})
+            with open(os.path.join(root, "bob.lock"), "r") as fp:
+                lock = json.load(fp)
+            lock["Packages"][0]["Sha256"] = "changed"
+            with open(os.path.join(root, "bob.lock"), "w") as fp:
+                json.dump(lock, fp)
+            self.assertRaises(DependencyResolverException, self.run_locked, config_obj, {})
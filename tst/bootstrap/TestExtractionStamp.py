@@ -0,0 +1,66 @@
+import unittest
+import os
+import json
+import tempfile
+
+from unittest.mock import patch
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+
+
+class TestExtractionStamp (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.folder = self.temp_dir.name
+        self.archive = os.path.join(self.folder, "A.tar")
+        self.write(self.archive, b"archive")
+        self.write(os.path.join(self.folder, "include", "a.h"), b"a")
+        self.stamp = ExtractionStamp(self.archive, self.folder)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(data)
+
+    def test_no_stamp(self):
+        self.assertFalse(self.stamp.matches())
+
+    def test_matches_after_write(self):
+        self.assertTrue(self.stamp.write(["include", "./include/a.h"]))
+        self.assertTrue(self.stamp.matches())
+        with open(os.path.join(self.folder, ExtractionStamp.FILE_NAME)) as fp:
+            self.assertEqual(["include", "include/a.h"], json.load(fp)["Members"])
+
+    def test_missing_member(self):
+        self.stamp.write(["include/a.h"])
+        os.remove(os.path.join(self.folder, "include", "a.h"))
+        self.assertFalse(self.stamp.matches())
+
+    def test_changed_archive(self):
+        self.stamp.write(["include/a.h"])
+        self.write(self.archive, b"other archive")
+        self.assertFalse(self.stamp.matches())
+        self.write(self.archive, b"ARCHIVE")
+        self.assertFalse(self.stamp.matches())
+
+    def test_same_content_new_mtime(self):
+        self.stamp.write(["include/a.h"])
+        os.utime(self.archive, ns=(0, 12345))
+        self.assertTrue(self.stamp.matches())
+        with patch("modules.bootstrap.BlobStore.BlobStore.hash_file", side_effect=AssertionError("hashed again")):
+            self.assertTrue(self.stamp.matches())
+
+    def test_clear(self):
+        self.stamp.write(["include/a.h"])
+        self.stamp.clear()
+        self.stamp.clear()
+        self.assertFalse(self.stamp.matches())
+
+    def test_corrupt_stamp(self):
+        self.write(os.path.join(self.folder, ExtractionStamp.FILE_NAME), b"{not json")
+        self.assertFalse(self.stamp.matches())
+
+    def test_write_without_archive(self):
+        self.assertFalse(ExtractionStamp(os.path.join(self.folder, "missing.tar"), self.folder).write([]))
@@ -0,0 +1,313 @@
+import unittest
+import os
+import tempfile
+import socket
+import threading
+import json
+import base64
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+from modules.bootstrap.HttpDownloader import HttpDownloaderException, HttpDownloader
+
+
+class FileHandler (BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append((self.path, self.headers.get("Authorization"), self.headers.get("Proxy-Authorization")))
+        if self.path.startswith("http://"):
+            # Sent through the proxy
+            self.path = "/" + self.path.split("/", 3)[3]
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/A/1.0/A.tar")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path not in self.server.files:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.files[self.path]
+        etag = "\"" + str(len(body)) + "\""
+        self.server.ranges.append(self.headers.get("Range"))
+        if self.headers.get("Range") is not None and self.headers.get("If-Range", etag) == etag and self.server.ranges_supported:
+            start, _, end = self.headers.get("Range")[len("bytes="):].partition("-")
+            start = int(start)
+            end = len(body) - 1 if end == "" else min(int(end), len(body) - 1)
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes " + str(start) + "-" + str(end) + "/" + str(len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.server.connections.add(self.client_address)
+        if self.path.startswith("/private/"):
+            self.send_response(403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200 if self.path in self.server.files else 404)
+        body = self.server.files.get(self.path, b"")
+        if self.path in self.server.files:
+            self.send_header("ETag", "\"" + str(len(body)) + "\"")
+        if self.server.ranges_supported:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class TestHttpDownloader (unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+        self.server.files = {
+            "/A/1.0/A.tar": b"A" * 100000,
+            "/B/2.0/B.tar": b"B" * 10
+        }
+        self.server.connections = set()
+        self.server.ranges = []
+        self.server.ranges_supported = True
+        self.server.requests = []
+        # The tests talk to the local server directly, whatever the proxies of the environment
+        self.environment = patch.dict(os.environ, {"no_proxy": "127.0.0.1", "NO_PROXY": "127.0.0.1"})
+        self.environment.start()
+        self.addCleanup(self.environment.stop)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = HttpDownloader(max_connections_per_host=2, timeout=10)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def test_download_happy_case(self):
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        size = self.downloader.download(self.base_url + "/A/1.0/A.tar", dest)
+        self.assertEqual(100000, size)
+        with open(dest, "rb") as fp:
+            self.assertEqual(self.server.files["/A/1.0/A.tar"], fp.read())
+
+    def test_connection_is_reused(self):
+        for _ in range(5):
+            self.downloader.download(self.base_url + "/B/2.0/B.tar", os.path.join(self.temp_dir.name, "B.tar"))
+        self.downloader.download(self.base_url + "/A/1.0/A.tar", os.path.join(self.temp_dir.name, "A.tar"))
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_follows_redirects(self):
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.assertEqual(100000, self.downloader.download(self.base_url + "/moved", dest))
+
+    def test_exception_on_missing_file(self):
+        dest = os.path.join(self.temp_dir.name, "C.tar")
+        self.assertRaises(HttpDownloaderException, self.downloader.download, self.base_url + "/C/1.0/C.tar", dest)
+
+    def test_exception_on_unreachable_host(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            closed_port = s.getsockname()[1]
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.assertRaises(HttpDownloaderException, self.downloader.download, "http://127.0.0.1:" + str(closed_port) + "/A/1.0/A.tar", dest)
+
+    def test_per_host_cap(self):
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+        original_send = self.downloader.send
+
+        def counting_send(connection, method, url, headers):
+            with lock:
+                in_flight.append(None)
+                peak.append(len(in_flight))
+            try:
+                return original_send(connection, method, url, headers)
+            finally:
+                with lock:
+                    in_flight.pop()
+
+        self.downloader.send = counting_send
+        threads = [
+            threading.Thread(target=self.downloader.download, args=(self.base_url + "/A/1.0/A.tar", os.path.join(self.temp_dir.name, "A" + str(i) + ".tar")))
+            for i in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(max(peak), 2)
+        self.assertLessEqual(len(self.server.connections), 2)
+
+    def test_invalid_scheme(self):
+        self.assertRaises(HttpDownloaderException, HttpDownloader.host_key, "ftp://host/file")
+        self.assertRaises(HttpDownloaderException, HttpDownloader, 0)
+
+    def write_partial(self, dest, url, data, validator):
+        with open(dest + ".partial", "wb") as fp:
+            fp.write(data)
+        with open(dest + ".partial.json", "w") as fp:
+            json.dump({"Source": url, "Validator": validator, "Length": 100000}, fp)
+
+    def test_resumes_partial_download(self):
+        url = self.base_url + "/A/1.0/A.tar"
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.write_partial(dest, url, b"A" * 40000, "\"100000\"")
+        self.assertEqual(100000, self.downloader.download(url, dest))
+        self.assertEqual(["bytes=40000-"], self.server.ranges)
+        with open(dest, "rb") as fp:
+            self.assertEqual(self.server.files["/A/1.0/A.tar"], fp.read())
+        self.assertFalse(os.path.exists(dest + ".partial"))
+        self.assertFalse(os.path.exists(dest + ".partial.json"))
+
+    def test_restarts_when_remote_changed(self):
+        url = self.base_url + "/A/1.0/A.tar"
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.write_partial(dest, url, b"Z" * 40000, "\"old\"")
+        self.assertEqual(100000, self.downloader.download(url, dest))
+        with open(dest, "rb") as fp:
+            self.assertEqual(self.server.files["/A/1.0/A.tar"], fp.read())
+
+    def test_restarts_after_unsatisfiable_range(self):
+        # The remote object shrank below the partial file, with a single connection to the host
+        self.server.files["/A/1.0/A.tar"] = b"N" * 30000
+        url = self.base_url + "/A/1.0/A.tar"
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.write_partial(dest, url, b"N" * 40000, "\"30000\"")
+        downloader = HttpDownloader(max_connections_per_host=1, timeout=10)
+        try:
+            self.assertEqual(30000, downloader.download(url, dest))
+        finally:
+            downloader.close()
+        self.assertEqual(["bytes=40000-", None], self.server.ranges)
+        with open(dest, "rb") as fp:
+            self.assertEqual(b"N" * 30000, fp.read())
+
+    def test_partial_of_other_source_is_ignored(self):
+        url = self.base_url + "/A/1.0/A.tar"
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.write_partial(dest, self.base_url + "/B/2.0/B.tar", b"Z" * 40000, "\"100000\"")
+        self.assertEqual(100000, self.downloader.download(url, dest))
+        self.assertEqual([None], self.server.ranges)
+
+    def test_failed_download_leaves_no_file(self):
+        dest = os.path.join(self.temp_dir.name, "C.tar")
+        self.assertRaises(HttpDownloaderException, self.downloader.download, self.base_url + "/C/1.0/C.tar", dest)
+        self.assertFalse(os.path.exists(dest))
+
+    def test_stream(self):
+        self.assertEqual(100000, self.downloader.stream(self.base_url + "/A/1.0/A.tar", lambda body: len(body.read())))
+        self.assertEqual(10, self.downloader.stream(self.base_url + "/B/2.0/B.tar", lambda body: len(body.read())))
+        self.assertEqual(1, len(self.server.connections))
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+        with self.assertRaises(HttpDownloaderException):
+            self.downloader.stream(self.base_url + "/missing", lambda body: body.read())
+
+    def test_read_range(self):
+        self.server.files["/C/1.0/C.tar"] = bytes(range(256)) * 4
+        url = self.base_url + "/C/1.0/C.tar"
+        self.assertEqual(bytes(range(10, 20)), self.downloader.read_range(url, 10, 19))
+        self.assertEqual(bytes(range(250, 256)), self.downloader.read_range(url, 1018, 2000))
+        self.assertEqual(b"", self.downloader.read_range(url, 5000, 6000))
+        self.assertEqual(1, len(self.server.connections))
+        with self.assertRaises(HttpDownloaderException):
+            self.downloader.read_range(self.base_url + "/missing", 0, 10)
+
+    def test_read_range_not_supported(self):
+        self.server.ranges_supported = False
+        self.assertIsNone(self.downloader.read_range(self.base_url + "/A/1.0/A.tar", 0, 10))
+        # The unread body is not left on a pooled connection
+        self.assertEqual(10, self.downloader.stream(self.base_url + "/B/2.0/B.tar", lambda body: len(body.read())))
+
+    def test_download_segmented(self):
+        data = bytes(range(256)) * 1000
+        self.server.files["/m1/C.tar"] = data
+        self.server.files["/m2/C.tar"] = data
+        urls = [self.base_url + "/m1/C.tar", self.base_url + "/m2/C.tar", self.base_url + "/m3/C.tar"]
+        dest = os.path.join(self.temp_dir.name, "C.tar")
+        self.assertEqual(len(data), self.downloader.download_segmented(urls, dest, 10000))
+        with open(dest, "rb") as fp:
+            self.assertEqual(data, fp.read())
+        # Every part was fetched with a ranged GET, the missing mirror was dropped
+        self.assertEqual(26, len([r for r in self.server.ranges if r is not None and r.endswith(tuple("0123456789"))]))
+        self.assertEqual(["C.tar"], os.listdir(self.temp_dir.name))
+
+    def test_download_segmented_failure(self):
+        urls = [self.base_url + "/m3/C.tar", self.base_url + "/m4/C.tar"]
+        dest = os.path.join(self.temp_dir.name, "C.tar")
+        self.assertRaises(HttpDownloaderException, self.downloader.download_segmented, urls, dest, 100)
+        self.assertFalse(os.path.exists(dest))
+
+    def test_download_segmented_not_worth_it(self):
+        self.server.files["/m1/C.tar"] = b"C" * 1000
+        self.server.files["/m2/C.tar"] = b"C" * 1000
+        self.server.files["/m3/C.tar"] = b"C" * 999
+        urls = [self.base_url + "/m1/C.tar", self.base_url + "/m2/C.tar"]
+        dest = os.path.join(self.temp_dir.name, "C.tar")
+        # The package fits in a part
+        self.assertIsNone(self.downloader.download_segmented(urls, dest, 1000))
+        # The mirrors do not agree on the package
+        self.assertIsNone(self.downloader.download_segmented([urls[0], self.base_url + "/m3/C.tar"], dest, 100))
+        # The mirrors do not support Range requests
+        self.server.ranges_supported = False
+        self.assertIsNone(self.downloader.download_segmented(urls, dest, 100))
+        self.assertEqual([], [r for r in self.server.ranges if r is not None])
+        self.assertFalse(os.path.exists(dest))
+
+    def test_url_credentials(self):
+        self.assertEqual(10, self.downloader.stream(self.base_url.replace("://", "://me:p%40ss@") + "/B/2.0/B.tar", lambda body: len(body.read())))
+        self.assertEqual([("/B/2.0/B.tar", "Basic " + base64.b64encode(b"me:p@ss").decode("ascii"), None)], self.server.requests)
+
+    def test_http_proxy(self):
+        proxy = self.base_url.replace("://", "://me:secret@")
+        with patch.dict(os.environ, {"http_proxy": proxy, "no_proxy": "", "NO_PROXY": ""}):
+            downloader = HttpDownloader(timeout=10)
+            try:
+                # The server plays the proxy of example.com
+                self.assertEqual(10, downloader.stream("http://example.com/B/2.0/B.tar", lambda body: len(body.read())))
+            finally:
+                downloader.close()
+        self.assertEqual([("http://example.com/B/2.0/B.tar", None, "Basic " + base64.b64encode(b"me:secret").decode("ascii"))], self.server.requests)
+
+    def test_unsupported_proxy_releases_slot(self):
+        with patch.dict(os.environ, {"http_proxy": "ftp://bad:21", "no_proxy": "", "NO_PROXY": ""}):
+            downloader = HttpDownloader(max_connections_per_host=1, timeout=10)
+            try:
+                for _ in range(3):
+                    with self.assertRaises(HttpDownloaderException):
+                        downloader.exists("http://example.com/B/2.0/B.tar")
+            finally:
+                downloader.close()
+
+    def test_https_proxy(self):
+        with patch.dict(os.environ, {"https_proxy": "proxy.local:3128", "no_proxy": "internal.example.com", "NO_PROXY": ""}):
+            downloader = HttpDownloader()
+            connection = downloader.new_connection(("https", "example.com", 443))
+            self.assertEqual(("proxy.local", 3128), (connection.host, connection.port))
+            self.assertEqual(("example.com", 443), (connection._tunnel_host, connection._tunnel_port))
+            connection = downloader.new_connection(("https", "internal.example.com", 443))
+            self.assertEqual(("internal.example.com", 443), (connection.host, connection.port))
+
+    def test_exists(self):
+        self.assertTrue(self.downloader.exists(self.base_url + "/A/1.0/A.tar"))
+        self.assertFalse(self.downloader.exists(self.base_url + "/A/1.0/A.tar.zst"))
+        self.assertFalse(self.downloader.exists(self.base_url + "/private/A/1.0/A.tar.zst"))
+        self.assertTrue(self.downloader.exists(self.base_url + "/B/2.0/B.tar"))
+        self.assertEqual(1, len(self.server.connections))
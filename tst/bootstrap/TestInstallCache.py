@@ -0,0 +1,93 @@
+import unittest
+import os
+import stat
+import tempfile
+
+from unittest.mock import patch
+from modules.bootstrap.InstallCache import InstallCacheException, InstallCache
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+
+
+class TestInstallCache (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.global_cache = os.path.join(self.temp_dir.name, "global")
+        self.prefix = os.path.join(self.temp_dir.name, "local")
+        os.makedirs(os.path.join(self.global_cache, "A", "1.0"))
+        ExtractionStamp(os.path.join(self.global_cache, "A", "1.0", "A.tar"), os.path.join(self.global_cache, "A", "1.0")).write(["md.json"], "A_DIGEST", 10)
+        self.fingerprint = {"CC": "cc 1.0", "CXX": "c++ 1.0", "CMake": "cmake 3.0", "Flags": {}}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_tree(self, root):
+        os.makedirs(os.path.join(root, "lib"))
+        os.makedirs(os.path.join(root, "include"))
+        with open(os.path.join(root, "lib", "libA.so.1"), "wb") as fp:
+            fp.write(b"LIBRARY")
+        os.chmod(os.path.join(root, "lib", "libA.so.1"), 0o755)
+        os.symlink("libA.so.1", os.path.join(root, "lib", "libA.so"))
+        with open(os.path.join(root, "include", "a.h"), "w") as fp:
+            fp.write("int a();")
+        return root
+
+    def test_invalid_restore_mode(self):
+        self.assertRaises(InstallCacheException, InstallCache, self.global_cache, "symlink")
+
+    def test_key(self):
+        cache = InstallCache(self.global_cache)
+        with patch.object(InstallCache, "fingerprint", return_value=self.fingerprint):
+            key = cache.key("A", "1.0", None, self.prefix, ["B_KEY", "C_KEY"])
+            self.assertEqual(key, cache.key("A", "1.0", None, self.prefix, ["C_KEY", "B_KEY"]))
+            self.assertNotEqual(key, cache.key("A", "1.0", None, self.prefix, ["B_KEY", "C_KEY2"]))
+            self.assertNotEqual(key, cache.key("A", "1.0", "Release", self.prefix, ["B_KEY", "C_KEY"]))
+            self.assertNotEqual(key, cache.key("A", "1.0", None, self.prefix + "2", ["B_KEY", "C_KEY"]))
+        with patch.object(InstallCache, "fingerprint", return_value=dict(self.fingerprint, CC="cc 2.0")):
+            self.assertNotEqual(key, cache.key("A", "1.0", None, self.prefix, ["B_KEY", "C_KEY"]))
+        ExtractionStamp(os.path.join(self.global_cache, "A", "1.0", "A.tar"), os.path.join(self.global_cache, "A", "1.0")).write(["md.json"], "A_DIGEST2", 10)
+        with patch.object(InstallCache, "fingerprint", return_value=self.fingerprint):
+            self.assertNotEqual(key, cache.key("A", "1.0", None, self.prefix, ["B_KEY", "C_KEY"]))
+
+    def test_fingerprint_computed_once(self):
+        cache = InstallCache(self.global_cache)
+        with patch.object(InstallCache, "tool_version", return_value="1.0") as mock_version:
+            first = cache.fingerprint()
+            self.assertEqual(first, cache.fingerprint())
+            self.assertEqual(mock_version.call_count, 3)
+
+    def test_store_and_restore(self):
+        cache = InstallCache(self.global_cache)
+        self.assertIsNone(cache.lookup("A", "1.0", "KEY"))
+        staged = self.make_tree(os.path.join(self.temp_dir.name, "staging", "local"))
+        tree = cache.store("A", "1.0", "KEY", staged)
+        self.assertFalse(os.path.exists(staged))
+        self.assertEqual(cache.lookup("A", "1.0", "KEY"), tree)
+        self.assertTrue(tree.startswith(os.path.join(self.global_cache, InstallCache.FOLDER, "A", "1.0")))
+
+        os.makedirs(os.path.join(self.prefix, "lib"))
+        with open(os.path.join(self.prefix, "lib", "libA.so.1"), "w") as fp:
+            fp.write("OLD")
+        self.assertEqual(cache.restore(tree, self.prefix), 3)
+        with open(os.path.join(self.prefix, "lib", "libA.so.1"), "rb") as fp:
+            self.assertEqual(fp.read(), b"LIBRARY")
+        self.assertEqual(os.readlink(os.path.join(self.prefix, "lib", "libA.so")), "libA.so.1")
+        self.assertTrue(os.stat(os.path.join(self.prefix, "lib", "libA.so.1")).st_mode & stat.S_IXUSR)
+        self.assertNotEqual(os.stat(os.path.join(self.prefix, "include", "a.h")).st_ino,
+                            os.stat(os.path.join(tree, "include", "a.h")).st_ino)
+
+    def test_store_and_restore_hardlinks(self):
+        cache = InstallCache(self.global_cache, "hardlink")
+        tree = cache.store("A", "1.0", "KEY", self.make_tree(os.path.join(self.temp_dir.name, "staging", "local")))
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(tree, "include", "a.h")).st_mode) & stat.S_IWUSR, 0)
+        self.assertEqual(cache.restore(tree, self.prefix), 3)
+        self.assertEqual(os.stat(os.path.join(self.prefix, "include", "a.h")).st_ino,
+                         os.stat(os.path.join(tree, "include", "a.h")).st_ino)
+        # Restoring again replaces the links
+        self.assertEqual(cache.restore(tree, self.prefix), 3)
+
+    def test_store_empty_install(self):
+        cache = InstallCache(self.global_cache)
+        tree = cache.store("A", "1.0", "KEY", os.path.join(self.temp_dir.name, "missing"))
+        self.assertEqual(cache.lookup("A", "1.0", "KEY"), tree)
+        self.assertEqual(cache.restore(tree, self.prefix), 0)
+        self.assertTrue(os.path.isdir(self.prefix))
@@ -0,0 +1,74 @@
+import unittest
+import os
+import json
+import tempfile
+
+from modules.bootstrap.InstallReceipts import InstallReceiptsException, InstallReceipts
+
+
+class TestInstallReceipts (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.local_cache = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def install(self, files):
+        for path in files:
+            path = os.path.join(self.local_cache, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fp:
+                fp.write(path)
+        return files
+
+    def test_installed(self):
+        receipts = InstallReceipts(self.local_cache)
+        self.assertFalse(receipts.installed("A", "1.0", "KEY"))
+        receipts.record("A", "1.0", "KEY", self.install(["lib/libA.a", "include/a.h"]))
+        # The receipts are read back by the next bootstrap
+        receipts = InstallReceipts(self.local_cache)
+        self.assertTrue(receipts.installed("A", "1.0", "KEY"))
+        self.assertFalse(receipts.installed("A", "2.0", "KEY"))
+        self.assertFalse(receipts.installed("A", "1.0", "OTHER_KEY"))
+        os.remove(os.path.join(self.local_cache, "include", "a.h"))
+        self.assertFalse(receipts.installed("A", "1.0", "KEY"))
+
+    def test_invalid_receipts(self):
+        with open(os.path.join(self.local_cache, InstallReceipts.FILE_NAME), "w") as fp:
+            fp.write("{")
+        self.assertEqual({}, InstallReceipts(self.local_cache).load())
+        with open(os.path.join(self.local_cache, InstallReceipts.FILE_NAME), "w") as fp:
+            json.dump({"Version": InstallReceipts.VERSION, "Packages": {"A": {"Version": "1.0"}, "B": {"Version": "1.0", "Key": "KEY", "Files": []}}}, fp)
+        self.assertEqual(["B"], list(InstallReceipts(self.local_cache).load()))
+
+    def test_uninstall(self):
+        receipts = InstallReceipts(self.local_cache)
+        receipts.record("A", "1.0", "KEY", self.install(["lib/libA.a", "include/a/a.h", "include/shared.h"]))
+        receipts.record("B", "1.0", "KEY", self.install(["lib/libB.a", "include/shared.h"]))
+        self.assertEqual(0, receipts.uninstall("C"))
+        self.assertEqual(2, receipts.uninstall("A"))
+        # The files of B are kept, and the folders left empty are removed
+        self.assertEqual(["B"], list(InstallReceipts(self.local_cache).load()))
+        self.assertEqual(["libB.a"], os.listdir(os.path.join(self.local_cache, "lib")))
+        self.assertEqual(["shared.h"], os.listdir(os.path.join(self.local_cache, "include")))
+        self.assertTrue(receipts.installed("B", "1.0", "KEY"))
+
+    def test_write_error(self):
+        receipts = InstallReceipts(os.path.join(self.local_cache, "absent"))
+        self.assertRaises(InstallReceiptsException, receipts.record, "A", "1.0", "KEY", [])
+
+    def test_tree_files(self):
+        self.install(["lib/libA.so.1", "include/a/a.h"])
+        os.symlink("libA.so.1", os.path.join(self.local_cache, "lib", "libA.so"))
+        os.symlink("a", os.path.join(self.local_cache, "include", "alias"))
+        self.assertEqual(["include/a/a.h", "include/alias", "lib/libA.so", "lib/libA.so.1"], sorted(InstallReceipts.tree_files(self.local_cache)))
+
+    def test_manifest_files(self):
+        build_folder = os.path.join(self.local_cache, "build")
+        prefix = os.path.join(self.local_cache, "prefix")
+        os.makedirs(build_folder)
+        self.assertEqual([], InstallReceipts.manifest_files(build_folder, prefix))
+        with open(os.path.join(build_folder, InstallReceipts.INSTALL_MANIFEST), "w") as fp:
+            fp.write(prefix + "/lib/libA.a\n" + prefix + "/include/a.h\n/usr/share/a.txt\n")
+        self.assertEqual(["lib/libA.a", "include/a.h"], InstallReceipts.manifest_files(build_folder, prefix))
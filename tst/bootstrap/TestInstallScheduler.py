@@ -0,0 +1,82 @@
+import unittest
+import threading
+
+from tst.testutils.Mocks import MockLog
+from modules.bootstrap.InstallScheduler import InstallSchedulerException, InstallScheduler
+from modules.bootstrap.PackageInstaller import PackageInstallerException
+
+
+class RecordingInstaller:
+    def __init__(self, fails=None, barrier=None):
+        self.fails = fails
+        self.barrier = barrier
+        self.installed = []
+        self.lock = threading.Lock()
+
+    def install_a_package(self, package_name, package_version):
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        if package_name == self.fails:
+            raise PackageInstallerException("Make failed on package " + package_name)
+        with self.lock:
+            self.installed.append(package_name)
+
+
+class TestInstallScheduler (unittest.TestCase):
+    def setUp(self):
+        self.dependencies = {
+            "App": ["Net", "Log"],
+            "Net": ["Ssl", "Zlib"],
+            "Ssl": ["Zlib"],
+            "Log": [],
+            "Zlib": []
+        }
+        self.packages = [{"Name": name, "Version": "1.0"} for name in ["App", "Log", "Net", "Ssl", "Zlib"]]
+
+    def dependencies_of(self, package):
+        return [{"Name": name, "Version": "1.0"} for name in self.dependencies.get(package["Name"], [])]
+
+    def test_invalid_concurrency(self):
+        for concurrency in [0, -1, "4", True]:
+            self.assertRaises(InstallSchedulerException, InstallScheduler, RecordingInstaller(), MockLog(), concurrency)
+
+    def test_dependencies_first(self):
+        installer = RecordingInstaller()
+        installed = InstallScheduler(installer, MockLog(), 1).install(self.packages, self.dependencies_of)
+        # Log is ready from the start, but Zlib heads the longest chain
+        self.assertEqual(["Zlib", "Ssl", "Log", "Net", "App"], installer.installed)
+        self.assertEqual(installer.installed, [p["Name"] for p in installed])
+
+    def test_dependencies_first_concurrently(self):
+        installer = RecordingInstaller()
+        InstallScheduler(installer, MockLog(), 4).install(self.packages, self.dependencies_of)
+        self.assertEqual(sorted(installer.installed), sorted(self.dependencies))
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                self.assertLess(installer.installed.index(dep), installer.installed.index(name))
+
+    def test_independent_packages_run_concurrently(self):
+        # Both installs have to be running at the same time to get through the barrier
+        installer = RecordingInstaller(barrier=threading.Barrier(2))
+        packages = [{"Name": "Log", "Version": "1.0"}, {"Name": "Zlib", "Version": "1.0"}]
+        InstallScheduler(installer, MockLog(), 2).install(packages, self.dependencies_of)
+        self.assertEqual(["Log", "Zlib"], sorted(installer.installed))
+
+    def test_dependencies_outside_the_set(self):
+        installer = RecordingInstaller()
+        packages = [{"Name": "App", "Version": "1.0"}, {"Name": "Log", "Version": "1.0"}]
+        InstallScheduler(installer, MockLog(), 1).install(packages, self.dependencies_of)
+        self.assertEqual(["Log", "App"], installer.installed)
+
+    def test_cycle(self):
+        self.dependencies = {"A": ["B"], "B": ["A"], "C": ["A"]}
+        packages = [{"Name": name, "Version": "1.0"} for name in ["C", "B", "A"]]
+        installer = RecordingInstaller()
+        InstallScheduler(installer, MockLog(), 2).install(packages, self.dependencies_of)
+        self.assertEqual(["B", "A", "C"], installer.installed)
+
+    def test_fail_fast(self):
+        installer = RecordingInstaller(fails="Ssl")
+        self.assertRaises(PackageInstallerException, InstallScheduler(installer, MockLog(), 1).install, self.packages, self.dependencies_of)
+        # Nothing is started after the failure, not even Log that does not depend on Ssl
+        self.assertEqual(["Zlib"], installer.installed)
@@ -0,0 +1,58 @@
+import unittest
+import os
+import json
+import tempfile
+
+from modules.bootstrap.LockFile import LockFileException, LockFile
+
+
+class TestLockFile (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.lock_file = LockFile(self.temp_dir.name)
+        self.entries = [
+            {"Name": "B", "Version": "2.0", "Level": 1, "Sha256": "sha-B", "Dependencies": []},
+            {"Name": "A", "Version": "1.0", "Level": 0, "Sha256": "sha-A", "Dependencies": [{"Name": "B", "Version": "2.0"}]},
+            {"Name": "C", "Version": "3.0", "Level": 0, "Sha256": "sha-C", "Dependencies": [], "PackageSource": {"Type": "S3", "Bucket": "b"}}
+        ]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_md_hash(self):
+        md = {"Name": "P", "Version": "1.0", "Dependencies": [{"Name": "A", "Version": "1.0"}]}
+        self.assertEqual(LockFile.md_hash(md), LockFile.md_hash(dict(md, Version="2.0", Logger=None)))
+        self.assertNotEqual(LockFile.md_hash(md), LockFile.md_hash(dict(md, TestDeps=[{"Name": "T", "Version": "1.0"}])))
+
+    def test_round_trip(self):
+        self.lock_file.write("hash", self.entries)
+        lock = self.lock_file.read()
+        self.assertEqual("hash", lock["MdHash"])
+        self.assertEqual(["A", "C", "B"], [entry["Name"] for entry in lock["Packages"]])
+        self.assertEqual({"Name": "C", "Version": "3.0", "PackageSource": {"Type": "S3", "Bucket": "b"}}, LockFile.package(lock["Packages"][1]))
+        self.assertFalse(os.path.exists(self.lock_file.path + ".tmp"))
+
+    def test_unusable_lock(self):
+        self.assertIsNone(self.lock_file.read())
+        with open(self.lock_file.path, "w") as fp:
+            fp.write("{")
+        self.assertIsNone(self.lock_file.read())
+        with open(self.lock_file.path, "w") as fp:
+            json.dump({"Version": LockFile.VERSION, "MdHash": "hash", "Packages": [{"Name": "A", "Version": "1.0"}]}, fp)
+        self.assertIsNone(self.lock_file.read())
+        with open(self.lock_file.path, "w") as fp:
+            json.dump({"Version": LockFile.VERSION + 1, "MdHash": "hash", "Packages": []}, fp)
+        self.assertIsNone(self.lock_file.read())
+
+    def test_write_fails(self):
+        lock_file = LockFile(os.path.join(self.temp_dir.name, "missing"))
+        self.assertRaises(LockFileException, lock_file.write, "hash", self.entries)
+
+    def test_locked_closure(self):
+        lock = {"Packages": self.entries}
+        locked, new_roots = LockFile.locked_closure(lock, [{"Name": "A", "Version": "1.0"}, {"Name": "D", "Version": "4.0"}])
+        self.assertEqual(["A", "B"], [entry["Name"] for entry in locked])
+        self.assertEqual([{"Name": "D", "Version": "4.0"}], new_roots)
+        # A version not in the lock is resolved again
+        locked, new_roots = LockFile.locked_closure(lock, [{"Name": "A", "Version": "1.1"}])
+        self.assertEqual(([], [{"Name": "A", "Version": "1.1"}]), (locked, new_roots))
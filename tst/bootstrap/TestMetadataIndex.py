@@ -0,0 +1,119 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from modules.bootstrap.MetadataIndex import MetadataIndex
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+
+
+class TestMetadataIndex (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.global_cache = self.temp_dir.name
+        self.deps = [{"Name": "B", "Version": "2.0"}]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def extract(self, name, version, digest):
+        folder = os.path.join(self.global_cache, name, version)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "md.json"), "w") as fp:
+            json.dump({"Dependencies": self.deps}, fp)
+        self.assertTrue(ExtractionStamp(os.path.join(folder, name + ".tar"), folder).write(["md.json"], digest, 10))
+
+    def test_record(self):
+        index = MetadataIndex(self.global_cache)
+        self.assertIsNone(index.dependencies("A", "1.0"))
+        # Packages that are not extracted are not indexed
+        index.record("A", "1.0", self.deps)
+        self.assertIsNone(index.dependencies("A", "1.0"))
+        self.extract("A", "1.0", "SHA")
+        index.record("A", "1.0", self.deps)
+        self.assertEqual(self.deps, index.dependencies("A", "1.0"))
+        self.assertTrue(index.save())
+        # The next bootstrap reads the index, and not md.json
+        os.remove(os.path.join(self.global_cache, "A", "1.0", "md.json"))
+        index = MetadataIndex(self.global_cache)
+        self.assertEqual(self.deps, index.dependencies("A", "1.0"))
+        self.assertIsNone(index.dependencies("A", "2.0"))
+
+    def test_invalidate(self):
+        self.extract("A", "1.0", "SHA")
+        index = MetadataIndex(self.global_cache)
+        index.record("A", "1.0", self.deps)
+        index.save()
+        index = MetadataIndex(self.global_cache)
+        # Extracted again from the same archive
+        index.invalidate("A", "1.0", "SHA")
+        self.assertEqual(self.deps, index.dependencies("A", "1.0"))
+        index.invalidate("A", "1.0", "OTHER_SHA")
+        self.assertIsNone(index.dependencies("A", "1.0"))
+        index.save()
+        self.assertIsNone(MetadataIndex(self.global_cache).dependencies("A", "1.0"))
+
+    def test_stale_entries_are_dropped(self):
+        self.extract("A", "1.0", "SHA")
+        self.extract("B", "1.0", "SHA")
+        index = MetadataIndex(self.global_cache)
+        index.record("A", "1.0", self.deps)
+        index.record("B", "1.0", self.deps)
+        index.save()
+        # A was extracted again from another archive, and B evicted, by other bootstraps
+        self.extract("A", "1.0", "OTHER_SHA")
+        shutil.rmtree(os.path.join(self.global_cache, "B"))
+        index = MetadataIndex(self.global_cache)
+        self.assertIsNone(index.dependencies("A", "1.0"))
+        self.assertIsNone(index.dependencies("B", "1.0"))
+        index.save()
+        self.assertEqual({}, MetadataIndex(self.global_cache).load())
+
+    def test_lookup_does_not_read_stamp(self):
+        self.extract("A", "1.0", "SHA")
+        index = MetadataIndex(self.global_cache)
+        index.record("A", "1.0", self.deps)
+        index.save()
+        index = MetadataIndex(self.global_cache)
+        index.load()
+        with patch.object(ExtractionStamp, "read") as mock_read:
+            self.assertEqual(self.deps, index.dependencies("A", "1.0"))
+            mock_read.assert_not_called()
+
+    def test_concurrent_saves(self):
+        self.extract("A", "1.0", "SHA")
+        self.extract("B", "1.0", "SHA")
+        first = MetadataIndex(self.global_cache)
+        second = MetadataIndex(self.global_cache)
+        self.assertIsNone(first.dependencies("A", "1.0"))
+        self.assertIsNone(second.dependencies("B", "1.0"))
+        first.record("A", "1.0", self.deps)
+        second.record("B", "1.0", [])
+        self.assertTrue(first.save())
+        self.assertTrue(second.save())
+        # Every bootstrap keeps what the others indexed
+        index = MetadataIndex(self.global_cache)
+        self.assertEqual(self.deps, index.dependencies("A", "1.0"))
+        self.assertEqual([], index.dependencies("B", "1.0"))
+        self.assertEqual(self.deps, second.dependencies("A", "1.0"))
+
+    def test_invalid_index(self):
+        with open(os.path.join(self.global_cache, MetadataIndex.FILE_NAME), "w") as fp:
+            fp.write("{")
+        self.assertEqual({}, MetadataIndex(self.global_cache).load())
+        with open(os.path.join(self.global_cache, MetadataIndex.FILE_NAME), "w") as fp:
+            json.dump({"Version": MetadataIndex.VERSION, "Packages": {"A/1.0": {"Sha256": "SHA"}, "B/1.0": {"Sha256": "SHA", "Stamp": [1, 2], "Dependencies": []}}}, fp)
+        self.assertEqual(["B/1.0"], list(MetadataIndex(self.global_cache).load()))
+
+    def test_write_error(self):
+        self.extract("A", "1.0", "SHA")
+        index = MetadataIndex(self.global_cache)
+        index.record("A", "1.0", self.deps)
+        index.path = os.path.join(self.global_cache, "absent", MetadataIndex.FILE_NAME)
+        self.assertFalse(index.save())
+        self.assertEqual(self.deps, index.dependencies("A", "1.0"))
+
+    def test_shared(self):
+        self.assertIs(MetadataIndex.of(self.global_cache), MetadataIndex.of(os.path.join(self.global_cache, ".")))
@@ -0,0 +1,54 @@
+import unittest
+import time
+
+from modules.bootstrap.MirrorSelector import MirrorSelectorException, MirrorSelector
+from modules.bootstrap.HttpDownloader import HttpDownloaderException
+from tst.testutils.Mocks import MockLog
+
+
+class TestMirrorSelector (unittest.TestCase):
+    def setUp(self):
+        self.source = {
+            "Type": "URL",
+            "Url": "https://far",
+            "Mirrors": ["https://near", "https://down", "https://far"]
+        }
+        self.delays = {"https://far": 0.05, "https://near": 0.0}
+        self.reads = []
+        self.selector = MirrorSelector(self.read_range, MockLog())
+
+    def read_range(self, endpoint, path, start, end):
+        self.reads.append((endpoint["Url"], path, start, end))
+        if endpoint["Url"] not in self.delays:
+            raise HttpDownloaderException("Connection refused")
+        time.sleep(self.delays[endpoint["Url"]])
+        return b"x" * (end - start + 1)
+
+    def test_endpoints(self):
+        self.assertEqual(
+            [{"Type": "URL", "Url": "https://far"}, {"Type": "URL", "Url": "https://near"}, {"Type": "URL", "Url": "https://down"}],
+            MirrorSelector.endpoints(self.source))
+        s3_source = {"Type": "S3", "Bucket": "b1", "Mirrors": "b2"}
+        self.assertEqual([{"Type": "S3", "Bucket": "b1"}, {"Type": "S3", "Bucket": "b2"}], MirrorSelector.endpoints(s3_source))
+        self.assertEqual([{"Type": "S3", "Bucket": "b1"}], MirrorSelector.endpoints({"Type": "S3", "Bucket": "b1"}))
+        self.assertRaises(MirrorSelectorException, MirrorSelector.endpoints, {"Type": "FTP", "Url": "ftp://a"})
+
+    def test_ranking(self):
+        ranking = self.selector.ranked(self.source, "A/1.0/A.tar")
+        self.assertEqual(["https://near", "https://far", "https://down"], [endpoint["Url"] for endpoint in ranking])
+        self.assertEqual(("https://far", "A/1.0/A.tar", 0, 0), self.reads[0])
+        self.assertEqual(("https://far", "A/1.0/A.tar", 0, MirrorSelector.PROBE_SIZE - 1), self.reads[1])
+        # Mirrors are probed once per run
+        reads = len(self.reads)
+        self.assertEqual(ranking, self.selector.ranked(self.source, "B/1.0/B.tar"))
+        self.assertEqual(reads, len(self.reads))
+
+    def test_demote(self):
+        ranking = self.selector.ranked(self.source, "A/1.0/A.tar")
+        self.selector.demote(self.source, ranking[0])
+        self.assertEqual(["https://far", "https://down", "https://near"], [e["Url"] for e in self.selector.ranked(self.source, "A/1.0/A.tar")])
+
+    def test_single_source_not_probed(self):
+        source = {"Type": "URL", "Url": "https://far"}
+        self.assertEqual([source], self.selector.ranked(source, "A/1.0/A.tar"))
+        self.assertEqual([], self.reads)
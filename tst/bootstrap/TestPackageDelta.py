@@ -0,0 +1,147 @@
+import unittest
+import os
+import io
+import json
+import tarfile
+import tempfile
+
+from unittest.mock import patch
+from modules.bootstrap.PackageDelta import PackageDeltaException, PackageDelta
+from modules.bootstrap.ArchiveFormat import ArchiveFormat
+
+
+class TestPackageDelta (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.library = os.urandom(200000)
+        self.base = self.make_archive("A-1.0.tar", {
+            "md.json": b"{\"Name\": \"A\", \"Version\": \"1.0\"}",
+            "include/a.h": b"int a();",
+            "include/old.h": b"int old();",
+            "lib/libA.so": self.library
+        })
+        self.new = self.make_archive("A-1.1.tar", {
+            "md.json": b"{\"Name\": \"A\", \"Version\": \"1.1\"}",
+            "include/a.h": b"int a();",
+            "include/moved.h": b"int old();",
+            "include/b.h": b"int b();",
+            "lib/libA.so": self.library[:1000] + b"fixed" + self.library[1005:]
+        }, {"lib/libA.so.1": "libA.so"})
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_archive(self, name, files, links=None):
+        path = os.path.join(self.root, name)
+        with tarfile.open(path, "w") as tfp:
+            for folder in sorted(set(os.path.dirname(member) for member in files if "/" in member)):
+                info = tarfile.TarInfo(folder)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tfp.addfile(info)
+            for member, data in sorted(files.items()):
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                info.mode = 0o755 if member.endswith(".so") else 0o644
+                tfp.addfile(info, io.BytesIO(data))
+            for member, target in sorted((links or {}).items()):
+                info = tarfile.TarInfo(member)
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                tfp.addfile(info)
+        return path
+
+    def extract(self, archive, name):
+        folder = os.path.join(self.root, name)
+        with tarfile.open(archive) as tfp:
+            tfp.extractall(path=folder)
+        return folder
+
+    def test_round_trip(self):
+        delta = os.path.join(self.root, PackageDelta.file_name("A", "1.0"))
+        manifest = PackageDelta.create(self.base, ArchiveFormat.TAR, self.new, ArchiveFormat.TAR, "1.0", delta)
+        self.assertEqual("1.0", manifest["Base"])
+        self.assertEqual(os.path.getsize(self.new), manifest["Size"])
+        self.assertEqual("include/a.h", manifest["Files"]["include/a.h"]["Base"])
+        self.assertEqual("include/old.h", manifest["Files"]["include/moved.h"]["Base"])
+        self.assertEqual("lib/libA.so", manifest["Files"]["lib/libA.so"]["Patch"])
+        self.assertNotIn("Base", manifest["Files"]["include/b.h"])
+        self.assertEqual({"lib/libA.so.1": "libA.so"}, manifest["Links"])
+        # The changed library is sent as a patch against the old one
+        self.assertLess(os.path.getsize(delta), 10000)
+
+        base_root = self.extract(self.base, "base")
+        dest = os.path.join(self.root, "rebuilt")
+        applied, members = PackageDelta.apply(delta, base_root, dest)
+        self.assertEqual(manifest, applied)
+        self.assertEqual(PackageDelta.scan(self.extract(self.new, "expected")), PackageDelta.scan(dest))
+        self.assertIn("lib/libA.so.1", members)
+        self.assertIn("include", members)
+
+    def test_without_zstandard(self):
+        delta = os.path.join(self.root, PackageDelta.file_name("A", "1.0"))
+        with patch("modules.bootstrap.ArchiveFormat.ArchiveFormat.zstandard", return_value=None):
+            manifest = PackageDelta.create(self.base, ArchiveFormat.TAR, self.new, ArchiveFormat.TAR, "1.0", delta)
+            self.assertNotIn("Patch", manifest["Files"]["lib/libA.so"])
+            dest = os.path.join(self.root, "rebuilt")
+            PackageDelta.apply(delta, self.extract(self.base, "base"), dest)
+        self.assertEqual(PackageDelta.scan(self.extract(self.new, "expected")), PackageDelta.scan(dest))
+
+    def test_damaged_base(self):
+        delta = os.path.join(self.root, PackageDelta.file_name("A", "1.0"))
+        PackageDelta.create(self.base, ArchiveFormat.TAR, self.new, ArchiveFormat.TAR, "1.0", delta)
+        base_root = self.extract(self.base, "base")
+        with open(os.path.join(base_root, "include", "a.h"), "w") as fp:
+            fp.write("changed")
+        self.assertRaises(PackageDeltaException, PackageDelta.apply, delta, base_root, os.path.join(self.root, "rebuilt"))
+        os.remove(os.path.join(base_root, "include", "a.h"))
+        self.assertRaises(PackageDeltaException, PackageDelta.apply, delta, base_root, os.path.join(self.root, "rebuilt2"))
+
+    def test_path_out_of_package(self):
+        delta = os.path.join(self.root, "evil.tar.xz")
+        manifest = {"Base": "1.0", "Sha256": "0", "Size": 1, "Files": {"../evil": {"Sha256": "0", "Mode": 420}}}
+        data = json.dumps(manifest).encode("utf-8")
+        with ArchiveFormat.writer(delta, ArchiveFormat.XZ) as tfp:
+            info = tarfile.TarInfo(PackageDelta.MANIFEST)
+            info.size = len(data)
+            tfp.addfile(info, io.BytesIO(data))
+        self.assertRaises(PackageDeltaException, PackageDelta.apply, delta, self.root, os.path.join(self.root, "rebuilt"))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "evil")))
+
+    def write_delta(self, manifest, members=None):
+        delta = os.path.join(self.root, "evil.tar.xz")
+        data = json.dumps(manifest).encode("utf-8")
+        with ArchiveFormat.writer(delta, ArchiveFormat.XZ) as tfp:
+            info = tarfile.TarInfo(PackageDelta.MANIFEST)
+            info.size = len(data)
+            tfp.addfile(info, io.BytesIO(data))
+            for info in members or []:
+                tfp.addfile(info)
+        return delta
+
+    def test_link_out_of_package(self):
+        for i, link_target in enumerate(["/etc/passwd", "../../evil", "../.."]):
+            manifest = {"Base": "1.0", "Sha256": "0", "Size": 1, "Files": {}, "Links": {"lib/link": link_target}}
+            dest = os.path.join(self.root, "rebuilt" + str(i))
+            self.assertRaises(PackageDeltaException, PackageDelta.apply, self.write_delta(manifest), self.root, dest)
+            self.assertFalse(os.path.lexists(os.path.join(dest, "lib", "link")))
+        manifest = {"Base": "1.0", "Sha256": "0", "Size": 1, "Files": {}, "Links": {"lib/link": "../include/a.h"}}
+        self.assertEqual(["lib/link"], PackageDelta.apply(self.write_delta(manifest), self.root, os.path.join(self.root, "rebuilt"))[1])
+
+    def test_payload_out_of_package(self):
+        link = tarfile.TarInfo("files/link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "/etc"
+        escape = tarfile.TarInfo("../evil")
+        manifest = {"Base": "1.0", "Sha256": "0", "Size": 1, "Files": {}}
+        for i, member in enumerate([link, escape]):
+            self.assertRaises(PackageDeltaException, PackageDelta.apply, self.write_delta(manifest, [member]), self.root, os.path.join(self.root, "rebuilt" + str(i)))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "evil")))
+
+    def test_names_and_versions(self):
+        self.assertEqual("A.delta-1.0.tar.xz", PackageDelta.file_name("A", "1.0"))
+        self.assertEqual("1.0", PackageDelta.base_version("A", "A.delta-1.0.tar.xz"))
+        self.assertIsNone(PackageDelta.base_version("A", "AB.delta-1.0.tar.xz"))
+        self.assertIsNone(PackageDelta.base_version("A", "A.tar.xz"))
+        self.assertEqual(["1.2", "1.9", "1.10", "2.0"], sorted(["1.10", "2.0", "1.9", "1.2"], key=PackageDelta.version_key))
@@ -1,10 +1,24 @@
 import unittest
 import os
-import subprocess
+import io
+import tarfile
+import tempfile
+import json
+import hashlib
+import shutil
 
 from modules.bootstrap.PackageDownloader import PackageDownloaderException, PackageDownloader
-from tst.testutils.Mocks import MockS3Client, MockLog, MockProcess, MockTarfilePointer, MockFilePointer
+from modules.bootstrap.S3Downloader import S3Downloader, S3DownloaderException
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+from modules.bootstrap.ArchiveFormat import ArchiveFormat
+from modules.bootstrap.BlobStore import BlobStore
+from modules.bootstrap.PackageDelta import PackageDelta
+from modules.bootstrap.MirrorSelector import MirrorSelector
+from modules.bootstrap.HttpDownloader import HttpDownloaderException
+from tst.testutils.S3StandIn import S3StandIn
+from tst.testutils.Mocks import MockS3Client, MockS3Downloader, MockLog, MockHttpDownloader, MockTarfilePointer, MockFilePointer
 from unittest.mock import patch, call
+from threading import Lock
 
 
 class TestPackageDownloader (unittest.TestCase):
@@ -45,17 +59,16 @@ class TestPackageDownloader (unittest.TestCase):
             }
         ]
         self.downloader = PackageDownloader(self.config_obj)
+        self.downloader.s3 = MockS3Downloader()
 
     @patch("os.path.isfile", return_value=False)
     @patch("os.path.isdir", autospec=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
-    def test_packages_downloaded_happy_case(self, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir, mock_isfile):
+    def test_packages_downloaded_happy_case(self, mock_file, mock_tarfile, mock_makedirs, mock_isdir, mock_isfile):
         # Mocks
-        wget_1 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
-        wget_2 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
+        http = MockHttpDownloader()
         tarfile_open = MockTarfilePointer()
         file_open = MockFilePointer()
 
@@ -83,7 +96,7 @@ class TestPackageDownloader (unittest.TestCase):
                 self.package_list[2]["Name"],
                 self.package_list[2]["Version"]))
         ]
-        wget_url_1 = "/".join([
+        url_1 = "/".join([
             self.config_obj["PackageSource"]["Url"],
             self.package_list[0]["Name"],
             self.package_list[0]["Version"],
@@ -96,7 +109,7 @@ class TestPackageDownloader (unittest.TestCase):
             self.package_list[0]["Name"] + ".tar"
         )
 
-        wget_url_2 = "/".join([
+        url_2 = "/".join([
             self.package_list[2]["PackageSource"]["Url"],
             self.package_list[2]["Name"],
             self.package_list[2]["Version"],
@@ -108,9 +121,9 @@ class TestPackageDownloader (unittest.TestCase):
             self.package_list[2]["Version"],
             self.package_list[2]["Name"] + ".tar"
         )
-        popen_calls = [
-            call(["wget", wget_url_1, "-O", dest_1], stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            call(["wget", wget_url_2, "-O", dest_2], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        http_calls = [
+            (url_1, dest_1),
+            (url_2, dest_2)
         ]
         s3_key = os.path.join(
             self.package_list[1]["Name"],
@@ -138,73 +151,72 @@ class TestPackageDownloader (unittest.TestCase):
         mock_isdir.side_effect = [False, False, True, False, True, False]
         mock_tarfile.side_effect = [tarfile_open, tarfile_open, tarfile_open]
         mock_file.side_effect = [file_open]
-        mock_popen.side_effect = [wget_1, wget_2]
+        self.downloader.http = http
 
         self.downloader.download_and_extract(self.package_list)
 
         mock_isdir.assert_has_calls(isdir_calls, any_order=False)
         mock_makedirs.assert_has_calls(makedirs_calls, any_order=False)
-        mock_popen.assert_has_calls(popen_calls)
-        self.assertEqual(1, len(self.downloader.s3_client.invocations))
-        self.assertEqual((self.package_list[1]["PackageSource"]["Bucket"], s3_key, file_open), self.downloader.s3_client.invocations[0])
+        self.assertEqual(http_calls, http.invocations)
+        s3_dest = os.path.join(
+            self.config_obj["GlobalPackageCache"],
+            self.package_list[1]["Name"],
+            self.package_list[1]["Version"],
+            self.package_list[1]["Name"] + ".tar"
+        )
+        self.assertEqual(1, len(self.downloader.s3.invocations))
+        self.assertEqual((self.package_list[1]["PackageSource"]["Bucket"], s3_key, s3_dest), self.downloader.s3.invocations[0])
         self.assertEqual(tarfile_opens, tarfile_open.invocations["extractall"])
 
     @patch("os.path.isfile", return_value=False)
     @patch("os.path.isdir", return_value=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
-    def test_exception_on_failed_wget(self, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir, mock_isfile):
-        wget_1 = MockProcess("ERR", "ERROR occured", TestPackageDownloader.EXIT_FAILURE)
-        wget_2 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
-        mock_popen.side_effect = [wget_1, wget_2]
+    def test_exception_on_failed_http_download(self, mock_file, mock_tarfile, mock_makedirs, mock_isdir, mock_isfile):
+        http = MockHttpDownloader(failures=[True, False])
+        self.downloader.http = http
         self.assertRaises(PackageDownloaderException, self.downloader.download_and_extract, self.package_list)
 
     @patch("os.path.isfile", return_value=True)
     @patch("os.path.isdir", return_value=False)
     @patch("os.makedirs", autospec=True)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
-    def test_exception_on_fail_create_cache(self, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir, mock_isfile):
+    def test_exception_on_fail_create_cache(self, mock_file, mock_tarfile, mock_makedirs, mock_isdir, mock_isfile):
         mock_makedirs.side_effect = OSError()
         self.assertRaises(PackageDownloaderException, self.downloader.download_and_extract, self.package_list)
 
     @patch("os.path.isfile", autospec=True)
     @patch("os.path.isdir", return_value=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
     @patch("boto3.client", return_value=MockS3Client())
-    def test_exception_on_failed_s3_download(self, mock_s3, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir, mock_isfile):
+    def test_exception_on_failed_s3_download(self, mock_s3, mock_file, mock_tarfile, mock_makedirs, mock_isdir, mock_isfile):
         # Mocks
         mock_isfile.side_effect = [True, False, True]
-        wget_1 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_FAILURE)
-        wget_2 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
         tarfile_open = MockTarfilePointer()
         file_open = MockFilePointer()
 
         mock_tarfile.side_effect = [tarfile_open, tarfile_open, tarfile_open]
         mock_file.side_effect = [file_open]
-        mock_popen.side_effect = [wget_1, wget_2]
 
         downloader = PackageDownloader(self.config_obj)
+        downloader.http = MockHttpDownloader()
 
-        downloader.s3_client.set_up_client_error()
+        downloader.s3 = MockS3Downloader()
+        downloader.s3.set_up_client_error()
         self.assertRaises(PackageDownloaderException, downloader.download_and_extract, self.package_list)
 
     @patch("os.path.isdir", return_value=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
     @patch("os.path.isfile", autospec=True)
-    def test_not_downloaded_on_existing_package(self, mock_isfile, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir):
+    def test_not_downloaded_on_existing_package(self, mock_isfile, mock_file, mock_tarfile, mock_makedirs, mock_isdir):
         # Mocks
-        wget_1 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
-        wget_2 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
+        http = MockHttpDownloader()
         tarfile_open = MockTarfilePointer()
         file_open = MockFilePointer()
 
@@ -213,7 +225,7 @@ class TestPackageDownloader (unittest.TestCase):
             call(self.config_obj["GlobalPackageCache"])
         ]
         makedirs_calls = []
-        wget_url_1 = "/".join([
+        url_1 = "/".join([
             self.config_obj["PackageSource"]["Url"],
             self.package_list[0]["Name"],
             self.package_list[0]["Version"],
@@ -226,7 +238,7 @@ class TestPackageDownloader (unittest.TestCase):
             self.package_list[0]["Name"] + ".tar"
         )
 
-        wget_url_2 = "/".join([
+        url_2 = "/".join([
             self.package_list[2]["PackageSource"]["Url"],
             self.package_list[2]["Name"],
             self.package_list[2]["Version"],
@@ -238,15 +250,10 @@ class TestPackageDownloader (unittest.TestCase):
             self.package_list[2]["Version"],
             self.package_list[2]["Name"] + ".tar"
         )
-        popen_calls = [
-            call(["wget", wget_url_1, "-O", dest_1], stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            call(["wget", wget_url_2, "-O", dest_2], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        http_calls = [
+            (url_1, dest_1),
+            (url_2, dest_2)
         ]
-        s3_key = os.path.join(
-            self.package_list[1]["Name"],
-            self.package_list[1]["Version"],
-            self.package_list[1]["Name"] + ".tar"
-        )
         tarfile_opens = [
             os.path.join(
                 self.config_obj["GlobalPackageCache"],
@@ -268,14 +275,14 @@ class TestPackageDownloader (unittest.TestCase):
         mock_isfile.side_effect = [False, True, False]
         mock_tarfile.side_effect = [tarfile_open, tarfile_open, tarfile_open]
         mock_file.side_effect = [file_open]
-        mock_popen.side_effect = [wget_1, wget_2]
+        self.downloader.http = http
 
         self.downloader.download_and_extract(self.package_list)
 
         mock_isdir.assert_has_calls(isdir_calls, any_order=False)
         mock_makedirs.assert_has_calls(makedirs_calls, any_order=False)
-        mock_popen.assert_has_calls(popen_calls)
-        self.assertEqual(0, len(self.downloader.s3_client.invocations))
+        self.assertEqual(http_calls, http.invocations)
+        self.assertEqual(0, len(self.downloader.s3.invocations))
         self.assertEqual(tarfile_opens, tarfile_open.invocations["extractall"])
 
     def test_initialization_fail(self):
@@ -313,49 +320,472 @@ class TestPackageDownloader (unittest.TestCase):
 
     @patch("os.path.isdir", return_value=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
-    def test_exception_on_failure_to_extract(self, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir):
+    def test_exception_on_failure_to_extract(self, mock_file, mock_tarfile, mock_makedirs, mock_isdir):
         # Mocks
-        wget_1 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_FAILURE)
-        wget_2 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
+        http = MockHttpDownloader(failures=[True, False])
         tarfile_open = MockTarfilePointer()
         tarfile_open.set_exception()
         file_open = MockFilePointer()
 
         mock_tarfile.side_effect = [tarfile_open, tarfile_open, tarfile_open]
         mock_file.side_effect = [file_open]
-        mock_popen.side_effect = [wget_1, wget_2]
+        self.downloader.http = http
 
         self.assertRaises(PackageDownloaderException, self.downloader.download_and_extract, self.package_list)
 
     @patch("os.path.isdir", return_value=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
-    def test_exception_on_absent_wget(self, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir):
-        mock_popen.side_effect = OSError()
+    def test_exception_on_unreachable_server(self, mock_file, mock_tarfile, mock_makedirs, mock_isdir):
+        self.downloader.http = MockHttpDownloader(failures=[True])
         self.assertRaises(PackageDownloaderException, self.downloader.download_and_extract, self.package_list)
 
     @patch("os.path.isfile", return_value=False)
     @patch("os.path.isdir", return_value=True)
     @patch("os.makedirs", return_value=None)
-    @patch("subprocess.Popen", autospec=True)
     @patch("tarfile.open", autospec=True)
     @patch("builtins.open", autospec=True)
-    def test_exception_on_extract_fail(self, mock_file, mock_tarfile, mock_popen, mock_makedirs, mock_isdir, mock_isfile):
-        wget_1 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
-        wget_2 = MockProcess("ERR", "OUT", TestPackageDownloader.EXIT_SUCCESS)
-        mock_popen.side_effect = [wget_1, wget_2]
+    def test_exception_on_extract_fail(self, mock_file, mock_tarfile, mock_makedirs, mock_isdir, mock_isfile):
+        http = MockHttpDownloader()
+        self.downloader.http = http
 
         tarfile_pointer = MockTarfilePointer()
         mock_tarfile.side_effect = [tarfile_pointer]
         tarfile_pointer.set_exception()
         self.assertRaises(PackageDownloaderException, self.downloader.download_and_extract, self.package_list)
 
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_concurrent_frontier_happy_case(self, mock_s3):
+        config_obj = dict(self.config_obj)
+        config_obj["DownloadConcurrency"] = 4
+        downloader = PackageDownloader(config_obj)
+        lock = Lock()
+        fetched = []
+
+        def fake_download(package_name, package_version, source_info, archives=None, deltas=None):
+            with lock:
+                fetched.append(package_name)
+            return downloader
+
+        with patch.object(downloader, "prep_cache", return_value=downloader), \
+                patch.object(downloader, "download_a_package_if_needed", side_effect=fake_download), \
+                patch.object(downloader, "extract_one_package", return_value=downloader):
+            downloader.download_and_extract(self.package_list)
+        self.assertEqual(["A", "B", "C"], sorted(fetched))
+
+    def test_largest_first_ordering(self):
+        package_list = [
+            {"Name": "A", "Version": "1.0", "Size": 10},
+            {"Name": "B", "Version": "1.0"},
+            {"Name": "C", "Version": "1.0", "Size": 1000}
+        ]
+        self.assertEqual(["C", "A", "B"], [p["Name"] for p in PackageDownloader.largest_first(package_list)])
 
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_concurrent_frontier_failure(self, mock_s3):
+        config_obj = dict(self.config_obj)
+        config_obj["DownloadConcurrency"] = 4
+        downloader = PackageDownloader(config_obj)
+
+        def fake_download(package_name, package_version, source_info, archives=None, deltas=None):
+            if package_name == "B":
+                raise PackageDownloaderException("CLIENT_ERROR")
+            return downloader
+
+        with patch.object(downloader, "prep_cache", return_value=downloader), \
+                patch.object(downloader, "download_a_package_if_needed", side_effect=fake_download), \
+                patch.object(downloader, "extract_one_package", return_value=downloader):
+            self.assertRaises(PackageDownloaderException, downloader.download_and_extract, self.package_list)
+
+    def test_invalid_concurrency(self):
+        config_obj = dict(self.config_obj)
+        config_obj["DownloadConcurrency"] = "many"
+        self.assertRaises(PackageDownloaderException, PackageDownloader, config_obj)
 
+    @patch("os.path.isfile", return_value=False)
+    @patch("os.path.isdir", return_value=True)
+    @patch("tarfile.open", autospec=True)
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_failed_download_is_retried(self, mock_s3, mock_tarfile, mock_isdir, mock_isfile):
+        config_obj = dict(self.config_obj)
+        config_obj["DownloadRetries"] = 2
+        downloader = PackageDownloader(config_obj)
+        downloader.http = MockHttpDownloader(failures=[True, False])
+        mock_tarfile.side_effect = [MockTarfilePointer()]
+        downloader.download_and_extract(self.package_list[:1])
+        self.assertEqual(2, len(downloader.http.invocations))
+
+    @staticmethod
+    def write_tar(path, files):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tarfile.open(path, "w") as tfp:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tfp.addfile(info, io.BytesIO(data))
+
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_deduplicated_extraction(self, mock_s3):
+        with tempfile.TemporaryDirectory() as cache:
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            config_obj["DedupPackageStore"] = True
+            TestPackageDownloader.write_tar(os.path.join(cache, "A", "1.0", "A.tar"), {"md.json": b"{}", "include/a.h": b"old"})
+            TestPackageDownloader.write_tar(os.path.join(cache, "A", "2.0", "A.tar"), {"md.json": b"{}", "include/a.h": b"new"})
+            downloader = PackageDownloader(config_obj)
+            package_list = [{"Name": "A", "Version": "1.0"}, {"Name": "A", "Version": "2.0"}]
+
+            downloader.download_and_extract(package_list)
+            downloader.download_and_extract(package_list)
+
+            md_1 = os.path.join(cache, "A", "1.0", "md.json")
+            md_2 = os.path.join(cache, "A", "2.0", "md.json")
+            self.assertEqual(os.stat(md_1).st_ino, os.stat(md_2).st_ino)
+            with open(os.path.join(cache, "A", "1.0", "include", "a.h")) as fp:
+                self.assertEqual("old", fp.read())
+            with open(os.path.join(cache, "A", "2.0", "include", "a.h")) as fp:
+                self.assertEqual("new", fp.read())
+            self.assertEqual([".access", ".extracted.json", "A.tar", "include", "md.json"], sorted(os.listdir(os.path.join(cache, "A", "1.0"))))
+
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_extraction_skipped_when_stamped(self, mock_s3):
+        with tempfile.TemporaryDirectory() as cache:
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            TestPackageDownloader.write_tar(os.path.join(cache, "A", "1.0", "A.tar"), {"md.json": b"{}", "include/a.h": b"a"})
+            downloader = PackageDownloader(config_obj)
+            downloader.extract_one_package("A", "1.0")
+
+            with patch("tarfile.open", autospec=True) as mock_tarfile:
+                downloader.extract_one_package("A", "1.0")
+                mock_tarfile.assert_not_called()
+
+            os.remove(os.path.join(cache, "A", "1.0", "include", "a.h"))
+            downloader.extract_one_package("A", "1.0")
+            self.assertTrue(os.path.isfile(os.path.join(cache, "A", "1.0", "include", "a.h")))
+
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_metadata_index(self, mock_s3):
+        with tempfile.TemporaryDirectory() as cache:
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            config_obj["MetadataIndex"] = True
+            tar = os.path.join(cache, "A", "1.0", "A.tar")
+            TestPackageDownloader.write_tar(tar, {"md.json": json.dumps({"Dependencies": [{"Name": "B", "Version": "1.0"}]}).encode("utf-8")})
+            downloader = PackageDownloader(config_obj)
+            downloader.extract_one_package("A", "1.0")
+            package = {"Name": "A", "Version": "1.0"}
+            self.assertEqual([{"Name": "B", "Version": "1.0"}], downloader.package_dependencies(package))
+            with patch("builtins.open", autospec=True) as mock_open:
+                self.assertEqual([{"Name": "B", "Version": "1.0"}], downloader.package_dependencies(package))
+                mock_open.assert_not_called()
+
+            # Extracted again from another archive: its metadata is read again
+            TestPackageDownloader.write_tar(tar, {"md.json": json.dumps({"Dependencies": [{"Name": "B", "Version": "2.0"}]}).encode("utf-8")})
+            downloader.extract_one_package("A", "1.0")
+            self.assertEqual([{"Name": "B", "Version": "2.0"}], downloader.package_dependencies(package))
+
+    def test_stream_extraction(self):
+        tar_path = os.path.join(tempfile.gettempdir(), "stream-" + str(os.getpid()) + ".tar")
+        TestPackageDownloader.write_tar(tar_path, {"md.json": b"{}", "include/b.h": b"b"})
+        with open(tar_path, "rb") as fp:
+            tar_bytes = fp.read()
+        os.remove(tar_path)
+        with tempfile.TemporaryDirectory() as cache, S3StandIn() as s3:
+            s3.put_object("MY_BUCKET", "B/2.0/B.tar", tar_bytes)
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            config_obj["StreamExtract"] = True
+            config_obj["KeepArchives"] = False
+            config_obj["DedupPackageStore"] = True
+            s3_downloader = S3Downloader(s3.client())
+            with patch("boto3.client", return_value=MockS3Client()):
+                downloader = PackageDownloader(config_obj)
+            downloader.s3 = s3_downloader
+            folder = os.path.join(cache, "B", "2.0")
+
+            downloader.download_and_extract(self.package_list[1:2])
+            downloader.download_and_extract(self.package_list[1:2])
+
+            self.assertEqual(1, len(s3.requests()))
+            self.assertFalse(os.path.exists(os.path.join(folder, "B.tar")))
+            with open(os.path.join(folder, "include", "b.h")) as fp:
+                self.assertEqual("b", fp.read())
+            with open(os.path.join(folder, ExtractionStamp.FILE_NAME)) as fp:
+                self.assertEqual(hashlib.sha256(tar_bytes).hexdigest(), json.load(fp)["Sha256"])
+
+            downloader.keep_archives = True
+            os.remove(os.path.join(folder, "md.json"))
+            downloader.download_and_extract(self.package_list[1:2])
+            with open(os.path.join(folder, "B.tar"), "rb") as fp:
+                self.assertEqual(tar_bytes, fp.read())
+
+            s3.put_object("MY_BUCKET", "C/1.0/C.tar", b"not a tar")
+            package = {"Name": "C", "Version": "1.0", "PackageSource": {"Type": "S3", "Bucket": "MY_BUCKET"}}
+            self.assertRaises(PackageDownloaderException, downloader.download_and_extract, [package])
+            self.assertFalse(os.path.exists(os.path.join(cache, "C", "1.0", "C.tar.streaming")))
+
+    def test_probes_compressed_formats(self):
+        with tempfile.TemporaryDirectory() as cache, S3StandIn() as s3:
+            for name, archive_format in [("B", ArchiveFormat.GZIP), ("C", ArchiveFormat.GZIP), ("D", ArchiveFormat.XZ)]:
+                path = os.path.join(cache, "src", ArchiveFormat.file_name(name, archive_format))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with ArchiveFormat.writer(path, archive_format) as tfp:
+                    tfp.addfile(tarfile.TarInfo("md.json"), io.BytesIO(b""))
+                with open(path, "rb") as fp:
+                    s3.put_object("MY_BUCKET", name + "/1.0/" + os.path.basename(path), fp.read())
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            config_obj["ArchiveFormats"] = [ArchiveFormat.XZ, ArchiveFormat.GZIP, ArchiveFormat.TAR]
+            s3_downloader = S3Downloader(s3.client())
+            with patch("boto3.client", return_value=MockS3Client()):
+                downloader = PackageDownloader(config_obj)
+            downloader.s3 = s3_downloader
+            source = {"Type": "S3", "Bucket": "MY_BUCKET"}
+
+            for name in ["B", "C", "D"]:
+                downloader.download_and_extract([{"Name": name, "Version": "1.0", "PackageSource": source}])
+
+            heads = [request[2] for request in s3.requests() if request[0] == "HEAD"]
+            self.assertEqual(["B/1.0/B.tar.xz", "B/1.0/B.tar.gz", "C/1.0/C.tar.gz", "D/1.0/D.tar.gz", "D/1.0/D.tar.xz"], heads)
+            self.assertTrue(os.path.isfile(os.path.join(cache, "B", "1.0", "B.tar.gz")))
+            self.assertTrue(os.path.isfile(os.path.join(cache, "D", "1.0", "md.json")))
+
+            downloader.download_and_extract([{"Name": "B", "Version": "1.0", "PackageSource": source}])
+            self.assertEqual(5, len([request for request in s3.requests() if request[0] == "HEAD"]))
+
+            missing = {"Name": "E", "Version": "1.0", "PackageSource": source}
+            self.assertRaises(PackageDownloaderException, downloader.download_and_extract, [missing])
+
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_failed_probe_tries_next_format(self, mock_s3):
+        def variant_exists(endpoint, path):
+            if path.endswith(".tar.xz"):
+                raise HttpDownloaderException("Probe of " + path + " failed with status 500")
+            return path.endswith(".tar.gz")
+        downloader = PackageDownloader(dict(self.config_obj, ArchiveFormats=[ArchiveFormat.XZ, ArchiveFormat.GZIP]))
+        downloader.variant_exists = variant_exists
+        self.assertEqual(ArchiveFormat.GZIP, downloader.probe("A", "1.0", self.config_obj["PackageSource"]))
+        # The last format left is not taken for granted
+        downloader = PackageDownloader(dict(self.config_obj, ArchiveFormats=[ArchiveFormat.GZIP, ArchiveFormat.XZ]))
+        downloader.variant_exists = lambda endpoint, path: variant_exists(endpoint, path) and False
+        self.assertRaises(PackageDownloaderException, downloader.probe, "A", "1.0", self.config_obj["PackageSource"])
+        # The index names the format, nothing is probed
+        downloader.variant_exists = None
+        self.assertEqual(ArchiveFormat.XZ, downloader.probe("A", "1.0", self.config_obj["PackageSource"], {ArchiveFormat.XZ: {}}))
+
+    def test_index_hints(self):
+        for stream_extract in [False, True]:
+            with tempfile.TemporaryDirectory() as cache, S3StandIn() as s3:
+                path = os.path.join(cache, "src", "B.tar.xz")
+                os.makedirs(os.path.dirname(path))
+                with ArchiveFormat.writer(path, ArchiveFormat.XZ) as tfp:
+                    tfp.addfile(tarfile.TarInfo("md.json"), io.BytesIO(b""))
+                with open(path, "rb") as fp:
+                    data = fp.read()
+                s3.put_object("MY_BUCKET", "B/1.0/B.tar.xz", data)
+                s3.put_object("MY_BUCKET", "C/1.0/C.tar.xz", data)
+                config_obj = dict(self.config_obj)
+                config_obj["GlobalPackageCache"] = cache
+                config_obj["ArchiveFormats"] = [ArchiveFormat.GZIP, ArchiveFormat.XZ, ArchiveFormat.TAR]
+                config_obj["StreamExtract"] = stream_extract
+                s3_downloader = S3Downloader(s3.client())
+                with patch("boto3.client", return_value=MockS3Client()):
+                    downloader = PackageDownloader(config_obj)
+                downloader.s3 = s3_downloader
+                source = {"Type": "S3", "Bucket": "MY_BUCKET"}
+                archives = {
+                    ArchiveFormat.XZ: {"Size": len(data), "Sha256": BlobStore.hash_file(path)},
+                    ArchiveFormat.TAR: {"Size": 10 * len(data), "Sha256": "0"}
+                }
 
+                downloader.download_and_extract([{"Name": "B", "Version": "1.0", "PackageSource": source, "Archives": archives}])
+                self.assertTrue(os.path.isfile(os.path.join(cache, "B", "1.0", "md.json")))
+                # The hinted format is downloaded without probing
+                self.assertEqual(0, len([request for request in s3.requests() if request[0] == "HEAD"]))
+
+                archives = {ArchiveFormat.XZ: {"Size": len(data), "Sha256": "0" * 64}}
+                package = {"Name": "C", "Version": "1.0", "PackageSource": source, "Archives": archives}
+                self.assertRaises(PackageDownloaderException, downloader.download_and_extract, [package])
+                self.assertFalse(os.path.exists(os.path.join(cache, "C", "1.0", "C.tar.xz")))
+                self.assertFalse(os.path.exists(os.path.join(cache, "C", "1.0", ExtractionStamp.FILE_NAME)))
+
+    def test_fetch_dependencies(self):
+        with tempfile.TemporaryDirectory() as cache, S3StandIn() as s3:
+            md = {"Name": "B", "Version": "1.0", "Dependencies": [{"Name": "D", "Version": "1.0"}], "TestDeps": [{"Name": "E", "Version": "2.0"}]}
+            for name, archive_format in [("B", ArchiveFormat.TAR), ("C", ArchiveFormat.XZ)]:
+                path = os.path.join(cache, "src", ArchiveFormat.file_name(name, archive_format))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = json.dumps(md).encode("utf-8")
+                with ArchiveFormat.writer(path, archive_format) as tfp:
+                    info = tarfile.TarInfo("md.json")
+                    info.size = len(data)
+                    tfp.addfile(info, io.BytesIO(data))
+                    payload = tarfile.TarInfo("libpayload.so")
+                    payload.size = 200000
+                    tfp.addfile(payload, io.BytesIO(b"\0" * payload.size))
+                with open(path, "rb") as fp:
+                    s3.put_object("MY_BUCKET", name + "/1.0/" + os.path.basename(path), fp.read())
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            config_obj["ArchiveFormats"] = [ArchiveFormat.TAR, ArchiveFormat.XZ]
+            config_obj["DownloadConcurrency"] = 2
+            s3_downloader = S3Downloader(s3.client())
+            with patch("boto3.client", return_value=MockS3Client()):
+                downloader = PackageDownloader(config_obj)
+            downloader.s3 = s3_downloader
+            source = {"Type": "S3", "Bucket": "MY_BUCKET"}
+            packages = [{"Name": "B", "Version": "1.0", "PackageSource": source}, {"Name": "C", "Version": "1.0", "PackageSource": source}]
+
+            expected = [{"Name": "D", "Version": "1.0"}, {"Name": "E", "Version": "2.0"}]
+            self.assertEqual([expected, expected], downloader.fetch_dependencies(packages))
+            gets = [request for request in s3.requests() if request[0] == "GET"]
+            # md.json of the tar is read with a single ranged GET, the compressed package is downloaded in full
+            self.assertEqual([("B/1.0/B.tar", "bytes=0-65535")], [(r[2], r[3]) for r in gets if r[2].startswith("B/")])
+            self.assertFalse(os.path.exists(os.path.join(cache, "B", "1.0")))
+            self.assertTrue(os.path.isfile(os.path.join(cache, "C", "1.0", "libpayload.so")))
+
+            # The metadata of a package extracted already is read from the cache
+            requests = len(s3.requests())
+            self.assertEqual([expected], downloader.fetch_dependencies(packages[1:]))
+            self.assertEqual(requests, len(s3.requests()))
+
+            s3.put_object("MY_BUCKET", "F/1.0/F.tar", b"not a tar" * 100)
+            missing = {"Name": "F", "Version": "1.0", "PackageSource": source}
+            self.assertRaises(PackageDownloaderException, downloader.fetch_dependencies, [missing])
+
+    def test_mirror_failover(self):
+        with tempfile.TemporaryDirectory() as cache, S3StandIn() as s3:
+            path = os.path.join(cache, "src", "B.tar")
+            os.makedirs(os.path.dirname(path))
+            with ArchiveFormat.writer(path, ArchiveFormat.TAR) as tfp:
+                tfp.addfile(tarfile.TarInfo("md.json"), io.BytesIO(b""))
+            with open(path, "rb") as fp:
+                data = fp.read()
+            s3.put_object("MIRROR", "B/1.0/B.tar", data)
+            s3.put_object("MIRROR", "C/1.0/C.tar", data)
+            s3.put_object("PRIMARY", "C/1.0/C.tar", data)
+            config_obj = dict(self.config_obj)
+            config_obj["GlobalPackageCache"] = cache
+            s3_downloader = S3Downloader(s3.client())
+            with patch("boto3.client", return_value=MockS3Client()):
+                downloader = PackageDownloader(config_obj)
+            downloader.s3 = s3_downloader
+            source = {"Type": "S3", "Bucket": "PRIMARY", "Mirrors": ["MIRROR"]}
+
+            downloader.download_and_extract([{"Name": "B", "Version": "1.0", "PackageSource": source}])
+            self.assertTrue(os.path.isfile(os.path.join(cache, "B", "1.0", "md.json")))
+            # The primary does not have B, so the mirror was ranked first
+            self.assertEqual("MIRROR", downloader.mirrors.ranked(source, "B/1.0/B.tar")[0]["Bucket"])
+
+            # C is only missing from the mirror now, the download fails over to the primary
+            s3.put_object("MIRROR", "C/1.0/C.tar", None)
+            downloader.download_and_extract([{"Name": "C", "Version": "1.0", "PackageSource": source}])
+            self.assertTrue(os.path.isfile(os.path.join(cache, "C", "1.0", "md.json")))
+            self.assertEqual("PRIMARY", downloader.mirrors.ranked(source, "C/1.0/C.tar")[0]["Bucket"])
 
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_segmented_download_falls_back(self, mock_s3):
+        def download(url, dest):
+            with open(dest, "wb") as fp:
+                fp.write(b"package")
+            return 7
+        source = {"Type": "URL", "Url": "https://primary", "Mirrors": ["https://mirror"]}
+        for segmented in [None, HttpDownloaderException("does not support Range requests")]:
+            with tempfile.TemporaryDirectory() as cache:
+                downloader = PackageDownloader(dict(self.config_obj, GlobalPackageCache=cache, MirrorSegmentSize=100))
+                downloader.mirrors.ranked = lambda source_info, path: MirrorSelector.endpoints(source_info)
+                with patch.object(downloader.http, "download_segmented", side_effect=[segmented] * 3) as mock_segmented, \
+                        patch.object(downloader.http, "download", side_effect=download) as mock_download:
+                    downloader.download_a_package_if_needed("A", "1.0", source)
+                self.assertTrue(mock_segmented.called)
+                mock_download.assert_called_once_with("https://primary/A/1.0/A.tar", os.path.join(cache, "A", "1.0", "A.tar"))
+                self.assertTrue(os.path.isfile(os.path.join(cache, "A", "1.0", "A.tar")))
+
+    @patch("boto3.client", return_value=MockS3Client())
+    def test_invalid_archive_formats(self, mock_s3):
+        config_obj = dict(self.config_obj)
+        config_obj["ArchiveFormats"] = ["tar.bz2"]
+        self.assertRaises(PackageDownloaderException, PackageDownloader, config_obj)
+        config_obj["ArchiveFormats"] = []
+        self.assertRaises(PackageDownloaderException, PackageDownloader, config_obj)
+
+    def test_s3_client_created_on_first_use(self):
+        with patch("boto3.client", return_value=MockS3Client()) as mock_boto3:
+            downloader = PackageDownloader(dict(self.config_obj, S3EndpointUrl="http://localhost:9000", S3PartSize=1024))
+            self.assertIsNone(downloader.s3)
+            mock_boto3.assert_not_called()
+            s3 = downloader.s3_downloader()
+            self.assertIs(s3, downloader.s3_downloader())
+            self.assertEqual(1, mock_boto3.call_count)
+            self.assertEqual("http://localhost:9000", mock_boto3.call_args[1]["endpoint_url"])
+            self.assertEqual(1024, s3.part_size)
+        self.assertRaises(PackageDownloaderException, PackageDownloader, dict(self.config_obj, S3PartSize=0))
+
+    def test_delta(self):
+        for stream_extract in [False, True]:
+            with tempfile.TemporaryDirectory() as cache, S3StandIn() as s3:
+                archives = {}
+                for version, header in [("1.0", b"int a();"), ("1.1", b"int a(int);")]:
+                    path = os.path.join(cache, "src", version, "A.tar")
+                    os.makedirs(os.path.dirname(path))
+                    with ArchiveFormat.writer(path, ArchiveFormat.TAR) as tfp:
+                        for name, data in [("md.json", b"{}"), ("include/a.h", header), ("lib/libA.so", b"\1" * 100000)]:
+                            info = tarfile.TarInfo(name)
+                            info.size = len(data)
+                            tfp.addfile(info, io.BytesIO(data))
+                    with open(path, "rb") as fp:
+                        s3.put_object("MY_BUCKET", "A/" + version + "/A.tar", fp.read())
+                    archives[version] = {ArchiveFormat.TAR: {"Size": os.path.getsize(path), "Sha256": BlobStore.hash_file(path)}}
+                delta = os.path.join(cache, "src", "1.1", PackageDelta.file_name("A", "1.0"))
+                PackageDelta.create(
+                    os.path.join(cache, "src", "1.0", "A.tar"), ArchiveFormat.TAR, os.path.join(cache, "src", "1.1", "A.tar"), ArchiveFormat.TAR, "1.0", delta)
+                with open(delta, "rb") as fp:
+                    s3.put_object("MY_BUCKET", "A/1.1/" + PackageDelta.file_name("A", "1.0"), fp.read())
+                config_obj = dict(self.config_obj)
+                config_obj["GlobalPackageCache"] = cache
+                config_obj["StreamExtract"] = stream_extract
+                config_obj["UseDeltas"] = True
+                config_obj["DedupPackageStore"] = stream_extract
+                s3_downloader = S3Downloader(s3.client())
+                with patch("boto3.client", return_value=MockS3Client()):
+                    downloader = PackageDownloader(config_obj)
+                downloader.s3 = s3_downloader
+                source = {"Type": "S3", "Bucket": "MY_BUCKET"}
+                downloader.download_and_extract([{"Name": "A", "Version": "1.0", "PackageSource": source}])
+
+                requests = len(s3.requests())
+                package = {"Name": "A", "Version": "1.1", "PackageSource": source}
+                downloader.download_and_extract([package])
+                fetched = [request[2] for request in s3.requests()[requests:]]
+                self.assertNotIn("A/1.1/A.tar", fetched)
+                self.assertIn("A/1.1/A.delta-1.0.tar.xz", fetched)
+                with open(os.path.join(cache, "A", "1.1", "include", "a.h"), "r") as fp:
+                    self.assertEqual("int a(int);", fp.read())
+                self.assertEqual(archives["1.1"][ArchiveFormat.TAR]["Sha256"], downloader.extracted_digest(package))
+                self.assertFalse(os.path.exists(os.path.join(cache, "A", "1.1", PackageDelta.file_name("A", "1.0"))))
+
+                # The rebuilt package is not fetched again
+                requests = len(s3.requests())
+                downloader.download_and_extract([package])
+                self.assertEqual(requests, len(s3.requests()))
+
+                # A delta that does not match the index is not used
+                shutil.rmtree(os.path.join(cache, "A", "1.1"))
+                hinted = dict(package, Archives=archives["1.1"], Deltas={"1.0": {"Size": 10, "Sha256": "0" * 64}})
+                downloader.download_and_extract([hinted])
+                self.assertIn("A/1.1/A.tar", [request[2] for request in s3.requests()[requests:]])
+                with open(os.path.join(cache, "A", "1.1", "include", "a.h"), "r") as fp:
+                    self.assertEqual("int a(int);", fp.read())
+
+                # A delta that can not be probed is not used
+                shutil.rmtree(os.path.join(cache, "A", "1.1"))
+                requests = len(s3.requests())
+                with patch.object(downloader, "variant_exists", side_effect=S3DownloaderException("AccessDenied")):
+                    downloader.download_and_extract([package])
+                self.assertNotIn("A/1.1/A.delta-1.0.tar.xz", [request[2] for request in s3.requests()[requests:]])
+                with open(os.path.join(cache, "A", "1.1", "include", "a.h"), "r") as fp:
+                    self.assertEqual("int a(int);", fp.read())
@@ -0,0 +1,135 @@
+import unittest
+import os
+import io
+import json
+import tarfile
+import tempfile
+
+from unittest.mock import patch
+from modules.bootstrap.PackageIndex import PackageIndexException, PackageIndex
+from modules.bootstrap.S3Downloader import S3DownloaderException, S3Downloader
+from modules.bootstrap.BlobStore import BlobStore
+from modules.bootstrap.PackageDelta import PackageDelta
+from tst.testutils.S3StandIn import S3StandIn
+from tst.testutils.Mocks import MockLog
+
+
+class TestPackageIndex (unittest.TestCase):
+    def setUp(self):
+        self.s3 = S3StandIn().__enter__()
+        self.downloader = S3Downloader(self.s3.client())
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = {"Type": "S3", "Bucket": "MY_BUCKET"}
+        self.config = {
+            "GlobalPackageCache": self.temp_dir.name,
+            "PackageSource": self.source,
+            "Logger": MockLog()
+        }
+        self.index = {
+            "Packages": {
+                "A": {"1.0": {"Dependencies": [{"Name": "B", "Version": "2.0"}], "Archives": {"tar": {"Size": 10, "Sha256": "X"}}}},
+                "B": {"2.0": {"Dependencies": []}}
+            }
+        }
+        self.s3.put_object("MY_BUCKET", "index.json", json.dumps(self.index).encode("utf-8"))
+
+    def tearDown(self):
+        self.downloader.close()
+        self.s3.__exit__(None, None, None)
+        self.temp_dir.cleanup()
+
+    def index_gets(self):
+        return [r for r in self.s3.requests() if r[0] == "GET" and r[2] == "index.json"]
+
+    def test_lookup(self):
+        package_index = PackageIndex(self.config, None, lambda: self.downloader)
+        self.assertEqual(self.index["Packages"]["A"]["1.0"], package_index.lookup({"Name": "A", "Version": "1.0"}))
+        self.assertEqual({"Dependencies": []}, package_index.lookup({"Name": "B", "Version": "2.0"}))
+        self.assertIsNone(package_index.lookup({"Name": "A", "Version": "9.0"}))
+        self.assertIsNone(package_index.lookup({"Name": "Z", "Version": "1.0"}))
+        # The index is fetched once per run
+        self.assertEqual(1, len(self.index_gets()))
+
+    def test_revalidation(self):
+        PackageIndex(self.config, None, lambda: self.downloader).lookup({"Name": "A", "Version": "1.0"})
+        self.assertTrue(os.path.isdir(os.path.join(self.temp_dir.name, PackageIndex.CACHE_FOLDER)))
+        # Unchanged: the cached copy is revalidated
+        entry = PackageIndex(self.config, None, lambda: self.downloader).lookup({"Name": "B", "Version": "2.0"})
+        self.assertEqual({"Dependencies": []}, entry)
+        self.assertEqual(2, len(self.index_gets()))
+        # Changed: the new index is fetched and cached
+        self.index["Packages"]["B"]["2.0"]["Dependencies"] = [{"Name": "C", "Version": "1.0"}]
+        self.s3.put_object("MY_BUCKET", "index.json", json.dumps(self.index).encode("utf-8"))
+        entry = PackageIndex(self.config, None, lambda: self.downloader).lookup({"Name": "B", "Version": "2.0"})
+        self.assertEqual([{"Name": "C", "Version": "1.0"}], entry["Dependencies"])
+
+    @patch.object(S3Downloader, "get", side_effect=S3DownloaderException("Connection refused"))
+    def test_cached_index_used_when_unreachable(self, mock_get):
+        package_index = PackageIndex(self.config, None, lambda: self.downloader)
+        package_index.save(self.source, "\"etag\"", self.index)
+        self.assertEqual({"Dependencies": []}, package_index.lookup({"Name": "B", "Version": "2.0"}))
+        mock_get.assert_called_once_with("MY_BUCKET", "index.json", "\"etag\"")
+        # Without a cached copy, the source is resolved without its index
+        other = {"Type": "S3", "Bucket": "OTHER"}
+        self.assertIsNone(package_index.lookup({"Name": "B", "Version": "2.0", "PackageSource": other}))
+
+    def test_source_without_index(self):
+        package_index = PackageIndex(self.config, None, lambda: self.downloader)
+        self.assertIsNone(package_index.lookup({"Name": "A", "Version": "1.0", "PackageSource": {"Type": "S3", "Bucket": "OTHER"}}))
+
+    def test_malformed_index(self):
+        self.s3.put_object("MY_BUCKET", "index.json", b"[1, 2")
+        self.assertIsNone(PackageIndex(self.config, None, lambda: self.downloader).lookup({"Name": "A", "Version": "1.0"}))
+
+    def test_init_error(self):
+        self.assertRaises(PackageIndexException, PackageIndex, {}, None, None)
+        self.assertRaises(PackageIndexException, PackageIndex, 10, None, None)
+
+    def add_package(self, root, name, version, md):
+        folder = os.path.join(root, name, version)
+        os.makedirs(folder)
+        archive = os.path.join(folder, name + ".tar.gz")
+        data = json.dumps(md).encode("utf-8")
+        with tarfile.open(archive, "w:gz") as tfp:
+            info = tarfile.TarInfo("md.json")
+            info.size = len(data)
+            tfp.addfile(info, io.BytesIO(data))
+        return archive
+
+    def test_build(self):
+        root = os.path.join(self.temp_dir.name, "repository")
+        archive = self.add_package(root, "A", "1.0", {
+            "Name": "A",
+            "Version": "1.0",
+            "Dependencies": [{"Name": "B", "Version": "2.0"}],
+            "BuildDeps": [{"Name": "C", "Version": "3.0"}]
+        })
+        self.add_package(root, "B", "2.0", {"Name": "B", "Version": "2.0"})
+        index = PackageIndex.build(root)
+        with open(os.path.join(root, PackageIndex.FILE_NAME), "r") as fp:
+            self.assertEqual(index, json.load(fp))
+        self.assertEqual(
+            [{"Name": "B", "Version": "2.0"}, {"Name": "C", "Version": "3.0"}],
+            index["Packages"]["A"]["1.0"]["Dependencies"])
+        self.assertEqual(
+            {"tar.gz": {"Size": os.path.getsize(archive), "Sha256": BlobStore.hash_file(archive)}},
+            index["Packages"]["A"]["1.0"]["Archives"])
+        self.assertEqual([], index["Packages"]["B"]["2.0"]["Dependencies"])
+
+    def test_build_error(self):
+        self.assertRaises(PackageIndexException, PackageIndex.build, os.path.join(self.temp_dir.name, "missing"))
+
+    def test_build_deltas(self):
+        root = os.path.join(self.temp_dir.name, "repository")
+        for version in ["1.9", "1.10", "1.2"]:
+            self.add_package(root, "A", version, {"Name": "A", "Version": version})
+        index = PackageIndex.build(root)
+        self.assertNotIn("Deltas", index["Packages"]["A"]["1.10"])
+
+        index = PackageIndex.build(root, True)
+        self.assertNotIn("Deltas", index["Packages"]["A"]["1.2"])
+        self.assertEqual(["1.2"], list(index["Packages"]["A"]["1.9"]["Deltas"]))
+        delta = os.path.join(root, "A", "1.10", PackageDelta.file_name("A", "1.9"))
+        self.assertEqual(
+            {"1.9": {"Size": os.path.getsize(delta), "Sha256": BlobStore.hash_file(delta)}},
+            index["Packages"]["A"]["1.10"]["Deltas"])
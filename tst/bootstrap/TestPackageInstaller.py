@@ -2,9 +2,16 @@ import unittest
 import json
 import os
 import subprocess
+import shutil
+import tempfile
 
 from tst.testutils.Mocks import MockLog, MockProcess, MockFilePointer
 from modules.bootstrap.PackageInstaller import PackageInstallerException, PackageInstaller
+from modules.bootstrap.InstallCache import InstallCache
+from modules.bootstrap.InstallReceipts import InstallReceipts
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
+from modules.bootstrap.MetadataIndex import MetadataIndex
+from modules.build.JobServer import JobServer
 from unittest.mock import patch, call
 
 
@@ -55,6 +62,14 @@ class TestPackageInstaller (unittest.TestCase):
                 ]
             }
         }
+        self.src = os.path.join(self.conf["GlobalPackageCache"], "A", "1.0")
+        # The tests run in the "CWD" folder, which the relative prefix is resolved against
+        with patch("os.getcwd", return_value="CWD"):
+            self.build = PackageInstaller.build_folder(self.conf["GlobalPackageCache"], "A", "1.0", self.conf["LocalPackageCache"], [])
+        # The build folders are not created
+        self.build_lock = patch.object(PackageInstaller, "build_lock")
+        self.build_lock.start()
+        self.addCleanup(self.build_lock.stop)
         self.installer = PackageInstaller(self.conf)
 
     @patch("builtins.open", autospec=True)
@@ -105,23 +120,18 @@ class TestPackageInstaller (unittest.TestCase):
         ]
         mock_makedirs.assert_has_calls(makedirs_calls, any_order=False)
 
-        def get_chdir_call(i):
-            return [
-                call(os.path.join(
-                    self.conf["GlobalPackageCache"],
-                    self.package_list[i]["Name"],
-                    self.package_list[i]["Version"]
-                )),
-                call("CWD")
-            ]*3
-        chdir_calls = get_chdir_call(0) + get_chdir_call(1)
-        mock_chdir.assert_has_calls(chdir_calls, any_order=False)
-
-        popen_calls = [
-                call(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]], stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-                call(["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-                call(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        ] * 2
+        # Builds run in the package folder, without changing the working directory of the process
+        mock_chdir.assert_not_called()
+
+        popen_calls = []
+        for package in self.package_list:
+            src = os.path.join(self.conf["GlobalPackageCache"], package["Name"], package["Version"])
+            build = PackageInstaller.build_folder(self.conf["GlobalPackageCache"], package["Name"], package["Version"], self.conf["LocalPackageCache"], [])
+            popen_calls.extend([
+                call(["cmake", "-S", src, "-B", build, "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]], cwd=build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+                call(["make"], cwd=build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+                call(["make", "install"], cwd=build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            ])
         mock_popen.assert_has_calls(popen_calls, any_order=False)
 
     @patch("builtins.open", autospec=True)
@@ -169,8 +179,8 @@ class TestPackageInstaller (unittest.TestCase):
         self.assertRaises(PackageInstallerException, self.installer.install_packages, self.package_list)
 
         popen_calls = [
-                          call(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                          call(["cmake", "-S", self.src, "-B", self.build, "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
+                               cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
                       ]
         mock_popen.assert_has_calls(popen_calls, any_order=False)
@@ -196,9 +206,9 @@ class TestPackageInstaller (unittest.TestCase):
         self.assertRaises(PackageInstallerException, self.installer.install_packages, self.package_list)
 
         popen_calls = [
-            call(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
-                 stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            call(["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            call(["cmake", "-S", self.src, "-B", self.build, "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
+                 cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make"], cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.assert_has_calls(popen_calls, any_order=False)
 
@@ -223,8 +233,8 @@ class TestPackageInstaller (unittest.TestCase):
         self.assertRaises(PackageInstallerException, self.installer.install_packages, self.package_list)
 
         popen_calls = [
-            call(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
-                 stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            call(["cmake", "-S", self.src, "-B", self.build, "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
+                 cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
         ]
         mock_popen.assert_has_calls(popen_calls, any_order=False)
 
@@ -249,9 +259,9 @@ class TestPackageInstaller (unittest.TestCase):
         self.assertRaises(PackageInstallerException, self.installer.install_packages, self.package_list)
 
         popen_calls = [
-            call(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
-                 stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            call(["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            call(["cmake", "-S", self.src, "-B", self.build, "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
+                 cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make"], cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.assert_has_calls(popen_calls, any_order=False)
 
@@ -276,10 +286,10 @@ class TestPackageInstaller (unittest.TestCase):
         self.assertRaises(PackageInstallerException, self.installer.install_packages, self.package_list)
 
         popen_calls = [
-            call(["cmake", ".", "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
-                 stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            call(["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            call(["make", "install"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            call(["cmake", "-S", self.src, "-B", self.build, "-DCMAKE_INSTALL_PREFIX=" + self.conf["LocalPackageCache"]],
+                 cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make"], cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make", "install"], cwd=self.build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.assert_has_calls(popen_calls, any_order=False)
 
@@ -334,3 +344,164 @@ class TestPackageInstaller (unittest.TestCase):
         self.assertRaises(PackageInstallerException, PackageInstaller, {})
         self.assertRaises(PackageInstallerException, PackageInstaller, 10)
 
+    def test_install_cache(self):
+        with tempfile.TemporaryDirectory() as root:
+            conf = {
+                "GlobalPackageCache": os.path.join(root, "global"),
+                "LocalPackageCache": os.path.join(root, "local"),
+                "Logger": MockLog(),
+                "InstallCache": True,
+                "BuildType": "Release"
+            }
+            mds = {"A/1.0": {"Dependencies": [{"Name": "C", "Version": "3.0"}]}, "C/3.0": {}}
+            for package_id, md in mds.items():
+                package_folder = os.path.join(conf["GlobalPackageCache"], package_id)
+                os.makedirs(package_folder)
+                with open(os.path.join(package_folder, "md.json"), "w") as fp:
+                    json.dump(md, fp)
+                ExtractionStamp(os.path.join(package_folder, "package.tar"), package_folder).write(["md.json"], package_id + "_DIGEST", 10)
+
+            def fake_popen(args, cwd=None, stdout=None, stderr=None):
+                destdir = [arg[len("DESTDIR="):] for arg in args if arg.startswith("DESTDIR=")]
+                if len(destdir) > 0:
+                    prefix = destdir[0] + os.path.abspath(conf["LocalPackageCache"])
+                    os.makedirs(os.path.join(prefix, "lib"), exist_ok=True)
+                    with open(os.path.join(prefix, "lib", "libA.so"), "w") as fp:
+                        fp.write("LIBRARY")
+                return MockProcess("OUT", "ERR", 0)
+
+            with patch.object(InstallCache, "fingerprint", return_value={"CC": "cc"}):
+                with patch("subprocess.Popen", side_effect=fake_popen) as mock_popen:
+                    installer = PackageInstaller(conf)
+                    installer.install_a_package("A", "1.0")
+                    self.assertEqual(mock_popen.call_count, 3)
+                    src = os.path.join(conf["GlobalPackageCache"], "A", "1.0")
+                    prefix = os.path.abspath(conf["LocalPackageCache"])
+                    build = PackageInstaller.build_folder(conf["GlobalPackageCache"], "A", "1.0", prefix, ["-DCMAKE_BUILD_TYPE=Release"])
+                    self.assertEqual(mock_popen.call_args_list[0], call(
+                        ["cmake", "-S", src, "-B", build, "-DCMAKE_INSTALL_PREFIX=" + prefix, "-DCMAKE_BUILD_TYPE=Release"],
+                        cwd=build, stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+                    self.assertTrue(os.path.isfile(os.path.join(conf["LocalPackageCache"], "lib", "libA.so")))
+                    self.assertEqual(1, len(os.listdir(os.path.join(conf["GlobalPackageCache"], InstallCache.FOLDER, "A", "1.0"))))
+                    self.assertNotIn(InstallCache.FOLDER, os.listdir(src))
+
+                    # Another project, or the next bootstrap, restores the package from the cache
+                    shutil.rmtree(conf["LocalPackageCache"])
+                    PackageInstaller(conf).install_a_package("A", "1.0")
+                    self.assertEqual(mock_popen.call_count, 3)
+                    self.assertTrue(os.path.isfile(os.path.join(conf["LocalPackageCache"], "lib", "libA.so")))
+
+                    # A dependency that changed builds the package again
+                    c_folder = os.path.join(conf["GlobalPackageCache"], "C", "3.0")
+                    ExtractionStamp(os.path.join(c_folder, "package.tar"), c_folder).write(["md.json"], "C_DIGEST2", 10)
+                    PackageInstaller(conf).install_a_package("A", "1.0")
+                    self.assertEqual(mock_popen.call_count, 6)
+
+    @unittest.skipIf(any(shutil.which(tool) is None for tool in ["cmake", "make", "cc"]), "cmake, make or cc is not installed")
+    def test_out_of_source_builds(self):
+        self.build_lock.stop()
+        with tempfile.TemporaryDirectory() as root:
+            src = os.path.join(root, "global", "P", "1.0")
+            os.makedirs(src)
+            with open(os.path.join(src, "CMakeLists.txt"), "w") as fp:
+                fp.write("cmake_minimum_required(VERSION 3.13)\nproject(P C)\nadd_library(p STATIC p.c)\ninstall(TARGETS p DESTINATION lib)\n")
+            with open(os.path.join(src, "p.c"), "w") as fp:
+                fp.write("int p() { return 1; }\n")
+            with open(os.path.join(src, "md.json"), "w") as fp:
+                fp.write("{}")
+            sources = sorted(os.listdir(src))
+            job_server = JobServer(2, 1)
+            self.addCleanup(job_server.close)
+            for project in ["project1", "project2"]:
+                conf = {
+                    "GlobalPackageCache": os.path.join(root, "global"),
+                    "LocalPackageCache": os.path.join(root, project, ".packagecache"),
+                    "Logger": MockLog(),
+                    "JobServer": job_server
+                }
+                PackageInstaller(conf).install_a_package("P", "1.0")
+                self.assertTrue(os.path.isfile(os.path.join(conf["LocalPackageCache"], "lib", "libp.a")))
+            # The sources are untouched, and each project prefix has its own build folder
+            self.assertEqual(sources, sorted(os.listdir(src)))
+            self.assertEqual(2, len(os.listdir(PackageInstaller.builds_folder(os.path.join(root, "global"), "P", "1.0"))))
+
+    def test_cmake_build_with_generator(self):
+        self.build_lock.stop()
+        with tempfile.TemporaryDirectory() as root:
+            src = os.path.join(root, "global", "P", "1.0")
+            os.makedirs(src)
+            with open(os.path.join(src, "CMakeLists.txt"), "w") as fp:
+                fp.write("cmake_minimum_required(VERSION 3.13)\nproject(P C)\nadd_library(p STATIC p.c)\ninstall(TARGETS p DESTINATION lib)\n")
+            with open(os.path.join(src, "p.c"), "w") as fp:
+                fp.write("int p() { return 1; }\n")
+            with open(os.path.join(src, "md.json"), "w") as fp:
+                fp.write("{}")
+            job_server = JobServer(2, 1)
+            self.addCleanup(job_server.close)
+            conf = {
+                "GlobalPackageCache": os.path.join(root, "global"),
+                "LocalPackageCache": os.path.join(root, "project", ".packagecache"),
+                "Logger": MockLog(),
+                "JobServer": job_server,
+                "Generator": "Unix Makefiles",
+                "InstallCache": True
+            }
+            PackageInstaller(conf).install_a_package("P", "1.0")
+            # Staged through DESTDIR, then restored from the install cache
+            self.assertTrue(os.path.isfile(os.path.join(conf["LocalPackageCache"], "lib", "libp.a")))
+            self.assertEqual(1, len(os.listdir(os.path.join(root, "global", InstallCache.FOLDER, "P", "1.0"))))
+
+    def test_invalid_generator(self):
+        self.assertRaises(PackageInstallerException, PackageInstaller, {
+            "GlobalPackageCache": "GLOBAL", "LocalPackageCache": "LOCAL", "Logger": MockLog(), "Generator": "Xcode"
+        })
+
+    def test_install_receipts(self):
+        self.build_lock.stop()
+        with tempfile.TemporaryDirectory() as root:
+            for version, library in [("1.0", "p1"), ("2.0", "p2")]:
+                src = os.path.join(root, "global", "P", version)
+                os.makedirs(src)
+                with open(os.path.join(src, "CMakeLists.txt"), "w") as fp:
+                    fp.write("cmake_minimum_required(VERSION 3.13)\nproject(P C)\nadd_library(" + library + " STATIC p.c)\ninstall(TARGETS " + library + " DESTINATION lib/" + library + ")\n")
+                with open(os.path.join(src, "p.c"), "w") as fp:
+                    fp.write("int p() { return 1; }\n")
+                with open(os.path.join(src, "md.json"), "w") as fp:
+                    fp.write("{}")
+            for install_cache in [False, True]:
+                local_cache = os.path.join(root, "project" + str(install_cache), ".packagecache")
+                conf = {
+                    "GlobalPackageCache": os.path.join(root, "global"),
+                    "LocalPackageCache": local_cache,
+                    "Logger": MockLog(),
+                    "InstallCache": install_cache,
+                    "InstallReceipts": True
+                }
+                with patch.object(InstallCache, "fingerprint", return_value={}):
+                    PackageInstaller(conf).install_a_package("P", "1.0")
+                    self.assertEqual(["lib/p1/libp1.a"], InstallReceipts(local_cache).load()["P"]["Files"])
+                    # Installed already: nothing is built
+                    with patch.object(PackageInstaller, "build") as mock_build:
+                        PackageInstaller(conf).install_a_package("P", "1.0")
+                        mock_build.assert_not_called()
+                    # The files of the previous version are replaced
+                    PackageInstaller(conf).install_a_package("P", "2.0")
+                self.assertEqual(["p2"], os.listdir(os.path.join(local_cache, "lib")))
+                self.assertEqual("2.0", InstallReceipts(local_cache).load()["P"]["Version"])
+
+    def test_metadata_index(self):
+        with tempfile.TemporaryDirectory() as root:
+            conf = dict(self.conf, GlobalPackageCache=root, MetadataIndex=True)
+            folder = os.path.join(root, "A", "1.0")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "md.json"), "w") as fp:
+                json.dump(self.md["A"], fp)
+            self.assertTrue(ExtractionStamp(os.path.join(folder, "A.tar"), folder).write(["md.json"], "SHA", 10))
+            expected = self.md["A"]["Dependencies"] + self.md["A"]["TestDeps"]
+            installer = PackageInstaller(conf)
+            self.assertEqual(expected, installer.get_package_dependency("A", "1.0"))
+            installer.save_metadata()
+            # The next bootstrap only reads the index
+            with patch.object(MetadataIndex, "shared", {}), patch("builtins.open", wraps=open) as mock_open:
+                self.assertEqual(expected, PackageInstaller(conf).get_package_dependency("A", "1.0"))
+                self.assertEqual([call(os.path.join(root, MetadataIndex.FILE_NAME), "r")], mock_open.call_args_list)
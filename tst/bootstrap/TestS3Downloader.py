@@ -0,0 +1,112 @@
+import unittest
+import os
+import json
+import tempfile
+
+from modules.bootstrap.S3Downloader import S3DownloaderException, S3Downloader
+from tst.testutils.S3StandIn import S3StandIn
+
+
+class TestS3Downloader (unittest.TestCase):
+    PART_SIZE = 1024
+
+    def setUp(self):
+        self.s3 = S3StandIn().__enter__()
+        self.small = b"small package"
+        self.large = bytes(range(256)) * 20
+        self.s3.put_object("MY_BUCKET", "A/1.0/A.tar", self.small)
+        self.s3.put_object("MY_BUCKET", "B/2.0/B.tar", self.large)
+        self.s3.put_object("MY_BUCKET", "E/1.0/E.tar", b"")
+        self.downloader = S3Downloader(self.s3.client(), part_size=TestS3Downloader.PART_SIZE, max_concurrency=4)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.temp_dir.name, "B.tar")
+
+    def tearDown(self):
+        self.downloader.close()
+        self.s3.__exit__(None, None, None)
+        self.temp_dir.cleanup()
+
+    def read(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def gets(self):
+        return [r for r in self.s3.requests() if r[0] == "GET"]
+
+    def test_small_object_single_get(self):
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.assertEqual(len(self.small), self.downloader.download("MY_BUCKET", "A/1.0/A.tar", dest))
+        self.assertEqual(self.small, self.read(dest))
+        self.assertEqual(1, len(self.gets()))
+
+    def test_empty_object(self):
+        dest = os.path.join(self.temp_dir.name, "E.tar")
+        self.assertEqual(0, self.downloader.download("MY_BUCKET", "E/1.0/E.tar", dest))
+        self.assertEqual(b"", self.read(dest))
+
+    def test_large_object_ranged_parts(self):
+        self.assertEqual(len(self.large), self.downloader.download("MY_BUCKET", "B/2.0/B.tar", self.dest))
+        self.assertEqual(self.large, self.read(self.dest))
+        ranges = sorted([r[3] for r in self.gets()], key=lambda r: int(r[len("bytes="):].split("-")[0]))
+        expected = ["bytes=" + str(i) + "-" + str(min(i + 1023, len(self.large) - 1)) for i in range(0, len(self.large), 1024)]
+        self.assertEqual(expected, ranges)
+        self.assertFalse(os.path.exists(self.dest + ".partial"))
+
+    def test_failed_part_is_resumed_alone(self):
+        self.s3.fail_once("bytes=2048-3071")
+        self.assertRaises(S3DownloaderException, self.downloader.download, "MY_BUCKET", "B/2.0/B.tar", self.dest)
+        self.assertFalse(os.path.exists(self.dest))
+        with open(self.dest + ".partial.json") as fp:
+            self.assertEqual([0, 1, 3, 4], json.load(fp)["Parts"])
+
+        requests_before = len(self.gets())
+        self.assertEqual(len(self.large), self.downloader.download("MY_BUCKET", "B/2.0/B.tar", self.dest))
+        self.assertEqual(self.large, self.read(self.dest))
+        self.assertEqual(["bytes=2048-3071"], [r[3] for r in self.gets()[requests_before:]])
+
+    def test_restart_when_object_changed(self):
+        self.s3.fail_once("bytes=2048-3071")
+        self.assertRaises(S3DownloaderException, self.downloader.download, "MY_BUCKET", "B/2.0/B.tar", self.dest)
+        new_data = b"new" * 2000
+        self.s3.put_object("MY_BUCKET", "B/2.0/B.tar", new_data)
+        self.assertEqual(len(new_data), self.downloader.download("MY_BUCKET", "B/2.0/B.tar", self.dest))
+        self.assertEqual(new_data, self.read(self.dest))
+
+    def test_resume_single_piece_download(self):
+        dest = os.path.join(self.temp_dir.name, "A.tar")
+        self.downloader.download("MY_BUCKET", "A/1.0/A.tar", dest)
+        etag = self.s3.client().head_object(Bucket="MY_BUCKET", Key="A/1.0/A.tar")["ETag"]
+        os.remove(dest)
+        with open(dest + ".partial", "wb") as fp:
+            fp.write(self.small[:5])
+        with open(dest + ".partial.json", "w") as fp:
+            json.dump({"Source": "s3://MY_BUCKET/A/1.0/A.tar", "Validator": etag, "Length": len(self.small)}, fp)
+        self.assertEqual(len(self.small), self.downloader.download("MY_BUCKET", "A/1.0/A.tar", dest))
+        self.assertEqual(self.small, self.read(dest))
+        self.assertEqual("bytes=5-", self.gets()[-1][3])
+
+    def test_exception_on_missing_object(self):
+        dest = os.path.join(self.temp_dir.name, "C.tar")
+        self.assertRaises(S3DownloaderException, self.downloader.download, "MY_BUCKET", "C/1.0/C.tar", dest)
+        self.assertFalse(os.path.exists(dest))
+
+    def test_invalid_settings(self):
+        self.assertRaises(S3DownloaderException, S3Downloader, None, 0)
+        self.assertRaises(S3DownloaderException, S3Downloader, None, 10, 0)
+
+    def test_stream(self):
+        self.assertEqual(self.large, self.downloader.stream("MY_BUCKET", "B/2.0/B.tar", lambda body: body.read()))
+        self.assertEqual(1, len(self.s3.requests()))
+        with self.assertRaises(S3DownloaderException):
+            self.downloader.stream("MY_BUCKET", "missing", lambda body: body.read())
+
+    def test_read_range(self):
+        self.assertEqual(self.large[100:200], self.downloader.read_range("MY_BUCKET", "B/2.0/B.tar", 100, 199))
+        self.assertEqual(self.small[5:], self.downloader.read_range("MY_BUCKET", "A/1.0/A.tar", 5, 1000))
+        self.assertEqual(b"", self.downloader.read_range("MY_BUCKET", "A/1.0/A.tar", 1000, 2000))
+        self.assertRaises(S3DownloaderException, self.downloader.read_range, "MY_BUCKET", "Z/1.0/Z.tar", 0, 10)
+
+    def test_exists(self):
+        self.assertTrue(self.downloader.exists("MY_BUCKET", "A/1.0/A.tar"))
+        self.assertFalse(self.downloader.exists("MY_BUCKET", "A/1.0/A.tar.gz"))
+        self.assertEqual(["HEAD", "HEAD"], [request[0] for request in self.s3.requests()])
@@ -0,0 +1,61 @@
+import unittest
+import io
+import tarfile
+
+from modules.bootstrap.TarProbe import TarProbeException, TarProbe
+
+
+class TestTarProbe (unittest.TestCase):
+    def setUp(self):
+        self.ranges = []
+
+    def make_tar(self, members, tar_format=tarfile.PAX_FORMAT):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w", format=tar_format) as tfp:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tfp.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def reader(self, data, ranges_supported=True):
+        def read_range(start, end):
+            self.ranges.append((start, end))
+            return data[start:end + 1] if ranges_supported else None
+        return read_range
+
+    def test_member_at_start(self):
+        data = self.make_tar([("CMakeLists.txt", b"project(A)"), ("md.json", b"{}"), ("libA.so", b"\0" * 300000)])
+        self.assertEqual(b"{}", TarProbe(self.reader(data)).find("md.json"))
+        # Both headers are in the first block
+        self.assertEqual([(0, TarProbe.BLOCK_SIZE - 1)], self.ranges)
+
+    def test_member_after_large_member(self):
+        data = self.make_tar([("libA.so", b"\1" * 300000), ("./md.json", b"{\"Name\": \"A\"}")])
+        self.assertEqual(b"{\"Name\": \"A\"}", TarProbe(self.reader(data)).find("md.json"))
+        self.assertEqual(2, len(self.ranges))
+        self.assertEqual(0, self.ranges[0][0])
+        self.assertEqual(512 + 300032, self.ranges[1][0])
+
+    def test_long_names(self):
+        long_name = "a" * 120 + "/md.json"
+        for tar_format in [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT]:
+            data = self.make_tar([(long_name, b"long"), ("b" * 120 + "/other", b"other")], tar_format)
+            self.assertEqual(b"long", TarProbe(self.reader(data)).find(long_name))
+            self.assertIsNone(TarProbe(self.reader(data)).find("a" * 120))
+
+    def test_missing_member(self):
+        data = self.make_tar([("CMakeLists.txt", b"project(A)")])
+        self.assertIsNone(TarProbe(self.reader(data)).find("md.json"))
+        self.assertIsNone(TarProbe(self.reader(b"")).find("md.json"))
+
+    def test_gives_up_after_max_members(self):
+        members = [("file" + str(i), b"x") for i in range(TarProbe.MAX_MEMBERS)] + [("md.json", b"{}")]
+        self.assertIsNone(TarProbe(self.reader(self.make_tar(members))).find("md.json"))
+
+    def test_ranges_not_supported(self):
+        data = self.make_tar([("md.json", b"{}")])
+        self.assertIsNone(TarProbe(self.reader(data, False)).find("md.json"))
+
+    def test_not_a_tar(self):
+        self.assertRaises(TarProbeException, TarProbe(self.reader(b"\x1f\x8b" + b"z" * 1024)).find, "md.json")
@@ -0,0 +1,87 @@
+import unittest
+
+from tst.testutils.Mocks import MockLog
+from modules.bootstrap.VersionSolver import VersionSolverException, VersionSolver
+
+
+class TestVersionSolver (unittest.TestCase):
+    def solver(self, repository):
+        self.dependency_calls = []
+
+        def dependencies_of(package):
+            self.dependency_calls.append(package["Name"] + "/" + package["Version"])
+            return repository.get(package["Name"], {}).get(package["Version"], [])
+        return VersionSolver(lambda package: list(repository.get(package["Name"], {})), dependencies_of, MockLog())
+
+    def test_parse(self):
+        self.assertEqual((("==", "1.0"),), VersionSolver.parse("1.0"))
+        self.assertEqual(((">=", "1.0"), ("<", "2.0")), VersionSolver.parse(">=1.0, <2.0"))
+        self.assertEqual((), VersionSolver.parse("*"))
+        self.assertRaises(VersionSolverException, VersionSolver.parse, ">=1.0,2.0")
+        self.assertFalse(VersionSolver.is_range("1.0"))
+        self.assertTrue(VersionSolver.is_range("==1.0"))
+
+    def test_matches(self):
+        self.assertTrue(VersionSolver.matches("1.10", VersionSolver.parse(">1.9")))
+        self.assertFalse(VersionSolver.matches("2.0", VersionSolver.parse(">=1.0,<2.0")))
+        self.assertFalse(VersionSolver.matches("1.5", VersionSolver.parse(">=1.0,!=1.5")))
+        self.assertFalse(VersionSolver.matches("1.0.0", VersionSolver.parse("1.0")))
+        self.assertTrue(VersionSolver.matches("1.0.0", VersionSolver.parse("<=1.0.0")))
+
+    def test_newest_version(self):
+        solver = self.solver({"A": {"1.9": [], "1.10": [], "2.0": []}})
+        self.assertEqual({"A": "1.10"}, solver.solve([{"Name": "A", "Version": "<2.0"}]))
+        # Preferred versions are tried first
+        self.assertEqual({"A": "1.9"}, solver.solve([{"Name": "A", "Version": "<2.0"}], {"A": "1.9"}))
+        # An exact version does not need to be known
+        self.assertEqual({"A": "0.5"}, solver.solve([{"Name": "A", "Version": "0.5"}]))
+
+    def test_diamond_backtracks(self):
+        solver = self.solver({
+            "App": {"1.0": [{"Name": "Net", "Version": "*"}, {"Name": "Log", "Version": ">=1.0"}]},
+            "Net": {"1.0": [{"Name": "Ssl", "Version": "<3.0"}], "2.0": [{"Name": "Ssl", "Version": ">=3.0"}]},
+            "Log": {"1.0": [{"Name": "Ssl", "Version": "<3.0"}], "2.0": [{"Name": "Ssl", "Version": "2.1"}]},
+            "Ssl": {"2.0": [], "2.1": [], "3.0": []}
+        })
+        self.assertEqual({"App": "1.0", "Net": "1.0", "Log": "2.0", "Ssl": "2.1"}, solver.solve([{"Name": "App", "Version": "1.0"}]))
+        # The dependencies of every version are read once
+        self.assertEqual(len(self.dependency_calls), len(set(self.dependency_calls)))
+
+    def test_backtracks_across_packages(self):
+        # Every version of B but the oldest needs a C that D rules out, which is only known once D is picked
+        repository = {
+            "A": {"1.0": [{"Name": "B", "Version": "*"}, {"Name": "D", "Version": "*"}]},
+            "B": {str(i) + ".0": [{"Name": "C", "Version": ">=" + str(i) + ".0"}] for i in range(1, 6)},
+            "C": {str(i) + ".0": [] for i in range(1, 6)},
+            "D": {"1.0": [{"Name": "E", "Version": "*"}]},
+            "E": {"1.0": [{"Name": "C", "Version": "<2.0"}]}
+        }
+        solver = self.solver(repository)
+        self.assertEqual({"A": "1.0", "B": "1.0", "C": "1.0", "D": "1.0", "E": "1.0"}, solver.solve([{"Name": "A", "Version": "1.0"}]))
+
+    def test_conflict(self):
+        solver = self.solver({
+            "A": {"1.0": [{"Name": "C", "Version": ">=2.0"}]},
+            "B": {"1.0": [{"Name": "C", "Version": "<2.0"}]},
+            "C": {"1.0": [], "2.0": []}
+        })
+        with self.assertRaises(VersionSolverException) as context:
+            solver.solve([{"Name": "A", "Version": "1.0"}, {"Name": "B", "Version": "1.0"}])
+        self.assertIn("C is required as >=2.0 by A/1.0, <2.0 by B/1.0", str(context.exception))
+        self.assertRaises(VersionSolverException, solver.solve, [{"Name": "C", "Version": ">=3.0"}])
+
+    def test_cycle(self):
+        solver = self.solver({
+            "A": {"1.0": [{"Name": "B", "Version": "*"}]},
+            "B": {"1.0": [{"Name": "A", "Version": "1.0"}], "2.0": [{"Name": "A", "Version": "2.0"}]}
+        })
+        self.assertEqual({"A": "1.0", "B": "1.0"}, solver.solve([{"Name": "A", "Version": "*"}]))
+
+    def test_deep_graph(self):
+        depth = 5000
+        repository = {"P" + str(i): {"1.0": [{"Name": "P" + str(i + 1), "Version": ">=1.0"}], "2.0": []} for i in range(depth)}
+        repository["P" + str(depth)] = {"1.0": []}
+        # Deeper than the recursion limit
+        solver = self.solver(repository)
+        self.assertEqual({"P0": "2.0"}, solver.solve([{"Name": "P0", "Version": "*"}]))
+        self.assertEqual(depth + 1, len(solver.solve([{"Name": "P0", "Version": "<2.0"}], {"P" + str(i): "1.0" for i in range(depth)})))
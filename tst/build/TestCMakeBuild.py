@@ -0,0 +1,39 @@
+import unittest
+
+from unittest.mock import patch
+from tst.testutils.Mocks import MockLog
+from modules.build.CMakeBuild import CMakeBuildException, CMakeBuild
+from modules.build.JobServer import JobServer
+
+
+class TestCMakeBuild (unittest.TestCase):
+    def test_generator(self):
+        with patch("shutil.which", return_value="/usr/bin/ninja"):
+            self.assertEqual(CMakeBuild.NINJA, CMakeBuild.generator("Ninja", MockLog()))
+        with patch("shutil.which", return_value=None):
+            self.assertEqual(CMakeBuild.MAKEFILES, CMakeBuild.generator("Ninja", MockLog()))
+        self.assertEqual(CMakeBuild.MAKEFILES, CMakeBuild.generator("Unix Makefiles", MockLog()))
+        self.assertRaises(CMakeBuildException, CMakeBuild.generator, "Xcode", MockLog())
+
+    def test_build_command(self):
+        self.assertEqual(["cmake", "--build", "BUILD"], CMakeBuild.build_command("BUILD"))
+        self.assertEqual(["cmake", "--build", "BUILD", "--target", "install"], CMakeBuild.build_command("BUILD", "install"))
+
+    def test_parallelism(self):
+        with CMakeBuild.parallelism(None, CMakeBuild.NINJA) as (args, popen_args):
+            self.assertEqual(([], {}), (args, popen_args))
+        job_server = JobServer(3, 1)
+        self.addCleanup(job_server.close)
+        with CMakeBuild.parallelism(job_server, CMakeBuild.MAKEFILES) as (args, popen_args):
+            # make shares the jobserver
+            self.assertEqual([], args)
+            self.assertEqual(job_server.pipe, popen_args["pass_fds"])
+            self.assertIn("--jobserver-auth=", popen_args["env"]["MAKEFLAGS"])
+        with job_server.job():
+            with CMakeBuild.parallelism(job_server, CMakeBuild.NINJA) as (args, popen_args):
+                # ninja runs as many jobs as there were free tokens
+                self.assertEqual(["--parallel", "2"], args)
+                self.assertNotIn("MAKEFLAGS", popen_args["env"])
+                self.assertEqual(job_server.link_pool, popen_args["env"][JobServer.LINK_POOL_VARIABLE])
+        with CMakeBuild.parallelism(job_server, CMakeBuild.NINJA) as (args, popen_args):
+            self.assertEqual(["--parallel", "3"], args)
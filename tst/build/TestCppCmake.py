@@ -1,9 +1,12 @@
 import unittest
+import os
 import subprocess
+import tempfile
 
 from unittest.mock import patch, call
 from tst.testutils.Mocks import MockLog, MockProcess
 from modules.build.CppCmake import CppCmake, BuildException
+from modules.build.JobServer import JobServer
 
 
 class TestCppCmake (unittest.TestCase):
@@ -42,8 +45,8 @@ class TestCppCmake (unittest.TestCase):
             call(self.config_obj["ProjectRoot"])
         ]
         popen_calls = [
-            call(["cmake", self.config_obj["ProjectRoot"], "-DPACKAGE_CACHE=" + self.config_obj["LocalPackageCache"]],stdout=subprocess.PIPE),
-            call(["make"])
+            call(["cmake", self.config_obj["ProjectRoot"], "-DPACKAGE_CACHE=" + self.config_obj["LocalPackageCache"]],stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.side_effect = [p_cmake, p_make]
 
@@ -69,7 +72,7 @@ class TestCppCmake (unittest.TestCase):
             call(self.config_obj["ProjectRoot"])
         ]
         popen_calls = [
-            call(["make", "test"])
+            call(["make", "test"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.side_effect = [p_make]
 
@@ -95,7 +98,7 @@ class TestCppCmake (unittest.TestCase):
             call(self.config_obj["ProjectRoot"])
         ]
         popen_calls = [
-            call(["make", "test"])
+            call(["make", "test"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.side_effect = [p_make]
 
@@ -137,9 +140,9 @@ class TestCppCmake (unittest.TestCase):
             call(self.config_obj["ProjectRoot"])
         ]
         popen_calls = [
-            call(["cmake", self.config_obj["ProjectRoot"], "-DPACKAGE_CACHE=" + self.config_obj["LocalPackageCache"]], stdout=subprocess.PIPE),
-            call(["make"]),
-            call(["make", "test"])
+            call(["cmake", self.config_obj["ProjectRoot"], "-DPACKAGE_CACHE=" + self.config_obj["LocalPackageCache"]], stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["make", "test"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         ]
         mock_popen.side_effect = [p_cmake, p_make, p_make_test]
         mock_isdir.side_effect = [False, False]
@@ -167,6 +170,8 @@ class TestCppCmake (unittest.TestCase):
     def test_exception_on_cmake_error(self, mock_makedirs, mock_popen, mock_isdir, mock_chdir, mock_getcwd):
         mock_popen.side_effect = OSError("No such file")
         self.assertRaises(BuildException, self.builder.build)
+        # The working directory is restored
+        mock_chdir.assert_has_calls([call(self.config_obj["BuildDir"]), call(self.config_obj["ProjectRoot"])], any_order=False)
 
     @patch("os.getcwd", return_value="CWD")
     @patch("os.chdir", return_value=None)
@@ -185,3 +190,127 @@ class TestCppCmake (unittest.TestCase):
         mock_popen.side_effect = OSError("No such file")
         self.assertRaises(BuildException, self.builder.run_tests)
 
+    @patch("os.getcwd", return_value="CWD")
+    @patch("os.chdir", return_value=None)
+    @patch("os.path.isdir", return_value=True)
+    @patch("subprocess.Popen", autospec=True)
+    def test_build_with_job_server(self, mock_popen, mock_isdir, mock_chdir, mock_getcwd):
+        job_server = JobServer(4, 1)
+        self.config_obj["JobServer"] = job_server
+        builder = CppCmake(self.config_obj)
+        mock_popen.side_effect = [MockProcess("OUT", "ERR", TestCppCmake.EXIT_SUCCESS), MockProcess("OUT", "ERR", TestCppCmake.EXIT_SUCCESS)]
+        try:
+            builder.build()
+            cmake_args, _ = mock_popen.call_args_list[0]
+            self.assertEqual(JobServer.linker_launcher_args(), cmake_args[0][3:])
+            make_args, make_kwargs = mock_popen.call_args_list[1]
+            self.assertEqual((["make"],), make_args)
+            self.assertEqual(job_server.pipe, make_kwargs["pass_fds"])
+            self.assertIn("--jobserver-auth=", make_kwargs["env"]["MAKEFLAGS"])
+        finally:
+            job_server.close()
+
+    @patch("os.getcwd", return_value="CWD")
+    @patch("os.chdir", return_value=None)
+    @patch("os.path.isdir", return_value=True)
+    @patch("subprocess.Popen", autospec=True)
+    @patch("shutil.which", return_value="/usr/bin/ninja")
+    def test_build_with_ninja(self, mock_which, mock_popen, mock_isdir, mock_chdir, mock_getcwd):
+        self.config_obj["Generator"] = "Ninja"
+        builder = CppCmake(self.config_obj)
+        mock_popen.side_effect = [MockProcess("OUT", "ERR", TestCppCmake.EXIT_SUCCESS) for i in range(3)]
+        builder.build()
+        builder.run_tests()
+        popen_calls = [
+            call(["cmake", self.config_obj["ProjectRoot"], "-DPACKAGE_CACHE=" + self.config_obj["LocalPackageCache"], "-G", "Ninja"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["cmake", "--build", self.config_obj["BuildDir"]], stdout=subprocess.PIPE, stderr=subprocess.STDOUT),
+            call(["cmake", "--build", self.config_obj["BuildDir"], "--target", "test"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        ]
+        mock_popen.assert_has_calls(popen_calls, any_order=False)
+
+    @patch("os.getcwd", return_value="CWD")
+    @patch("os.chdir", return_value=None)
+    @patch("os.path.isdir", return_value=True)
+    @patch("subprocess.Popen", autospec=True)
+    def test_build_failure_with_generator(self, mock_popen, mock_isdir, mock_chdir, mock_getcwd):
+        self.config_obj["Generator"] = "Unix Makefiles"
+        builder = CppCmake(self.config_obj)
+        mock_popen.side_effect = [MockProcess("OUT", "ERR", TestCppCmake.EXIT_SUCCESS), MockProcess("OUT", "ERR", TestCppCmake.EXIT_FAILURE)]
+        self.assertRaises(BuildException, builder.build)
+
+    def test_invalid_generator(self):
+        self.config_obj["Generator"] = "Xcode"
+        self.assertRaises(BuildException, CppCmake, self.config_obj)
+
+    def test_generator_change_configures_again(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.config_obj["BuildDir"] = root
+            self.config_obj["Generator"] = "Unix Makefiles"
+            with open(os.path.join(root, "CMakeCache.txt"), "w") as fp:
+                fp.write("CMAKE_BUILD_TYPE:STRING=\nCMAKE_GENERATOR:INTERNAL=Ninja\n")
+            os.makedirs(os.path.join(root, "CMakeFiles"))
+            self.assertEqual("Ninja", CppCmake.cached_generator(root))
+            builder = CppCmake(self.config_obj)
+            with patch("subprocess.Popen", autospec=True) as mock_popen:
+                with patch("os.chdir", return_value=None):
+                    mock_popen.side_effect = [MockProcess("OUT", "ERR", TestCppCmake.EXIT_SUCCESS) for i in range(2)]
+                    builder.build()
+            self.assertFalse(os.path.exists(os.path.join(root, "CMakeCache.txt")))
+            self.assertFalse(os.path.exists(os.path.join(root, "CMakeFiles")))
+
+    @patch("shutil.rmtree", return_value=None)
+    @patch("os.path.isdir", return_value=True)
+    def test_clean_keeps_package_cache_with_receipts(self, mock_isdir, mock_rmtree):
+        self.config_obj["InstallReceipts"] = True
+        CppCmake(self.config_obj).clean()
+        mock_rmtree.assert_called_once_with(self.config_obj["BuildDir"])
+
+    @patch("os.getcwd", return_value="CWD")
+    @patch("os.chdir", return_value=None)
+    @patch("os.path.isdir", return_value=True)
+    @patch("subprocess.Popen", autospec=True)
+    def test_exception_on_failed_cmake(self, mock_popen, mock_isdir, mock_chdir, mock_getcwd):
+        mock_popen.side_effect = [MockProcess("OUT", "ERR", TestCppCmake.EXIT_FAILURE)]
+        self.assertRaises(BuildException, self.builder.build)
+        self.assertEqual(1, mock_popen.call_count)
+
+    def test_build_fingerprint(self):
+        with tempfile.TemporaryDirectory() as root:
+            for path in ["CMakeLists.txt", "main.cpp"]:
+                with open(os.path.join(root, path), "w") as fp:
+                    fp.write(path)
+            self.config_obj["ProjectRoot"] = root
+            self.config_obj["BuildDir"] = os.path.join(root, "build")
+            self.config_obj["LocalPackageCache"] = os.path.join(root, ".packagecache")
+            self.config_obj["BuildFingerprint"] = True
+            builder = CppCmake(self.config_obj)
+            os.makedirs(self.config_obj["BuildDir"])
+            # What cmake leaves in a configured build folder
+            with open(os.path.join(self.config_obj["BuildDir"], "CMakeCache.txt"), "w"):
+                pass
+
+            def build(exit_codes):
+                """
+                Builds with commands exiting with exit_codes. Returns the commands run.
+                """
+                with patch("subprocess.Popen", autospec=True) as mock_popen, patch("os.chdir", return_value=None):
+                    mock_popen.side_effect = [MockProcess("OUT", "ERR", exit_code) for exit_code in exit_codes]
+                    if TestCppCmake.EXIT_FAILURE in exit_codes:
+                        self.assertRaises(BuildException, builder.build)
+                    else:
+                        builder.build()
+                    return [args[0][0] for args, _ in mock_popen.call_args_list]
+
+            self.assertEqual(["cmake", "make"], build([TestCppCmake.EXIT_SUCCESS] * 2))
+            # Nothing changed
+            self.assertEqual([], build([]))
+            # A source changed: only make runs
+            with open(os.path.join(root, "main.cpp"), "a") as fp:
+                fp.write("int main() { return 0; }")
+            self.assertEqual(["make"], build([TestCppCmake.EXIT_SUCCESS]))
+            # A CMake file changed: cmake runs again. The failed build is not taken for a complete one
+            with open(os.path.join(root, "CMakeLists.txt"), "a") as fp:
+                fp.write("project(P)")
+            self.assertEqual(["cmake", "make"], build([TestCppCmake.EXIT_SUCCESS, TestCppCmake.EXIT_FAILURE]))
+            self.assertEqual(["make"], build([TestCppCmake.EXIT_SUCCESS]))
+            self.assertEqual([], build([]))
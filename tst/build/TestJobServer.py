@@ -0,0 +1,92 @@
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+
+from unittest.mock import patch
+from modules.build.JobServer import JobServerException, JobServer
+
+GB = 1024 * 1024 * 1024
+
+
+class TestJobServer (unittest.TestCase):
+    def setUp(self):
+        self.job_server = JobServer(3, 2)
+
+    def tearDown(self):
+        self.job_server.close()
+
+    @patch.object(JobServer, "cores", return_value=8)
+    def test_limits(self, mock_cores):
+        with patch.object(JobServer, "available_memory", return_value=16 * GB):
+            self.assertEqual((8, 2), JobServer.limits())
+            self.assertEqual((6, 1), JobServer.limits(6))
+            self.assertEqual((8, 3), JobServer.limits(0, 3))
+            self.assertEqual((2, 2), JobServer.limits(2, 5))
+        with patch.object(JobServer, "available_memory", return_value=3 * GB):
+            self.assertEqual((3, 1), JobServer.limits())
+        with patch.object(JobServer, "available_memory", return_value=100):
+            self.assertEqual((1, 1), JobServer.limits())
+        with patch.object(JobServer, "available_memory", return_value=None):
+            self.assertEqual((8, 2), JobServer.limits())
+        for jobs, link_jobs in [(-1, 0), (0, "2"), (True, 0)]:
+            self.assertRaises(JobServerException, JobServer.limits, jobs, link_jobs)
+
+    def test_from_config(self):
+        job_server = JobServer.from_config({"BuildJobs": 5, "LinkJobs": 2})
+        self.assertEqual((5, 2), (job_server.jobs, job_server.link_jobs))
+        self.assertRaises(JobServerException, JobServer.from_config, {"BuildJobs": "many"})
+
+    def test_job_holds_a_token(self):
+        with self.job_server.job():
+            with self.job_server.job():
+                os.set_blocking(self.job_server.pipe[0], False)
+                self.assertEqual(b"+", os.read(self.job_server.pipe[0], 1024))
+                self.assertRaises(BlockingIOError, os.read, self.job_server.pipe[0], 1)
+                os.set_blocking(self.job_server.pipe[0], True)
+                os.write(self.job_server.pipe[1], b"+")
+        os.set_blocking(self.job_server.pipe[0], False)
+        tokens = os.read(self.job_server.pipe[0], 1024)
+        os.set_blocking(self.job_server.pipe[0], True)
+        self.assertEqual(3, len(tokens))
+
+    def test_free_jobs(self):
+        with self.job_server.job():
+            with self.job_server.free_jobs() as jobs:
+                self.assertEqual(2, jobs)
+        with self.job_server.free_jobs() as jobs:
+            self.assertEqual(3, jobs)
+
+    def test_link_launcher(self):
+        args = self.job_server.popen_args()
+        self.assertIn("--jobserver-auth=" + str(args["pass_fds"][0]) + "," + str(args["pass_fds"][1]), args["env"]["MAKEFLAGS"])
+        launcher = JobServer.linker_launcher_args()[0].split("=", 1)[1].split(";")
+        p = subprocess.Popen(launcher + [sys.executable, "-c", "import sys; sys.exit(3)"], env=args["env"])
+        p.communicate()
+        self.assertEqual(3, p.returncode)
+        # The link token was given back
+        os.set_blocking(self.job_server.link_pool_fd, False)
+        tokens = os.read(self.job_server.link_pool_fd, 1024)
+        os.set_blocking(self.job_server.link_pool_fd, True)
+        self.assertEqual(b"++", tokens)
+
+    def test_close(self):
+        self.job_server.open()
+        link_pool = self.job_server.link_pool
+        self.assertTrue(os.path.exists(link_pool))
+        self.job_server.close()
+        self.assertFalse(os.path.exists(link_pool))
+
+    @unittest.skipIf(shutil.which("make") is None, "make is not installed")
+    def test_make_uses_the_jobserver(self):
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, "Makefile"), "w") as fp:
+                fp.write("all: a b\na:\n\t@echo $(MAKEFLAGS)\nb:\n\t@true\n")
+            with self.job_server.job():
+                p = subprocess.Popen(["make"], cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **self.job_server.popen_args())
+                out, err = p.communicate()
+            self.assertEqual(0, p.returncode)
+            self.assertIn(b"--jobserver-auth", out)
+            self.assertNotIn(b"warning", err)
@@ -0,0 +1,30 @@
+import unittest
+import sys
+
+from tst.testutils.Mocks import MockLogger
+from modules.build.ProcessRunner import ProcessRunnerException, ProcessRunner
+
+
+class TestProcessRunner (unittest.TestCase):
+    def test_streams_output(self):
+        logger = MockLogger()
+        script = "import sys\nprint('out 1', flush=True)\nprint('err 1', file=sys.stderr, flush=True)\nprint('out 2')\nsys.exit(3)"
+        return_code, tail = ProcessRunner.run([sys.executable, "-c", script], logger)
+        self.assertEqual(3, return_code)
+        self.assertEqual(["out 1", "err 1", "out 2"], logger.infos)
+        self.assertEqual(["out 1", "err 1", "out 2"], tail)
+
+    def test_keeps_the_tail(self):
+        logger = MockLogger()
+        return_code, tail = ProcessRunner.run([sys.executable, "-c", "for i in range(1000): print(i)"], logger, tail_lines=3)
+        self.assertEqual(0, return_code)
+        self.assertEqual(1000, len(logger.infos))
+        self.assertEqual(["997", "998", "999"], tail)
+
+    def test_long_lines_are_split(self):
+        logger = MockLogger()
+        ProcessRunner.run([sys.executable, "-c", "print('x' * " + str(ProcessRunner.LINE_LIMIT + 10) + ")"], logger)
+        self.assertEqual([ProcessRunner.LINE_LIMIT, 10], [len(line) for line in logger.infos])
+
+    def test_absent_command(self):
+        self.assertRaises(ProcessRunnerException, ProcessRunner.run, ["bob-absent-command"], MockLogger())
@@ -0,0 +1,80 @@
+import unittest
+import os
+import json
+import tempfile
+
+from modules.build.SourceFingerprint import SourceFingerprint
+from modules.bootstrap.InstallReceipts import InstallReceipts
+
+
+class TestSourceFingerprint (unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.build_folder = os.path.join(self.root, "build")
+        self.package_cache = os.path.join(self.root, ".packagecache")
+        for path in ["CMakeLists.txt", "md.json", "src/main.cpp", "src/util.cpp", "cmake/Find.cmake", "build/main.o", ".packagecache/include/a.h", ".git/HEAD"]:
+            self.write(path, path)
+        self.fingerprint = SourceFingerprint(self.root, self.build_folder, self.package_cache)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            fp.write(content)
+
+    def test_walk(self):
+        excluded = {os.path.abspath(self.build_folder), os.path.abspath(self.package_cache)}
+        paths = [path for path, _ in SourceFingerprint.walk(self.root, excluded)]
+        self.assertEqual(["CMakeLists.txt", "md.json", "cmake/Find.cmake", "src/main.cpp", "src/util.cpp"], paths)
+
+    def test_unchanged(self):
+        self.assertEqual(self.fingerprint.compute([]), self.fingerprint.compute([]))
+        # The build folder, the package cache and the version control folders are not part of the project
+        before = self.fingerprint.compute([])
+        self.write("build/main.o", "rebuilt")
+        self.write(".git/HEAD", "other")
+        self.assertEqual(before, self.fingerprint.compute([]))
+        self.assertNotEqual(before["Configure"], self.fingerprint.compute(["-G", "Ninja"])["Configure"])
+
+    def test_source_change(self):
+        before = self.fingerprint.compute([])
+        self.write("src/main.cpp", "int main() { return 0; }")
+        after = self.fingerprint.compute([])
+        self.assertEqual(before["Configure"], after["Configure"])
+        self.assertNotEqual(before["Build"], after["Build"])
+
+    def test_cmake_inputs_change(self):
+        for path in ["CMakeLists.txt", "md.json", "cmake/Find.cmake", "src/new.cpp", ".packagecache/include/b.h"]:
+            before = self.fingerprint.compute([])
+            self.write(path, "changed " + path)
+            after = self.fingerprint.compute([])
+            self.assertNotEqual(before["Configure"], after["Configure"], path)
+            self.assertNotEqual(before["Build"], after["Build"], path)
+
+    def test_package_cache_receipts(self):
+        self.write(".packagecache/" + InstallReceipts.FILE_NAME, json.dumps({"Version": 1, "Packages": {}}))
+        before = self.fingerprint.compute([])
+        # Only the receipts are read: a package cache with receipts is not walked
+        self.write(".packagecache/include/b.h", "b")
+        self.assertEqual(before, self.fingerprint.compute([]))
+        self.write(".packagecache/" + InstallReceipts.FILE_NAME, json.dumps({"Version": 1, "Packages": {"A": {}}}))
+        self.assertNotEqual(before["Configure"], self.fingerprint.compute([])["Configure"])
+
+    def test_read_write(self):
+        self.assertIsNone(self.fingerprint.read())
+        fingerprint = self.fingerprint.compute([])
+        self.assertTrue(self.fingerprint.write(fingerprint))
+        self.assertEqual(fingerprint["Build"], self.fingerprint.read()["Build"])
+        self.fingerprint.clear()
+        self.fingerprint.clear()
+        self.assertIsNone(self.fingerprint.read())
+        self.write("build/" + SourceFingerprint.FILE_NAME, "{")
+        self.assertIsNone(self.fingerprint.read())
+        self.write("build/" + SourceFingerprint.FILE_NAME, json.dumps({"Version": SourceFingerprint.VERSION, "Build": "SHA"}))
+        self.assertIsNone(self.fingerprint.read())
+        absent = SourceFingerprint(self.root, os.path.join(self.root, "absent"), self.package_cache)
+        self.assertFalse(absent.write(fingerprint))
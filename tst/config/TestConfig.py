@@ -13,7 +13,32 @@ class TestConfig (unittest.TestCase):
             "GlobalPackageCache": os.path.join(os.environ["HOME"], ".packagecache"),
             "LogFile": os.path.join(os.environ["HOME"], ".bob", "bob.log"),
             "Level": "INFO",
-            "ProgramName": "Bob"
+            "ProgramName": "Bob",
+            "DownloadConcurrency": 8,
+            "HttpConnectionsPerHost": 8,
+            "DownloadRetries": 3,
+            "S3PartSize": 8388608,
+            "S3MaxConcurrency": 10,
+            "S3MaxPoolConnections": 10,
+            "DedupPackageStore": False,
+            "MaxGlobalCacheSizeMB": 0,
+            "StreamExtract": False,
+            "KeepArchives": True,
+            "ArchiveFormats": ["tar"],
+            "UsePackageIndex": True,
+            "ProbeMetadata": True,
+            "MirrorSegmentSize": 8388608,
+            "UseLockFile": True,
+            "UseDeltas": False,
+            "InstallCache": True,
+            "InstallCacheRestore": "copy",
+            "InstallConcurrency": 4,
+            "BuildJobs": 0,
+            "LinkJobs": 0,
+            "InstallReceipts": True,
+            "ResolveVersions": False,
+            "MetadataIndex": True,
+            "BuildFingerprint": True
         }
         self.md = {
             "Name": "TestPackage",
@@ -2,10 +2,14 @@ import unittest
 import copy
 import yaml
 import os
+import subprocess
+import tempfile
 
 from tst.testutils.Mocks import MockLog, MockProcess, MockFilePointer, MockTemporaryDirectory
 from unittest.mock import patch, call
 from modules.package.SnapCMake import SnapCMakeException, SnapCMake
+from modules.bootstrap.ArchiveFormat import ArchiveFormat
+from modules.bootstrap.ExtractionStamp import ExtractionStamp
 
 
 class TestSnapCMake (unittest.TestCase):
@@ -98,7 +102,7 @@ class TestSnapCMake (unittest.TestCase):
         self.assertEquals(1, len(snap_yaml_fp.invocations["write"]))
 
         # Validate it called snapcraft command
-        popen_calls = [call(["snapcraft"])]
+        popen_calls = [call(["snapcraft"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)]
         mock_subprocess.assert_has_calls(popen_calls)
 
         # Validate it copied the snap back to the build folder
@@ -110,6 +114,22 @@ class TestSnapCMake (unittest.TestCase):
         ]
         mock_copyfile.assert_has_calls(mock_copyfile_calls)
 
+    def test_package_path_of_streamed_package(self):
+        with tempfile.TemporaryDirectory() as cache:
+            conf = dict(self.conf, GlobalPackageCache=cache)
+            folder = os.path.join(cache, "A", "1.0")
+            os.makedirs(folder)
+            snapper = SnapCMake(conf)
+            self.assertRaises(SnapCMakeException, snapper.get_package_path, "A", "1.0")
+            # The extracted folder of a package that did not keep its archive
+            ExtractionStamp(os.path.join(folder, "A.tar"), folder).write(["md.json"], "DIGEST", 10)
+            self.assertEqual(folder, snapper.get_package_path("A", "1.0"))
+            # The archive, whatever its format
+            archive = os.path.join(folder, ArchiveFormat.file_name("A", ArchiveFormat.GZIP))
+            with open(archive, "wb"):
+                pass
+            self.assertEqual(archive, snapper.get_package_path("A", "1.0"))
+
     def test_exception_on_missing_config_params(self):
         # Make the package call
         conf = copy.deepcopy(self.conf)
@@ -2,6 +2,8 @@ import unittest
 import copy
 import json
 import os
+import tarfile
+import tempfile
 
 from tst.testutils.Mocks import MockLog, MockTemporaryFilePointer, MockTarfilePointer
 from unittest.mock import patch
@@ -241,6 +243,28 @@ class TestSnapPart (unittest.TestCase):
         snap_part = SnapPart(conf)
         self.assertRaises(SnapPartException, snap_part.generate_snap_part)
 
+    def test_compressed_headers_part(self):
+        with tempfile.TemporaryDirectory() as root:
+            conf = copy.deepcopy(self.conf)
+            conf["ProjectRoot"] = root
+            conf["BuildFolder"] = os.path.join(root, "build")
+            conf["PartType"] = "headers"
+            conf["HeadersSource"] = "include"
+            conf["HeadersDest"] = "headers"
+            conf["ArchiveFormat"] = "tar.xz"
+            os.makedirs(os.path.join(root, "include"))
+            os.makedirs(conf["BuildFolder"])
+            with open(os.path.join(root, "include", "a.h"), "w") as fp:
+                fp.write("int a();")
+
+            SnapPart(conf).generate_snap_part()
+
+            with tarfile.open(os.path.join(conf["BuildFolder"], "TEST_PROJECT.tar.xz"), "r:xz") as tfp:
+                self.assertEqual(["CMakeLists.txt", "headers", "headers/a.h", "md.json"], sorted(tfp.getnames()))
+
+            conf["ArchiveFormat"] = "zip"
+            self.assertRaises(SnapPartException, SnapPart(conf).generate_snap_part)
+
     def test_exception_on_invalid_config(self):
         conf = copy.deepcopy(self.conf)
         del conf["Logger"]
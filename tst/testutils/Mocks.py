@@ -1,6 +1,8 @@
-from botocore.exceptions import ClientError
+import io
 
 from modules.bootstrap.PackageDownloader import PackageDownloaderException
+from modules.bootstrap.HttpDownloader import HttpDownloaderException
+from modules.bootstrap.S3Downloader import S3DownloaderException
 from modules.bootstrap.PackageInstaller import PackageInstallerException
 from modules.bootstrap.DependencyResolver import DependencyResolverException
 from modules.package.SnapPart import SnapPartException
@@ -37,11 +39,32 @@ class MockProcess:
             "communicate": []
         }
 
+    @property
+    def stdout(self):
+        # What the process streams when its stderr is merged into its stdout
+        return io.BytesIO((str(self.out) + "\n" + str(self.err) + "\n").encode("utf-8"))
+
     def communicate(self):
         return self.out, self.err
 
+    def wait(self):
+        return self.returncode
 
-class MockS3Client:
+
+class MockHttpDownloader:
+    def __init__(self, failures=[]):
+        self.failures = failures
+        self.invocations = []
+
+    def download(self, url, dest):
+        failed = len(self.invocations) < len(self.failures) and self.failures[len(self.invocations)]
+        self.invocations.append((url, dest))
+        if failed:
+            raise HttpDownloaderException("ERROR")
+        return 0
+
+
+class MockS3Downloader:
     def __init__(self):
         self.invocations = []
         self.raise_client_error = False
@@ -49,17 +72,16 @@ class MockS3Client:
     def set_up_client_error(self):
         self.raise_client_error = True
 
-    def download_fileobj(self, bucket, key, file_obj):
+    def download(self, bucket, key, dest):
         if self.raise_client_error:
-            raise ClientError(
-                error_response={
-                    "Error": {
-                        "Code": "CLIENT_ERROR"
-                    }
-                },
-                operation_name="download-fileobj"
-            )
-        self.invocations.append((bucket, key, file_obj))
+            raise S3DownloaderException("CLIENT_ERROR")
+        self.invocations.append((bucket, key, dest))
+        return 0
+
+
+class MockS3Client:
+    def __init__(self):
+        self.invocations = []
 
 
 class MockTarfilePointer:
@@ -79,6 +101,9 @@ class MockTarfilePointer:
             raise OSError("Error")
         self.invocations["extractall"].append(path)
 
+    def getnames(self):
+        return []
+
     def add(self, filename, arcname=None):
         self.invocations["add"].append((filename, arcname))
 
@@ -120,10 +145,19 @@ class MockPackageDownloader:
     def __init__(self):
         self.invocations = []
         self.throws = False
+        self.http = None
+        self.s3 = None
+        self.probes = []
+        self.metadata = {}
+        self.digests = {}
+        self.global_package_cache = "GLOBAL_CACHE"
 
     def set_throws(self):
         self.throws = True
 
+    def s3_downloader(self):
+        return self.s3
+
     def unset_throws(self):
         self.throws = False
 
@@ -131,14 +165,44 @@ class MockPackageDownloader:
         if self.throws:
             raise PackageDownloaderException()
         self.invocations.append(package_list[:])
+        for package in package_list:
+            self.digests.pop(package["Name"], None)
+
+    def extracted_digest(self, package):
+        return self.digests.get(package["Name"], "sha-" + package["Name"])
+
+    def fetch_dependencies(self, package_list):
+        if self.throws:
+            raise PackageDownloaderException()
+        self.probes.append(package_list[:])
+        return [self.metadata.get(package["Name"], []) for package in package_list]
+
+    def package_dependencies(self, package):
+        self.probes.append([package])
+        return self.metadata.get(package["Name"], [])
+
+
+class MockPackageIndex:
+    def __init__(self, entries={}):
+        self.entries = entries
+        self.lookups = []
+
+    def lookup(self, package):
+        self.lookups.append(package["Name"])
+        # Entries are looked up by name and version, then by name
+        return self.entries.get(package["Name"] + "/" + str(package["Version"]), self.entries.get(package["Name"]))
+
+    def versions(self, package):
+        return [key.split("/", 1)[1] for key in self.entries if key.startswith(package["Name"] + "/")]
 
 
 class MockPackageInstaller:
-    def __init__(self, collected_dependencies=[]):
-        self.collected_dependencies = collected_dependencies
+    def __init__(self, package_dependencies={}):
+        self.package_dependencies = package_dependencies
         self.invocations = []
-        self.invocation_count = -1
         self.throws = False
+        self.pins = {}
+        self.saved = 0
 
     def set_throws(self):
         self.throws = True
@@ -146,12 +210,26 @@ class MockPackageInstaller:
     def unset_throws(self):
         self.throws = False
 
-    def install_packages(self, package_list):
+    def pin_versions(self, pins):
+        self.pins = dict(pins)
+
+    def pinned(self, dep):
+        if dep["Name"] not in self.pins:
+            return dep
+        return dict(dep, Version=self.pins[dep["Name"]])
+
+    def get_package_dependency(self, package_name, package_version):
+        # Dependencies are looked up by name and version, then by name
+        deps = self.package_dependencies.get(package_name + "/" + str(package_version), self.package_dependencies.get(package_name, []))
+        return [self.pinned(dep) for dep in deps]
+
+    def install_a_package(self, package_name, package_version):
         if self.throws:
             raise PackageInstallerException()
-        self.invocations.append(package_list[:])
-        self.invocation_count = self.invocation_count + 1
-        return self.collected_dependencies[self.invocation_count]
+        self.invocations.append(package_name)
+
+    def save_metadata(self):
+        self.saved = self.saved + 1
 
 
 class MockConfig:
@@ -0,0 +1,123 @@
+"""
+A local stand-in for S3, to test the S3 transfers against a real boto3 client without AWS.
+
+It serves objects kept in memory over HTTP, with path style addressing (http://host:port/<bucket>/<key>). It
+implements what the downloader uses: GetObject and HeadObject, with Range, If-Match and If-None-Match, and S3 style
+XML errors. Requests are not authenticated. A range can be made to fail once, to test how transfers recover.
+"""
+import threading
+import hashlib
+import boto3
+
+from botocore.config import Config
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+
+class S3StandInHandler (BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_error_code(self, status, code):
+        body = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>" + code + "</Code><Message>" + code +
+                "</Message></Error>").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def serve(self):
+        bucket, _, key = unquote(self.path.split("?")[0]).lstrip("/").partition("/")
+        with self.server.lock:
+            self.server.requests.append((self.command, bucket, key, self.headers.get("Range")))
+            data = self.server.objects.get((bucket, key))
+            failing = self.headers.get("Range") in self.server.failing_ranges
+            self.server.failing_ranges.discard(self.headers.get("Range"))
+        if failing:
+            self.send_error_code(500, "InternalError")
+            return
+        if data is None:
+            self.send_error_code(404, "NoSuchKey")
+            return
+        etag = "\"" + hashlib.md5(data).hexdigest() + "\""
+        if self.headers.get("If-Match") is not None and self.headers.get("If-Match") != etag:
+            self.send_error_code(412, "PreconditionFailed")
+            return
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        status = 200
+        body = data
+        requested_range = self.headers.get("Range")
+        if requested_range is not None:
+            start, _, end = requested_range[len("bytes="):].partition("-")
+            start = int(start)
+            end = len(data) - 1 if end == "" else min(int(end), len(data) - 1)
+            if start >= len(data):
+                self.send_error_code(416, "InvalidRange")
+                return
+            status = 206
+            body = data[start:end + 1]
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", "bytes " + str(start) + "-" + str(end) + "/" + str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.serve()
+
+    def do_HEAD(self):
+        self.serve()
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class S3StandIn:
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), S3StandInHandler)
+        self.server.objects = {}
+        self.server.requests = []
+        self.server.failing_ranges = set()
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.endpoint_url = "http://127.0.0.1:" + str(self.server.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def put_object(self, bucket, key, data):
+        with self.server.lock:
+            self.server.objects[(bucket, key)] = data
+
+    def fail_once(self, requested_range):
+        with self.server.lock:
+            self.server.failing_ranges.add(requested_range)
+
+    def requests(self):
+        with self.server.lock:
+            return list(self.server.requests)
+
+    def client(self, max_pool_connections=10):
+        return boto3.client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="stand-in",
+            aws_secret_access_key="stand-in",
+            config=Config(
+                max_pool_connections=max_pool_connections,
+                s3={"addressing_style": "path"},
+                retries={"total_max_attempts": 1}))
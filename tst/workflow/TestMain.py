@@ -1,14 +1,18 @@
 import unittest
 import sys
+import os
+import json
+import tempfile
+import subprocess
 
-from unittest.mock import patch, call
+from unittest.mock import patch
 from modules.workflow.Main import execute_cmd
 from tst.testutils.Mocks import MockWorkflow
 
 
 class TestMain (unittest.TestCase):
     @patch.object(sys, "argv", ["bob"])
-    @patch("modules.workflow.Main.Workflow", autospec=True)
+    @patch("modules.workflow.Workflow.Workflow", autospec=True)
     def test_start_workflow_full(self, mock_workflow):
         w = MockWorkflow()
         mock_workflow.side_effect = [w]
@@ -16,7 +20,7 @@ class TestMain (unittest.TestCase):
         self.assertEquals(1, len(w.invocations["Run"]))
 
     @patch.object(sys, "argv", ["bob", "-s", "MyStep"])
-    @patch("modules.workflow.Main.Workflow", autospec=True)
+    @patch("modules.workflow.Workflow.Workflow", autospec=True)
     def test_workflow_step(self, mock_workflow):
         w = MockWorkflow()
         mock_workflow.side_effect = [w]
@@ -25,7 +29,7 @@ class TestMain (unittest.TestCase):
         self.assertEquals(["MyStep"], w.invocations["Step"])
 
     @patch.object(sys, "argv", ["bob", "-c"])
-    @patch("modules.workflow.Main.Workflow", autospec=True)
+    @patch("modules.workflow.Workflow.Workflow", autospec=True)
     def test_workflow_clean(self, mock_workflow):
         w = MockWorkflow()
         mock_workflow.side_effect = [w]
@@ -33,3 +37,40 @@ class TestMain (unittest.TestCase):
         self.assertEquals(0, len(w.invocations["Run"]))
         self.assertEquals(["Clean"], w.invocations["Step"])
 
+    @patch.object(sys, "argv", ["bob", "--gc"])
+    @patch("modules.bootstrap.CacheGC.main", return_value=True)
+    @patch("modules.workflow.Workflow.Workflow", autospec=True)
+    def test_gc(self, mock_workflow, mock_gc):
+        self.assertTrue(execute_cmd())
+        mock_gc.assert_called_once_with()
+        mock_workflow.assert_not_called()
+
+    @patch.object(sys, "argv", ["bob", "--index", "REPO"])
+    @patch("modules.bootstrap.PackageIndex.PackageIndex.build", return_value={"Packages": {"A": {"1.0": {}, "2.0": {}}}})
+    @patch("modules.workflow.Workflow.Workflow", autospec=True)
+    def test_index(self, mock_workflow, mock_build):
+        self.assertTrue(execute_cmd())
+        mock_build.assert_called_once_with("REPO", False)
+        mock_workflow.assert_not_called()
+
+    def test_startup_imports(self):
+        # `bob --help` and `bob -c` must not load the modules that only bootstraps and packaging need
+        heavy = ["boto3", "botocore", "tarfile", "http.client", "modules.package.Package"]
+        script = (
+            "import sys, json\n"
+            "from modules.workflow.Main import execute_cmd\n"
+            "try:\n"
+            "    execute_cmd()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "sys.stderr.write(json.dumps([m for m in " + json.dumps(heavy) + " if m in sys.modules]))\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+        with tempfile.TemporaryDirectory() as project, tempfile.TemporaryDirectory() as home:
+            with open(os.path.join(project, "md.json"), "w") as fp:
+                json.dump({"Name": "Startup", "Version": "1.0", "BuildSystem": "CppCmake"}, fp)
+            env = dict(os.environ, HOME=home, PYTHONPATH=root)
+            for args in [["--help"], ["-c"]]:
+                result = subprocess.run([sys.executable, "-c", script] + args, cwd=project, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+                self.assertEqual([], json.loads(result.stderr.decode("utf-8").strip().splitlines()[-1]))
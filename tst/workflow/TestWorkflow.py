@@ -10,7 +10,7 @@ from modules.workflow.Workflow import WorkflowException, Workflow
 
 
 class TestWorkflow (unittest.TestCase):
-    @patch("modules.workflow.Workflow.Package", autospec=True)
+    @patch("modules.package.Package.Package", autospec=True)
     @patch("modules.workflow.Workflow.DependencyResolver", autospec=True)
     @patch("modules.workflow.Workflow.CppCmake", autospec=True)
     @patch("modules.workflow.Workflow.Config", autospec=True)
@@ -59,7 +59,7 @@ class TestWorkflow (unittest.TestCase):
 
         self.assertRaises(WorkflowException, Workflow)
 
-    @patch("modules.workflow.Workflow.Package", autospec=True)
+    @patch("modules.package.Package.Package", autospec=True)
     @patch("modules.workflow.Workflow.DependencyResolver", autospec=True)
     @patch("modules.workflow.Workflow.CppCmake", autospec=True)
     @patch("modules.workflow.Workflow.Config", autospec=True)
@@ -153,7 +153,7 @@ class TestWorkflow (unittest.TestCase):
 
         self.assertRaises(WorkflowException, Workflow)
 
-    @patch("modules.workflow.Workflow.Package", autospec=True)
+    @patch("modules.package.Package.Package", autospec=True)
     @patch("modules.workflow.Workflow.DependencyResolver", autospec=True)
     @patch("modules.workflow.Workflow.CppCmake", autospec=True)
     @patch("modules.workflow.Workflow.Config", autospec=True)